@@ -1,3 +1,39 @@
-from app.ai_engine.gemini import GeminiEngine
+from app.ai_engine.gemini import (
+    GeminiEngine,
+    GeminiTimeout,
+    GeminiUnavailable,
+    InFlightLimiter,
+    ModelPool,
+    ModelPoolExhausted,
+    get_gemini_engine,
+    get_in_flight_limiter,
+    get_model_pool,
+)
+from app.ai_engine.prompt import AssembledPrompt, PromptAssembler, estimate_tokens, get_prompt_assembler
+from app.ai_engine.resilience import CircuitBreaker, ResilientCaller, RetryBudget, get_resilient_caller
+from app.ai_engine.response_cache import ResponseCache, get_response_cache
+from app.ai_engine.single_flight import SingleFlight, get_single_flight
 
-__all__ = ["GeminiEngine"]
+__all__ = [
+    "AssembledPrompt",
+    "CircuitBreaker",
+    "GeminiEngine",
+    "GeminiTimeout",
+    "GeminiUnavailable",
+    "InFlightLimiter",
+    "ModelPool",
+    "ModelPoolExhausted",
+    "PromptAssembler",
+    "ResilientCaller",
+    "ResponseCache",
+    "RetryBudget",
+    "SingleFlight",
+    "estimate_tokens",
+    "get_gemini_engine",
+    "get_in_flight_limiter",
+    "get_model_pool",
+    "get_prompt_assembler",
+    "get_resilient_caller",
+    "get_response_cache",
+    "get_single_flight",
+]
@@ -0,0 +1,193 @@
+"""
+Rolling summaries of long chat sessions.
+
+A session's latest CHAT_SUMMARY_KEEP_RECENT messages are always sent
+verbatim. Once CHAT_SUMMARY_EVERY_TURNS more have aged out of that window, a
+background job folds them into the session's ChatSessionSummary. Each update
+summarizes the previous summary plus only the newly aged messages, so its cost
+does not grow with the length of the session. Prompts then carry the summary
+and the messages after it instead of the whole session.
+
+The backend comes from the summarizer registry of app.training.summaries and
+is chosen with CHAT_SUMMARIZER: "extractive" is the offline, deterministic
+stub and "gemini" asks the model.
+
+Bring every session up to date by hand with:
+
+    python -m app.ai_engine.conversation
+"""
+import argparse
+import asyncio
+import json
+import logging
+import threading
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import func
+
+from app.config import get_settings
+from app.database import SessionLocal
+from app.models import ChatMessage, ChatSessionSummary
+from app.training.summaries import Summarizer, get_summarizer
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+ROLE_LABELS = {"user": "Student", "assistant": "Tutor"}
+
+
+class ConversationSummarizer:
+    def __init__(
+        self,
+        session_factory=None,
+        summarizer: Optional[Summarizer] = None,
+        every_turns: Optional[int] = None,
+        keep_recent: Optional[int] = None,
+        max_words: Optional[int] = None,
+    ):
+        self.session_factory = session_factory or SessionLocal
+        self._summarizer = summarizer
+        self.every_turns = max(every_turns or settings.CHAT_SUMMARY_EVERY_TURNS, 1)
+        self.keep_recent = settings.CHAT_SUMMARY_KEEP_RECENT if keep_recent is None else keep_recent
+        self.max_words = max_words or settings.CHAT_SUMMARY_MAX_WORDS
+        # Turns are only queued while the background job runs to consume them.
+        self.active = False
+        self._dirty: Set[str] = set()
+        self._lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+
+    @property
+    def summarizer(self) -> Summarizer:
+        if self._summarizer is None:
+            self._summarizer = get_summarizer(settings.CHAT_SUMMARIZER)
+        return self._summarizer
+
+    def notify(self, session_id: str):
+        """A message was stored in `session_id`; cheap enough to call on every turn"""
+        if not self.active:
+            return
+        with self._lock:
+            self._dirty.add(session_id)
+        self.wake_event.set()
+
+    def take_notified(self) -> List[str]:
+        with self._lock:
+            session_ids, self._dirty = self._dirty, set()
+        return sorted(session_ids)
+
+    def pending(self, db) -> List[str]:
+        """Sessions with at least every_turns messages aged out of the recent window and not yet summarized"""
+        threshold = self.keep_recent + self.every_turns
+        counts = db.query(ChatMessage.session_id, func.count(ChatMessage.id)).group_by(
+            ChatMessage.session_id
+        ).having(func.count(ChatMessage.id) >= threshold).all()
+        if not counts:
+            return []
+        covered = dict(db.query(ChatSessionSummary.session_id, ChatSessionSummary.message_count).filter(
+            ChatSessionSummary.session_id.in_([session_id for session_id, _ in counts])
+        ).all())
+        return [session_id for session_id, total in counts if total - covered.get(session_id, 0) >= threshold]
+
+    def summarize_session(self, db, session_id: str) -> bool:
+        """Fold the messages that have aged out of the recent window into the summary, once enough have"""
+        record = db.query(ChatSessionSummary).filter(ChatSessionSummary.session_id == session_id).first()
+        covered = record.message_count if record else 0
+        total = db.query(func.count(ChatMessage.id)).filter(ChatMessage.session_id == session_id).scalar()
+        aged = total - covered - self.keep_recent
+        if aged < self.every_turns:
+            return False
+
+        query = db.query(ChatMessage).filter(ChatMessage.session_id == session_id)
+        if record:
+            query = query.filter(ChatMessage.created_at > record.covered_until)
+        messages = query.order_by(ChatMessage.created_at).limit(aged).all()
+        if not messages:
+            return False
+
+        texts = [record.summary] if record and record.summary else []
+        texts += [f"{ROLE_LABELS.get(message.role, message.role)}: {message.content}" for message in messages]
+        summary = self.summarizer.summarize(texts, self.max_words)
+
+        if record is None:
+            record = ChatSessionSummary(session_id=session_id)
+            db.add(record)
+        record.summary = summary
+        record.message_count = covered + len(messages)
+        record.covered_until = messages[-1].created_at
+        db.commit()
+        return True
+
+    def run_pass(self, session_ids: Optional[List[str]] = None) -> Dict[str, int]:
+        """Summarize `session_ids`, or every session that is due when None"""
+        report = {"checked": 0, "summarized": 0, "failed": 0}
+        db = self.session_factory()
+        try:
+            if session_ids is None:
+                session_ids = self.pending(db)
+            for session_id in session_ids:
+                if self.stop_event.is_set():
+                    break
+                report["checked"] += 1
+                try:
+                    if self.summarize_session(db, session_id):
+                        report["summarized"] += 1
+                except Exception as e:
+                    # Usually the session was deleted mid-pass.
+                    db.rollback()
+                    report["failed"] += 1
+                    logger.error(f"Summarizing chat session {session_id} failed: {e}")
+        finally:
+            db.close()
+        if report["summarized"] or report["failed"]:
+            logger.info(f"Conversation summaries: {report}")
+        return report
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+
+
+_summarizer = None
+
+
+def get_conversation_summarizer() -> ConversationSummarizer:
+    global _summarizer
+    if _summarizer is None:
+        _summarizer = ConversationSummarizer()
+    return _summarizer
+
+
+async def run_conversation_summarizer_forever(summarizer: ConversationSummarizer):
+    """Summarize sessions as their turns arrive, and sweep for due sessions every CHAT_SUMMARY_INTERVAL_SECONDS"""
+    summarizer.active = True
+    loop = asyncio.get_running_loop()
+    next_sweep = loop.time() + settings.CHAT_SUMMARY_INTERVAL_SECONDS
+    try:
+        while not summarizer.stop_event.is_set():
+            await asyncio.to_thread(summarizer.wake_event.wait, max(next_sweep - loop.time(), 0))
+            summarizer.wake_event.clear()
+            if summarizer.stop_event.is_set():
+                break
+            session_ids = summarizer.take_notified()
+            if loop.time() >= next_sweep:
+                session_ids = None
+                next_sweep = loop.time() + settings.CHAT_SUMMARY_INTERVAL_SECONDS
+            try:
+                await asyncio.to_thread(summarizer.run_pass, session_ids)
+            except Exception as e:
+                logger.error(f"Conversation summary pass failed: {e}")
+    finally:
+        summarizer.active = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fold the older turns of long chat sessions into their running summaries")
+    parser.add_argument("--session", action="append", help="only this session (repeatable)")
+    args = parser.parse_args()
+
+    print(json.dumps(ConversationSummarizer().run_pass(args.session), indent=2))
+
+
+if __name__ == "__main__":
+    main()
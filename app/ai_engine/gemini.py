@@ -1,49 +1,386 @@
+import asyncio
+import copy
+import queue
+import threading
+import weakref
+from contextlib import aclosing, asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
 import google.generativeai as genai
+from google.generativeai import client as genai_client
+from google.generativeai.types import content_types
+from app.ai_engine.resilience import GeminiUnavailable, ResilientCaller, get_resilient_caller
+from app.ai_engine.single_flight import SingleFlight, get_single_flight, prompt_fingerprint
 from app.config import get_settings
-from typing import List, Optional
 
 settings = get_settings()
 
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_ONLY_HIGH",
+    },
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_ONLY_HIGH",
+    },
+]
+
+_configure_lock = threading.Lock()
+_configured = False
+
+
+def configure_genai():
+    """genai.configure once per process; it resets every client the library has cached"""
+    global _configured
+    with _configure_lock:
+        if not _configured:
+            genai.configure(api_key=settings.GOOGLE_API_KEY)
+            _configured = True
+
+
+def make_model() -> genai.GenerativeModel:
+    """A model bound to its own service client (its own connection), not the library's shared default"""
+    configure_genai()
+    model = genai.GenerativeModel(settings.GEMINI_MODEL, safety_settings=SAFETY_SETTINGS)
+    model._client = genai_client._client_manager.make_client("generative")
+    return model
+
+
+def make_async_model() -> genai.GenerativeModel:
+    """
+    The model used by the async path. Its async client is created on first use
+    inside the running event loop; one gRPC channel multiplexes every call.
+    """
+    configure_genai()
+    return genai.GenerativeModel(settings.GEMINI_MODEL, safety_settings=SAFETY_SETTINGS)
+
+
+def with_system_instruction(model, system_instruction: Optional[str]):
+    """
+    `model` answering under `system_instruction`. The copy shares the
+    original's client, so a pooled connection can serve any system prompt.
+    """
+    if not system_instruction:
+        return model
+    variant = copy.copy(model)
+    variant._system_instruction = content_types.to_content(system_instruction)
+    return variant
+
+
+class ModelPoolExhausted(Exception):
+    pass
+
+
+class GeminiTimeout(Exception):
+    pass
+
+
+class ModelPool:
+    """
+    A fixed set of models created up front. A call borrows one for its
+    duration, so at most `size` model calls run at once per process and no
+    request pays for building a client.
+    """
+
+    def __init__(self, size: Optional[int] = None, factory: Callable[[], object] = make_model):
+        self.size = max(size or settings.GEMINI_POOL_SIZE, 1)
+        self._idle: "queue.Queue" = queue.Queue()
+        for _ in range(self.size):
+            self._idle.put(factory())
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.waits = 0
+
+    @contextmanager
+    def acquire(self, timeout: Optional[float] = None):
+        timeout = settings.GEMINI_POOL_TIMEOUT_SECONDS if timeout is None else timeout
+        try:
+            model = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self.waits += 1
+            try:
+                model = self._idle.get(timeout=timeout)
+            except queue.Empty:
+                raise ModelPoolExhausted(f"All {self.size} model clients busy for {timeout}s")
+        with self._lock:
+            self.in_use += 1
+        try:
+            yield model
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._idle.put(model)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": self.size, "in_use": self.in_use, "waits": self.waits}
+
+
+class InFlightLimiter:
+    """
+    Caps model calls awaiting a reply across a worker, GEMINI_MAX_IN_FLIGHT by
+    default. Waiting for a slot costs nothing but a suspended coroutine, so a
+    worker can hold hundreds of chats without blocking its event loop.
+    """
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = max(limit or settings.GEMINI_MAX_IN_FLIGHT, 1)
+        # asyncio primitives belong to one loop; keep one semaphore per running loop.
+        self._semaphores: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self.in_flight = 0
+        self.waiting = 0
+        self.timeouts = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.limit)
+        return semaphore
+
+    @asynccontextmanager
+    async def slot(self, timeout: Optional[float] = None):
+        semaphore = self._semaphore()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout)
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            semaphore.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {"limit": self.limit, "in_flight": self.in_flight, "waiting": self.waiting, "timeouts": self.timeouts}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_limiter = None
+
+
+def get_model_pool() -> ModelPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ModelPool()
+    return _pool
+
+
+def get_in_flight_limiter() -> InFlightLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = InFlightLimiter()
+    return _limiter
+
 
 class GeminiEngine:
-    def __init__(self):
-        genai.configure(api_key=settings.GOOGLE_API_KEY)
-        self.model = genai.GenerativeModel(
-            settings.GEMINI_MODEL,
-            safety_settings=[
-                {
-                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                    "threshold": "BLOCK_ONLY_HIGH",
-                },
-                {
-                    "category": "HARM_CATEGORY_HARASSMENT",
-                    "threshold": "BLOCK_ONLY_HIGH",
-                },
-            ]
-        )
-        self.chat = None
-
-    def start_chat(self, history: Optional[List[dict]] = None):
-        """Start a new chat session with optional history"""
-        conversation_history = history or []
-        self.chat = self.model.start_chat(history=conversation_history)
-        return self.chat
-
-    def send_message(self, message: str, context: Optional[str] = None) -> str:
-        """Send a message and get response"""
+    """
+    Stateless: every call carries its own history, so one engine can serve
+    any number of concurrent conversations. Models come from the shared pool,
+    and identical concurrent async calls share one upstream call (see
+    app.ai_engine.single_flight). Async calls are retried, hedged and cut off
+    by a circuit breaker as app.ai_engine.resilience describes.
+    """
+
+    def __init__(
+        self,
+        pool: Optional[ModelPool] = None,
+        async_model=None,
+        limiter: Optional[InFlightLimiter] = None,
+        flights: Optional[SingleFlight] = None,
+        resilience: Optional[ResilientCaller] = None
+    ):
+        self._pool = pool
+        self._async_model = async_model
+        self._limiter = limiter
+        self._flights = flights
+        self._resilience = resilience
+
+    @property
+    def pool(self) -> ModelPool:
+        return self._pool or get_model_pool()
+
+    @property
+    def async_model(self):
+        if self._async_model is None:
+            self._async_model = make_async_model()
+        return self._async_model
+
+    @property
+    def limiter(self) -> InFlightLimiter:
+        return self._limiter or get_in_flight_limiter()
+
+    @property
+    def flights(self) -> SingleFlight:
+        return self._flights or get_single_flight()
+
+    @property
+    def resilience(self) -> ResilientCaller:
+        return self._resilience or get_resilient_caller()
+
+    @staticmethod
+    def build_message(message: str, context: Optional[str] = None) -> str:
         if context:
-            full_message = f"Context:\n{context}\n\nUser Question:\n{message}"
-        else:
-            full_message = message
+            return f"Context:\n{context}\n\nUser Question:\n{message}"
+        return message
 
+    def send_message(
+        self,
+        message: str,
+        context: Optional[str] = None,
+        history: Optional[List[dict]] = None,
+        system_instruction: Optional[str] = None
+    ) -> str:
+        """Reply to `message` given the earlier turns in `history` (Gemini role/parts dicts)"""
+        full_message = self.build_message(message, context)
         try:
-            response = self.chat.send_message(full_message)
-            return response.text
+            with self.pool.acquire() as model:
+                chat = with_system_instruction(model, system_instruction).start_chat(history=list(history or []))
+                response = chat.send_message(full_message)
+                return response.text
         except Exception as e:
             raise Exception(f"Error sending message to Gemini: {str(e)}")
 
+    async def send_message_async(
+        self,
+        message: str,
+        context: Optional[str] = None,
+        history: Optional[List[dict]] = None,
+        timeout: Optional[float] = None,
+        system_instruction: Optional[str] = None
+    ) -> str:
+        """
+        send_message without blocking the event loop. `timeout` (default
+        GEMINI_TIMEOUT_SECONDS) covers waiting for a slot and the model call;
+        when it expires, or the caller is cancelled, the upstream call is
+        cancelled too unless an identical call is still waiting on it.
+        """
+        timeout = settings.GEMINI_TIMEOUT_SECONDS if timeout is None else timeout
+        full_message = self.build_message(message, context)
+        key = prompt_fingerprint(full_message, history, system_instruction)
+        loop = asyncio.get_running_loop()
+
+        async def call() -> str:
+            deadline = loop.time() + timeout
+
+            async def attempt() -> str:
+                async with self.limiter.slot():
+                    chat = with_system_instruction(self.async_model, system_instruction).start_chat(history=list(history or []))
+                    response = await chat.send_message_async(
+                        full_message, request_options={"timeout": max(deadline - loop.time(), 0.001)}
+                    )
+                    return response.text
+
+            return await self.resilience.call(attempt, deadline)
+
+        try:
+            return await self.flights.call(key, call, timeout)
+        except asyncio.TimeoutError:
+            self.limiter.timeouts += 1
+            raise GeminiTimeout(f"Gemini did not answer within {timeout}s")
+        except (asyncio.CancelledError, GeminiUnavailable):
+            raise
+        except Exception as e:
+            raise Exception(f"Error sending message to Gemini: {str(e)}")
+
+    async def stream_message_async(
+        self,
+        message: str,
+        context: Optional[str] = None,
+        history: Optional[List[dict]] = None,
+        timeout: Optional[float] = None,
+        system_instruction: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        The reply as text chunks while the model generates it. `timeout` bounds
+        the whole stream; closing the iterator early (a client that went away)
+        cancels the upstream call and frees the slot, unless an identical
+        stream is still reading it.
+        """
+        timeout = settings.GEMINI_TIMEOUT_SECONDS if timeout is None else timeout
+        full_message = self.build_message(message, context)
+        key = prompt_fingerprint(full_message, history, system_instruction)
+        chunks = self.flights.stream(key, lambda: self._stream(full_message, history, timeout, system_instruction), timeout)
+        try:
+            async with aclosing(chunks):
+                async for text in chunks:
+                    yield text
+        except asyncio.TimeoutError:
+            self.limiter.timeouts += 1
+            raise GeminiTimeout(f"Gemini did not finish within {timeout}s")
+
+    async def _stream(
+        self,
+        full_message: str,
+        history: Optional[List[dict]],
+        timeout: float,
+        system_instruction: Optional[str]
+    ) -> AsyncIterator[str]:
+        """The upstream stream behind stream_message_async"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        def remaining() -> float:
+            left = deadline - loop.time()
+            if left <= 0:
+                raise asyncio.TimeoutError()
+            return left
+
+        resilience = self.resilience
+        resilience.start_call()
+        tries = 0
+        try:
+            while True:
+                resilience.admit()
+                tries += 1
+                started = False
+                try:
+                    async with self.limiter.slot(timeout=remaining()):
+                        chat = with_system_instruction(self.async_model, system_instruction).start_chat(history=list(history or []))
+                        response = await asyncio.wait_for(
+                            chat.send_message_async(full_message, stream=True, request_options={"timeout": remaining()}),
+                            remaining()
+                        )
+                        chunks = response.__aiter__()
+                        try:
+                            while True:
+                                try:
+                                    chunk = await asyncio.wait_for(chunks.__anext__(), remaining())
+                                except StopAsyncIteration:
+                                    break
+                                if chunk.text:
+                                    started = True
+                                    yield chunk.text
+                        finally:
+                            if hasattr(chunks, "aclose"):
+                                await chunks.aclose()
+                except BaseException as e:
+                    resilience.record(e, deadline)
+                    # Once text has gone out a retry would repeat it.
+                    delay = None if started else resilience.retry_delay(e, tries, deadline)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    continue
+                resilience.record(None, deadline)
+                return
+        except asyncio.TimeoutError:
+            self.limiter.timeouts += 1
+            raise GeminiTimeout(f"Gemini did not finish within {timeout}s")
+        except GeminiUnavailable:
+            raise
+        except Exception as e:
+            raise Exception(f"Error streaming from Gemini: {str(e)}")
+
     def generate_embeddings(self, text: str) -> List[float]:
         """Generate embeddings for text using Gemini"""
+        configure_genai()
         try:
             result = genai.embed_content(
                 model="models/embedding-001",
@@ -77,3 +414,10 @@ EDUCATIONAL FOCUS AREAS:
 - Security concepts and best practices
 
 Always respond helpfully but responsibly, steering conversations toward legitimate learning."""
+
+
+_engine = GeminiEngine()
+
+
+def get_gemini_engine() -> GeminiEngine:
+    return _engine
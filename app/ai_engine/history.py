@@ -0,0 +1,97 @@
+"""
+In-process cache of recent chat history, already in Gemini's role/parts form.
+
+Each cached session keeps its last CHAT_HISTORY_TURNS messages and is
+appended to as turns are stored, so a turn in a warm session reads no
+messages from the database. A cold session is loaded with a single query for
+its last CHAT_HISTORY_TURNS messages. At most CHAT_HISTORY_CACHE_SESSIONS are
+kept; the least recently used are evicted first.
+
+Appends come from this process, so the cache is exact only while a session's
+turns are all served by one process. The shard router arranges that for a
+cluster, and a deployment running several workers per node should route
+sessions the same way or set CHAT_HISTORY_CACHE_SESSIONS=0.
+"""
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+
+from app.config import get_settings
+from app.models import ChatMessage
+
+settings = get_settings()
+
+Turn = Tuple[datetime, Dict]
+
+
+def to_turn(message: ChatMessage) -> Turn:
+    role = "model" if message.role == "assistant" else "user"
+    return message.created_at, {"role": role, "parts": [{"text": message.content}]}
+
+
+class SessionHistoryCache:
+    def __init__(self, max_sessions: Optional[int] = None, max_turns: Optional[int] = None):
+        self.max_sessions = settings.CHAT_HISTORY_CACHE_SESSIONS if max_sessions is None else max_sessions
+        self.max_turns = max(max_turns or settings.CHAT_HISTORY_TURNS, 1)
+        self._sessions: "OrderedDict[str, Deque[Turn]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, session_id: str, turns: List[Turn]):
+        if self.max_sessions <= 0:
+            return
+        self._sessions[session_id] = deque(turns, maxlen=self.max_turns)
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def history(self, db, session_id: str, after: Optional[datetime] = None) -> List[Dict]:
+        """The session's recent turns, oldest first, leaving out any at or before `after`"""
+        with self._lock:
+            turns = self._sessions.get(session_id)
+            if turns is not None:
+                self._sessions.move_to_end(session_id)
+                self.hits += 1
+                turns = list(turns)
+        if turns is None:
+            query = db.query(ChatMessage).filter(ChatMessage.session_id == session_id)
+            if after is not None:
+                query = query.filter(ChatMessage.created_at > after)
+            messages = query.order_by(ChatMessage.created_at.desc()).limit(self.max_turns).all()
+            turns = [to_turn(message) for message in reversed(messages)]
+            with self._lock:
+                self.misses += 1
+                if session_id not in self._sessions:
+                    self._store(session_id, turns)
+        return [turn for created_at, turn in turns if after is None or created_at > after]
+
+    def start(self, session_id: str):
+        """A new session: nothing to load"""
+        with self._lock:
+            self._store(session_id, [])
+
+    def append(self, session_id: str, message: ChatMessage):
+        """Record a stored message; sessions not in the cache are loaded in full on their next turn"""
+        with self._lock:
+            turns = self._sessions.get(session_id)
+            if turns is not None:
+                turns.append(to_turn(message))
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"sessions": len(self._sessions), "hits": self.hits, "misses": self.misses}
+
+
+_cache = None
+
+
+def get_history_cache() -> SessionHistoryCache:
+    global _cache
+    if _cache is None:
+        _cache = SessionHistoryCache()
+    return _cache
@@ -0,0 +1,144 @@
+"""
+Fitting a chat request into a token budget.
+
+The system prompt travels once per call as the model's system instruction
+rather than being pasted into the user turn (and from there into every later
+turn's history). What is left of PROMPT_TOKEN_BUDGET is filled in priority
+order: the current question, then the session's running summary (see
+app.ai_engine.conversation), then retrieved context in ranking order, then
+history from the most recent turn backwards. Tokens are estimated locally -
+no count_tokens round trip - at about four characters per token, which is
+close for English prose and errs high for code.
+"""
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+from app.config import get_settings
+
+settings = get_settings()
+
+CHARS_PER_TOKEN = 4
+# Role, parts and separators around each history turn or context item
+TURN_OVERHEAD_TOKENS = 4
+SUMMARY_HEADER = "\n\nSummary of the earlier conversation:\n"
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _history_text(turn: Dict) -> str:
+    return "".join(part.get("text", "") for part in turn.get("parts", []))
+
+
+@dataclass
+class PromptReport:
+    """What made it into the prompt and what had to be left out"""
+    budget: int
+    tokens: int = 0
+    system_tokens: int = 0
+    question_truncated: bool = False
+    summary_tokens: int = 0
+    summary_dropped: bool = False
+    context_used: List[int] = field(default_factory=list)
+    context_dropped: int = 0
+    history_used: int = 0
+    history_dropped: int = 0
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+@dataclass
+class AssembledPrompt:
+    system_instruction: Optional[str]
+    message: str
+    context: str
+    history: List[Dict]
+    report: PromptReport
+
+
+class PromptAssembler:
+    def __init__(self, budget: Optional[int] = None):
+        self.budget = budget or settings.PROMPT_TOKEN_BUDGET
+
+    def assemble(
+        self,
+        question: str,
+        system_instruction: Optional[str] = None,
+        context_items: Sequence[str] = (),
+        history: Sequence[Dict] = (),
+        context_header: str = "",
+        summary: Optional[str] = None
+    ) -> AssembledPrompt:
+        """
+        `context_items` are ranked best first and kept or dropped whole; a
+        later, shorter item may still fit after a long one was dropped.
+        History is kept as an unbroken run of the latest turns. A summary of
+        the turns before `history` rides along in the system instruction.
+        """
+        report = PromptReport(budget=self.budget)
+        report.system_tokens = estimate_tokens(system_instruction) if system_instruction else 0
+        left = self.budget - report.system_tokens
+
+        # The question always goes in; only a question larger than the whole budget is cut.
+        question_tokens = estimate_tokens(question)
+        if question_tokens > left:
+            question = question[:max(left, 0) * CHARS_PER_TOKEN]
+            question_tokens = estimate_tokens(question)
+            report.question_truncated = True
+        left -= question_tokens
+
+        if summary:
+            cost = estimate_tokens(SUMMARY_HEADER + summary)
+            if cost <= left:
+                system_instruction = (system_instruction or "") + SUMMARY_HEADER + summary
+                report.summary_tokens = cost
+                left -= cost
+            else:
+                report.summary_dropped = True
+
+        kept = []
+        header_tokens = estimate_tokens(context_header) if context_header else 0
+        for index, item in enumerate(context_items):
+            cost = estimate_tokens(item) + TURN_OVERHEAD_TOKENS + (0 if kept else header_tokens)
+            if cost <= left:
+                kept.append(item)
+                report.context_used.append(index)
+                left -= cost
+        report.context_dropped = len(context_items) - len(kept)
+        context = context_header + "\n".join(kept) if kept else ""
+
+        recent = []
+        for turn in reversed(history):
+            cost = estimate_tokens(_history_text(turn)) + TURN_OVERHEAD_TOKENS
+            if cost > left:
+                break
+            recent.append((turn, cost))
+            left -= cost
+        recent.reverse()
+        # A conversation handed to the model starts with the user, not mid-exchange.
+        while recent and recent[0][0].get("role") != "user":
+            left += recent.pop(0)[1]
+        recent = [turn for turn, _ in recent]
+        report.history_used = len(recent)
+        report.history_dropped = len(history) - len(recent)
+
+        report.tokens = self.budget - left
+        return AssembledPrompt(
+            system_instruction=system_instruction,
+            message=question,
+            context=context,
+            history=recent,
+            report=report
+        )
+
+
+_assembler = None
+
+
+def get_prompt_assembler() -> PromptAssembler:
+    global _assembler
+    if _assembler is None:
+        _assembler = PromptAssembler()
+    return _assembler
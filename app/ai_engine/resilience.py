@@ -0,0 +1,337 @@
+"""
+Retries, a retry budget, a circuit breaker and hedged requests for Gemini calls.
+
+Transient upstream errors (unavailable, rate limited, internal errors, upstream
+deadlines, dropped connections) are retried up to GEMINI_RETRY_ATTEMPTS times
+in all, with full-jitter exponential backoff from GEMINI_RETRY_BASE_SECONDS,
+and never past the caller's deadline. Retries share a budget: within any
+GEMINI_RESILIENCE_WINDOW_SECONDS they may add GEMINI_RETRY_BUDGET_MIN plus
+GEMINI_RETRY_BUDGET_RATIO of the calls made, so a struggling upstream is not
+hit with a multiple of its normal load.
+
+The circuit breaker watches the same window. Once GEMINI_BREAKER_MIN_CALLS
+requests have finished there and GEMINI_BREAKER_FAILURE_RATE of them failed,
+it opens: calls fail at once with GeminiUnavailable for
+GEMINI_BREAKER_OPEN_SECONDS. Then a single probe is let through; its success
+closes the breaker and its failure opens it again. Errors saying the request
+itself was bad are neither retried nor held against the upstream.
+
+With GEMINI_HEDGE set, a request that has not answered by the p95 of recent
+latencies is sent a second time and the first answer wins; the other request
+is cancelled. Hedges spend the retry budget. Streams are retried only until
+their first chunk and are never hedged.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from google.api_core import exceptions as google_exceptions
+
+from app.config import get_settings
+
+settings = get_settings()
+
+T = TypeVar("T")
+
+TRANSIENT_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    ConnectionError,
+)
+
+
+class GeminiUnavailable(Exception):
+    """The circuit breaker is open; retry after `retry_after` seconds"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Gemini is unavailable; try again in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Errors that say the upstream is unhealthy, as opposed to the request being bad or abandoned"""
+    return isinstance(error, TRANSIENT_ERRORS + (asyncio.TimeoutError,))
+
+
+class RetryBudget:
+    def __init__(
+        self,
+        ratio: Optional[float] = None,
+        minimum: Optional[int] = None,
+        window_seconds: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ratio = settings.GEMINI_RETRY_BUDGET_RATIO if ratio is None else ratio
+        self.minimum = settings.GEMINI_RETRY_BUDGET_MIN if minimum is None else minimum
+        self.window_seconds = window_seconds or settings.GEMINI_RESILIENCE_WINDOW_SECONDS
+        self.clock = clock
+        self._calls: Deque[float] = deque()
+        self._spent: Deque[float] = deque()
+        self._lock = threading.Lock()
+        self.exhausted = 0
+
+    def _trim(self, now: float):
+        for events in (self._calls, self._spent):
+            while events and events[0] <= now - self.window_seconds:
+                events.popleft()
+
+    def record_call(self):
+        with self._lock:
+            now = self.clock()
+            self._trim(now)
+            self._calls.append(now)
+
+    def try_spend(self) -> bool:
+        """Take one retry (or hedge) from the budget, if any is left"""
+        with self._lock:
+            now = self.clock()
+            self._trim(now)
+            if len(self._spent) < self.minimum + self.ratio * len(self._calls):
+                self._spent.append(now)
+                return True
+            self.exhausted += 1
+            return False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._trim(self.clock())
+            return {"calls": len(self._calls), "spent": len(self._spent), "exhausted": self.exhausted}
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_rate: Optional[float] = None,
+        min_calls: Optional[int] = None,
+        window_seconds: Optional[float] = None,
+        open_seconds: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_rate = failure_rate or settings.GEMINI_BREAKER_FAILURE_RATE
+        self.min_calls = max(min_calls or settings.GEMINI_BREAKER_MIN_CALLS, 1)
+        self.window_seconds = window_seconds or settings.GEMINI_RESILIENCE_WINDOW_SECONDS
+        self.open_seconds = open_seconds or settings.GEMINI_BREAKER_OPEN_SECONDS
+        self.clock = clock
+        self.state = self.CLOSED
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.rejected = 0
+
+    def _open(self, now: float):
+        self.state = self.OPEN
+        self._opened_at = now
+        self._probing = False
+        self._outcomes.clear()
+        self.opened += 1
+
+    def retry_after(self) -> float:
+        return max(self._opened_at + self.open_seconds - self.clock(), 0.0)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN:
+                if self.clock() - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    self.rejected += 1
+                    return False
+                self._probing = True
+            return True
+
+    def record(self, error: Optional[BaseException]):
+        """The outcome of a request allow() let through; None for success"""
+        with self._lock:
+            now = self.clock()
+            if error is not None and not is_upstream_failure(error):
+                # Abandoned or rejected as bad: says nothing about the upstream.
+                self._probing = False
+                return
+            failed = error is not None
+            if self.state == self.HALF_OPEN:
+                if failed:
+                    self._open(now)
+                else:
+                    self.state = self.CLOSED
+                    self._probing = False
+                return
+            if self.state == self.OPEN:
+                return
+            self._outcomes.append((now, failed))
+            while self._outcomes[0][0] <= now - self.window_seconds:
+                self._outcomes.popleft()
+            failures = sum(1 for _, failed in self._outcomes if failed)
+            if len(self._outcomes) >= self.min_calls and failures >= self.failure_rate * len(self._outcomes):
+                self._open(now)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            failures = sum(1 for _, failed in self._outcomes if failed)
+            return {
+                "state": self.state,
+                "recent_requests": len(self._outcomes),
+                "recent_failures": failures,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+class LatencyTracker:
+    """Latencies of recent successful requests, for the hedging delay"""
+
+    def __init__(self, size: int = 500, min_samples: Optional[int] = None):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self.min_samples = settings.GEMINI_HEDGE_MIN_SAMPLES if min_samples is None else min_samples
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        samples: List[float] = sorted(self._samples)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        return samples[min(int(fraction * len(samples)), len(samples) - 1)]
+
+
+class ResilientCaller:
+    def __init__(
+        self,
+        attempts: Optional[int] = None,
+        base_delay: Optional[float] = None,
+        max_delay: Optional[float] = None,
+        budget: Optional[RetryBudget] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        hedge: Optional[bool] = None,
+        latencies: Optional[LatencyTracker] = None,
+    ):
+        self.attempts = max(attempts or settings.GEMINI_RETRY_ATTEMPTS, 1)
+        self.base_delay = settings.GEMINI_RETRY_BASE_SECONDS if base_delay is None else base_delay
+        self.max_delay = settings.GEMINI_RETRY_MAX_SECONDS if max_delay is None else max_delay
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = settings.GEMINI_HEDGE if hedge is None else hedge
+        self.latencies = latencies or LatencyTracker()
+        self.calls = 0
+        self.retries = 0
+        self.gave_up = 0
+        self.hedges = 0
+        self.hedges_won = 0
+
+    def start_call(self):
+        """Once per logical call, however many requests it takes"""
+        self.calls += 1
+        self.budget.record_call()
+
+    def admit(self):
+        """Before each request: raises GeminiUnavailable while the breaker is open"""
+        if not self.breaker.allow():
+            raise GeminiUnavailable(self.breaker.retry_after())
+
+    def record(self, error: Optional[BaseException], deadline: float):
+        """Tell the breaker how a request admit() let through ended; None for success"""
+        if isinstance(error, asyncio.CancelledError) and asyncio.get_running_loop().time() >= deadline:
+            # Cut off by the caller's deadline: the upstream was too slow.
+            error = asyncio.TimeoutError()
+        self.breaker.record(error)
+
+    def retry_delay(self, error: BaseException, tries: int, deadline: float) -> Optional[float]:
+        """How long to back off before another try after `error`, or None to give up"""
+        if not isinstance(error, TRANSIENT_ERRORS):
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (tries - 1)))
+        if tries >= self.attempts or asyncio.get_running_loop().time() + delay >= deadline or not self.budget.try_spend():
+            self.gave_up += 1
+            return None
+        self.retries += 1
+        return delay
+
+    async def call(self, attempt: Callable[[], Awaitable[T]], deadline: float) -> T:
+        """attempt()'s result, retried and hedged as configured; asyncio.TimeoutError at `deadline` (loop time)"""
+        self.start_call()
+        tries = 0
+        while True:
+            self.admit()
+            tries += 1
+            try:
+                result = await self._hedged(attempt, deadline)
+            except BaseException as e:
+                self.record(e, deadline)
+                delay = self.retry_delay(e, tries, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.record(None, deadline)
+            return result
+
+    async def _hedged(self, attempt: Callable[[], Awaitable[T]], deadline: float) -> T:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        hedge_after = self.latencies.percentile(0.95) if self.hedge and self.breaker.state == CircuitBreaker.CLOSED else None
+        tasks = [asyncio.ensure_future(attempt())]
+        try:
+            if hedge_after is not None and started + hedge_after < deadline:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                if not done and self.budget.try_spend():
+                    self.hedges += 1
+                    tasks.append(asyncio.ensure_future(attempt()))
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=deadline - loop.time(), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.hedges_won += 1
+                        self.latencies.record(loop.time() - started)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        hedge_after = self.latencies.percentile(0.95)
+        return {
+            "breaker": self.breaker.stats(),
+            "retry_budget": self.budget.stats(),
+            "calls": self.calls,
+            "retries": self.retries,
+            "gave_up": self.gave_up,
+            "hedging": self.hedge,
+            "hedge_after_ms": round(hedge_after * 1000) if hedge_after is not None else None,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+        }
+
+
+_caller = None
+
+
+def get_resilient_caller() -> ResilientCaller:
+    global _caller
+    if _caller is None:
+        _caller = ResilientCaller()
+    return _caller
@@ -0,0 +1,256 @@
+"""
+Cache of model replies to history-independent prompts.
+
+Many students open a session with the same introductory question, and a
+prompt with no history and no conversation summary gets the same answer
+whoever asks it. Such replies are kept for RESPONSE_CACHE_TTL_SECONDS.
+
+Lookups match exactly on the normalized question plus hashes of the system
+instruction and the retrieved context, so a re-indexed document or a changed
+prompt misses rather than serving a stale answer. With RESPONSE_CACHE_SEMANTIC
+set, a miss then looks for an earlier question with the same instruction and
+context whose embedding is at least RESPONSE_CACHE_SIMILARITY similar. The
+"hashing" embedder runs offline; "gemini" makes one embedding call per lookup.
+
+Every entry belongs to a scope. Replies grounded in a user's own training
+documents go in that user's scope and are never served to anyone else;
+replies built only from shared material go in the global scope. The cache
+holds at most RESPONSE_CACHE_MAX_ENTRIES replies and RESPONSE_CACHE_MAX_CHARS
+characters, evicting the least recently used first.
+"""
+import asyncio
+import hashlib
+import math
+import re
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from app.ai_engine.prompt import AssembledPrompt
+from app.config import get_settings
+
+settings = get_settings()
+
+GLOBAL_SCOPE = "global"
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def normalize_question(text: str) -> str:
+    """"What is XSS?" and "what is  xss" are the same question"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return " ".join(PUNCTUATION_PATTERN.sub(" ", text).split())
+
+
+def user_scope(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+def _digest(text: Optional[str]) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+class Embedder(ABC):
+    # A remote embedder is called off the event loop.
+    remote = False
+
+    @abstractmethod
+    def embed(self, text: str) -> List[float]:
+        """A unit-length vector for `text`"""
+
+
+class HashingEmbedder(Embedder):
+    """Word and word-pair counts hashed into a fixed number of dimensions; offline and deterministic"""
+
+    def __init__(self, dimensions: int = 512):
+        self.dimensions = dimensions
+
+    def embed(self, text: str) -> List[float]:
+        words = WORD_PATTERN.findall(text.lower())
+        vector = [0.0] * self.dimensions
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            index = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=4).digest(), "big")
+            vector[index % self.dimensions] += 1.0
+        return _unit(vector)
+
+
+class GeminiEmbedder(Embedder):
+    remote = True
+
+    def embed(self, text: str) -> List[float]:
+        from app.ai_engine.gemini import get_gemini_engine
+        return _unit(get_gemini_engine().generate_embeddings(text))
+
+
+EMBEDDERS = {
+    "hashing": HashingEmbedder,
+    "gemini": GeminiEmbedder,
+}
+
+
+def _unit(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else vector
+
+
+def get_embedder(name: Optional[str] = None) -> Optional[Embedder]:
+    name = (settings.RESPONSE_CACHE_SEMANTIC if name is None else name).lower()
+    if not name:
+        return None
+    if name not in EMBEDDERS:
+        raise ValueError(f"Unknown response cache embedder: {name}")
+    return EMBEDDERS[name]()
+
+
+@dataclass
+class CachedReply:
+    scope: str
+    prompt_hash: str
+    question: str
+    response: str
+    expires_at: float
+    vector: Optional[List[float]] = None
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_chars: Optional[int] = None,
+        ttl_seconds: Optional[int] = None,
+        embedder: Optional[Embedder] = None,
+        similarity: Optional[float] = None,
+    ):
+        self.max_entries = settings.RESPONSE_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.max_chars = max_chars or settings.RESPONSE_CACHE_MAX_CHARS
+        self.ttl_seconds = ttl_seconds or settings.RESPONSE_CACHE_TTL_SECONDS
+        self.embedder = embedder
+        self.similarity = similarity or settings.RESPONSE_CACHE_SIMILARITY
+        self._entries: "OrderedDict[str, CachedReply]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def _prompt_hash(prompt: AssembledPrompt) -> str:
+        return _digest(f"{_digest(prompt.system_instruction)}:{_digest(prompt.context)}")
+
+    @staticmethod
+    def _key(scope: str, prompt_hash: str, question: str) -> str:
+        return _digest(f"{scope}\0{prompt_hash}\0{question}")
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._chars -= len(entry.response)
+
+    def get(self, scope: str, prompt: AssembledPrompt) -> Optional[str]:
+        if not self.enabled:
+            return None
+        question = normalize_question(prompt.message)
+        prompt_hash = self._prompt_hash(prompt)
+        key = self._key(scope, prompt_hash, question)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry.response
+            if self.embedder is None:
+                self.misses += 1
+                return None
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if entry.scope == scope and entry.prompt_hash == prompt_hash and entry.vector and entry.expires_at > now
+            ]
+
+        vector = self.embedder.embed(question) if candidates else None
+        best_key, best_score = None, self.similarity
+        for key, entry in candidates:
+            score = sum(a * b for a, b in zip(vector, entry.vector))
+            if score >= best_score:
+                best_key, best_score = key, score
+
+        with self._lock:
+            entry = self._entries.get(best_key) if best_key else None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.semantic_hits += 1
+            return entry.response
+
+    def put(self, scope: str, prompt: AssembledPrompt, response: str):
+        if not self.enabled or not response or len(response) > self.max_chars:
+            return
+        question = normalize_question(prompt.message)
+        prompt_hash = self._prompt_hash(prompt)
+        vector = self.embedder.embed(question) if self.embedder else None
+        key = self._key(scope, prompt_hash, question)
+        entry = CachedReply(scope, prompt_hash, question, response, time.time() + self.ttl_seconds, vector)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._chars += len(response)
+            self.stores += 1
+            while len(self._entries) > self.max_entries or self._chars > self.max_chars:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    async def lookup(self, scope: str, prompt: AssembledPrompt) -> Optional[str]:
+        if self.embedder is not None and self.embedder.remote:
+            return await asyncio.to_thread(self.get, scope, prompt)
+        return self.get(scope, prompt)
+
+    async def remember(self, scope: str, prompt: AssembledPrompt, response: str):
+        if self.embedder is not None and self.embedder.remote:
+            await asyncio.to_thread(self.put, scope, prompt, response)
+        else:
+            self.put(scope, prompt, response)
+
+    def clear(self, scope: Optional[str] = None):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if scope is None or entry.scope == scope]:
+                self._remove(key)
+
+    def stats(self) -> Dict:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "chars": self._chars,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+_cache = None
+
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache(embedder=get_embedder())
+    return _cache
@@ -0,0 +1,159 @@
+"""
+Single-flight for identical concurrent model calls.
+
+When a class works through the same exercise, dozens of students send the
+same prompt within a second or two. A call whose prompt fingerprint (system
+instruction, history and message) matches one already in flight joins it
+instead of making its own upstream call: a reply is handed to every caller,
+and a stream is replayed to each subscriber from its first chunk and then
+followed live.
+
+Every caller keeps its own deadline. One whose deadline passes, or that is
+cancelled or closes its stream, leaves without disturbing the others; the
+upstream call is cancelled once nobody is left waiting on it. Errors from the
+upstream call, its own timeout included, reach everyone on it. Flights only
+span calls that overlap in time (the response cache covers later repeats) and
+belong to one event loop.
+"""
+import asyncio
+import hashlib
+import json
+import weakref
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+def prompt_fingerprint(message: str, history: Optional[List[dict]] = None, system_instruction: Optional[str] = None) -> str:
+    payload = json.dumps([system_instruction, history or [], message], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class _Broadcast:
+    """Runs one stream to completion, keeping every chunk for subscribers that join late"""
+
+    def __init__(self, chunks: AsyncIterator[str]):
+        self.chunks: List[str] = []
+        self.error: Optional[BaseException] = None
+        self.finished = False
+        self.subscribers = 0
+        self._more = asyncio.get_running_loop().create_future()
+        self.task = asyncio.ensure_future(self._pump(chunks))
+
+    def _wake(self):
+        more, self._more = self._more, asyncio.get_running_loop().create_future()
+        more.set_result(None)
+
+    async def _pump(self, chunks: AsyncIterator[str]):
+        try:
+            async with aclosing(chunks):
+                async for text in chunks:
+                    self.chunks.append(text)
+                    self._wake()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+            self._wake()
+
+    async def wait(self, timeout: float):
+        await asyncio.wait_for(asyncio.shield(self._more), timeout)
+
+
+class SingleFlight:
+    def __init__(self):
+        # asyncio tasks belong to one loop; keep one table of flights per running loop.
+        self._tables: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self.leaders = 0
+        self.followers = 0
+        self.abandoned = 0
+
+    def _table(self) -> Dict:
+        loop = asyncio.get_running_loop()
+        table = self._tables.get(loop)
+        if table is None:
+            table = self._tables[loop] = {}
+        return table
+
+    @staticmethod
+    def _forget(table: Dict, key, flight):
+        if table.get(key) is flight:
+            del table[key]
+
+    async def _abandon(self, table: Dict, key, flight):
+        """The last caller left: cancel the upstream call and let it wind down before returning"""
+        self._forget(table, key, flight)
+        flight.task.cancel()
+        self.abandoned += 1
+        await asyncio.wait([flight.task])
+
+    async def call(self, key: str, start: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+        """start()'s result, shared with every concurrent call for `key`; asyncio.TimeoutError after `timeout`"""
+        table = self._table()
+        flight = table.get(("call", key))
+        if flight is None:
+            flight = table[("call", key)] = _Call(asyncio.ensure_future(start()))
+            flight.task.add_done_callback(lambda _: self._forget(table, ("call", key), flight))
+            self.leaders += 1
+        else:
+            self.followers += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight.task), timeout)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                await self._abandon(table, ("call", key), flight)
+
+    async def stream(self, key: str, start: Callable[[], AsyncIterator[str]], timeout: float) -> AsyncIterator[str]:
+        """start()'s chunks, shared with every concurrent stream for `key`; asyncio.TimeoutError after `timeout`"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        table = self._table()
+        flight = table.get(("stream", key))
+        if flight is None:
+            flight = table[("stream", key)] = _Broadcast(start())
+            flight.task.add_done_callback(lambda _: self._forget(table, ("stream", key), flight))
+            self.leaders += 1
+        else:
+            self.followers += 1
+
+        flight.subscribers += 1
+        sent = 0
+        try:
+            while True:
+                if sent < len(flight.chunks):
+                    sent += 1
+                    yield flight.chunks[sent - 1]
+                elif flight.finished:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await flight.wait(deadline - loop.time())
+        finally:
+            flight.subscribers -= 1
+            if not flight.subscribers and not flight.task.done():
+                await self._abandon(table, ("stream", key), flight)
+
+    def stats(self) -> Dict[str, int]:
+        in_flight = sum(len(table) for table in list(self._tables.values()))
+        return {"in_flight": in_flight, "leaders": self.leaders, "followers": self.followers, "abandoned": self.abandoned}
+
+
+_flights = None
+
+
+def get_single_flight() -> SingleFlight:
+    global _flights
+    if _flights is None:
+        _flights = SingleFlight()
+    return _flights
@@ -3,7 +3,7 @@ from typing import Optional
 from app.config import get_settings
 
 
-async def verify_admin_token(authorization: Optional[str] = Header(None)):
+def _bearer_token(authorization: Optional[str]) -> str:
     if not authorization:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -19,6 +19,11 @@ async def verify_admin_token(authorization: Optional[str] = Header(None)):
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authorization header"
         )
+    return token
+
+
+async def verify_admin_token(authorization: Optional[str] = Header(None)):
+    token = _bearer_token(authorization)
     
     settings = get_settings()
     admin_password = settings.ADMIN_PASSWORD
@@ -30,3 +35,21 @@ async def verify_admin_token(authorization: Optional[str] = Header(None)):
         )
     
     return {"authenticated": True}
+
+
+async def verify_replication_token(authorization: Optional[str] = Header(None)):
+    """Index and cluster endpoints other nodes call: the admin password, or REPLICATION_TOKEN when set"""
+    token = _bearer_token(authorization)
+    
+    settings = get_settings()
+    accepted = {settings.ADMIN_PASSWORD}
+    if settings.REPLICATION_TOKEN:
+        accepted.add(settings.REPLICATION_TOKEN)
+    
+    if token not in accepted:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid admin credentials"
+        )
+    
+    return {"authenticated": True}
@@ -1,15 +1,39 @@
-from fastapi import APIRouter, HTTPException, Depends, Query, status
+import asyncio
+import os
+import tempfile
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, status
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
-from typing import Optional
+from starlette.background import BackgroundTask
+from typing import Dict, Optional
 from app.db.queries import AdminQueries, SubscriptionQueries, PaymentQueries, TokenQueries, BankSettingsQueries, ContactQueries
-from app.api.dependencies.admin_auth import verify_admin_token
+from app.api.dependencies.admin_auth import verify_admin_token, verify_replication_token
+from app.ai_engine.gemini import get_in_flight_limiter
+from app.ai_engine.history import get_history_cache
+from app.ai_engine.resilience import get_resilient_caller
+from app.ai_engine.single_flight import get_single_flight
+from app.ai_engine.response_cache import get_response_cache
 from app.core.mac_manager import MACManager
+from app.core.sharding import get_shard_router
 from datetime import datetime, timedelta
 from app.core.supabase_client import supabase
+from app.training.rebalance import broadcast_membership, get_rebalancer, import_collections
+from app.training.replication import SnapshotError, write_index_snapshot
+from app.training.vector_store import USAGE_FIELDS, get_vector_store
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
 
+class ClusterMembershipRequest(BaseModel):
+    nodes: Dict[str, str]
+    generation: int
+
+
+class ClusterNodeRequest(BaseModel):
+    node_id: str
+    url: str
+
+
 class UserUpdateRequest(BaseModel):
     email: Optional[str] = None
     username: Optional[str] = None
@@ -97,6 +121,120 @@ async def get_dashboard_stats():
     return stats
 
 
+@router.get("/ai/engine", dependencies=[Depends(verify_admin_token)])
+async def get_ai_engine_stats():
+    return {
+        "in_flight": get_in_flight_limiter().stats(),
+        "single_flight": get_single_flight().stats(),
+        "resilience": get_resilient_caller().stats()
+    }
+
+
+@router.get("/chat/caches", dependencies=[Depends(verify_admin_token)])
+async def get_chat_cache_stats():
+    return {
+        "responses": get_response_cache().stats(),
+        "history": get_history_cache().stats()
+    }
+
+
+@router.delete("/chat/caches/responses", dependencies=[Depends(verify_admin_token)])
+async def clear_response_cache():
+    """Forget every cached reply, e.g. once a poor answer has been reported"""
+    get_response_cache().clear()
+    return {"message": "Response cache cleared"}
+
+
+@router.get("/collections/usage", dependencies=[Depends(verify_admin_token)])
+async def get_collection_usage_report(top: int = Query(20, ge=1, le=500)):
+    report = get_vector_store().usage_report()
+    totals = {name: sum(entry[name] for entry in report) for name in USAGE_FIELDS + ("total_bytes",)}
+    return {
+        "collections": len(report),
+        "totals": totals,
+        "top": report[:top]
+    }
+
+
+@router.get("/index/snapshot", dependencies=[Depends(verify_replication_token)])
+async def get_index_snapshot(since: Optional[int] = Query(None, ge=0), epoch: Optional[str] = None):
+    """Binary snapshot of the vector index for standby nodes; a delta when `since` belongs to this process's epoch"""
+    store = get_vector_store()
+    # Captured without awaiting, so no request can change a collection mid-copy.
+    state = store.export_state(since if since is not None and epoch == store.epoch else None)
+    fd, path = tempfile.mkstemp(suffix=".vssnap")
+    os.close(fd)
+    try:
+        header = await asyncio.to_thread(write_index_snapshot, path, state)
+    except Exception:
+        os.remove(path)
+        raise
+    return FileResponse(
+        path,
+        media_type="application/octet-stream",
+        headers={
+            "X-Snapshot-Kind": header["kind"],
+            "X-Snapshot-Epoch": header["epoch"],
+            "X-Snapshot-Version": str(header["version"]),
+        },
+        background=BackgroundTask(os.remove, path)
+    )
+
+
+@router.post("/index/collections", dependencies=[Depends(verify_replication_token)])
+async def import_index_collections(request: Request):
+    """Receive collections handed off by another node (a body in the index snapshot format)"""
+    fd, path = tempfile.mkstemp(suffix=".vssnap")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for block in request.stream():
+                f.write(block)
+        imported = await import_collections(get_vector_store(), path)
+    except SnapshotError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    finally:
+        os.remove(path)
+    return {"imported": imported}
+
+
+@router.get("/cluster", dependencies=[Depends(verify_replication_token)])
+async def get_cluster():
+    shard_router = get_shard_router()
+    return {**shard_router.describe(), "misplaced_collections": sum(map(len, get_rebalancer().misplaced().values()))}
+
+
+@router.put("/cluster", dependencies=[Depends(verify_replication_token)])
+async def set_cluster_members(payload: ClusterMembershipRequest):
+    """Adopt a member list pushed by another node; older generations are ignored"""
+    shard_router = get_shard_router()
+    accepted = shard_router.set_members(payload.nodes, payload.generation)
+    if accepted:
+        get_rebalancer().wake()
+    return {**shard_router.describe(), "accepted": accepted}
+
+
+@router.post("/cluster/nodes", dependencies=[Depends(verify_admin_token)])
+async def join_cluster_node(payload: ClusterNodeRequest):
+    shard_router = get_shard_router()
+    previous = dict(shard_router.nodes)
+    shard_router.join(payload.node_id, payload.url)
+    unreachable = await broadcast_membership(shard_router, previous)
+    get_rebalancer().wake()
+    return {**shard_router.describe(), "unreachable": unreachable}
+
+
+@router.delete("/cluster/nodes/{node_id}", dependencies=[Depends(verify_admin_token)])
+async def leave_cluster_node(node_id: str):
+    shard_router = get_shard_router()
+    if node_id not in shard_router.nodes:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Node is not a cluster member")
+    previous = dict(shard_router.nodes)
+    shard_router.leave(node_id)
+    unreachable = await broadcast_membership(shard_router, previous)
+    get_rebalancer().wake()
+    return {**shard_router.describe(), "unreachable": unreachable}
+
+
 @router.get("/users", dependencies=[Depends(verify_admin_token)])
 async def list_users(
     search: Optional[str] = Query(None),
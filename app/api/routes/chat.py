@@ -1,30 +1,45 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import json
+import logging
+import time
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from app.database import get_db
-from app.models import User, ChatSession, ChatMessage
+from app.database import SessionLocal, get_db
+from app.models import User, ChatSession, ChatMessage, ChatSessionSummary
 from app import schemas, security
-from app.ai_engine.gemini import GeminiEngine
-from app.training.vector_store import VectorStore
+from app.ai_engine.conversation import get_conversation_summarizer
+from app.ai_engine.gemini import GeminiEngine, GeminiTimeout, GeminiUnavailable, get_gemini_engine
+from app.ai_engine.history import get_history_cache
+from app.ai_engine.prompt import AssembledPrompt, get_prompt_assembler
+from app.ai_engine.response_cache import GLOBAL_SCOPE, get_response_cache, user_scope
+from app.config import get_settings
+from app.core.sharding import get_shard_router
+from app.middleware.mac_verification import verify_connection_device
+from app.training.module_corpus import get_module_corpus
+from app.training.vector_store import get_vector_store
 from app.safety_filter import SafetyFilter
+from app.utils.sse import SSE_HEADERS, sse_event
 
+settings = get_settings()
+logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/chat", tags=["chat"])
 
-gemini_engine = GeminiEngine()
-_vector_store = None
+gemini_engine = get_gemini_engine()
+history_cache = get_history_cache()
+response_cache = get_response_cache()
 
-def get_vector_store():
-    global _vector_store
-    if _vector_store is None:
-        _vector_store = VectorStore()
-    return _vector_store
 
-
-@router.post("/message", response_model=schemas.ChatResponse)
-async def send_message(
-    chat_request: schemas.ChatRequest,
-    current_user: User = Depends(security.get_current_user),
-    db: Session = Depends(get_db)
-):
+async def prepare_chat_turn(chat_request: schemas.ChatRequest, current_user: User, db: Session):
+    """
+    Check the message, store it and fit what the model needs into the prompt
+    budget: (session_id, user_message, prompt, cache_scope). cache_scope is the
+    response cache scope the reply may be shared in, or None when the prompt
+    depends on the conversation so far.
+    """
     is_safe, message_or_redirect = SafetyFilter.filter_query(chat_request.message)
     
     if not is_safe:
@@ -40,6 +55,7 @@ async def send_message(
         db.commit()
         db.refresh(session)
         session_id = session.id
+        history_cache.start(session_id)
     else:
         session = db.query(ChatSession).filter(
             ChatSession.id == session_id,
@@ -52,6 +68,10 @@ async def send_message(
                 detail="Chat session not found"
             )
     
+    # Turns already folded into the running summary are not sent again.
+    summary = db.query(ChatSessionSummary).filter(ChatSessionSummary.session_id == session_id).first()
+    conversation_history = history_cache.history(db, session_id, after=summary.covered_until if summary else None)
+    
     user_message = ChatMessage(
         session_id=session_id,
         role="user",
@@ -60,41 +80,39 @@ async def send_message(
     db.add(user_message)
     db.commit()
     db.refresh(user_message)
+    history_cache.append(session_id, user_message)
     
     retrieved_docs = get_vector_store().retrieve(current_user.id, chat_request.message, n_results=3)
-    context = ""
-    if retrieved_docs:
-        context = "Retrieved knowledge base:\n"
-        for doc in retrieved_docs:
-            context += f"- {doc['content'][:200]}...\n"
-    
-    conversation_history = []
-    messages = db.query(ChatMessage).filter(
-        ChatMessage.session_id == session_id
-    ).order_by(ChatMessage.created_at).all()
-    
-    for msg in messages[:-1]:
-        gemini_role = "model" if msg.role == "assistant" else "user"
-        conversation_history.append({
-            "role": gemini_role,
-            "parts": [{"text": msg.content}]
-        })
+    module_corpus = get_module_corpus()
+    if module_corpus:
+        retrieved_docs += module_corpus.query(chat_request.message, n_results=3, module_id=chat_request.module_id)
+        retrieved_docs = sorted(retrieved_docs, key=lambda doc: doc["distance"])[:3]
+    context_items = []
+    for doc in retrieved_docs:
+        label = f"[{doc['title']} module] " if doc.get("module_id") else ""
+        context_items.append(f"- {label}{doc['content'][:200]}...")
     
-    gemini_engine.start_chat(conversation_history)
-    
-    system_prompt = GeminiEngine.get_system_prompt()
-    full_prompt = f"{system_prompt}\n\n{chat_request.message}"
-    
-    try:
-        ai_response = gemini_engine.send_message(full_prompt, context)
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error generating response: {str(e)}"
-        )
+    prompt = get_prompt_assembler().assemble(
+        chat_request.message,
+        system_instruction=GeminiEngine.get_system_prompt(),
+        context_items=context_items,
+        history=conversation_history,
+        context_header="Retrieved knowledge base:\n",
+        summary=summary.summary if summary else None
+    )
+    if prompt.report.context_dropped or prompt.report.history_dropped or prompt.report.question_truncated:
+        logger.info(f"Prompt for session {session_id} over budget: {prompt.report.to_dict()}")
     
-    ai_response = SafetyFilter.add_educational_disclaimer(ai_response, chat_request.message)
+    cache_scope = None
+    if not prompt.history and not prompt.report.summary_tokens:
+        # Answers drawn from the user's own documents are never shared.
+        personal = any(not retrieved_docs[index].get("module_id") for index in prompt.report.context_used)
+        cache_scope = user_scope(current_user.id) if personal else GLOBAL_SCOPE
     
+    return session_id, user_message, prompt, cache_scope
+
+
+def save_ai_message(db: Session, session_id: str, ai_response: str) -> ChatMessage:
     ai_message = ChatMessage(
         session_id=session_id,
         role="assistant",
@@ -103,18 +121,140 @@ async def send_message(
     db.add(ai_message)
     db.commit()
     db.refresh(ai_message)
-    
+    history_cache.append(session_id, ai_message)
+    get_conversation_summarizer().notify(session_id)
+    return ai_message
+
+
+async def answer_prompt(prompt: AssembledPrompt, cache_scope: Optional[str]) -> str:
+    """The model's reply to `prompt`, from the response cache when the scope allows"""
+    if cache_scope:
+        cached = await response_cache.lookup(cache_scope, prompt)
+        if cached is not None:
+            return cached
+    ai_response = await gemini_engine.send_message_async(
+        prompt.message, prompt.context, prompt.history, system_instruction=prompt.system_instruction
+    )
+    if cache_scope:
+        await response_cache.remember(cache_scope, prompt, ai_response)
+    return ai_response
+
+
+async def stream_prompt(prompt: AssembledPrompt, cache_scope: Optional[str]) -> AsyncIterator[str]:
+    """answer_prompt as chunks; a cached reply arrives as a single chunk, and only a completed stream is cached"""
+    if cache_scope:
+        cached = await response_cache.lookup(cache_scope, prompt)
+        if cached is not None:
+            yield cached
+            return
+    parts = []
+    chunks = gemini_engine.stream_message_async(
+        prompt.message, prompt.context, prompt.history, system_instruction=prompt.system_instruction
+    )
+    async with aclosing(chunks):
+        async for text in chunks:
+            parts.append(text)
+            yield text
+    if cache_scope:
+        await response_cache.remember(cache_scope, prompt, "".join(parts))
+
+
+async def charge_chat_message(user_id: str, reason: str = "Chat message"):
     # Deduct 5 tokens for the chat message
     try:
         from app.db.queries import TokenQueries
         await TokenQueries.add_token_transaction(
-            user_id=current_user.id,
+            user_id=user_id,
             amount=5,
             transaction_type="usage",
-            reason="Chat message"
+            reason=reason
         )
     except Exception as e:
         print(f"Warning: Failed to deduct token: {str(e)}")
+
+
+def chat_turn_completion(session_id: str, user_id: str) -> Callable[[str], Awaitable[Dict]]:
+    """on_complete for stream_reply: store the finished reply and charge for it"""
+    async def on_complete(ai_response: str) -> Dict:
+        # Streams outlive the request's session, so the reply gets its own.
+        db = SessionLocal()
+        try:
+            ai_message = save_ai_message(db, session_id, ai_response)
+        finally:
+            db.close()
+        await charge_chat_message(user_id)
+        return {"session_id": session_id, "message_id": ai_message.id}
+    
+    return on_complete
+
+
+async def stream_reply(
+    chunks: AsyncIterator[str],
+    disclaimer: str,
+    on_complete: Callable[[str], Awaitable[Dict]],
+    start: Dict,
+    encode: Callable[[str, Dict], Any] = sse_event
+) -> AsyncIterator[Any]:
+    """
+    Events of a streamed reply, as SSE text unless `encode` says otherwise:
+    `start`, the disclaimer and model chunks as `chunk` events, then whatever
+    on_complete(full reply) returns as `done`. If the client goes away
+    mid-stream the generator is closed: the model call is cancelled and
+    on_complete - storing the reply, debiting tokens - never runs.
+    """
+    yield encode("start", start)
+    parts = []
+    try:
+        if disclaimer:
+            parts.append(disclaimer)
+            yield encode("chunk", {"text": disclaimer})
+        async for text in chunks:
+            parts.append(text)
+            yield encode("chunk", {"text": text})
+    except GeminiTimeout as e:
+        yield encode("error", {"status": status.HTTP_504_GATEWAY_TIMEOUT, "detail": str(e)})
+        return
+    except GeminiUnavailable as e:
+        yield encode("error", {"status": status.HTTP_503_SERVICE_UNAVAILABLE, "detail": str(e), "retry_after": round(e.retry_after)})
+        return
+    except Exception as e:
+        yield encode("error", {"status": status.HTTP_500_INTERNAL_SERVER_ERROR, "detail": f"Error generating response: {str(e)}"})
+        return
+    finally:
+        await chunks.aclose()
+    yield encode("done", await on_complete("".join(parts)))
+
+
+@router.post("/message", response_model=schemas.ChatResponse)
+async def send_message(
+    chat_request: schemas.ChatRequest,
+    current_user: User = Depends(security.get_current_user),
+    db: Session = Depends(get_db)
+):
+    session_id, user_message, prompt, cache_scope = await prepare_chat_turn(chat_request, current_user, db)
+    
+    try:
+        ai_response = await answer_prompt(prompt, cache_scope)
+    except GeminiTimeout as e:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=str(e)
+        )
+    except GeminiUnavailable as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(round(e.retry_after))}
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error generating response: {str(e)}"
+        )
+    
+    ai_response = SafetyFilter.add_educational_disclaimer(ai_response, chat_request.message)
+    save_ai_message(db, session_id, ai_response)
+    await charge_chat_message(current_user.id)
     
     return {
         "message": {
@@ -124,10 +264,206 @@ async def send_message(
             "created_at": user_message.created_at
         },
         "session_id": session_id,
-        "ai_response": ai_response
+        "ai_response": ai_response,
+        "prompt": prompt.report.to_dict()
     }
 
 
+@router.post("/message/stream")
+async def send_message_stream(
+    chat_request: schemas.ChatRequest,
+    current_user: User = Depends(security.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """/chat/message as Server-Sent Events (see app.utils.sse)"""
+    session_id, user_message, prompt, cache_scope = await prepare_chat_turn(chat_request, current_user, db)
+    
+    return StreamingResponse(
+        stream_reply(
+            stream_prompt(prompt, cache_scope),
+            SafetyFilter.add_educational_disclaimer("", chat_request.message),
+            chat_turn_completion(session_id, current_user.id),
+            {"session_id": session_id, "user_message_id": user_message.id, "prompt": prompt.report.to_dict()}
+        ),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
+class ChatSocket:
+    """
+    One authenticated chat connection carrying many turns.
+    
+    Client frames are JSON objects with a "type": "message" (the fields of
+    ChatRequest), "ping" and "pong". Each turn is answered in order with the
+    events of /chat/message/stream as {"type": event, ...} frames. At most
+    CHAT_WS_MAX_PENDING_TURNS wait behind the turn being answered; further
+    ones get a 429 error frame rather than being buffered. Sends wait for the
+    socket to drain, so a slow reader slows the model stream down, and a reader
+    that stalls for CHAT_WS_SEND_TIMEOUT_SECONDS is disconnected. The server
+    pings every CHAT_WS_HEARTBEAT_SECONDS and closes the connection when the
+    client has been silent for two intervals or its token has expired.
+    """
+    
+    def __init__(self, websocket: WebSocket, user: User, expires_at: Optional[float] = None):
+        self.websocket = websocket
+        self.user = user
+        self.expires_at = expires_at
+        self.turns = asyncio.Queue(maxsize=settings.CHAT_WS_MAX_PENDING_TURNS)
+        self.last_seen = time.monotonic()
+        self._send_lock = asyncio.Lock()
+    
+    async def send(self, event: str, data: Dict):
+        async with self._send_lock:
+            await asyncio.wait_for(
+                self.websocket.send_text(json.dumps({"type": event, **data}, default=str)),
+                settings.CHAT_WS_SEND_TIMEOUT_SECONDS
+            )
+    
+    async def receive(self):
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+            self.last_seen = time.monotonic()
+            try:
+                frame = json.loads(message.get("text") or "")
+                kind = frame.get("type")
+            except (ValueError, AttributeError):
+                await self.send("error", {"status": status.HTTP_400_BAD_REQUEST, "detail": "Frames must be JSON objects"})
+                continue
+            
+            if kind == "ping":
+                await self.send("pong", {})
+            elif kind == "message":
+                try:
+                    chat_request = schemas.ChatRequest(**{key: value for key, value in frame.items() if key != "type"})
+                except ValidationError as e:
+                    await self.send("error", {"status": status.HTTP_422_UNPROCESSABLE_ENTITY, "detail": e.errors()})
+                    continue
+                try:
+                    self.turns.put_nowait(chat_request)
+                except asyncio.QueueFull:
+                    await self.send("error", {
+                        "status": status.HTTP_429_TOO_MANY_REQUESTS,
+                        "detail": "Too many messages are waiting for a reply"
+                    })
+            elif kind != "pong":
+                await self.send("error", {"status": status.HTTP_400_BAD_REQUEST, "detail": f"Unknown frame type: {kind}"})
+    
+    async def answer(self):
+        while True:
+            chat_request = await self.turns.get()
+            db = SessionLocal()
+            try:
+                session_id, _, prompt, cache_scope = await prepare_chat_turn(chat_request, self.user, db)
+            except HTTPException as e:
+                await self.send("error", {"status": e.status_code, "detail": e.detail})
+                continue
+            finally:
+                db.close()
+            
+            frames = stream_reply(
+                stream_prompt(prompt, cache_scope),
+                SafetyFilter.add_educational_disclaimer("", chat_request.message),
+                chat_turn_completion(session_id, self.user.id),
+                {"session_id": session_id, "prompt": prompt.report.to_dict()},
+                encode=lambda event, data: (event, data)
+            )
+            async with aclosing(frames):
+                async for event, data in frames:
+                    await self.send(event, data)
+    
+    async def heartbeat(self) -> int:
+        """Returns the close code once the connection should end"""
+        interval = settings.CHAT_WS_HEARTBEAT_SECONDS
+        while True:
+            wait = interval if self.expires_at is None else min(interval, max(0.0, self.expires_at - time.time()))
+            await asyncio.sleep(wait)
+            if self.expires_at is not None and time.time() >= self.expires_at:
+                await self.send("error", {"status": status.HTTP_401_UNAUTHORIZED, "detail": "Token expired"})
+                return status.WS_1008_POLICY_VIOLATION
+            if time.monotonic() - self.last_seen > 2 * interval:
+                return status.WS_1001_GOING_AWAY
+            await self.send("ping", {})
+    
+    async def run(self):
+        tasks = [asyncio.create_task(job) for job in (self.receive(), self.answer(), self.heartbeat())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Cancelling the turn closes its reply stream: nothing is stored or charged.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+        finished = done.pop()
+        error = finished.exception()
+        if isinstance(error, WebSocketDisconnect):
+            return
+        if error is not None and not isinstance(error, asyncio.TimeoutError):
+            logger.error(f"Chat socket for user {self.user.id} failed: {type(error).__name__}: {error}")
+        code = status.WS_1011_INTERNAL_ERROR if error is not None else finished.result()
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), settings.CHAT_WS_SEND_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+
+
+@router.websocket("/ws")
+async def chat_socket(websocket: WebSocket, token: Optional[str] = None):
+    """
+    /chat/message over a WebSocket. The token is checked and the device verified
+    once, at connect, rather than on every turn. Browsers cannot set headers on
+    a WebSocket, so the token may also be passed as ?token=.
+    """
+    authorization = websocket.headers.get("authorization", "")
+    token = authorization.split(" ", 1)[1] if authorization.startswith("Bearer ") else token
+    if not token:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    db = SessionLocal()
+    try:
+        user, payload = security.authenticate_token(token, db)
+        user_id = user.id
+        db.expunge(user)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    finally:
+        db.close()
+    
+    try:
+        verified = await verify_connection_device(websocket, user_id)
+    except Exception as e:
+        logger.error(f"Device verification for chat socket failed: {type(e).__name__}: {str(e)}")
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        return
+    if not verified:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    
+    # ShardRoutingMiddleware only sees HTTP, so point the client at the owner itself.
+    shard_router = get_shard_router()
+    if not shard_router.is_local(user_id):
+        owner_id, owner_url = shard_router.owner(user_id)
+        await websocket.send_json({
+            "type": "error",
+            "status": status.HTTP_421_MISDIRECTED_REQUEST,
+            "detail": "This user is served by another node",
+            "owner": owner_id,
+            "location": owner_url.replace("http", "ws", 1) + websocket.url.path
+        })
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+    
+    await websocket.send_json({"type": "ready", "heartbeat_seconds": settings.CHAT_WS_HEARTBEAT_SECONDS})
+    await ChatSocket(websocket, user, payload.get("exp")).run()
+
+
 @router.get("/sessions", response_model=list[schemas.ChatSessionResponse])
 async def get_sessions(
     current_user: User = Depends(security.get_current_user),
@@ -179,5 +515,6 @@ async def delete_session(
     
     db.delete(session)
     db.commit()
+    history_cache.invalidate(session_id)
     
     return {"message": "Chat session deleted successfully"}
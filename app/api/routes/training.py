@@ -1,27 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Query, Form
+from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Query, Form, Header, Request, Response
 from sqlalchemy.orm import Session
+import asyncio
 import os
+import json
+import logging
+import mimetypes
 import uuid
 from datetime import datetime
+from typing import List, Optional, Tuple
 from app.database import get_db
-from app.models import User, TrainingDocument
+from app.models import User, TrainingDocument, DocumentMerkleTree
 from app import schemas, security
 from app.config import get_settings
 from app.training.document_processor import DocumentProcessor
-from app.training.vector_store import VectorStore
-from app.utils.checksum import ChecksumUtils
+from app.training.resumable_upload import UploadSessionError, get_upload_session_manager
+from app.training.quotas import QuotaExceededError, check_quota, collection_quota
+from app.training.summaries import build_summary_tree, is_summary_query, match_document, root_summary
+from app.training.vector_store import get_vector_store
+from app.utils.checksum import ChecksumEngine, ChecksumUtils
+from app.utils.downloads import RangeNotSatisfiable, StoredFileResponse, content_disposition, etag_matches, parse_range_header
+from app.utils.merkle import MerkleBuilder, MerkleTree, check_leaf_hex, hash_file_with_merkle, hash_stream_with_merkle, verify_blocks
+from app.utils.security_events import record_security_event
+from app.utils.storage import BlobCorruptedError, get_storage, should_compress
+from app.utils.uploads import StoredUpload, locate_stored_upload, staging_path
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/training", tags=["training"])
 
-_vector_store = None
-
-def get_vector_store():
-    global _vector_store
-    if _vector_store is None:
-        _vector_store = VectorStore()
-    return _vector_store
-
 ALLOWED_EXTENSIONS = {"pdf", "txt", "md", "json"}
 
 
@@ -42,35 +48,164 @@ def validate_file_extension(filename: str) -> str:
     return ext
 
 
-@router.post("/upload", response_model=schemas.TrainingDocumentResponse)
-async def upload_document(
-    file: UploadFile = File(...),
-    current_user: User = Depends(security.get_current_user),
-    db: Session = Depends(get_db)
-):
-    if not file.filename:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="File name is required"
-        )
+def build_merkle_record(tree: MerkleTree) -> DocumentMerkleTree:
+    return DocumentMerkleTree(
+        block_size=tree.block_size,
+        leaf_count=tree.leaf_count,
+        root_hash=tree.root_hex,
+        leaf_hashes=tree.packed_leaves()
+    )
+
+
+def stored_merkle_tree(document: TrainingDocument) -> Optional[MerkleTree]:
+    record = document.merkle_tree
+    if not record:
+        return None
+    return MerkleTree.from_leaf_bytes(record.leaf_hashes, record.block_size)
+
+
+def locate_document_file(document: TrainingDocument) -> Optional[StoredUpload]:
+    return locate_stored_upload(document.source_name, document.checksum_sha256)
+
+
+def stored_sha256(stored: StoredUpload) -> Optional[str]:
+    """SHA-256 of the stored bytes, or None if they can no longer be read back"""
+    # Verification must see bit rot that leaves size and mtime alone, so the stat-keyed
+    # cache is bypassed; plain files still use the mmap engine, compressed blobs are streamed.
+    if stored.path:
+        return ChecksumUtils.compute_sha256_from_file(stored.path, use_cache=False)
+    try:
+        with stored.open() as f:
+            return ChecksumEngine.hash_stream(f, ("sha256",))["sha256"]
+    except BlobCorruptedError:
+        return None
+
+
+def load_merkle_tree(db: Session, document: TrainingDocument, stored: Optional[StoredUpload]) -> Optional[MerkleTree]:
+    """Stored tree, or for legacy uploads one built from the file if it still matches checksum_sha256"""
+    tree = stored_merkle_tree(document)
+    if tree or not document.checksum_sha256 or not stored:
+        return tree
     
-    file_ext = validate_file_extension(file.filename)
+    try:
+        with stored.open() as f:
+            checksum, _, tree = hash_stream_with_merkle(f, settings.MERKLE_BLOCK_SIZE)
+    except BlobCorruptedError:
+        return None
+    if checksum != document.checksum_sha256:
+        return None
     
-    if file.size and file.size > settings.MAX_UPLOAD_SIZE:
+    document.merkle_tree = build_merkle_record(tree)
+    db.commit()
+    return tree
+
+
+def parse_leaf_hashes(raw: Optional[str]) -> Optional[List[str]]:
+    """Leaf hashes from a multipart form field; 400 unless a JSON list of 64-character hex strings"""
+    if not raw:
+        return None
+    try:
+        leaf_hashes = json.loads(raw)
+        if not isinstance(leaf_hashes, list):
+            raise ValueError("expected a list")
+        return list(check_leaf_hex(leaf_hashes))
+    except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"File size exceeds maximum allowed size of {settings.MAX_UPLOAD_SIZE / 1024 / 1024}MB"
+            detail=f"Invalid leaf hashes: {str(e)}"
         )
+
+
+def locate_server_corruption(document: TrainingDocument, stored: StoredUpload) -> List[dict]:
+    """Byte ranges where the stored file no longer matches its upload-time Merkle tree"""
+    tree = stored_merkle_tree(document)
+    if not tree:
+        return []
+    builder = MerkleBuilder(tree.block_size)
+    try:
+        # Block-sized reads, so a damaged compressed stream still yields every block before the damage.
+        with stored.open() as f:
+            for block in iter(lambda: f.read(tree.block_size), b""):
+                builder.update(block)
+    except BlobCorruptedError:
+        pass  # whatever could not be decoded is missing from current_tree, so it diffs as changed
+    current_tree = builder.tree()
+    file_size = max(document.file_size or 0, stored.size)
+    return tree.byte_ranges(tree.diff(current_tree), file_size)
+
+
+async def refresh_summaries(user_id: str, source_name: str, chunks: List[str]):
+    """(Re)build a source's summary tree, reusing nodes whose text is unchanged; summaries are best effort"""
+    vector_store = get_vector_store()
+    previous = vector_store.get_source_summaries(user_id, source_name)
+    # Summarizing may call the model; only the vector store reads and writes stay on the event loop.
+    try:
+        nodes = await asyncio.to_thread(build_summary_tree, chunks, previous=previous)
+    except Exception as e:
+        logger.warning(f"Failed to summarize {source_name}: {e}")
+        nodes = []
+    vector_store.set_source_summaries(user_id, source_name, nodes)
+
+
+async def get_collection_quota(user_id: str) -> Optional[int]:
+    """The user's collection quota in bytes (None if unlimited), refused outright if already used up"""
+    _, quota_bytes = await collection_quota(user_id)
+    enforce_collection_quota(user_id, [], None, quota_bytes)
+    return quota_bytes
+
+
+def enforce_collection_quota(
+    user_id: str,
+    chunks: List[str],
+    source_name: Optional[str],
+    quota_bytes: Optional[int],
+    replacing: bool = False
+):
+    """413 if indexing `chunks` (replacing the source's current chunks, if `replacing`) would exceed the quota"""
+    if quota_bytes is None:
+        return
+    vector_store = get_vector_store()
+    usage_bytes = vector_store.collection_usage(user_id)["total_bytes"]
+    if replacing:
+        usage_bytes -= vector_store.source_usage(user_id, source_name)["total_bytes"]
+    # An upload needs at least one byte of headroom even before its size is known.
+    additional_bytes = vector_store.estimate_usage(chunks, source_name=source_name or "")["total_bytes"] if chunks else 1
+    try:
+        check_quota(usage_bytes, additional_bytes, quota_bytes)
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+
+
+def get_user_document(db: Session, user_id: str, source_name: str) -> TrainingDocument:
+    document = db.query(TrainingDocument).filter(
+        TrainingDocument.source_name == source_name,
+        TrainingDocument.user_id == user_id
+    ).first()
     
-    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-    
-    file_id = str(uuid.uuid4())
-    file_path = os.path.join(settings.UPLOAD_DIR, f"{file_id}_{file.filename}")
-    
-    contents = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(contents)
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found"
+        )
     
+    return document
+
+
+async def ingest_stored_file(
+    db: Session,
+    user_id: str,
+    file_path: str,
+    filename: str,
+    file_ext: str,
+    file_id: str,
+    checksum_sha256: str,
+    file_size: int,
+    merkle_tree: MerkleTree,
+    chunk_metadata: Optional[dict] = None,
+    quota_bytes: Optional[int] = None,
+    **document_fields
+) -> TrainingDocument:
+    """Extract, chunk and index a staged upload, move it into blob storage, then record it"""
     try:
         chunks, full_text = DocumentProcessor.process_document(file_path, file_ext)
     except Exception as e:
@@ -80,16 +215,20 @@ async def upload_document(
             detail=f"Error processing document: {str(e)}"
         )
     
-    source_name = f"{file.filename}_{file_id}"
+    source_name = f"{filename}_{file_id}"
     
-    checksum_sha256, file_size = ChecksumUtils.get_file_stats(file_path)
+    try:
+        enforce_collection_quota(user_id, chunks, source_name, quota_bytes)
+    except HTTPException:
+        os.remove(file_path)
+        raise
     
     try:
         chunk_count = get_vector_store().add_documents(
-            user_id=current_user.id,
+            user_id=user_id,
             source_name=source_name,
             chunks=chunks,
-            metadata={"filename": file.filename, "checksum": checksum_sha256}
+            metadata={"filename": filename, "checksum": checksum_sha256, **(chunk_metadata or {})}
         )
     except Exception as e:
         os.remove(file_path)
@@ -98,42 +237,59 @@ async def upload_document(
             detail=f"Error storing document in vector database: {str(e)}"
         )
     
+    await refresh_summaries(user_id, source_name, chunks)
+    
+    document_id = str(uuid.uuid4())
+    try:
+        get_storage().put_file(file_path, checksum_sha256, owner=document_id, compress=should_compress(file_ext))
+    except OSError as e:
+        get_vector_store().delete_collection_by_source(user_id, source_name)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error storing document file: {str(e)}"
+        )
+    
     content_preview = full_text[:500] if full_text else ""
     
     db_document = TrainingDocument(
-        user_id=current_user.id,
-        filename=file.filename,
+        id=document_id,
+        user_id=user_id,
+        filename=filename,
         source_name=source_name,
         file_type=file_ext,
         content_preview=content_preview,
         chunk_count=chunk_count,
         checksum_sha256=checksum_sha256,
-        file_size=file_size
+        file_size=file_size,
+        merkle_tree=build_merkle_record(merkle_tree),
+        **document_fields
     )
     
     db.add(db_document)
     db.commit()
     db.refresh(db_document)
     
-    return {
-        "id": db_document.id,
-        "filename": db_document.filename,
-        "source_name": db_document.source_name,
-        "file_type": db_document.file_type,
-        "chunk_count": db_document.chunk_count,
-        "checksum_sha256": db_document.checksum_sha256,
-        "file_size": db_document.file_size,
-        "created_at": db_document.created_at
-    }
+    return db_document
 
 
-@router.post("/upload-with-verify", response_model=dict)
-async def upload_document_with_two_way_verification(
-    file: UploadFile = File(...),
-    client_checksum: str = Form(...),
-    current_user: User = Depends(security.get_current_user),
-    db: Session = Depends(get_db)
-):
+async def save_upload_file(file: UploadFile) -> Tuple[str, str]:
+    """Copy an UploadFile into the staging area in 1 MiB pieces; returns (file_id, file_path)"""
+    file_id = str(uuid.uuid4())
+    file_path = staging_path(file_id, file.filename)
+    
+    with open(file_path, "wb") as f:
+        while True:
+            piece = await file.read(1024 * 1024)
+            if not piece:
+                break
+            f.write(piece)
+    
+    return file_id, file_path
+
+
+def validate_upload(file: UploadFile) -> str:
     if not file.filename:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -148,93 +304,104 @@ async def upload_document_with_two_way_verification(
             detail=f"File size exceeds maximum allowed size of {settings.MAX_UPLOAD_SIZE / 1024 / 1024}MB"
         )
     
-    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    return file_ext
+
+
+@router.post("/upload", response_model=schemas.TrainingDocumentResponse)
+async def upload_document(
+    file: UploadFile = File(...),
+    current_user: User = Depends(security.get_current_user),
+    db: Session = Depends(get_db)
+):
+    file_ext = validate_upload(file)
+    quota_bytes = await get_collection_quota(current_user.id)
+    file_id, file_path = await save_upload_file(file)
     
-    file_id = str(uuid.uuid4())
-    file_path = os.path.join(settings.UPLOAD_DIR, f"{file_id}_{file.filename}")
+    checksum_sha256, file_size, merkle_tree = hash_file_with_merkle(file_path, settings.MERKLE_BLOCK_SIZE)
     
-    contents = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(contents)
+    db_document = await ingest_stored_file(
+        db,
+        user_id=current_user.id,
+        quota_bytes=quota_bytes,
+        file_path=file_path,
+        filename=file.filename,
+        file_ext=file_ext,
+        file_id=file_id,
+        checksum_sha256=checksum_sha256,
+        file_size=file_size,
+        merkle_tree=merkle_tree
+    )
     
-    try:
-        chunks, full_text = DocumentProcessor.process_document(file_path, file_ext)
-    except Exception as e:
-        os.remove(file_path)
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error processing document: {str(e)}"
-        )
+    return {
+        "id": db_document.id,
+        "filename": db_document.filename,
+        "source_name": db_document.source_name,
+        "file_type": db_document.file_type,
+        "chunk_count": db_document.chunk_count,
+        "checksum_sha256": db_document.checksum_sha256,
+        "file_size": db_document.file_size,
+        "created_at": db_document.created_at
+    }
+
+
+@router.post("/upload-with-verify", response_model=dict)
+async def upload_document_with_two_way_verification(
+    file: UploadFile = File(...),
+    client_checksum: str = Form(...),
+    client_merkle_root: Optional[str] = Form(None),
+    client_leaf_hashes: Optional[str] = Form(None),
+    current_user: User = Depends(security.get_current_user),
+    db: Session = Depends(get_db)
+):
+    file_ext = validate_upload(file)
+    leaf_hashes = parse_leaf_hashes(client_leaf_hashes)
+    quota_bytes = await get_collection_quota(current_user.id)
+    file_id, file_path = await save_upload_file(file)
     
-    source_name = f"{file.filename}_{file_id}"
-    server_checksum, file_size = ChecksumUtils.get_file_stats(file_path)
+    server_checksum, file_size, merkle_tree = hash_file_with_merkle(file_path, settings.MERKLE_BLOCK_SIZE)
     
     verification_match = client_checksum.lower() == server_checksum.lower()
+    if client_merkle_root:
+        verification_match = verification_match and client_merkle_root.lower() == merkle_tree.root_hex
     
-    try:
-        chunk_count = get_vector_store().add_documents(
-            user_id=current_user.id,
-            source_name=source_name,
-            chunks=chunks,
-            metadata={
-                "filename": file.filename,
-                "checksum": server_checksum,
-                "client_checksum": client_checksum,
-                "two_way_verified": verification_match
-            }
-        )
-    except Exception as e:
-        os.remove(file_path)
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error storing document in vector database: {str(e)}"
-        )
-    
-    content_preview = full_text[:500] if full_text else ""
+    mismatched_ranges = []
+    if not verification_match and leaf_hashes:
+        client_tree = MerkleTree.from_leaf_hex(leaf_hashes, merkle_tree.block_size)
+        mismatched_ranges = merkle_tree.byte_ranges(merkle_tree.diff(client_tree), file_size)
     
-    db_document = TrainingDocument(
+    db_document = await ingest_stored_file(
+        db,
         user_id=current_user.id,
+        quota_bytes=quota_bytes,
+        file_path=file_path,
         filename=file.filename,
-        source_name=source_name,
-        file_type=file_ext,
-        content_preview=content_preview,
-        chunk_count=chunk_count,
+        file_ext=file_ext,
+        file_id=file_id,
         checksum_sha256=server_checksum,
         file_size=file_size,
+        merkle_tree=merkle_tree,
+        chunk_metadata={"client_checksum": client_checksum, "two_way_verified": verification_match},
         client_checksum=client_checksum,
         checksum_verified=verification_match,
         verification_timestamp=datetime.utcnow() if verification_match else None
     )
-                                                 
-    db.add(db_document)
-    db.commit()
-    db.refresh(db_document)
     
     if not verification_match:
-        try:
-            from sqlalchemy import text
-            db.execute(
-                text("""
-                    INSERT INTO security_events (user_id, event_type, resource_type, resource_id, description, severity, metadata)
-                    VALUES (:user_id, :event_type, :resource_type, :resource_id, :description, :severity, :metadata)
-                """),
-                {
-                    "user_id": current_user.id,
-                    "event_type": "two_way_checksum_mismatch",
-                    "resource_type": "training_document",
-                    "resource_id": db_document.id,
-                    "description": f"Two-way checksum mismatch detected for {file.filename}",
-                    "severity": "critical",
-                    "metadata": {
-                        "client_checksum": client_checksum,
-                        "server_checksum": server_checksum,
-                        "verification_type": "upload"
-                    }
-                }
-            )
-            db.commit()
-        except Exception as e:
-            print(f"Failed to log security event: {str(e)}")
+        record_security_event(
+            db,
+            user_id=current_user.id,
+            event_type="two_way_checksum_mismatch",
+            resource_id=db_document.id,
+            description=f"Two-way checksum mismatch detected for {file.filename}",
+            metadata={
+                "client_checksum": client_checksum,
+                "server_checksum": server_checksum,
+                "client_merkle_root": client_merkle_root,
+                "server_merkle_root": merkle_tree.root_hex,
+                "mismatched_ranges": mismatched_ranges,
+                "verification_type": "upload"
+            }
+        )
     
     return {
         "id": db_document.id,
@@ -248,10 +415,136 @@ async def upload_document_with_two_way_verification(
         "verified": True,
         "client_checksum": client_checksum,
         "server_checksum": server_checksum,
-        "match": verification_match
+        "merkle_root": merkle_tree.root_hex,
+        "merkle_block_size": merkle_tree.block_size,
+        "match": verification_match,
+        "mismatched_ranges": mismatched_ranges
+    }
+
+
+@router.post("/uploads", response_model=dict)
+async def create_upload_session(
+    request: schemas.UploadSessionCreate,
+    current_user: User = Depends(security.get_current_user)
+):
+    file_ext = validate_file_extension(request.filename)
+    await get_collection_quota(current_user.id)
+    manager = get_upload_session_manager()
+    
+    try:
+        # Preallocating the file and counting the user's open sessions both touch the disk.
+        state = await asyncio.to_thread(
+            manager.create_session,
+            user_id=current_user.id,
+            filename=request.filename,
+            file_type=file_ext,
+            total_size=request.total_size,
+            part_size=request.part_size,
+            client_checksum=request.client_checksum
+        )
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    
+    return manager.describe(state)
+
+
+@router.get("/uploads/{session_id}", response_model=dict)
+async def get_upload_session(
+    session_id: str,
+    current_user: User = Depends(security.get_current_user)
+):
+    manager = get_upload_session_manager()
+    try:
+        return manager.describe(manager.get_session(session_id, current_user.id))
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+@router.put("/uploads/{session_id}/parts/{part_index}", response_model=dict)
+async def upload_part(
+    session_id: str,
+    part_index: int,
+    request: Request,
+    x_part_checksum: str = Header(..., description="SHA-256 hex digest of this part"),
+    current_user: User = Depends(security.get_current_user)
+):
+    try:
+        return await get_upload_session_manager().write_part(
+            session_id,
+            current_user.id,
+            part_index,
+            request.stream(),
+            x_part_checksum
+        )
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+@router.post("/uploads/{session_id}/finalize", response_model=dict)
+async def finalize_upload_session(
+    session_id: str,
+    current_user: User = Depends(security.get_current_user),
+    db: Session = Depends(get_db)
+):
+    quota_bytes = await get_collection_quota(current_user.id)
+    manager = get_upload_session_manager()
+    try:
+        session = manager.get_session(session_id, current_user.id)
+        file_id = str(uuid.uuid4())
+        file_path = staging_path(file_id, session["filename"])
+        # Hashing whatever was not received in order and moving the file block; keep them off the loop.
+        session, checksum_sha256, merkle_tree = await asyncio.to_thread(
+            manager.finalize, session_id, current_user.id, file_path
+        )
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    
+    client_checksum = session["client_checksum"]
+    db_document = await ingest_stored_file(
+        db,
+        user_id=current_user.id,
+        quota_bytes=quota_bytes,
+        file_path=file_path,
+        filename=session["filename"],
+        file_ext=session["file_type"],
+        file_id=file_id,
+        checksum_sha256=checksum_sha256,
+        file_size=session["total_size"],
+        merkle_tree=merkle_tree,
+        chunk_metadata={"client_checksum": client_checksum, "two_way_verified": bool(client_checksum)},
+        client_checksum=client_checksum,
+        checksum_verified=bool(client_checksum),
+        verification_timestamp=datetime.utcnow() if client_checksum else None
+    )
+    
+    return {
+        "id": db_document.id,
+        "filename": db_document.filename,
+        "source_name": db_document.source_name,
+        "file_type": db_document.file_type,
+        "chunk_count": db_document.chunk_count,
+        "checksum_sha256": db_document.checksum_sha256,
+        "file_size": db_document.file_size,
+        "created_at": db_document.created_at,
+        "merkle_root": merkle_tree.root_hex,
+        "merkle_block_size": merkle_tree.block_size,
+        "match": bool(client_checksum)
     }
 
 
+@router.delete("/uploads/{session_id}")
+async def abort_upload_session(
+    session_id: str,
+    current_user: User = Depends(security.get_current_user)
+):
+    try:
+        get_upload_session_manager().abort(session_id, current_user.id)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    
+    return {"message": "Upload session aborted"}
+
+
 @router.get("/documents", response_model=list[schemas.TrainingDocumentResponse])
 async def get_documents(
     current_user: User = Depends(security.get_current_user),
@@ -264,6 +557,21 @@ async def get_documents(
     return documents
 
 
+@router.get("/usage", response_model=dict)
+async def get_collection_usage(
+    current_user: User = Depends(security.get_current_user)
+):
+    """Approximate memory held by the user's indexed documents, against their tier's quota"""
+    tier, quota_bytes = await collection_quota(current_user.id)
+    usage = get_vector_store().collection_usage(current_user.id)
+    return {
+        "tier": tier,
+        "quota_bytes": quota_bytes,
+        "usage": usage,
+        "percent_used": round(100 * usage["total_bytes"] / quota_bytes, 1) if quota_bytes else None
+    }
+
+
 @router.get("/documents/{source_name}/verify")
 async def verify_document_integrity(
     source_name: str,
@@ -289,14 +597,9 @@ async def verify_document_integrity(
             "checksum": None
         }
     
-    file_id = document.source_name.split('_')[-1]
-    file_path = None
-    for fname in os.listdir(settings.UPLOAD_DIR):
-        if file_id in fname:
-            file_path = os.path.join(settings.UPLOAD_DIR, fname)
-            break
+    stored = locate_document_file(document)
     
-    if not file_path or not os.path.exists(file_path):
+    if not stored:
         return {
             "verified": False,
             "status": "file_missing",
@@ -304,36 +607,31 @@ async def verify_document_integrity(
             "checksum": document.checksum_sha256[:16] + "..."
         }
     
-    current_checksum = ChecksumUtils.compute_sha256_from_file(file_path)
+    current_checksum = stored_sha256(stored)
     verified = current_checksum == document.checksum_sha256
     
+    mismatched_ranges = []
     if not verified:
-        try:
-            from sqlalchemy import text
-            db.execute(
-                text("""
-                    INSERT INTO security_events (user_id, event_type, resource_type, resource_id, description, severity, metadata)
-                    VALUES (:user_id, :event_type, :resource_type, :resource_id, :description, :severity, :metadata)
-                """),
-                {
-                    "user_id": current_user.id,
-                    "event_type": "checksum_mismatch",
-                    "resource_type": "training_document",
-                    "resource_id": document.id,
-                    "description": f"File integrity mismatch detected for {document.filename}",
-                    "severity": "critical",
-                    "metadata": {"expected": document.checksum_sha256, "computed": current_checksum}
-                }
-            )
-            db.commit()
-        except Exception as e:
-            print(f"Failed to log security event: {str(e)}")
+        mismatched_ranges = locate_server_corruption(document, stored)
+        record_security_event(
+            db,
+            user_id=current_user.id,
+            event_type="checksum_mismatch",
+            resource_id=document.id,
+            description=f"File integrity mismatch detected for {document.filename}",
+            metadata={
+                "expected": document.checksum_sha256,
+                "computed": current_checksum,
+                "mismatched_ranges": mismatched_ranges
+            }
+        )
     
     return {
         "verified": verified,
         "status": "ok" if verified else "mismatch",
         "message": "Document integrity verified" if verified else "Document integrity verification failed - file may be tampered",
-        "checksum": document.checksum_sha256[:16] + "..." if document.checksum_sha256 else None
+        "checksum": document.checksum_sha256[:16] + "..." if document.checksum_sha256 else None,
+        "mismatched_ranges": mismatched_ranges
     }
 
 
@@ -365,47 +663,33 @@ async def verify_two_way_document_integrity(
             "server_file_ok": None
         }
     
-    file_id = document.source_name.split('_')[-1]
-    file_path = None
-    for fname in os.listdir(settings.UPLOAD_DIR):
-        if file_id in fname:
-            file_path = os.path.join(settings.UPLOAD_DIR, fname)
-            break
+    stored = locate_document_file(document)
     
-    server_file_ok = file_path and os.path.exists(file_path)
+    server_file_ok = stored is not None
+    server_mismatched_ranges = []
     
-    if server_file_ok and file_path:
-        current_server_checksum = ChecksumUtils.compute_sha256_from_file(file_path)
+    if stored:
+        current_server_checksum = stored_sha256(stored)
         server_file_ok = current_server_checksum == document.checksum_sha256
+        if not server_file_ok:
+            server_mismatched_ranges = locate_server_corruption(document, stored)
     
     checksums_match = document.client_checksum.lower() == document.checksum_sha256.lower()
     
     if not checksums_match:
-        try:
-            from sqlalchemy import text
-            db.execute(
-                text("""
-                    INSERT INTO security_events (user_id, event_type, resource_type, resource_id, description, severity, metadata)
-                    VALUES (:user_id, :event_type, :resource_type, :resource_id, :description, :severity, :metadata)
-                """),
-                {
-                    "user_id": current_user.id,
-                    "event_type": "two_way_checksum_mismatch_detected",
-                    "resource_type": "training_document",
-                    "resource_id": document.id,
-                    "description": f"Two-way checksum verification failed for {document.filename}",
-                    "severity": "critical",
-                    "metadata": {
-                        "client_checksum": document.client_checksum,
-                        "server_checksum": document.checksum_sha256,
-                        "verification_type": "retrieval",
-                        "server_file_integrity": server_file_ok
-                    }
-                }
-            )
-            db.commit()
-        except Exception as e:
-            print(f"Failed to log security event: {str(e)}")
+        record_security_event(
+            db,
+            user_id=current_user.id,
+            event_type="two_way_checksum_mismatch_detected",
+            resource_id=document.id,
+            description=f"Two-way checksum verification failed for {document.filename}",
+            metadata={
+                "client_checksum": document.client_checksum,
+                "server_checksum": document.checksum_sha256,
+                "verification_type": "retrieval",
+                "server_file_integrity": server_file_ok
+            }
+        )
     
     return {
         "verified": checksums_match and server_file_ok,
@@ -415,10 +699,377 @@ async def verify_two_way_document_integrity(
         "client_checksum": document.client_checksum[:16] + "..." if document.client_checksum else None,
         "match": checksums_match,
         "server_file_ok": server_file_ok,
+        "server_mismatched_ranges": server_mismatched_ranges,
         "verification_timestamp": document.verification_timestamp
     }
 
 
+@router.post("/documents/{source_name}/verify-two-way")
+async def verify_two_way_merkle(
+    source_name: str,
+    request: schemas.MerkleVerificationRequest,
+    current_user: User = Depends(security.get_current_user),
+    db: Session = Depends(get_db)
+):
+    document = get_user_document(db, current_user.id, source_name)
+    stored = locate_document_file(document)
+    tree = load_merkle_tree(db, document, stored)
+    
+    if not tree:
+        return {
+            "verified": False,
+            "verification_type": "none",
+            "message": "Merkle verification not available for this document",
+            "match": False
+        }
+    
+    if request.block_size != tree.block_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Block size must be {tree.block_size} bytes for this document"
+        )
+    
+    if request.leaf_hashes:
+        try:
+            check_leaf_hex(request.leaf_hashes)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid leaf hashes: {str(e)}"
+            )
+    
+    roots_match = request.merkle_root.lower() == tree.root_hex
+    
+    client_mismatched_ranges = []
+    if not roots_match and request.leaf_hashes:
+        client_tree = MerkleTree.from_leaf_hex(request.leaf_hashes, tree.block_size)
+        client_mismatched_ranges = tree.byte_ranges(tree.diff(client_tree), document.file_size)
+    
+    server_file_ok = stored is not None
+    server_mismatched_ranges = []
+    if server_file_ok:
+        server_mismatched_ranges = locate_server_corruption(document, stored)
+        server_file_ok = not server_mismatched_ranges
+    
+    if not roots_match:
+        record_security_event(
+            db,
+            user_id=current_user.id,
+            event_type="two_way_merkle_mismatch_detected",
+            resource_id=document.id,
+            description=f"Two-way Merkle verification failed for {document.filename}",
+            metadata={
+                "client_merkle_root": request.merkle_root,
+                "server_merkle_root": tree.root_hex,
+                "client_mismatched_ranges": client_mismatched_ranges,
+                "server_mismatched_ranges": server_mismatched_ranges,
+                "verification_type": "retrieval"
+            }
+        )
+    
+    verified = roots_match and server_file_ok
+    return {
+        "verified": verified,
+        "verification_type": "merkle",
+        "message": "✓ Two-way verification successful" if verified else "✗ Integrity verification failed",
+        "merkle_root": tree.root_hex,
+        "block_size": tree.block_size,
+        "match": roots_match,
+        "client_mismatched_ranges": client_mismatched_ranges,
+        "server_file_ok": server_file_ok,
+        "server_mismatched_ranges": server_mismatched_ranges
+    }
+
+
+@router.get("/documents/{source_name}/merkle")
+async def get_document_merkle_tree(
+    source_name: str,
+    level: Optional[int] = Query(None, ge=0),
+    current_user: User = Depends(security.get_current_user),
+    db: Session = Depends(get_db)
+):
+    document = get_user_document(db, current_user.id, source_name)
+    tree = load_merkle_tree(db, document, locate_document_file(document))
+    
+    if not tree:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Merkle tree not available for this document"
+        )
+    
+    response = {
+        "merkle_root": tree.root_hex,
+        "block_size": tree.block_size,
+        "leaf_count": tree.leaf_count,
+        "depth": len(tree.levels) - 1,
+        "file_size": document.file_size
+    }
+    
+    # Level 0 is the leaves; clients walk down level by level to find differing subtrees.
+    if level is not None:
+        if level >= len(tree.levels):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Level must be between 0 and {len(tree.levels) - 1}"
+            )
+        response["level"] = level
+        response["hashes"] = [node.hex() for node in tree.levels[level]]
+    
+    return response
+
+
+@router.get("/documents/{source_name}/merkle/proof")
+async def get_block_proof(
+    source_name: str,
+    block: int = Query(..., ge=0),
+    current_user: User = Depends(security.get_current_user),
+    db: Session = Depends(get_db)
+):
+    document = get_user_document(db, current_user.id, source_name)
+    tree = load_merkle_tree(db, document, locate_document_file(document))
+    
+    if not tree:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Merkle tree not available for this document"
+        )
+    
+    if block >= tree.leaf_count:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Block must be between 0 and {tree.leaf_count - 1}"
+        )
+    
+    start, end = tree.block_range(block, document.file_size or 0)
+    return {
+        "block": block,
+        "start": start,
+        "end": end,
+        "leaf_hash": tree.leaves[block].hex(),
+        "proof": tree.proof(block),
+        "merkle_root": tree.root_hex
+    }
+
+
+@router.get("/documents/{source_name}/verify-range")
+async def verify_document_range(
+    source_name: str,
+    start: int = Query(0, ge=0),
+    end: Optional[int] = Query(None, ge=0),
+    current_user: User = Depends(security.get_current_user),
+    db: Session = Depends(get_db)
+):
+    document = get_user_document(db, current_user.id, source_name)
+    stored = locate_document_file(document)
+    
+    if not stored:
+        return {
+            "verified": False,
+            "status": "file_missing",
+            "message": "Original file not found on disk"
+        }
+    
+    tree = load_merkle_tree(db, document, stored)
+    if not tree:
+        return {
+            "verified": False,
+            "status": "unknown",
+            "message": "Merkle tree not available for this document"
+        }
+    
+    # Legacy rows may predate file_size; the stored bytes know their length.
+    size = document.file_size if document.file_size is not None else stored.size
+    end = size if end is None else min(end, size)
+    blocks = tree.blocks_for_range(start, end)
+    
+    try:
+        with stored.open() as f:
+            failed = verify_blocks(f, tree, blocks)
+    except BlobCorruptedError:
+        failed = list(blocks)
+    
+    mismatched_ranges = tree.byte_ranges(failed, size)
+    if failed:
+        record_security_event(
+            db,
+            user_id=current_user.id,
+            event_type="range_checksum_mismatch",
+            resource_id=document.id,
+            description=f"Byte range integrity mismatch detected for {document.filename}",
+            metadata={"start": start, "end": end, "mismatched_ranges": mismatched_ranges}
+        )
+    
+    return {
+        "verified": not failed,
+        "status": "ok" if not failed else "mismatch",
+        "start": start,
+        "end": end,
+        "blocks_checked": len(blocks),
+        "mismatched_ranges": mismatched_ranges
+    }
+
+
+@router.api_route("/documents/{source_name}/download", methods=["GET", "HEAD"])
+async def download_document(
+    source_name: str,
+    request: Request,
+    current_user: User = Depends(security.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Original uploaded file, streamed from storage, with Range and conditional GET support"""
+    document = get_user_document(db, current_user.id, source_name)
+    stored = locate_document_file(document)
+    if not stored:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Original file not found on disk"
+        )
+
+    etag = f'"{document.checksum_sha256}"' if document.checksum_sha256 else None
+    headers = {
+        "accept-ranges": "bytes",
+        "cache-control": "private, no-cache",
+        "content-disposition": content_disposition(document.filename),
+    }
+    if etag:
+        headers["etag"] = etag
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # If-Range with a stale (or no) validator means the client's partial copy is outdated: send it all.
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and (not etag or if_range.strip() != etag):
+        range_header = None
+
+    try:
+        byte_range = parse_range_header(range_header, stored.size)
+    except RangeNotSatisfiable:
+        return Response(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={**headers, "content-range": f"bytes */{stored.size}"}
+        )
+
+    media_type = mimetypes.guess_type(document.filename)[0] or "application/octet-stream"
+    if byte_range:
+        start, end = byte_range
+        headers["content-range"] = f"bytes {start}-{end}/{stored.size}"
+        return StoredFileResponse(
+            stored,
+            status_code=status.HTTP_206_PARTIAL_CONTENT,
+            headers=headers,
+            media_type=media_type,
+            byte_range=byte_range
+        )
+    return StoredFileResponse(stored, headers=headers, media_type=media_type)
+
+
+@router.put("/documents/{source_name}", response_model=dict)
+async def upload_document_version(
+    source_name: str,
+    file: UploadFile = File(...),
+    current_user: User = Depends(security.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Replace a document with a new version, re-indexing only the chunks whose content changed"""
+    document = get_user_document(db, current_user.id, source_name)
+    file_ext = validate_upload(file)
+    if file_ext != document.file_type:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"New version must be a {document.file_type} file"
+        )
+    
+    _, quota_bytes = await collection_quota(current_user.id)
+    _, staged_path = await save_upload_file(file)
+    checksum_sha256, file_size, merkle_tree = hash_file_with_merkle(staged_path, settings.MERKLE_BLOCK_SIZE)
+    
+    if checksum_sha256 == document.checksum_sha256:
+        os.remove(staged_path)
+        return {
+            "source_name": source_name,
+            "changed": False,
+            "chunk_count": document.chunk_count,
+            "checksum_sha256": checksum_sha256,
+            "chunks": {"kept": document.chunk_count, "added": 0, "removed": 0}
+        }
+    
+    try:
+        chunks, full_text = DocumentProcessor.process_document(staged_path, file_ext)
+    except Exception as e:
+        os.remove(staged_path)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing document: {str(e)}"
+        )
+    
+    try:
+        enforce_collection_quota(current_user.id, chunks, source_name, quota_bytes, replacing=True)
+    except HTTPException:
+        os.remove(staged_path)
+        raise
+    
+    previous = locate_document_file(document)
+    storage = get_storage()
+    vector_store = get_vector_store()
+    stored_new = False
+    diff = None
+    
+    # The new blob, the chunks and the row change together; any failure puts all three back.
+    try:
+        storage.put_file(staged_path, checksum_sha256, owner=document.id, compress=should_compress(file_ext))
+        stored_new = True
+        diff = vector_store.update_source_chunks(
+            user_id=current_user.id,
+            source_name=source_name,
+            chunks=chunks,
+            metadata={"filename": document.filename, "checksum": checksum_sha256}
+        )
+        
+        document.content_preview = full_text[:500] if full_text else ""
+        document.chunk_count = len(chunks)
+        document.checksum_sha256 = checksum_sha256
+        document.file_size = file_size
+        document.client_checksum = None
+        document.checksum_verified = False
+        document.verification_timestamp = None
+        if document.merkle_tree:
+            document.merkle_tree.block_size = merkle_tree.block_size
+            document.merkle_tree.leaf_count = merkle_tree.leaf_count
+            document.merkle_tree.root_hash = merkle_tree.root_hex
+            document.merkle_tree.leaf_hashes = merkle_tree.packed_leaves()
+        else:
+            document.merkle_tree = build_merkle_record(merkle_tree)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        if diff is not None:
+            vector_store.revert_source_update(current_user.id, diff)
+        if stored_new:
+            storage.release(checksum_sha256, document.id)
+        elif os.path.exists(staged_path):
+            os.remove(staged_path)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error updating document: {str(e)}"
+        )
+    
+    if previous:
+        previous.release(document.id)
+    await refresh_summaries(current_user.id, source_name, chunks)
+    
+    return {
+        "source_name": source_name,
+        "changed": True,
+        "chunk_count": document.chunk_count,
+        "checksum_sha256": document.checksum_sha256,
+        "file_size": document.file_size,
+        "merkle_root": merkle_tree.root_hex,
+        "chunks": diff.summary()
+    }
+
+
 @router.delete("/documents/{source_name}")
 async def delete_document(
     source_name: str,
@@ -438,9 +1089,14 @@ async def delete_document(
     
     get_vector_store().delete_collection_by_source(current_user.id, source_name)
     
+    stored = locate_document_file(document)
+    document_id = document.id
     db.delete(document)
     db.commit()
     
+    if stored:
+        stored.release(document_id)
+    
     return {"message": "Document deleted successfully"}
 
 
@@ -458,13 +1114,9 @@ async def test_retrieval(
     }
 
 
-@router.post("/chat", response_model=schemas.TrainingChatResponse)
-async def training_chat(
-    chat_request: schemas.TrainingChatRequest,
-    current_user: User = Depends(security.get_current_user),
-    db: Session = Depends(get_db)
-):
-    from app.ai_engine.gemini import GeminiEngine
+def prepare_training_chat(chat_request: schemas.TrainingChatRequest, current_user: User, db: Session):
+    """(prompt, fixed answer, sources): the model is asked with the prompt unless a fixed answer is given"""
+    from app.ai_engine.prompt import get_prompt_assembler
     from app.safety_filter import SafetyFilter
     
     is_safe, message_or_redirect = SafetyFilter.filter_query(chat_request.message)
@@ -485,7 +1137,23 @@ async def training_chat(
             detail="No training documents found. Please upload documents first."
         )
     
-    retrieved_docs = get_vector_store().retrieve(current_user.id, chat_request.message, n_results=5)
+    # "Summarize X" is answered from X's document-level summary node rather than raw chunks.
+    summary_document = match_document(chat_request.message, documents) if is_summary_query(chat_request.message) else None
+    summary_node = root_summary(
+        get_vector_store().get_source_summaries(current_user.id, summary_document.source_name)
+    ) if summary_document else None
+    retrieved_docs = [] if summary_node else get_vector_store().retrieve(current_user.id, chat_request.message, n_results=5)
+    
+    if summary_node:
+        sources = [{"filename": summary_document.filename, "source_name": summary_document.source_name}]
+        prompt = get_prompt_assembler().assemble(
+            chat_request.message,
+            system_instruction=f"""You are an AI assistant that summarizes the user's training documents.
+        
+Answer using ONLY the provided summary of '{summary_document.filename}', citing the document by name.""",
+            context_items=[summary_node["summary"]]
+        )
+        return prompt, None, sources
     
     if not retrieved_docs:
         doc_list = "\n".join([f"- {d.filename}" for d in documents])
@@ -500,38 +1168,72 @@ Try asking questions about the topics covered in these documents. For example:
 - Explain [specific concept or topic] from your documents
 
 Feel free to rephrase your question or ask about specific topics from your training materials."""
-        sources = []
-    else:
-        context = "Answer the user's question based ONLY on the following training documents:\n\n"
-        sources = []
-        
-        for doc in retrieved_docs:
-            context += f"From '{doc.get('metadata', {}).get('filename', 'Unknown')}': {doc['content']}\n\n"
-            source_name = doc.get('source_name')
-            if source_name:
-                doc_record = db.query(TrainingDocument).filter(
-                    TrainingDocument.source_name == source_name
-                ).first()
-                if doc_record:
-                    sources.append({
-                        "filename": doc_record.filename,
-                        "source_name": doc_record.source_name
-                    })
-        
-        gemini_engine = GeminiEngine()
-        system_prompt = f"""You are an AI assistant that answers questions based ONLY on the provided training documents.
+        return None, ai_response, []
+    
+    # `documents` is already limited to this user's rows.
+    documents_by_source = {document.source_name: document for document in documents}
+    
+    def filename_for(source_name: str) -> str:
+        document = documents_by_source.get(source_name)
+        return document.filename if document else source_name
+    
+    prompt = get_prompt_assembler().assemble(
+        chat_request.message,
+        system_instruction="""You are an AI assistant that answers questions based ONLY on the provided training documents.
         
 IMPORTANT RULES:
 1. ONLY use information from the training documents provided
 2. If the answer is not in the training documents, say "I couldn't find this information in your training documents"
 3. Always cite which document you're using
 4. Do not make up information or use general knowledge
-5. Be helpful but honest about the limitations of your training data
+5. Be helpful but honest about the limitations of your training data""",
+        context_items=[
+            f"From '{filename_for(doc['source'])}': {doc['content']}\n"
+            for doc in retrieved_docs
+        ],
+        context_header="Answer the user's question based ONLY on the following training documents:\n\n"
+    )
+    
+    # Only documents that made it into the prompt are cited, each once.
+    sources = []
+    for index in prompt.report.context_used:
+        doc_record = documents_by_source.get(retrieved_docs[index]["source"])
+        if doc_record and all(source["source_name"] != doc_record.source_name for source in sources):
+            sources.append({
+                "filename": doc_record.filename,
+                "source_name": doc_record.source_name
+            })
+    return prompt, None, sources
 
-{context}"""
-        
+
+@router.post("/chat", response_model=schemas.TrainingChatResponse)
+async def training_chat(
+    chat_request: schemas.TrainingChatRequest,
+    current_user: User = Depends(security.get_current_user),
+    db: Session = Depends(get_db)
+):
+    from app.ai_engine.gemini import GeminiTimeout, GeminiUnavailable
+    from app.ai_engine.response_cache import user_scope
+    from app.api.routes.chat import answer_prompt, charge_chat_message
+    from app.safety_filter import SafetyFilter
+    
+    prompt, ai_response, sources = prepare_training_chat(chat_request, current_user, db)
+    
+    if prompt:
         try:
-            ai_response = gemini_engine.send_message(chat_request.message, system_prompt)
+            # Grounded in the user's own documents, so cached for this user only.
+            ai_response = await answer_prompt(prompt, user_scope(current_user.id))
+        except GeminiTimeout as e:
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail=str(e)
+            )
+        except GeminiUnavailable as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e),
+                headers={"Retry-After": str(round(e.retry_after))}
+            )
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -539,21 +1241,52 @@ IMPORTANT RULES:
             )
     
     ai_response = SafetyFilter.add_educational_disclaimer(ai_response, chat_request.message)
-    
-    try:
-        # Deduct 5 tokens for training chat message
-        from app.db.queries import TokenQueries
-        await TokenQueries.add_token_transaction(
-            user_id=current_user.id,
-            amount=5,
-            transaction_type="usage",
-            reason="Training chat message"
-        )
-    except Exception as e:
-        print(f"Warning: Failed to deduct token: {str(e)}")
+    await charge_chat_message(current_user.id, reason="Training chat message")
     
     return {
         "message_id": str(uuid.uuid4()),
         "ai_response": ai_response,
-        "sources": list({s['source_name']: s for s in sources}.values()) if sources else []
+        "sources": list({s['source_name']: s for s in sources}.values()) if sources else [],
+        "prompt": prompt.report.to_dict() if prompt else None
     }
+
+
+@router.post("/chat/stream")
+async def training_chat_stream(
+    chat_request: schemas.TrainingChatRequest,
+    current_user: User = Depends(security.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """/training/chat as Server-Sent Events; sources are sent up front in the `start` event"""
+    from fastapi.responses import StreamingResponse
+    from app.ai_engine.response_cache import user_scope
+    from app.api.routes.chat import charge_chat_message, stream_prompt, stream_reply
+    from app.safety_filter import SafetyFilter
+    from app.utils.sse import SSE_HEADERS
+    
+    prompt, ai_response, sources = prepare_training_chat(chat_request, current_user, db)
+    user_id = current_user.id
+    message_id = str(uuid.uuid4())
+    
+    async def fixed_answer():
+        yield ai_response
+    
+    async def on_complete(full_response: str):
+        await charge_chat_message(user_id, reason="Training chat message")
+        return {"message_id": message_id}
+    
+    chunks = stream_prompt(prompt, user_scope(user_id)) if prompt else fixed_answer()
+    return StreamingResponse(
+        stream_reply(
+            chunks,
+            SafetyFilter.add_educational_disclaimer("", chat_request.message),
+            on_complete,
+            {
+                "message_id": message_id,
+                "sources": list({s['source_name']: s for s in sources}.values()) if sources else [],
+                "prompt": prompt.report.to_dict() if prompt else None
+            }
+        ),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
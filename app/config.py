@@ -11,6 +11,42 @@ class Settings(BaseSettings):
     
     GOOGLE_API_KEY: str
     GEMINI_MODEL: str = "gemini-2.5-flash-lite"
+    GEMINI_POOL_SIZE: int = 8
+    GEMINI_POOL_TIMEOUT_SECONDS: int = 30
+    GEMINI_MAX_IN_FLIGHT: int = 256
+    GEMINI_TIMEOUT_SECONDS: float = 60.0
+    PROMPT_TOKEN_BUDGET: int = 8000
+
+    GEMINI_RETRY_ATTEMPTS: int = 3
+    GEMINI_RETRY_BASE_SECONDS: float = 0.25
+    GEMINI_RETRY_MAX_SECONDS: float = 4.0
+    GEMINI_RETRY_BUDGET_RATIO: float = 0.1
+    GEMINI_RETRY_BUDGET_MIN: int = 5
+    GEMINI_RESILIENCE_WINDOW_SECONDS: float = 30.0
+    GEMINI_BREAKER_FAILURE_RATE: float = 0.5
+    GEMINI_BREAKER_MIN_CALLS: int = 20
+    GEMINI_BREAKER_OPEN_SECONDS: float = 30.0
+    GEMINI_HEDGE: bool = False
+    GEMINI_HEDGE_MIN_SAMPLES: int = 50
+    
+    CHAT_HISTORY_TURNS: int = 50
+    CHAT_HISTORY_CACHE_SESSIONS: int = 1000
+
+    RESPONSE_CACHE_MAX_ENTRIES: int = 2000
+    RESPONSE_CACHE_MAX_CHARS: int = 8_000_000
+    RESPONSE_CACHE_TTL_SECONDS: int = 24 * 60 * 60
+    RESPONSE_CACHE_SEMANTIC: str = ""
+    RESPONSE_CACHE_SIMILARITY: float = 0.92
+
+    CHAT_SUMMARIZER: str = "extractive"
+    CHAT_SUMMARY_EVERY_TURNS: int = 10
+    CHAT_SUMMARY_KEEP_RECENT: int = 10
+    CHAT_SUMMARY_MAX_WORDS: int = 250
+    CHAT_SUMMARY_INTERVAL_SECONDS: int = 5 * 60
+    
+    CHAT_WS_HEARTBEAT_SECONDS: float = 20.0
+    CHAT_WS_MAX_PENDING_TURNS: int = 4
+    CHAT_WS_SEND_TIMEOUT_SECONDS: float = 10.0
     
     DATABASE_URL: str = "sqlite:///./cyber_scholar.db"
     CHROMA_PERSIST_DIR: str = "./chroma_data"
@@ -22,6 +58,55 @@ class Settings(BaseSettings):
     
     UPLOAD_DIR: str = "./uploads"
     MAX_UPLOAD_SIZE: int = 50 * 1024 * 1024
+    MERKLE_BLOCK_SIZE: int = 64 * 1024
+    RESUMABLE_UPLOAD_TTL_HOURS: int = 24
+    RESUMABLE_UPLOAD_MAX_SESSIONS: int = 4
+    RESUMABLE_UPLOAD_MAX_PENDING_BYTES: int = 100 * 1024 * 1024
+    STORAGE_DIR: str = ""
+    STORAGE_COMPRESS_TYPES: str = "txt,md,json"
+    STORAGE_COMPRESSION_LEVEL: int = 6
+    
+    SCRUB_ENABLED: bool = True
+    SCRUB_BYTES_PER_SECOND: int = 4 * 1024 * 1024
+    SCRUB_INTERVAL_SECONDS: int = 6 * 60 * 60
+    SCRUB_BATCH_SIZE: int = 50
+    
+    GC_ENABLED: bool = True
+    GC_INTERVAL_SECONDS: int = 6 * 60 * 60
+    GC_GRACE_SECONDS: int = 60 * 60
+    GC_BATCH_SIZE: int = 200
+    
+    REINDEX_WORKERS: int = 0
+    REINDEX_BYTES_PER_SECOND: int = 0
+    SNAPSHOT_RELOAD_SECONDS: int = 60
+    
+    REPLICATION_PRIMARY_URL: str = ""
+    REPLICATION_TOKEN: str = ""
+    REPLICATION_INTERVAL_SECONDS: int = 30
+    
+    CLUSTER_NODE_ID: str = ""
+    CLUSTER_NODES: str = ""
+    CLUSTER_VNODES: int = 128
+    CLUSTER_ROUTING: str = "forward"
+    CLUSTER_FORWARD_TIMEOUT_SECONDS: int = 120
+    CLUSTER_REBALANCE_SECONDS: int = 60
+    
+    DEDUP_ENABLED: bool = True
+    DEDUP_SIMILARITY_THRESHOLD: float = 0.9
+    MINHASH_PERMUTATIONS: int = 128
+    LSH_BANDS: int = 16
+    RETRIEVAL_DIVERSITY_THRESHOLD: float = 0.7
+    
+    SUMMARIZER: str = "extractive"
+    SUMMARY_FANOUT: int = 8
+    SUMMARY_MAX_WORDS: int = 150
+    
+    MODULE_CORPUS_PATH: str = ""
+    MODULE_CONTENT_DIR: str = "./module_content"
+    MODULE_BOOST: float = 0.5
+    
+    COLLECTION_QUOTAS_MB: str = "free=25"
+    COLLECTION_QUOTA_DEFAULT_MB: int = 250
     
     SUPABASE_URL: str = ""
     SUPABASE_SERVICE_KEY: str = ""
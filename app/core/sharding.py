@@ -0,0 +1,182 @@
+"""
+Consistent-hash assignment of users to application nodes.
+
+Collections and chat state live in the memory of one process, so each user has
+an owner node: the first point on a hash ring at or after hash(user_id). Every
+node is placed on the ring CLUSTER_VNODES times, which spreads users evenly and
+means a join or leave only moves the users on the arcs that node gains or
+loses (about 1/N of them) rather than reshuffling everybody.
+
+Membership is configured with CLUSTER_NODE_ID and CLUSTER_NODES
+("node-a=http://10.0.0.1:8000,node-b=http://10.0.0.2:8000") and changed at
+runtime through the admin cluster endpoints, which bump a generation number
+and push the new member list to every node. Clustering is off when
+CLUSTER_NODES is empty.
+
+A request proxied to its owner carries a forwarding header signed with the
+cluster token (REPLICATION_TOKEN, or ADMIN_PASSWORD when unset), so only a
+current member can ask the owner to serve a request without routing it again.
+"""
+import bisect
+import hashlib
+import hmac
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.config import get_settings
+
+settings = get_settings()
+
+FORWARD_SIGNATURE_MAX_AGE_SECONDS = 300
+
+
+def cluster_token() -> str:
+    return settings.REPLICATION_TOKEN or settings.ADMIN_PASSWORD
+
+
+def _forward_mac(node_id: str, timestamp: int, method: str, target: str, token: str) -> str:
+    message = f"{node_id}\n{timestamp}\n{method.upper()}\n{target}".encode("utf-8")
+    return hmac.new(token.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def sign_forward(node_id: str, method: str, target: str, token: str, timestamp: Optional[int] = None) -> str:
+    """Forwarding header value for `method target` (path and query) sent on by `node_id`"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    return f"{node_id};{timestamp};{_forward_mac(node_id, timestamp, method, target, token)}"
+
+
+def verify_forward(
+    value: str, method: str, target: str, token: str, members: Iterable[str], now: Optional[float] = None
+) -> Optional[str]:
+    """The forwarding node's id if `value` is a fresh signature by a cluster member for this request, else None"""
+    try:
+        node_id, timestamp, mac = value.rsplit(";", 2)
+        timestamp = int(timestamp)
+    except ValueError:
+        return None
+    now = time.time() if now is None else now
+    if node_id not in members or abs(now - timestamp) > FORWARD_SIGNATURE_MAX_AGE_SECONDS:
+        return None
+    if not hmac.compare_digest(mac, _forward_mac(node_id, timestamp, method, target, token)):
+        return None
+    return node_id
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 128):
+        self.vnodes = vnodes
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        self._nodes: set = set()
+        for node_id in nodes:
+            self.add(node_id)
+
+    @property
+    def nodes(self) -> List[str]:
+        return sorted(self._nodes)
+
+    def add(self, node_id: str):
+        if node_id in self._nodes:
+            return
+        self._nodes.add(node_id)
+        for replica in range(self.vnodes):
+            point = _hash(f"{node_id}#{replica}")
+            index = bisect.bisect_left(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node_id)
+
+    def remove(self, node_id: str):
+        if node_id not in self._nodes:
+            return
+        self._nodes.discard(node_id)
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node_id]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._points:
+            return None
+        index = bisect.bisect_right(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+def parse_nodes(spec: str) -> Dict[str, str]:
+    """"a=http://h1:8000,b=http://h2:8000" -> {"a": "http://h1:8000", "b": "http://h2:8000"}"""
+    nodes = {}
+    for item in spec.split(","):
+        node_id, _, url = item.partition("=")
+        if node_id.strip() and url.strip():
+            nodes[node_id.strip()] = url.strip().rstrip("/")
+    return nodes
+
+
+class ShardRouter:
+    """This node's view of the cluster: who the members are and which of them owns a user"""
+
+    def __init__(self, node_id: str = "", nodes: Optional[Dict[str, str]] = None, vnodes: Optional[int] = None):
+        self.node_id = node_id
+        self.vnodes = vnodes or settings.CLUSTER_VNODES
+        self.nodes: Dict[str, str] = {}
+        self.generation = 0
+        self.ring = HashRing(vnodes=self.vnodes)
+        self._lock = threading.Lock()
+        self.set_members(nodes or {}, 0)
+
+    @property
+    def enabled(self) -> bool:
+        # A node that has just been removed stays enabled so it hands its users off.
+        return bool(self.node_id and self.nodes) and set(self.nodes) != {self.node_id}
+
+    def set_members(self, nodes: Dict[str, str], generation: int) -> bool:
+        """Adopt a member list unless an equal or newer generation is already in place"""
+        with self._lock:
+            if generation < self.generation or (generation == self.generation and self.nodes):
+                return False
+            self.nodes = dict(nodes)
+            self.generation = generation
+            self.ring = HashRing(self.nodes, vnodes=self.vnodes)
+            return True
+
+    def join(self, node_id: str, url: str) -> Dict[str, str]:
+        nodes = {**self.nodes, node_id: url.rstrip("/")}
+        self.set_members(nodes, self.generation + 1)
+        return nodes
+
+    def leave(self, node_id: str) -> Dict[str, str]:
+        nodes = {member: url for member, url in self.nodes.items() if member != node_id}
+        self.set_members(nodes, self.generation + 1)
+        return nodes
+
+    def owner(self, user_id: str) -> Tuple[Optional[str], Optional[str]]:
+        """(owner node id, its base URL); (None, None) when clustering is off"""
+        if not self.enabled:
+            return None, None
+        node_id = self.ring.owner(user_id)
+        return node_id, self.nodes.get(node_id)
+
+    def is_local(self, user_id: str) -> bool:
+        node_id, _ = self.owner(user_id)
+        return node_id is None or node_id == self.node_id
+
+    def describe(self) -> Dict:
+        return {
+            "node_id": self.node_id,
+            "generation": self.generation,
+            "vnodes": self.vnodes,
+            "nodes": dict(self.nodes),
+        }
+
+
+_router = None
+
+
+def get_shard_router() -> ShardRouter:
+    global _router
+    if _router is None:
+        _router = ShardRouter(settings.CLUSTER_NODE_ID, parse_nodes(settings.CLUSTER_NODES))
+    return _router
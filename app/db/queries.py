@@ -50,6 +50,16 @@ class SubscriptionQueries:
         except Exception:
             return None
 
+    @staticmethod
+    async def get_user_tier(user_id: str) -> str:
+        try:
+            result = supabase.table("profiles").select("subscription_tier").eq("id", user_id).execute()
+            if result.data and result.data[0].get("subscription_tier"):
+                return result.data[0]["subscription_tier"]
+            return "free"
+        except Exception:
+            return "free"
+
     @staticmethod
     async def get_subscription_history(user_id: str):
         try:
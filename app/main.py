@@ -8,6 +8,7 @@ from app.database import init_db
 from app.core.supabase_client import supabase
 from app.api.routes import auth, chat, training, modules, subscriptions, admin, chat_security, contact
 from app.security_middleware import RateLimitMiddleware, SecurityHeadersMiddleware, RequestLoggingMiddleware
+import asyncio
 import logging
 from datetime import datetime
 
@@ -18,6 +19,7 @@ logger = logging.getLogger(__name__)
 
 from app.middleware.auth import AuthMiddleware
 from app.middleware.mac_verification import MACVerificationMiddleware
+from app.middleware.sharding import ShardRoutingMiddleware
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -137,6 +139,7 @@ app.add_middleware(RequestLoggingMiddleware)
 app.add_middleware(SecurityHeadersMiddleware)
 app.add_middleware(RateLimitMiddleware)
 app.add_middleware(MACVerificationMiddleware)
+app.add_middleware(ShardRoutingMiddleware)
 app.add_middleware(AuthMiddleware)
 app.add_middleware(CORSMiddleware, **cors_config)
 app.add_middleware(OptionsPreflightMiddleware)
@@ -185,6 +188,7 @@ async def http_exception_handler(request, exc):
             "Access-Control-Allow-Credentials": "true",
             "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
             "Access-Control-Allow-Headers": "Content-Type, Authorization, Referrer-Policy",
+            **(exc.headers or {}),
         }
     )
 
@@ -211,10 +215,67 @@ async def general_exception_handler(request, exc):
 
 
 
+_background_tasks = []
+
+
+def start_background_jobs():
+    if settings._is_serverless_environment():
+        logger.info("Serverless environment detected, background jobs disabled")
+        return
+    
+    if settings.SCRUB_ENABLED:
+        from app.training.scrubber import IntegrityScrubber, run_scrubber_forever
+        scrubber = IntegrityScrubber()
+        task = asyncio.create_task(run_scrubber_forever(scrubber))
+        _background_tasks.append((scrubber, task))
+        logger.info(f"Integrity scrubber started ({settings.SCRUB_BYTES_PER_SECOND} bytes/s budget)")
+    
+    if settings.SNAPSHOT_RELOAD_SECONDS > 0:
+        from app.training.reindex import SnapshotLoader, run_snapshot_loader_forever
+        loader = SnapshotLoader()
+        task = asyncio.create_task(run_snapshot_loader_forever(loader))
+        _background_tasks.append((loader, task))
+    
+    if settings.REPLICATION_PRIMARY_URL:
+        from app.training.replication import SnapshotFollower, run_follower_forever
+        follower = SnapshotFollower()
+        task = asyncio.create_task(run_follower_forever(follower))
+        _background_tasks.append((follower, task))
+        logger.info(f"Following index snapshots from {settings.REPLICATION_PRIMARY_URL}")
+    
+    if settings.CLUSTER_NODES:
+        from app.training.rebalance import get_rebalancer, run_rebalancer_forever
+        rebalancer = get_rebalancer()
+        task = asyncio.create_task(run_rebalancer_forever(rebalancer))
+        _background_tasks.append((rebalancer, task))
+        logger.info(f"Cluster node {settings.CLUSTER_NODE_ID} started ({settings.CLUSTER_ROUTING} routing)")
+    
+    if settings.CHAT_SUMMARY_EVERY_TURNS > 0:
+        from app.ai_engine.conversation import get_conversation_summarizer, run_conversation_summarizer_forever
+        summarizer = get_conversation_summarizer()
+        task = asyncio.create_task(run_conversation_summarizer_forever(summarizer))
+        _background_tasks.append((summarizer, task))
+        logger.info(f"Conversation summarizer started (every {settings.CHAT_SUMMARY_EVERY_TURNS} turns)")
+    
+    if settings.GC_ENABLED:
+        from app.training.gc import GarbageCollector, run_gc_forever
+        collector = GarbageCollector()
+        task = asyncio.create_task(run_gc_forever(collector))
+        _background_tasks.append((collector, task))
+        logger.info(f"Upload garbage collector started (every {settings.GC_INTERVAL_SECONDS}s)")
+
+
 @app.on_event("startup")
 async def startup_event():
     try:
         init_db()
+        from app.training.reindex import SnapshotLoader
+        loaded = SnapshotLoader().load_all()
+        if loaded:
+            logger.info(f"Loaded {loaded} re-indexed collection snapshots")
+        start_background_jobs()
+        from app.ai_engine.gemini import get_model_pool
+        logger.info(f"Gemini model pool ready ({get_model_pool().size} clients)")
         logger.info(f"Application started in {settings.ENVIRONMENT} mode")
     except ValueError as e:
         logger.error(f"Configuration error: {e}")
@@ -227,6 +288,14 @@ async def startup_event():
             raise
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    for job, task in _background_tasks:
+        job.stop()
+        task.cancel()
+    _background_tasks.clear()
+
+
 app.include_router(auth.router, prefix=settings.API_V1_STR)
 app.include_router(chat.router, prefix=settings.API_V1_STR)
 app.include_router(training.router, prefix=settings.API_V1_STR)
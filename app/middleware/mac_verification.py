@@ -3,6 +3,7 @@ import os
 from fastapi import Request, HTTPException, status
 from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import HTTPConnection
 from app.core.mac_manager import MACManager
 
 logger = logging.getLogger(__name__)
@@ -17,6 +18,23 @@ SENSITIVE_ROUTES = [
 logger.info(f"MAC Verification Middleware initialized with sensitive routes: {SENSITIVE_ROUTES}")
 
 
+async def verify_connection_device(connection: HTTPConnection, user_id: str) -> bool:
+    """
+    The middleware's check for a connection it never sees: BaseHTTPMiddleware
+    only handles HTTP, so WebSocket routes verify the device once at connect.
+    """
+    path = connection.url.path
+    if os.getenv("VERCEL") or not any(path.startswith(route) for route in SENSITIVE_ROUTES):
+        return True
+    
+    ip_address = connection.client.host if connection.client else None
+    verification = await MACManager.verify_mac(user_id, ip_address, connection.headers.get("user-agent"))
+    if not verification.get("verified"):
+        logger.warning(f"MAC verification failed for user {user_id} on {path}: {verification.get('reason')}")
+        return False
+    return True
+
+
 class MACVerificationMiddleware(BaseHTTPMiddleware):
     """
     Middleware to verify MAC address on sensitive requests.
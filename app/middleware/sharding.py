@@ -0,0 +1,135 @@
+import logging
+from typing import AsyncIterator, Iterator, Optional
+
+import anyio
+from fastapi import Request, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.config import get_settings
+from app.core.sharding import cluster_token, get_shard_router, sign_forward, verify_forward
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Routes that read or write a user's collection, so must run on the user's owner node
+SHARDED_ROUTES = [
+    "/api/v1/chat/",
+    "/api/v1/training/",
+]
+
+FORWARDED_HEADER = "X-Shard-Forwarded-By"
+OWNER_HEADER = "X-Shard-Owner"
+LOCATION_HEADER = "X-Shard-Location"
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailers",
+    "transfer-encoding", "upgrade", "host", "content-length", "content-encoding",
+}
+
+
+def _blocking_body(chunks: AsyncIterator[bytes]) -> Iterator[bytes]:
+    """Hands the request body to a worker thread block by block instead of buffering the whole upload"""
+    while True:
+        try:
+            block = anyio.from_thread.run(chunks.__anext__)
+        except StopAsyncIteration:
+            return
+        if block:
+            yield block
+
+
+def _forward(method: str, url: str, headers: dict, body: Optional[Iterator[bytes]]):
+    import requests
+
+    return requests.request(
+        method,
+        url,
+        headers=headers,
+        data=body,
+        stream=True,
+        allow_redirects=False,
+        timeout=settings.CLUSTER_FORWARD_TIMEOUT_SECONDS,
+    )
+
+
+class ShardRoutingMiddleware(BaseHTTPMiddleware):
+    """
+    Sends requests for users owned by another node to that node.
+    With CLUSTER_ROUTING="forward" the request is proxied and the owner's response
+    returned; with "hint" the client gets 421 and the owner's URL in X-Shard-Location.
+    """
+
+    async def dispatch(self, request: Request, call_next):
+        router = get_shard_router()
+        path = request.url.path
+        target = path + (f"?{request.url.query}" if request.url.query else "")
+        if (
+            not router.enabled
+            or request.method == "OPTIONS"
+            or not any(path.startswith(route) for route in SHARDED_ROUTES)
+            # Already forwarded once by a member: serve it here rather than bounce between nodes mid-rebalance.
+            or self._forwarded_by_member(request, target, router.nodes)
+        ):
+            return await call_next(request)
+
+        from app.security import get_current_user_id_from_request
+        user_id = getattr(request.state, "user_id", None) or get_current_user_id_from_request(request)
+        if not user_id:
+            return await call_next(request)
+
+        owner_id, owner_url = router.owner(user_id)
+        if owner_id == router.node_id:
+            response = await call_next(request)
+            response.headers[OWNER_HEADER] = owner_id
+            return response
+
+        location = owner_url + target
+        if settings.CLUSTER_ROUTING == "hint":
+            return JSONResponse(
+                status_code=status.HTTP_421_MISDIRECTED_REQUEST,
+                content={"detail": "This user is served by another node", "owner": owner_id, "location": location},
+                headers={OWNER_HEADER: owner_id, LOCATION_HEADER: location}
+            )
+
+        headers = {name: value for name, value in request.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+        headers[FORWARDED_HEADER] = sign_forward(router.node_id, request.method, target, cluster_token())
+        if request.client:
+            previous = request.headers.get("x-forwarded-for")
+            headers["X-Forwarded-For"] = f"{previous}, {request.client.host}" if previous else request.client.host
+        has_body = request.headers.get("content-length", "0") != "0" or "transfer-encoding" in request.headers
+        try:
+            body = _blocking_body(request.stream().__aiter__()) if has_body else None
+            upstream = await run_in_threadpool(_forward, request.method, location, headers, body)
+        except Exception as e:
+            logger.error(f"Forwarding {request.method} {path} to {owner_id} failed: {e}")
+            return JSONResponse(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                content={"detail": "Owner node unavailable", "owner": owner_id},
+                headers={OWNER_HEADER: owner_id, LOCATION_HEADER: location}
+            )
+
+        response_headers = {
+            name: value for name, value in upstream.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS
+        }
+        response_headers[OWNER_HEADER] = owner_id
+
+        async def body_stream():
+            try:
+                async for block in iterate_in_threadpool(upstream.iter_content(chunk_size=64 * 1024)):
+                    yield block
+            finally:
+                upstream.close()
+
+        return StreamingResponse(body_stream(), status_code=upstream.status_code, headers=response_headers)
+
+    @staticmethod
+    def _forwarded_by_member(request: Request, target: str, members) -> bool:
+        value = request.headers.get(FORWARDED_HEADER)
+        if not value:
+            return False
+        node_id = verify_forward(value, request.method, target, cluster_token(), members)
+        if node_id is None:
+            logger.warning(f"Ignoring unsigned or stale {FORWARDED_HEADER} on {request.method} {request.url.path}")
+            return False
+        return True
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Text, Integer, Boolean, ForeignKey
+from sqlalchemy import Column, String, DateTime, Text, Integer, Boolean, ForeignKey, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -34,6 +34,7 @@ class ChatSession(Base):
     
     user = relationship("User", back_populates="chat_sessions")
     messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan")
+    summary = relationship("ChatSessionSummary", back_populates="session", uselist=False, cascade="all, delete-orphan")
 
 
 class ChatMessage(Base):
@@ -48,6 +49,19 @@ class ChatMessage(Base):
     session = relationship("ChatSession", back_populates="messages")
 
 
+class ChatSessionSummary(Base):
+    """Running summary of a session's older messages: the first message_count, up to covered_until"""
+    __tablename__ = "chat_session_summaries"
+    
+    session_id = Column(String, ForeignKey("chat_sessions.id"), primary_key=True)
+    summary = Column(Text, nullable=False, default="")
+    message_count = Column(Integer, default=0)
+    covered_until = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    session = relationship("ChatSession", back_populates="summary")
+
+
 class TrainingDocument(Base):
     __tablename__ = "training_documents"
     
@@ -67,6 +81,22 @@ class TrainingDocument(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     user = relationship("User", back_populates="training_documents")
+    merkle_tree = relationship("DocumentMerkleTree", back_populates="document", uselist=False, cascade="all, delete-orphan")
+
+
+class DocumentMerkleTree(Base):
+    __tablename__ = "document_merkle_trees"
+    
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    document_id = Column(String, ForeignKey("training_documents.id"), nullable=False, unique=True, index=True)
+    block_size = Column(Integer, nullable=False)
+    leaf_count = Column(Integer, nullable=False)
+    root_hash = Column(String, nullable=False)
+    leaf_hashes = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    document = relationship("TrainingDocument", back_populates="merkle_tree")
 
 
 class ChatSecurity(Base):
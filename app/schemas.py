@@ -66,12 +66,27 @@ class ChatSessionResponse(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     session_id: Optional[str] = None
+    module_id: Optional[str] = None
+
+
+class PromptReport(BaseModel):
+    budget: int
+    tokens: int
+    system_tokens: int
+    question_truncated: bool
+    summary_tokens: int = 0
+    summary_dropped: bool = False
+    context_used: List[int]
+    context_dropped: int
+    history_used: int
+    history_dropped: int
 
 
 class ChatResponse(BaseModel):
     message: ChatMessageResponse
     session_id: str
     ai_response: str
+    prompt: Optional[PromptReport] = None
 
 
 class TrainingDocumentResponse(BaseModel):
@@ -95,6 +110,19 @@ class IntegrityVerificationResponse(BaseModel):
     checksum: Optional[str] = None
 
 
+class UploadSessionCreate(BaseModel):
+    filename: str
+    total_size: int
+    part_size: Optional[int] = None
+    client_checksum: Optional[str] = None
+
+
+class MerkleVerificationRequest(BaseModel):
+    merkle_root: str
+    block_size: int = 64 * 1024
+    leaf_hashes: Optional[List[str]] = None
+
+
 class RetrievalTestResponse(BaseModel):
     query: str
     results: List[dict]
@@ -114,3 +142,4 @@ class TrainingChatResponse(BaseModel):
     message_id: str
     ai_response: str
     sources: List[TrainingChatSource] = []
+    prompt: Optional[PromptReport] = None
@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status, Header
@@ -128,7 +128,12 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    token = credentials.credentials
+    user, _ = authenticate_token(credentials.credentials, db)
+    return user
+
+
+def authenticate_token(token: str, db: Session) -> Tuple[User, dict]:
+    """The user a bearer token belongs to, and the token's claims"""
     payload = decode_token(token)
     
     if payload is None:
@@ -206,7 +211,7 @@ async def get_current_user(
                 headers={"WWW-Authenticate": "Bearer"},
             )
     
-    return user
+    return user, payload
 
 
 async def verify_token(token: str) -> dict:
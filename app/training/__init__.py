@@ -1,4 +1,4 @@
 from app.training.document_processor import DocumentProcessor
-from app.training.vector_store import VectorStore
+from app.training.vector_store import VectorStore, get_vector_store
 
-__all__ = ["DocumentProcessor", "VectorStore"]
+__all__ = ["DocumentProcessor", "VectorStore", "get_vector_store"]
@@ -0,0 +1,113 @@
+"""
+MinHash signatures and LSH banding for near-duplicate chunk detection.
+
+Each chunk is reduced to word shingles, every shingle is hashed once to 64 bits,
+and permutation i is approximated by XOR-ing those hashes with a fixed random
+mask; the signature is the per-mask minimum. Two signatures agree at a position
+with probability ~ the Jaccard similarity of the shingle sets.
+
+The LSH index splits a signature into `bands` bands of `rows` values. Chunks
+sharing any band land in the same bucket and become candidates, which are then
+confirmed with the signature estimate. With 16 bands of 8 rows a pair at 0.9
+similarity is a candidate with probability > 0.999, one at 0.5 about 6% of
+the time.
+"""
+import hashlib
+import random
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+Signature = Tuple[int, ...]
+
+
+def _hash64(data: str) -> int:
+    return int.from_bytes(hashlib.blake2b(data.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 128, shingle_size: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = random.Random(seed)
+        self.masks = [rng.getrandbits(64) for _ in range(num_perm)]
+
+    def shingles(self, text: str) -> Set[str]:
+        words = text.lower().split()
+        if len(words) <= self.shingle_size:
+            return {" ".join(words)}
+        return {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def signature(self, text: str) -> Signature:
+        hashes = [_hash64(shingle) for shingle in self.shingles(text)]
+        return tuple(min(map(mask.__xor__, hashes)) for mask in self.masks)
+
+    @staticmethod
+    def similarity(a: Signature, b: Signature) -> float:
+        """Estimated Jaccard similarity of the texts behind two signatures"""
+        if not a or len(a) != len(b):
+            return 0.0
+        return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+class LSHIndex:
+    def __init__(self, bands: int = 16, rows: int = 8):
+        self.bands = bands
+        self.rows = rows
+        self.buckets: List[Dict[Signature, Set[str]]] = [defaultdict(set) for _ in range(bands)]
+
+    def _band_keys(self, signature: Signature) -> Iterable[Tuple[int, Signature]]:
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def insert(self, key: str, signature: Signature):
+        for band, band_key in self._band_keys(signature):
+            self.buckets[band][band_key].add(key)
+
+    def remove(self, key: str, signature: Signature):
+        for band, band_key in self._band_keys(signature):
+            bucket = self.buckets[band].get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band][band_key]
+
+    def candidates(self, signature: Signature) -> Set[str]:
+        found = set()
+        for band, band_key in self._band_keys(signature):
+            found.update(self.buckets[band].get(band_key, ()))
+        return found
+
+
+def best_match(
+    signature: Signature,
+    index: LSHIndex,
+    signatures: Dict[str, Signature],
+    threshold: float
+) -> Optional[str]:
+    """Most similar indexed key at or above `threshold`, if any"""
+    best_key, best_score = None, threshold
+    for key in index.candidates(signature):
+        score = MinHasher.similarity(signature, signatures[key])
+        if score >= best_score:
+            best_key, best_score = key, score
+    return best_key
+
+
+def diversify(
+    ranked_keys: Sequence[str],
+    signatures: Dict[str, Signature],
+    limit: int,
+    threshold: float
+) -> List[str]:
+    """Greedy top-k that skips anything too similar to an already selected result"""
+    selected: List[str] = []
+    for key in ranked_keys:
+        signature = signatures.get(key)
+        if signature and any(
+            MinHasher.similarity(signature, signatures[s]) >= threshold for s in selected if s in signatures
+        ):
+            continue
+        selected.append(key)
+        if len(selected) == limit:
+            break
+    return selected
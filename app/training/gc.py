@@ -0,0 +1,302 @@
+"""
+Reconciliation / garbage collection for uploaded training documents.
+
+Cross-checks the three places a document lives - its TrainingDocument row, its
+chunks in the vector store and its bytes (a content-addressed blob, or a legacy
+`{file_id}_{filename}` file in UPLOAD_DIR) - and removes what no longer belongs
+to anything:
+
+* blob references held by documents that no longer exist, and with them any
+  blob left unreferenced
+* legacy upload files with no row, and staged uploads a request never finished
+
+Files and blobs changed within GC_GRACE_SECONDS are left alone, so an upload
+still being processed is never touched. Also removed:
+
+* vector-store sources with no row, once they have been seen orphaned on two
+  consecutive passes (an ingest indexes chunks just before committing its row)
+* resumable upload sessions past their expiry
+
+Rows whose file has gone are only reported, unless prune_rows is set, in which
+case the row and its chunks are removed too. Deletes run in GC_BATCH_SIZE
+batches and the pass stops between batches when asked to.
+
+Run a single pass by hand with:
+
+    python -m app.training.gc --dry-run
+
+The vector store lives in the server process, so a CLI pass only reconciles
+files, upload sessions and rows; index entries are handled by the scheduled job,
+which does the file and row work in a worker thread and the index work on the
+event loop.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.config import get_settings
+from app.models import TrainingDocument
+from app.training.resumable_upload import UploadSessionManager
+from app.training.vector_store import get_vector_store
+from app.utils.storage import BlobStorage, get_storage
+from app.utils.uploads import STAGING_DIR_NAME, file_id_from_source_name, locate_stored_upload
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class GarbageCollector:
+    def __init__(
+        self,
+        session_factory=None,
+        upload_dir: Optional[str] = None,
+        vector_store=None,
+        batch_size: Optional[int] = None,
+        grace_seconds: Optional[int] = None,
+        storage: Optional[BlobStorage] = None,
+    ):
+        if session_factory is None:
+            from app.database import SessionLocal
+            session_factory = SessionLocal
+
+        self.session_factory = session_factory
+        self.upload_dir = upload_dir or settings.UPLOAD_DIR
+        self.vector_store = vector_store or get_vector_store()
+        self.storage = storage or get_storage()
+        self.batch_size = batch_size or settings.GC_BATCH_SIZE
+        self.grace_seconds = settings.GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+        self.sessions = UploadSessionManager(self.upload_dir)
+        self.stop_event = threading.Event()
+        # (user_id, source_name) pairs found orphaned on the previous pass
+        self._suspect_sources: Set[Tuple[str, str]] = set()
+
+    def _batches(self, items: List) -> List[List]:
+        return [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+
+    def _load_rows(self, db) -> Dict[str, Tuple[str, str, Optional[str]]]:
+        """document id -> (user_id, source_name, checksum_sha256), read in keyset batches"""
+        rows = {}
+        last_id = None
+        while True:
+            query = db.query(
+                TrainingDocument.id,
+                TrainingDocument.user_id,
+                TrainingDocument.source_name,
+                TrainingDocument.checksum_sha256
+            ).order_by(TrainingDocument.id)
+            if last_id:
+                query = query.filter(TrainingDocument.id > last_id)
+            batch = query.limit(self.batch_size).all()
+            if not batch:
+                return rows
+            for document_id, user_id, source_name, checksum in batch:
+                rows[document_id] = (user_id, source_name, checksum)
+            last_id = batch[-1][0]
+
+    @staticmethod
+    def _scan_files(directory: str) -> List[Tuple[str, str, int, float]]:
+        """(name, path, size, last change) for every regular, non-hidden file in `directory`"""
+        files = []
+        if not os.path.isdir(directory):
+            return files
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                files.append((entry.name, entry.path, stat.st_size, max(stat.st_mtime, stat.st_ctime)))
+        return files
+
+    def _remove_files(self, doomed: List[Tuple[str, int]], dry_run: bool, report: Dict[str, int]) -> bool:
+        """Delete in batches; False if the pass was asked to stop"""
+        for batch in self._batches(doomed):
+            if self.stop_event.is_set():
+                return False
+            for path, size in batch:
+                try:
+                    if not dry_run:
+                        os.remove(path)
+                    report["reclaimed_bytes"] += size
+                except OSError as e:
+                    logger.warning(f"GC could not remove {path}: {e}")
+        return True
+
+    def _new_report(self) -> Dict[str, int]:
+        return {
+            "orphan_blobs": 0,
+            "stale_blob_refs": 0,
+            "orphan_files": 0,
+            "stale_staged_files": 0,
+            "orphan_sources": 0,
+            "orphan_chunks": 0,
+            "expired_sessions": 0,
+            "rows_missing_file": 0,
+            "rows_pruned": 0,
+            "reclaimed_bytes": 0,
+        }
+
+    def reconcile_storage(
+        self, dry_run: bool = False, prune_rows: bool = False
+    ) -> Tuple[Dict[str, int], Optional[Set[Tuple[str, str]]], List[Tuple[str, str]]]:
+        """
+        The database, blob and file half of a pass; safe to run in a worker thread.
+        Returns (report, live sources, sources of pruned rows); live sources is None
+        if the pass was stopped before the index should be reconciled.
+        """
+        report = self._new_report()
+        pruned_sources: List[Tuple[str, str]] = []
+
+        db = self.session_factory()
+        try:
+            rows = self._load_rows(db)
+            cutoff = time.time() - self.grace_seconds
+
+            # Blob references whose document is gone; a blob goes with its last reference.
+            # Recently touched blobs are skipped: an ingest references the blob just before committing its row.
+            digests = list(self.storage.iter_digests())
+            for batch in self._batches(digests):
+                if self.stop_event.is_set():
+                    return report, None, pruned_sources
+                for digest in batch:
+                    info = self.storage.info(digest)
+                    changed = self.storage.meta_mtime(digest)
+                    if not info or (changed is not None and changed > cutoff):
+                        continue
+                    stale = [ref for ref in info.refs if ref not in rows]
+                    if not stale:
+                        continue
+                    report["stale_blob_refs"] += len(stale)
+                    if len(stale) == len(info.refs):
+                        report["orphan_blobs"] += 1
+                        if dry_run:
+                            report["reclaimed_bytes"] += info.stored_size
+                    if not dry_run:
+                        for ref in stale:
+                            report["reclaimed_bytes"] += self.storage.release(digest, ref)
+
+            # Legacy `{file_id}_{filename}` uploads no row points at any more.
+            legacy_ids = {file_id_from_source_name(source_name) for _, source_name, _ in rows.values()}
+            legacy_files = [f for f in self._scan_files(self.upload_dir) if "_" in f[0]]
+            doomed = [
+                (path, size) for name, path, size, changed in legacy_files
+                if changed <= cutoff and name.split("_", 1)[0] not in legacy_ids
+            ]
+            report["orphan_files"] = len(doomed)
+            if not self._remove_files(doomed, dry_run, report):
+                return report, None, pruned_sources
+
+            # Uploads left in staging by a request that died before storing them.
+            staged = self._scan_files(os.path.join(self.upload_dir, STAGING_DIR_NAME))
+            doomed = [(path, size) for _, path, size, changed in staged if changed <= cutoff]
+            report["stale_staged_files"] = len(doomed)
+            if not self._remove_files(doomed, dry_run, report):
+                return report, None, pruned_sources
+
+            live_sources = {(user_id, source_name) for user_id, source_name, _ in rows.values()}
+
+            purged, reclaimed = self.sessions.purge_expired(dry_run=dry_run)
+            report["expired_sessions"] = purged
+            report["reclaimed_bytes"] += reclaimed
+
+            legacy_index = {name.split("_", 1)[0]: path for name, path, _, _ in legacy_files}
+            missing = [
+                (document_id, user_id, source_name)
+                for document_id, (user_id, source_name, checksum) in rows.items()
+                if not locate_stored_upload(source_name, checksum, storage=self.storage, legacy_index=legacy_index)
+            ]
+            report["rows_missing_file"] = len(missing)
+            if prune_rows:
+                for batch in self._batches(missing):
+                    if self.stop_event.is_set():
+                        break
+                    if not dry_run:
+                        documents = db.query(TrainingDocument).filter(
+                            TrainingDocument.id.in_([document_id for document_id, _, _ in batch])
+                        ).all()
+                        for document in documents:
+                            db.delete(document)
+                        db.commit()
+                        pruned_sources.extend((user_id, source_name) for _, user_id, source_name in batch)
+                    report["rows_pruned"] += len(batch)
+        finally:
+            db.close()
+
+        return report, live_sources, pruned_sources
+
+    def reconcile_index(
+        self,
+        report: Dict[str, int],
+        live_sources: Set[Tuple[str, str]],
+        pruned_sources: List[Tuple[str, str]],
+        dry_run: bool = False,
+    ) -> Dict[str, int]:
+        """
+        The vector-store half of a pass. The store is not thread-safe, so the
+        scheduled job runs this on the event loop alongside the request handlers.
+        """
+        for user_id, source_name in pruned_sources:
+            self.vector_store.delete_collection_by_source(user_id, source_name)
+
+        orphaned = []
+        for user_id, sources in self.vector_store.list_sources().items():
+            for source_name, chunk_count in sources.items():
+                if (user_id, source_name) not in live_sources:
+                    orphaned.append((user_id, source_name, chunk_count))
+
+        confirmed = [o for o in orphaned if (o[0], o[1]) in self._suspect_sources]
+        if not dry_run:
+            self._suspect_sources = {(o[0], o[1]) for o in orphaned}
+        for batch in self._batches(confirmed):
+            if self.stop_event.is_set():
+                return report
+            for user_id, source_name, chunk_count in batch:
+                if not dry_run:
+                    self.vector_store.delete_collection_by_source(user_id, source_name)
+                report["orphan_sources"] += 1
+                report["orphan_chunks"] += chunk_count
+        return report
+
+    def run_pass(self, dry_run: bool = False, prune_rows: bool = False) -> Dict[str, int]:
+        report, live_sources, pruned_sources = self.reconcile_storage(dry_run=dry_run, prune_rows=prune_rows)
+        if live_sources is not None:
+            self.reconcile_index(report, live_sources, pruned_sources, dry_run=dry_run)
+        logger.info(f"Garbage collection pass finished (dry_run={dry_run}): {report}")
+        return report
+
+    def stop(self):
+        self.stop_event.set()
+
+
+async def run_gc_forever(collector: GarbageCollector):
+    """Run a pass every GC_INTERVAL_SECONDS: files and rows in a worker thread, the index on the loop"""
+    while not collector.stop_event.is_set():
+        await asyncio.to_thread(collector.stop_event.wait, settings.GC_INTERVAL_SECONDS)
+        if collector.stop_event.is_set():
+            break
+        try:
+            report, live_sources, pruned_sources = await asyncio.to_thread(collector.reconcile_storage)
+            if live_sources is not None:
+                collector.reconcile_index(report, live_sources, pruned_sources)
+            logger.info(f"Garbage collection pass finished (dry_run=False): {report}")
+        except Exception as e:
+            logger.error(f"Garbage collection pass failed: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove upload files, index entries and upload sessions that no document owns")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be removed without deleting")
+    parser.add_argument("--prune-rows", action="store_true", help="also delete documents whose stored file is gone")
+    parser.add_argument("--grace-seconds", type=int, default=None, help="ignore files modified more recently than this")
+    args = parser.parse_args()
+
+    collector = GarbageCollector(grace_seconds=args.grace_seconds)
+    print(json.dumps(collector.run_pass(dry_run=args.dry_run, prune_rows=args.prune_rows), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Shared, read-only knowledge base for the built-in learning modules.
+
+The curated content is compiled once into a single corpus file and every
+process maps it read-only, so all workers share one copy in the page cache and
+all users query the same collection. Layout:
+
+    b"MODCORP1" | u64 header length | JSON header | data
+
+The header lists each chunk (module, title, offset and length of its text in
+`data`, number of distinct terms) and a term dictionary pointing at postings -
+little-endian u32 chunk numbers - also stored in `data`. A query only reads the
+postings of its own terms to compute the same word-set Jaccard similarity user
+collections use, and decodes the text of the top results alone.
+
+Build or rebuild it with:
+
+    python -m app.training.module_corpus --content-dir ./module_content
+
+Content is read from `{content_dir}/{module_id}/*.{md,txt,json,pdf}`; every
+module also gets an overview chunk from its title, description and topics. If
+the corpus file is missing, the first process that needs it builds it.
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence
+
+from app.config import get_settings
+from app.training.document_processor import DocumentProcessor
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MODCORP1"
+HEADER_PREFIX = struct.Struct("<8sQ")
+CONTENT_TYPES = {"md", "txt", "json", "pdf"}
+
+
+def corpus_path() -> str:
+    return settings.MODULE_CORPUS_PATH or os.path.join(settings.CHROMA_PERSIST_DIR, "module_corpus.bin")
+
+
+def terms_of(text: str) -> set:
+    """Same tokenization as SimpleCollection's similarity"""
+    return set(text.lower().split())
+
+
+def module_overview(module: Dict) -> str:
+    topics = ", ".join(module.get("topics", []))
+    return f"{module['title']}: {module['description']}. Topics covered: {topics}."
+
+
+def collect_module_chunks(modules: Sequence[Dict], content_dir: Optional[str] = None) -> List[Dict]:
+    chunks = []
+    for module in modules:
+        chunks.append({"module_id": module["id"], "title": module["title"], "text": module_overview(module)})
+        module_dir = os.path.join(content_dir, module["id"]) if content_dir else None
+        if not module_dir or not os.path.isdir(module_dir):
+            continue
+        for name in sorted(os.listdir(module_dir)):
+            file_type = name.rsplit(".", 1)[-1].lower()
+            if file_type not in CONTENT_TYPES:
+                continue
+            text = DocumentProcessor.extract_text(os.path.join(module_dir, name), file_type)
+            for chunk in DocumentProcessor.chunk_text(text):
+                chunks.append({"module_id": module["id"], "title": module["title"], "text": chunk})
+    return chunks
+
+
+def write_module_corpus(path: str, chunks: List[Dict]) -> int:
+    """Write a corpus file atomically; returns the number of chunks"""
+    data = bytearray()
+    entries = []
+    postings: Dict[str, List[int]] = defaultdict(list)
+    for number, chunk in enumerate(chunks):
+        encoded = chunk["text"].encode("utf-8")
+        terms = terms_of(chunk["text"])
+        entries.append({
+            "module_id": chunk["module_id"],
+            "title": chunk["title"],
+            "offset": len(data),
+            "length": len(encoded),
+            "terms": len(terms),
+        })
+        data += encoded
+        for term in terms:
+            postings[term].append(number)
+
+    term_index = {}
+    for term in sorted(postings):
+        numbers = postings[term]
+        term_index[term] = [len(data), len(numbers)]
+        data += struct.pack(f"<{len(numbers)}I", *numbers)
+
+    header = json.dumps({"chunks": entries, "terms": term_index}).encode("utf-8")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER_PREFIX.pack(MAGIC, len(header)))
+        f.write(header)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(entries)
+
+
+def build_module_corpus(path: Optional[str] = None, content_dir: Optional[str] = None, modules: Optional[Sequence[Dict]] = None) -> int:
+    if modules is None:
+        from app.api.routes.modules import MODULES
+        modules = MODULES
+    content_dir = content_dir if content_dir is not None else settings.MODULE_CONTENT_DIR
+    return write_module_corpus(path or corpus_path(), collect_module_chunks(modules, content_dir))
+
+
+class ModuleCorpus:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = HEADER_PREFIX.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a module corpus")
+        header_start = HEADER_PREFIX.size
+        header = json.loads(self._map[header_start:header_start + header_length])
+        self._data_start = header_start + header_length
+        self.chunks: List[Dict] = header["chunks"]
+        self.terms: Dict[str, List[int]] = header["terms"]
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def _postings(self, term: str) -> Sequence[int]:
+        location = self.terms.get(term)
+        if not location:
+            return ()
+        offset, count = location
+        return struct.unpack_from(f"<{count}I", self._map, self._data_start + offset)
+
+    def text(self, number: int) -> str:
+        entry = self.chunks[number]
+        start = self._data_start + entry["offset"]
+        return self._map[start:start + entry["length"]].decode("utf-8")
+
+    def query(self, query: str, n_results: int = 3, module_id: Optional[str] = None) -> List[Dict]:
+        """Retrieve-style results; chunks of `module_id` have their similarity boosted by MODULE_BOOST"""
+        query_terms = terms_of(query)
+        if not query_terms:
+            return []
+
+        overlap: Dict[int, int] = defaultdict(int)
+        for term in query_terms:
+            for number in self._postings(term):
+                overlap[number] += 1
+
+        scored = []
+        for number, shared in overlap.items():
+            entry = self.chunks[number]
+            similarity = shared / (len(query_terms) + entry["terms"] - shared)
+            if module_id and entry["module_id"] == module_id:
+                similarity *= 1 + settings.MODULE_BOOST
+            scored.append((1.0 - similarity, number))
+        scored.sort()
+
+        return [
+            {
+                "content": self.text(number),
+                "source": f"module:{self.chunks[number]['module_id']}",
+                "module_id": self.chunks[number]["module_id"],
+                "title": self.chunks[number]["title"],
+                "distance": distance,
+                "duplicate_sources": []
+            }
+            for distance, number in scored[:n_results]
+        ]
+
+    def close(self):
+        self._map.close()
+
+
+_corpus = None
+_corpus_lock = threading.Lock()
+
+
+def get_module_corpus() -> Optional[ModuleCorpus]:
+    """The process-wide corpus, built on first use if the file is missing; None if it cannot be loaded"""
+    global _corpus
+    if _corpus is None:
+        with _corpus_lock:
+            if _corpus is None:
+                path = corpus_path()
+                try:
+                    if not os.path.exists(path):
+                        chunk_count = build_module_corpus(path)
+                        logger.info(f"Built module corpus with {chunk_count} chunks at {path}")
+                    _corpus = ModuleCorpus(path)
+                except Exception as e:
+                    logger.error(f"Module corpus unavailable: {e}")
+                    return None
+    return _corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile curated module content into the shared module corpus")
+    parser.add_argument("--content-dir", default=None, help="directory with one sub-directory per module id")
+    parser.add_argument("--output", default=None, help="corpus file to write (default: MODULE_CORPUS_PATH)")
+    args = parser.parse_args()
+
+    chunk_count = build_module_corpus(args.output, args.content_dir)
+    print(f"Wrote {chunk_count} chunks to {args.output or corpus_path()}")
+
+
+if __name__ == "__main__":
+    main()
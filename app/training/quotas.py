@@ -0,0 +1,59 @@
+"""
+Per-tier limits on how much memory a user's collection may hold.
+
+COLLECTION_QUOTAS_MB maps subscription tiers (profiles.subscription_tier, i.e.
+the plan slug) to megabytes, e.g. "free=25,enterprise=0"; tiers not listed get
+COLLECTION_QUOTA_DEFAULT_MB, and 0 means unlimited. Sizes are the estimates
+VectorStore.collection_usage reports, so the limit tracks what the collection
+actually keeps in RAM rather than the size of the uploaded files.
+"""
+from typing import Dict, Optional
+
+from app.config import get_settings
+
+settings = get_settings()
+
+MEGABYTE = 1024 * 1024
+
+
+class QuotaExceededError(Exception):
+    def __init__(self, message: str, usage_bytes: int, quota_bytes: int):
+        super().__init__(message)
+        self.usage_bytes = usage_bytes
+        self.quota_bytes = quota_bytes
+
+
+def parse_quotas(spec: str) -> Dict[str, int]:
+    """"free=25,pro=200" -> {"free": 25 MiB, "pro": 200 MiB}"""
+    quotas = {}
+    for item in spec.split(","):
+        tier, _, megabytes = item.partition("=")
+        if tier.strip() and megabytes.strip():
+            quotas[tier.strip().lower()] = int(float(megabytes) * MEGABYTE)
+    return quotas
+
+
+def quota_for_tier(tier: Optional[str]) -> Optional[int]:
+    """Quota in bytes, or None when the tier is unlimited"""
+    quotas = parse_quotas(settings.COLLECTION_QUOTAS_MB)
+    quota = quotas.get((tier or "free").lower(), settings.COLLECTION_QUOTA_DEFAULT_MB * MEGABYTE)
+    return quota or None
+
+
+async def collection_quota(user_id: str):
+    """(tier, quota bytes or None) for a user"""
+    from app.db.queries import SubscriptionQueries
+    tier = await SubscriptionQueries.get_user_tier(user_id)
+    return tier, quota_for_tier(tier)
+
+
+def check_quota(usage_bytes: int, additional_bytes: int, quota_bytes: Optional[int]):
+    if quota_bytes is None or additional_bytes <= 0:
+        return
+    if usage_bytes + additional_bytes > quota_bytes:
+        raise QuotaExceededError(
+            f"Training data quota exceeded: this upload needs {additional_bytes / MEGABYTE:.1f} MB "
+            f"and {usage_bytes / MEGABYTE:.1f} MB of your {quota_bytes / MEGABYTE:.1f} MB is in use",
+            usage_bytes,
+            quota_bytes
+        )
@@ -0,0 +1,157 @@
+"""
+Moving collections between nodes when cluster membership changes.
+
+After a join or leave (see app.core.sharding), each node looks for collections
+it holds for users it no longer owns and sends them to their new owner in the
+index snapshot format (app.training.replication), grouped per owner. The owner
+swaps them in, keeping any sources it already received for those users itself,
+and the sender drops a collection only if it did not change after it was
+exported; anything not handed off is retried every CLUSTER_REBALANCE_SECONDS.
+"""
+import asyncio
+import logging
+import os
+import tempfile
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from app.config import get_settings
+from app.core.sharding import ShardRouter, cluster_token, get_shard_router
+from app.training.replication import IndexSnapshot, restore_collections, write_index_snapshot
+from app.training.vector_store import VectorStore, get_vector_store
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+IMPORT_PATH = "/admin/index/collections"
+CLUSTER_PATH = "/admin/cluster"
+
+
+def _post_file(url: str, path: str, token: str):
+    import requests
+
+    with open(path, "rb") as f:
+        response = requests.post(
+            url,
+            data=f,
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/octet-stream"},
+            timeout=settings.CLUSTER_FORWARD_TIMEOUT_SECONDS
+        )
+    response.raise_for_status()
+    return response.json()
+
+
+def _put_members(url: str, members: Dict, token: str):
+    import requests
+
+    response = requests.put(
+        url, json=members, headers={"Authorization": f"Bearer {token}"}, timeout=settings.CLUSTER_FORWARD_TIMEOUT_SECONDS
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+async def broadcast_membership(router: ShardRouter, previous_nodes: Dict[str, str]) -> List[str]:
+    """Push this node's member list to every current and previous member; returns the nodes that failed"""
+    members = {"nodes": router.nodes, "generation": router.generation}
+    targets = {**previous_nodes, **router.nodes}
+    failed = []
+    for node_id, url in targets.items():
+        if node_id == router.node_id:
+            continue
+        try:
+            await asyncio.to_thread(_put_members, url + settings.API_V1_STR + CLUSTER_PATH, members, cluster_token())
+        except Exception as e:
+            logger.error(f"Could not send cluster membership to {node_id}: {e}")
+            failed.append(node_id)
+    return failed
+
+
+async def import_collections(store: VectorStore, path: str) -> int:
+    """Owner side of a handoff: swap in the collections of a snapshot file"""
+    snapshot = await asyncio.to_thread(IndexSnapshot, path)
+    try:
+        restored = await asyncio.to_thread(restore_collections, store, snapshot)
+    finally:
+        snapshot.close()
+    for user_id, data in restored:
+        store.swap_collection(user_id, data)
+    return len(restored)
+
+
+class Rebalancer:
+    def __init__(self, router: Optional[ShardRouter] = None, store: Optional[VectorStore] = None):
+        self.router = router or get_shard_router()
+        self.store = store or get_vector_store()
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+
+    def misplaced(self) -> Dict[str, List[str]]:
+        """owner node id -> users whose collections are here but belong there"""
+        by_owner = defaultdict(list)
+        if not self.router.enabled:
+            return by_owner
+        for data in list(self.store.collections.values()):
+            user_id = data["metadata"]["user_id"]
+            owner_id, _ = self.router.owner(user_id)
+            if owner_id and owner_id != self.router.node_id:
+                by_owner[owner_id].append(user_id)
+        return by_owner
+
+    async def handoff(self) -> Dict:
+        report = {"moved": 0, "changed": 0, "failed_nodes": []}
+        for owner_id, user_ids in self.misplaced().items():
+            owner_url = self.router.nodes.get(owner_id)
+            # Exported and versioned in one step on the event loop, so a later change is noticed.
+            state = self.store.export_state(user_ids=user_ids)
+            versions = {c["user_id"]: self.store.collections[f"user_{c['user_id']}"]["version"] for c in state["collections"]}
+            fd, path = tempfile.mkstemp(suffix=".vssnap")
+            os.close(fd)
+            try:
+                await asyncio.to_thread(write_index_snapshot, path, state)
+                await asyncio.to_thread(_post_file, owner_url + settings.API_V1_STR + IMPORT_PATH, path, cluster_token())
+            except Exception as e:
+                logger.error(f"Handing {len(user_ids)} collections to {owner_id} failed: {e}")
+                report["failed_nodes"].append(owner_id)
+                continue
+            finally:
+                os.remove(path)
+            for user_id, version in versions.items():
+                if self.store.release_collection(user_id, version):
+                    report["moved"] += 1
+                else:
+                    report["changed"] += 1
+        if report["moved"] or report["failed_nodes"]:
+            logger.info(f"Rebalance: {report}")
+        return report
+
+    def wake(self):
+        self.wake_event.set()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+
+
+_rebalancer = None
+
+
+def get_rebalancer() -> Rebalancer:
+    global _rebalancer
+    if _rebalancer is None:
+        _rebalancer = Rebalancer()
+    return _rebalancer
+
+
+async def run_rebalancer_forever(rebalancer: Rebalancer):
+    """Hand off misplaced collections after each membership change and every CLUSTER_REBALANCE_SECONDS"""
+    while not rebalancer.stop_event.is_set():
+        await asyncio.to_thread(rebalancer.wake_event.wait, settings.CLUSTER_REBALANCE_SECONDS)
+        rebalancer.wake_event.clear()
+        if rebalancer.stop_event.is_set():
+            break
+        try:
+            await rebalancer.handoff()
+        except Exception as e:
+            logger.error(f"Rebalance failed: {e}")
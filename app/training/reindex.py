@@ -0,0 +1,343 @@
+"""
+Bulk re-index: rebuild every user's collection from the stored uploads.
+
+After a change to extraction, chunking or retrieval, run:
+
+    python -m app.training.reindex --dry-run      # size estimate only
+    python -m app.training.reindex --workers 8
+    python -m app.training.reindex --resume       # continue an interrupted build
+
+Documents are extracted, chunked and summarized across a process pool. A user's collection
+is only written once every one of their documents has been processed: it goes
+to a snapshot file (`CHROMA_PERSIST_DIR/snapshots/user_{id}.json`) through an
+atomic rename, so a reader sees either the previous snapshot or the complete
+new one. A user with any document that could not be processed keeps their
+current collection and is reported instead.
+
+The server swaps new snapshots in as it notices them (every
+SNAPSHOT_RELOAD_SECONDS, and on startup). Progress is recorded per user in
+`reindex_state.json`, so --resume skips users already written by the same build.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from app.config import get_settings
+from app.models import TrainingDocument
+from app.training.document_processor import DocumentProcessor
+from app.training.scrubber import ByteRateLimiter
+from app.training.summaries import build_summary_tree
+from app.training.vector_store import VectorStore, chunk_records, get_vector_store, snapshot_dir, snapshot_path, write_snapshot
+from app.utils.storage import BlobStorage, get_storage
+from app.utils.uploads import StoredUpload, index_upload_dir, locate_stored_upload
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+def extract_chunks(stored: StoredUpload, file_type: str) -> List[str]:
+    """The document's chunks, read from wherever its bytes are stored"""
+    if stored.path:
+        return DocumentProcessor.process_document(stored.path, file_type)[0]
+    # Extractors want a path; compressed blobs are inflated to a temporary file first.
+    with tempfile.NamedTemporaryFile(suffix=f".{file_type}") as tmp:
+        with stored.open() as src:
+            shutil.copyfileobj(src, tmp)
+        tmp.flush()
+        return DocumentProcessor.process_document(tmp.name, file_type)[0]
+
+
+def process_stored_document(stored: StoredUpload, file_type: str) -> Tuple[List[str], List[Dict]]:
+    """Runs in a pool worker: chunks plus the summary tree (empty if summarizing failed)"""
+    chunks = extract_chunks(stored, file_type)
+    try:
+        summaries = build_summary_tree(chunks)
+    except Exception as e:
+        logger.warning(f"Re-index could not summarize a {file_type} document: {e}")
+        summaries = []
+    return chunks, summaries
+
+
+def chunk_metadata(document: TrainingDocument) -> Dict:
+    """Document-level chunk metadata, as the upload routes attach it"""
+    metadata = {"filename": document.filename, "checksum": document.checksum_sha256}
+    if document.client_checksum:
+        metadata["client_checksum"] = document.client_checksum
+        metadata["two_way_verified"] = bool(document.checksum_verified)
+    return metadata
+
+
+class Reindexer:
+    def __init__(
+        self,
+        session_factory=None,
+        workers: Optional[int] = None,
+        bytes_per_second: Optional[int] = None,
+        snapshot_directory: Optional[str] = None,
+        upload_dir: Optional[str] = None,
+        storage: Optional[BlobStorage] = None,
+    ):
+        if session_factory is None:
+            from app.database import SessionLocal
+            session_factory = SessionLocal
+
+        self.session_factory = session_factory
+        self.workers = workers or settings.REINDEX_WORKERS or os.cpu_count() or 1
+        self.limiter = ByteRateLimiter(
+            settings.REINDEX_BYTES_PER_SECOND if bytes_per_second is None else bytes_per_second
+        )
+        self.snapshot_directory = snapshot_directory or snapshot_dir()
+        self.state_path = os.path.join(self.snapshot_directory, "reindex_state.json")
+        self.upload_dir = upload_dir or settings.UPLOAD_DIR
+        self.storage = storage or get_storage()
+        self.stop_event = threading.Event()
+
+    def load_state(self) -> Dict:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self, state: Dict):
+        os.makedirs(self.snapshot_directory, exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _documents_by_user(self, db, user_ids: Optional[List[str]] = None) -> Dict[str, List[TrainingDocument]]:
+        query = db.query(TrainingDocument).order_by(TrainingDocument.user_id, TrainingDocument.created_at)
+        if user_ids:
+            query = query.filter(TrainingDocument.user_id.in_(user_ids))
+        grouped: Dict[str, List[TrainingDocument]] = {}
+        for document in query.all():
+            grouped.setdefault(document.user_id, []).append(document)
+        return grouped
+
+    def _locate(self, documents: List[TrainingDocument], legacy_index: Dict[str, str]) -> List[Tuple[TrainingDocument, Optional[StoredUpload]]]:
+        return [
+            (
+                document,
+                locate_stored_upload(
+                    document.source_name,
+                    document.checksum_sha256,
+                    storage=self.storage,
+                    legacy_index=legacy_index
+                )
+            )
+            for document in documents
+        ]
+
+    def estimate(self, user_ids: Optional[List[str]] = None) -> Dict:
+        """What a run would read, without extracting anything"""
+        db = self.session_factory()
+        try:
+            grouped = self._documents_by_user(db, user_ids)
+            legacy_index = index_upload_dir(self.upload_dir)
+            report = {"users": len(grouped), "documents": 0, "bytes": 0, "missing_files": 0}
+            for documents in grouped.values():
+                for _, stored in self._locate(documents, legacy_index):
+                    report["documents"] += 1
+                    if stored:
+                        report["bytes"] += stored.size
+                    else:
+                        report["missing_files"] += 1
+            if self.limiter.bytes_per_second > 0:
+                report["min_seconds"] = round(report["bytes"] / self.limiter.bytes_per_second, 1)
+            return report
+        finally:
+            db.close()
+
+    def _submit_user(self, pool, documents: List[TrainingDocument], legacy_index: Dict[str, str]) -> Tuple[List, List[str]]:
+        """Queue extraction of one user's documents under the byte-rate budget"""
+        futures, missing = [], []
+        for document, stored in self._locate(documents, legacy_index):
+            if not stored:
+                missing.append(document.source_name)
+                continue
+            self.limiter.consume(stored.size)
+            futures.append((document, pool.submit(process_stored_document, stored, document.file_type)))
+        return futures, missing
+
+    def _finish_user(self, db, user_id: str, futures: List, failures: List[str], build_id: str) -> Dict:
+        """Collect one user's chunks and write their snapshot; nothing is written on any failure"""
+        ids, chunks, metadatas, summaries, chunk_counts = [], [], [], {}, {}
+        for document, future in futures:
+            try:
+                document_chunks, summaries[document.source_name] = future.result()
+            except Exception as e:
+                logger.warning(f"Re-index could not process {document.source_name}: {e}")
+                failures.append(document.source_name)
+                continue
+            document_ids, document_metadatas = chunk_records(
+                user_id, document.source_name, document_chunks, chunk_metadata(document)
+            )
+            ids.extend(document_ids)
+            chunks.extend(document_chunks)
+            metadatas.extend(document_metadatas)
+            chunk_counts[document] = len(document_chunks)
+
+        if failures:
+            return {"written": False, "failed": failures}
+
+        write_snapshot(snapshot_path(user_id, self.snapshot_directory), {
+            "user_id": user_id,
+            "build_id": build_id,
+            "created_at": time.time(),
+            "ids": ids,
+            "documents": chunks,
+            "metadatas": metadatas,
+            "summaries": summaries,
+        })
+        for document, chunk_count in chunk_counts.items():
+            document.chunk_count = chunk_count
+        db.commit()
+        return {"written": True, "failed": [], "chunks": len(ids)}
+
+    def run(self, user_ids: Optional[List[str]] = None, resume: bool = False) -> Dict:
+        state = self.load_state() if resume else {}
+        if not state.get("build_id"):
+            state = {"build_id": uuid.uuid4().hex, "started_at": time.time(), "completed_users": []}
+            self.save_state(state)
+        completed = set(state["completed_users"])
+
+        report = {
+            "build_id": state["build_id"],
+            "users_written": 0,
+            "users_skipped": 0,
+            "users_failed": 0,
+            "documents": 0,
+            "chunks": 0,
+            "failed_documents": [],
+        }
+
+        def finish(user_id, futures, missing):
+            result = self._finish_user(db, user_id, futures, missing, state["build_id"])
+            if not result["written"]:
+                report["users_failed"] += 1
+                report["failed_documents"].extend(result["failed"])
+                return
+            report["users_written"] += 1
+            report["documents"] += len(futures)
+            report["chunks"] += result["chunks"]
+            state["completed_users"].append(user_id)
+            self.save_state(state)
+
+        db = self.session_factory()
+        try:
+            grouped = self._documents_by_user(db, user_ids)
+            legacy_index = index_upload_dir(self.upload_dir)
+            # Keep the pool busy across user boundaries, but bound how many jobs (and results) are in flight.
+            window = self.workers * 4
+            pending = deque()
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                for user_id, documents in grouped.items():
+                    if self.stop_event.is_set():
+                        break
+                    if user_id in completed:
+                        report["users_skipped"] += 1
+                        continue
+                    pending.append((user_id, *self._submit_user(pool, documents, legacy_index)))
+                    while sum(len(futures) for _, futures, _ in pending) > window:
+                        finish(*pending.popleft())
+                while pending:
+                    finish(*pending.popleft())
+        finally:
+            db.close()
+
+        logger.info(f"Re-index finished: {report}")
+        return report
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class SnapshotLoader:
+    """
+    Server side: swaps in snapshots written by a re-index. Sources deleted or
+    replaced by a new version since a snapshot was written are left out of it,
+    so neither a reload nor a restart brings old chunks back.
+    """
+
+    def __init__(self, store: Optional[VectorStore] = None, session_factory=None):
+        if session_factory is None:
+            from app.database import SessionLocal
+            session_factory = SessionLocal
+
+        self.store = store or get_vector_store()
+        self.session_factory = session_factory
+        self.stop_event = threading.Event()
+
+    def live_sources(self, user_id: str) -> Dict[str, Optional[str]]:
+        """source_name -> checksum of the user's current documents"""
+        db = self.session_factory()
+        try:
+            return dict(
+                db.query(TrainingDocument.source_name, TrainingDocument.checksum_sha256)
+                .filter(TrainingDocument.user_id == user_id)
+                .all()
+            )
+        finally:
+            db.close()
+
+    def load_all(self, directory: Optional[str] = None) -> int:
+        """Startup: swap in every snapshot on disk"""
+        return self.store.load_snapshots(directory, live_sources=self.live_sources)
+
+    async def load_changed(self) -> int:
+        loaded = 0
+        for path, stamp in await asyncio.to_thread(self.store.changed_snapshots):
+            # Building (MinHash for every chunk) happens in a thread; the swap runs
+            # on the event loop so no request can add chunks between carry-over and swap.
+            user_id, data = await asyncio.to_thread(self.store.build_from_snapshot, path, self.live_sources)
+            carried = self.store.swap_collection(user_id, data)
+            self.store.mark_snapshot_loaded(path, stamp)
+            logger.info(f"Loaded re-indexed collection for user {user_id} ({carried} newer sources kept)")
+            loaded += 1
+        return loaded
+
+    def stop(self):
+        self.stop_event.set()
+
+
+async def run_snapshot_loader_forever(loader: SnapshotLoader):
+    """Check for new snapshots every SNAPSHOT_RELOAD_SECONDS"""
+    while not loader.stop_event.is_set():
+        await asyncio.to_thread(loader.stop_event.wait, settings.SNAPSHOT_RELOAD_SECONDS)
+        if loader.stop_event.is_set():
+            break
+        try:
+            await loader.load_changed()
+        except Exception as e:
+            logger.error(f"Snapshot reload failed: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild user collections from the stored training documents")
+    parser.add_argument("--dry-run", action="store_true", help="only estimate how much would be re-read")
+    parser.add_argument("--resume", action="store_true", help="continue the last build, skipping users already written")
+    parser.add_argument("--workers", type=int, default=None, help="extraction processes (default: CPU count)")
+    parser.add_argument("--max-bytes-per-second", type=int, default=None, help="cap on stored bytes read (0 = unlimited)")
+    parser.add_argument("--user", action="append", dest="users", help="only re-index this user (repeatable)")
+    args = parser.parse_args()
+
+    reindexer = Reindexer(workers=args.workers, bytes_per_second=args.max_bytes_per_second)
+    if args.dry_run:
+        print(json.dumps(reindexer.estimate(args.users), indent=2))
+        return
+    print(json.dumps(reindexer.run(args.users, resume=args.resume), indent=2))
+
+
+if __name__ == "__main__":
+    main()
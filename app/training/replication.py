@@ -0,0 +1,352 @@
+"""
+Index snapshot shipping to warm standby nodes.
+
+The primary serves its collections at GET /api/v1/admin/index/snapshot as a
+single binary file:
+
+    b"VSSNAP01" | u64 header length | sha256 of header | JSON header | sections
+
+The header describes the snapshot (kind "full" or "delta", the primary's
+epoch and change version, the version a delta is based on, users deleted since
+then) and lists one section per collection with its offset, length and sha256.
+A section is zlib-compressed `u32 JSON length | JSON | signatures`, where the
+JSON holds the chunk ids, texts, metadatas, canonical map and summary trees
+and the signatures are the chunks' MinHash values as little-endian u64s, so a
+standby rebuilds its LSH index without re-hashing any text.
+
+The state is captured in one synchronous pass on the primary's event loop, so
+a snapshot is a consistent point in time across every collection. A delta
+holds the collections changed since `since` (whole collections - the unit the
+primary tracks versions for); when the primary has restarted since the
+standby's last pull its epoch differs and it answers with a full snapshot.
+
+A standby (REPLICATION_PRIMARY_URL set) keeps the last full snapshot it pulled
+in CHROMA_PERSIST_DIR/replica and maps it on startup, so it serves from there
+while it catches up with a delta. By hand:
+
+    python -m app.training.replication pull --primary http://primary:8000
+    python -m app.training.replication inspect snapshot.vssnap
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import get_settings
+from app.training.vector_store import VectorStore, get_vector_store
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+MAGIC = b"VSSNAP01"
+HEADER_PREFIX = struct.Struct("<8sQ32s")
+SECTION_PREFIX = struct.Struct("<I")
+SNAPSHOT_PATH = "/admin/index/snapshot"
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def replica_dir() -> str:
+    return os.path.join(settings.CHROMA_PERSIST_DIR, "replica")
+
+
+def _has_signatures(collection: Dict[str, Any], num_perm: int) -> bool:
+    return all(signature and len(signature) == num_perm for signature in collection["signatures"])
+
+
+def _encode_section(collection: Dict[str, Any], num_perm: int) -> bytes:
+    body = json.dumps({
+        "ids": collection["ids"],
+        "documents": collection["documents"],
+        "metadatas": collection["metadatas"],
+        "canonical_of": collection["canonical_of"],
+        "summaries": collection["summaries"],
+    }, default=str).encode("utf-8")
+    # Without a complete set the standby re-hashes the texts instead.
+    signatures = [
+        value for signature in collection["signatures"] for value in signature
+    ] if _has_signatures(collection, num_perm) else []
+    packed = struct.pack(f"<{len(signatures)}Q", *signatures)
+    return zlib.compress(SECTION_PREFIX.pack(len(body)) + body + packed, 6)
+
+
+def write_index_snapshot(path: str, state: Dict[str, Any], num_perm: Optional[int] = None) -> Dict[str, Any]:
+    """Write VectorStore.export_state output atomically; returns the header"""
+    num_perm = num_perm or settings.MINHASH_PERMUTATIONS
+    sections, entries, offset = [], [], 0
+    for collection in state["collections"]:
+        section = _encode_section(collection, num_perm)
+        entries.append({
+            "user_id": collection["user_id"],
+            "offset": offset,
+            "length": len(section),
+            "sha256": hashlib.sha256(section).hexdigest(),
+            "chunks": len(collection["ids"]),
+            "signatures": _has_signatures(collection, num_perm),
+        })
+        sections.append(section)
+        offset += len(section)
+
+    header = {
+        "kind": "full" if state["base_version"] is None else "delta",
+        "epoch": state["epoch"],
+        "version": state["version"],
+        "base_version": state["base_version"],
+        "created_at": time.time(),
+        "num_perm": num_perm,
+        "collections": entries,
+        "deleted": state["deleted"],
+    }
+    encoded = json.dumps(header).encode("utf-8")
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER_PREFIX.pack(MAGIC, len(encoded), hashlib.sha256(encoded).digest()))
+        f.write(encoded)
+        for section in sections:
+            f.write(section)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return header
+
+
+def export_snapshot(store: VectorStore, path: str, since: Optional[int] = None) -> Dict[str, Any]:
+    return write_index_snapshot(path, store.export_state(since))
+
+
+class IndexSnapshot:
+    """A snapshot file mapped read-only; sections are checked and decoded on demand"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(f"{path} is empty")
+        try:
+            magic, header_length, digest = HEADER_PREFIX.unpack_from(self._map, 0)
+        except struct.error:
+            self.close()
+            raise SnapshotError(f"{path} is truncated")
+        if magic != MAGIC:
+            self.close()
+            raise SnapshotError(f"{path} is not an index snapshot")
+        start = HEADER_PREFIX.size
+        encoded = self._map[start:start + header_length]
+        if hashlib.sha256(encoded).digest() != digest:
+            self.close()
+            raise SnapshotError(f"{path} has a corrupt header")
+        self.header: Dict[str, Any] = json.loads(encoded)
+        self._data_start = start + header_length
+
+    @property
+    def kind(self) -> str:
+        return self.header["kind"]
+
+    @property
+    def version(self) -> int:
+        return self.header["version"]
+
+    @property
+    def epoch(self) -> str:
+        return self.header["epoch"]
+
+    def _section(self, entry: Dict[str, Any]) -> bytes:
+        start = self._data_start + entry["offset"]
+        section = self._map[start:start + entry["length"]]
+        if len(section) != entry["length"] or hashlib.sha256(section).hexdigest() != entry["sha256"]:
+            raise SnapshotError(f"Collection of user {entry['user_id']} in {self.path} failed its checksum")
+        return section
+
+    def read_section(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        raw = zlib.decompress(self._section(entry))
+        (body_length,) = SECTION_PREFIX.unpack_from(raw, 0)
+        body_end = SECTION_PREFIX.size + body_length
+        collection = json.loads(raw[SECTION_PREFIX.size:body_end])
+        num_perm = self.header["num_perm"]
+        if entry.get("signatures"):
+            values = struct.unpack_from(f"<{entry['chunks'] * num_perm}Q", raw, body_end)
+            collection["signatures"] = [values[i:i + num_perm] for i in range(0, len(values), num_perm)]
+        else:
+            collection["signatures"] = [None] * entry["chunks"]
+        collection["user_id"] = entry["user_id"]
+        return collection
+
+    def verify(self):
+        """Check every section's checksum without decoding it"""
+        for entry in self.header["collections"]:
+            self._section(entry)
+
+    def close(self):
+        self._map.close()
+
+
+def restore_collections(store: VectorStore, snapshot: IndexSnapshot) -> List[Tuple[str, Dict]]:
+    """Decode every section into a ready collection; safe to run in a thread, and nothing is installed yet"""
+    restored = []
+    for entry in snapshot.header["collections"]:
+        collection = snapshot.read_section(entry)
+        restored.append((entry["user_id"], store.restore_collection(
+            entry["user_id"],
+            collection["ids"],
+            collection["documents"],
+            collection["metadatas"],
+            collection["signatures"],
+            collection["canonical_of"],
+            collection["summaries"]
+        )))
+    return restored
+
+
+def apply_snapshot(store: VectorStore, snapshot: IndexSnapshot) -> int:
+    """Restore and install a snapshot in one go; returns the number of collections installed"""
+    restored = restore_collections(store, snapshot)
+    store.install_collections(restored, snapshot.header["deleted"], replace_all=snapshot.kind == "full")
+    return len(restored)
+
+
+def pull_snapshot(primary_url: str, path: str, token: str, since: Optional[int] = None, epoch: Optional[str] = None, timeout: float = 60.0):
+    """Download a snapshot from the primary to `path`"""
+    import requests
+
+    params = {}
+    if since is not None and epoch:
+        params = {"since": since, "epoch": epoch}
+    url = primary_url.rstrip("/") + settings.API_V1_STR + SNAPSHOT_PATH
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    try:
+        with requests.get(url, params=params, headers={"Authorization": f"Bearer {token}"}, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                raise SnapshotError(f"Primary answered {response.status_code}: {response.text[:200]}")
+            with open(tmp_path, "wb") as f:
+                for block in response.iter_content(chunk_size=1024 * 1024):
+                    f.write(block)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class SnapshotFollower:
+    """Standby side: loads the local full snapshot, then keeps pulling deltas from the primary"""
+
+    def __init__(
+        self,
+        primary_url: Optional[str] = None,
+        store: Optional[VectorStore] = None,
+        directory: Optional[str] = None,
+        token: Optional[str] = None,
+    ):
+        self.primary_url = primary_url or settings.REPLICATION_PRIMARY_URL
+        self.store = store or get_vector_store()
+        self.directory = directory or replica_dir()
+        self.full_path = os.path.join(self.directory, "full.vssnap")
+        self.token = token or settings.REPLICATION_TOKEN or settings.ADMIN_PASSWORD
+        self.epoch: Optional[str] = None
+        self.version: Optional[int] = None
+        self.stop_event = threading.Event()
+
+    async def _apply(self, path: str) -> Tuple[str, int]:
+        snapshot = await asyncio.to_thread(IndexSnapshot, path)
+        try:
+            if snapshot.kind == "delta" and (snapshot.epoch != self.epoch or snapshot.header["base_version"] != self.version):
+                raise SnapshotError("Delta does not follow the applied snapshot")
+            # Decoding runs in a thread; installing stays on the event loop, between requests.
+            restored = await asyncio.to_thread(restore_collections, self.store, snapshot)
+            self.store.install_collections(restored, snapshot.header["deleted"], replace_all=snapshot.kind == "full")
+            self.epoch, self.version = snapshot.epoch, snapshot.version
+            return snapshot.kind, len(restored)
+        finally:
+            snapshot.close()
+
+    async def load_local(self) -> int:
+        """Serve from the last full snapshot on disk, if any"""
+        if not os.path.exists(self.full_path):
+            return 0
+        try:
+            return (await self._apply(self.full_path))[1]
+        except (OSError, ValueError, SnapshotError) as e:
+            logger.warning(f"Local replica snapshot unusable: {e}")
+            return 0
+
+    async def sync(self) -> Dict[str, Any]:
+        incoming = os.path.join(self.directory, "incoming.vssnap")
+        await asyncio.to_thread(pull_snapshot, self.primary_url, incoming, self.token, self.version, self.epoch)
+        try:
+            try:
+                snapshot_kind, installed = await self._apply(incoming)
+            except SnapshotError:
+                # Out of step with the primary: start over from a full snapshot next time.
+                self.epoch = self.version = None
+                raise
+            if snapshot_kind == "full":
+                os.replace(incoming, self.full_path)
+            return {"kind": snapshot_kind, "collections": installed, "version": self.version}
+        finally:
+            if os.path.exists(incoming):
+                os.remove(incoming)
+
+    def stop(self):
+        self.stop_event.set()
+
+
+async def run_follower_forever(follower: SnapshotFollower):
+    """Pull from the primary every REPLICATION_INTERVAL_SECONDS"""
+    loaded = await follower.load_local()
+    if loaded:
+        logger.info(f"Serving {loaded} collections from the local replica snapshot")
+    while not follower.stop_event.is_set():
+        try:
+            result = await follower.sync()
+            if result["collections"]:
+                logger.info(f"Applied {result['kind']} index snapshot: {result}")
+        except Exception as e:
+            logger.error(f"Index snapshot pull failed: {e}")
+        await asyncio.to_thread(follower.stop_event.wait, settings.REPLICATION_INTERVAL_SECONDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pull or inspect vector index snapshots")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pull = commands.add_parser("pull", help="download a snapshot from the primary")
+    pull.add_argument("--primary", default=None, help="primary base URL (default: REPLICATION_PRIMARY_URL)")
+    pull.add_argument("--output", default=None, help="file to write (default: the replica's full snapshot)")
+    pull.add_argument("--since", type=int, default=None, help="only collections changed after this version")
+    pull.add_argument("--epoch", default=None, help="primary epoch the --since version belongs to")
+    inspect = commands.add_parser("inspect", help="verify a snapshot file and print its header")
+    inspect.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "pull":
+        primary_url = args.primary or settings.REPLICATION_PRIMARY_URL
+        if not primary_url:
+            parser.error("--primary or REPLICATION_PRIMARY_URL is required")
+        output = args.output or os.path.join(replica_dir(), "full.vssnap")
+        pull_snapshot(primary_url, output, settings.REPLICATION_TOKEN or settings.ADMIN_PASSWORD, args.since, args.epoch)
+        args.path = output
+
+    snapshot = IndexSnapshot(args.path)
+    try:
+        snapshot.verify()
+        print(json.dumps(snapshot.header, indent=2))
+    finally:
+        snapshot.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+"""
+Resumable chunked uploads.
+
+Protocol:
+    1. create a session with the filename, total size and (optionally) the
+       whole-file SHA-256; the server preallocates the target file
+    2. PUT each part with its SHA-256; parts go straight to their offset, may
+       arrive in any order and may be retried until the checksum matches
+    3. finalize once every part is present
+
+The whole-file SHA-256 is kept as a running hash over the contiguous prefix of
+received parts, so an in-order upload finalizes without re-reading the file;
+otherwise only the bytes after that prefix are read back. Merkle leaves are
+computed per part (part_size is a multiple of the Merkle block size), so the
+tree never needs a second pass.
+
+Session state lives in a JSON sidecar next to the partial file, guarded by an
+flock, so any worker sharing UPLOAD_DIR can accept parts for any session.
+
+Every session preallocates its whole file, so a user may hold at most
+RESUMABLE_UPLOAD_MAX_SESSIONS unexpired sessions totalling at most
+RESUMABLE_UPLOAD_MAX_PENDING_BYTES.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from app.config import get_settings
+from app.utils.merkle import MerkleBuilder, MerkleTree
+
+settings = get_settings()
+
+PARTIAL_DIR_NAME = ".partial"
+USER_LOCK_PREFIX = "user_"
+
+
+class UploadSessionError(Exception):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UploadSessionManager:
+    DEFAULT_PART_SIZE = 5 * 1024 * 1024
+
+    def __init__(self, upload_dir: Optional[str] = None):
+        self.upload_dir = upload_dir or settings.UPLOAD_DIR
+        self.partial_dir = os.path.join(self.upload_dir, PARTIAL_DIR_NAME)
+        # session_id -> (sha256 over bytes [0, covered), covered); process-local fast path
+        self._prefix_hashers: Dict[str, Tuple["hashlib._Hash", int]] = {}
+        self._prefix_lock = threading.Lock()
+
+    def _state_path(self, session_id: str) -> str:
+        return os.path.join(self.partial_dir, f"{session_id}.json")
+
+    def data_path(self, session_id: str) -> str:
+        return os.path.join(self.partial_dir, f"{session_id}.part")
+
+    @contextmanager
+    def _locked(self, session_id: str):
+        os.makedirs(self.partial_dir, exist_ok=True)
+        with open(os.path.join(self.partial_dir, f"{session_id}.lock"), "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _part_lock_path(self, session_id: str, part_index: int) -> str:
+        return os.path.join(self.partial_dir, f"{session_id}.{part_index}.lock")
+
+    @contextmanager
+    def _claimed(self, session_id: str, part_index: int):
+        """Exclusive claim on one part while its bytes are written; a second writer gets a 409"""
+        os.makedirs(self.partial_dir, exist_ok=True)
+        with open(self._part_lock_path(session_id, part_index), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadSessionError(f"Part {part_index} is already being uploaded", status_code=409)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _read_state(self, session_id: str) -> Dict:
+        try:
+            with open(self._state_path(session_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise UploadSessionError("Upload session not found", status_code=404)
+
+    def _write_state(self, state: Dict):
+        path = self._state_path(state["session_id"])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def open_sessions(self, user_id: str, now: Optional[datetime] = None) -> List[Dict]:
+        """The user's sessions that have not expired yet"""
+        now = now or datetime.utcnow()
+        if not os.path.isdir(self.partial_dir):
+            return []
+        sessions = []
+        for name in os.listdir(self.partial_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                state = self._read_state(name[:-len(".json")])
+            except UploadSessionError:
+                continue
+            if state.get("user_id") == user_id and datetime.fromisoformat(state["expires_at"]) >= now:
+                sessions.append(state)
+        return sessions
+
+    @staticmethod
+    def _user_lock_name(user_id: str) -> str:
+        return f"{USER_LOCK_PREFIX}{user_id}"
+
+    def _check_session_limits(self, user_id: str, total_size: int):
+        sessions = self.open_sessions(user_id)
+        if len(sessions) >= settings.RESUMABLE_UPLOAD_MAX_SESSIONS:
+            raise UploadSessionError(
+                f"At most {settings.RESUMABLE_UPLOAD_MAX_SESSIONS} uploads may be in progress; finish or abort one first",
+                status_code=429
+            )
+        pending = sum(state["total_size"] for state in sessions)
+        if pending + total_size > settings.RESUMABLE_UPLOAD_MAX_PENDING_BYTES:
+            raise UploadSessionError(
+                f"Uploads in progress may total at most {settings.RESUMABLE_UPLOAD_MAX_PENDING_BYTES / 1024 / 1024}MB",
+                status_code=413
+            )
+
+    def get_session(self, session_id: str, user_id: str) -> Dict:
+        state = self._read_state(session_id)
+        if state["user_id"] != user_id:
+            raise UploadSessionError("Upload session not found", status_code=404)
+        if datetime.fromisoformat(state["expires_at"]) < datetime.utcnow():
+            raise UploadSessionError("Upload session expired", status_code=410)
+        return state
+
+    def create_session(
+        self,
+        user_id: str,
+        filename: str,
+        file_type: str,
+        total_size: int,
+        part_size: Optional[int] = None,
+        client_checksum: Optional[str] = None,
+    ) -> Dict:
+        block_size = settings.MERKLE_BLOCK_SIZE
+        part_size = part_size or self.DEFAULT_PART_SIZE
+
+        if total_size <= 0:
+            raise UploadSessionError("total_size must be positive")
+        if total_size > settings.MAX_UPLOAD_SIZE:
+            raise UploadSessionError(
+                f"File size exceeds maximum allowed size of {settings.MAX_UPLOAD_SIZE / 1024 / 1024}MB"
+            )
+        if part_size < block_size or part_size % block_size:
+            raise UploadSessionError(f"part_size must be a multiple of {block_size} bytes")
+
+        session_id = str(uuid.uuid4())
+        now = datetime.utcnow()
+        state = {
+            "session_id": session_id,
+            "user_id": user_id,
+            "filename": filename,
+            "file_type": file_type,
+            "total_size": total_size,
+            "part_size": part_size,
+            "part_count": (total_size + part_size - 1) // part_size,
+            "client_checksum": client_checksum.lower() if client_checksum else None,
+            "parts": {},
+            "created_at": now.isoformat(),
+            "expires_at": (now + timedelta(hours=settings.RESUMABLE_UPLOAD_TTL_HOURS)).isoformat(),
+        }
+
+        # The per-user lock keeps concurrent creates from both slipping under the limits.
+        with self._locked(self._user_lock_name(user_id)):
+            self._check_session_limits(user_id, total_size)
+            with self._locked(session_id):
+                self._allocate(session_id, total_size)
+                self._write_state(state)
+
+        with self._prefix_lock:
+            self._prefix_hashers[session_id] = (hashlib.sha256(), 0)
+        return state
+
+    def _allocate(self, session_id: str, total_size: int):
+        fd = os.open(self.data_path(session_id), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            if hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(fd, 0, total_size)
+                except OSError:
+                    os.ftruncate(fd, total_size)
+            else:
+                os.ftruncate(fd, total_size)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def part_bounds(state: Dict, part_index: int) -> Tuple[int, int]:
+        if not 0 <= part_index < state["part_count"]:
+            raise UploadSessionError(f"part_index must be between 0 and {state['part_count'] - 1}")
+        start = part_index * state["part_size"]
+        return start, min(start + state["part_size"], state["total_size"])
+
+    async def write_part(
+        self,
+        session_id: str,
+        user_id: str,
+        part_index: int,
+        body: AsyncIterator[bytes],
+        part_checksum: str,
+    ) -> Dict:
+        """Stream one part to its offset; it only counts as received if its SHA-256 matches"""
+        # Parts are streamed without the session flock so other parts keep flowing; the
+        # per-part claim stops two PUTs of the same part interleaving their writes.
+        with self._claimed(session_id, part_index):
+            state = self.get_session(session_id, user_id)
+            start, end = self.part_bounds(state, part_index)
+
+            # A retried part that already landed is a no-op; different content would clobber verified bytes.
+            received = state["parts"].get(str(part_index))
+            if received:
+                if received["sha256"] != part_checksum.lower():
+                    raise UploadSessionError(f"Part {part_index} was already received with a different checksum", status_code=409)
+                return self.describe(state)
+
+            part_hasher = hashlib.sha256()
+            leaves = MerkleBuilder(settings.MERKLE_BLOCK_SIZE)
+            with self._prefix_lock:
+                prefix = self._prefix_hashers.get(session_id)
+            prefix_hasher = prefix[0].copy() if prefix and prefix[1] == start else None
+
+            offset = start
+            fd = os.open(self.data_path(session_id), os.O_WRONLY)
+            try:
+                async for chunk in body:
+                    if offset + len(chunk) > end:
+                        raise UploadSessionError(f"Part {part_index} must be exactly {end - start} bytes")
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+                    part_hasher.update(chunk)
+                    leaves.update(chunk)
+                    if prefix_hasher:
+                        prefix_hasher.update(chunk)
+            finally:
+                os.close(fd)
+
+            if offset != end:
+                raise UploadSessionError(f"Part {part_index} must be exactly {end - start} bytes")
+
+            computed = part_hasher.hexdigest()
+            if computed != part_checksum.lower():
+                raise UploadSessionError(
+                    f"Part {part_index} checksum mismatch (expected {part_checksum}, computed {computed})",
+                    status_code=422
+                )
+
+            with self._locked(session_id):
+                state = self._read_state(session_id)
+                state["parts"][str(part_index)] = {
+                    "sha256": computed,
+                    "leaves": leaves.tree().packed_leaves().hex(),
+                }
+                self._write_state(state)
+
+        if prefix_hasher:
+            with self._prefix_lock:
+                current = self._prefix_hashers.get(session_id)
+                if current and current[1] == start:
+                    self._prefix_hashers[session_id] = (prefix_hasher, end)
+
+        return self.describe(state)
+
+    @staticmethod
+    def missing_parts(state: Dict) -> List[int]:
+        return [i for i in range(state["part_count"]) if str(i) not in state["parts"]]
+
+    def describe(self, state: Dict) -> Dict:
+        received = sorted(int(i) for i in state["parts"])
+        return {
+            "session_id": state["session_id"],
+            "filename": state["filename"],
+            "total_size": state["total_size"],
+            "part_size": state["part_size"],
+            "part_count": state["part_count"],
+            "received_parts": received,
+            "missing_parts": self.missing_parts(state),
+            "expires_at": state["expires_at"],
+        }
+
+    def _whole_file_sha256(self, state: Dict) -> str:
+        session_id = state["session_id"]
+        with self._prefix_lock:
+            prefix = self._prefix_hashers.pop(session_id, None)
+        hasher, covered = (prefix[0], prefix[1]) if prefix else (hashlib.sha256(), 0)
+
+        # Only the bytes after the in-order prefix need to be read back.
+        if covered < state["total_size"]:
+            with open(self.data_path(session_id), "rb") as f:
+                f.seek(covered)
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def finalize(self, session_id: str, user_id: str, destination: str) -> Tuple[Dict, str, MerkleTree]:
+        """Move the completed file to `destination`; returns (state, sha256, merkle tree)"""
+        with self._locked(session_id):
+            state = self.get_session(session_id, user_id)
+            missing = self.missing_parts(state)
+            if missing:
+                raise UploadSessionError(f"Missing parts: {missing}", status_code=409)
+
+            checksum = self._whole_file_sha256(state)
+            if state["client_checksum"] and state["client_checksum"] != checksum:
+                raise UploadSessionError(
+                    f"File checksum mismatch (expected {state['client_checksum']}, computed {checksum})",
+                    status_code=422
+                )
+
+            leaves = b"".join(
+                bytes.fromhex(state["parts"][str(i)]["leaves"]) for i in range(state["part_count"])
+            )
+            tree = MerkleTree.from_leaf_bytes(leaves, settings.MERKLE_BLOCK_SIZE)
+
+            os.replace(self.data_path(session_id), destination)
+            os.remove(self._state_path(session_id))
+        self._remove_lock(session_id)
+        return state, checksum, tree
+
+    def abort(self, session_id: str, user_id: str):
+        with self._locked(session_id):
+            self.get_session(session_id, user_id)
+            for path in (self.data_path(session_id), self._state_path(session_id)):
+                if os.path.exists(path):
+                    os.remove(path)
+        with self._prefix_lock:
+            self._prefix_hashers.pop(session_id, None)
+        self._remove_lock(session_id)
+
+    def purge_expired(self, now: Optional[datetime] = None, dry_run: bool = False) -> Tuple[int, int]:
+        """Remove expired sessions and leftovers with no readable state; returns (sessions, bytes)"""
+        now = now or datetime.utcnow()
+        stale_before = (now - timedelta(hours=settings.RESUMABLE_UPLOAD_TTL_HOURS)).timestamp()
+        if not os.path.isdir(self.partial_dir):
+            return 0, 0
+        
+        session_ids = {
+            name.split(".", 1)[0] for name in os.listdir(self.partial_dir) if not name.startswith(USER_LOCK_PREFIX)
+        }
+        purged, reclaimed = 0, 0
+        for session_id in session_ids:
+            with self._locked(session_id):
+                try:
+                    expired = datetime.fromisoformat(self._read_state(session_id)["expires_at"]) < now
+                except (UploadSessionError, KeyError, ValueError):
+                    # No state: a crashed create/finalize. Only trust mtime once a full TTL has passed.
+                    data_path = self.data_path(session_id)
+                    expired = not os.path.exists(data_path) or os.path.getmtime(data_path) < stale_before
+                if not expired:
+                    continue
+                
+                purged += 1
+                for suffix in (".part", ".json", ".json.tmp"):
+                    path = os.path.join(self.partial_dir, f"{session_id}{suffix}")
+                    if os.path.exists(path):
+                        reclaimed += os.path.getsize(path)
+                        if not dry_run:
+                            os.remove(path)
+            if not dry_run:
+                with self._prefix_lock:
+                    self._prefix_hashers.pop(session_id, None)
+                self._remove_lock(session_id)
+        return purged, reclaimed
+
+    def _remove_lock(self, session_id: str):
+        for name in os.listdir(self.partial_dir) if os.path.isdir(self.partial_dir) else []:
+            if name.startswith(f"{session_id}.") and name.endswith(".lock"):
+                try:
+                    os.remove(os.path.join(self.partial_dir, name))
+                except OSError:
+                    pass
+
+
+_session_manager = None
+
+
+def get_upload_session_manager() -> UploadSessionManager:
+    global _session_manager
+    if _session_manager is None:
+        _session_manager = UploadSessionManager()
+    return _session_manager
@@ -0,0 +1,232 @@
+"""
+Background integrity scrubber for uploaded training files.
+
+Walks every TrainingDocument in primary-key order, re-hashes the stored file
+(blob or legacy upload) under a bytes-per-second budget and compares it to checksum_sha256. Progress
+is written to a small JSON state file after every document, so a restarted
+worker resumes from the last scrubbed row instead of starting over.
+
+Run a single pass by hand with:
+
+    python -m app.training.scrubber --once
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from app.config import get_settings
+from app.models import TrainingDocument
+from app.utils.checksum import ChecksumEngine
+from app.utils.security_events import record_security_event
+from app.utils.storage import BlobCorruptedError, BlobStorage, get_storage
+from app.utils.uploads import StoredUpload, index_upload_dir, locate_stored_upload
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class ScrubInterrupted(Exception):
+    pass
+
+
+class ByteRateLimiter:
+    """Token bucket that sleeps just long enough to keep reads under bytes_per_second"""
+
+    def __init__(
+        self,
+        bytes_per_second: int,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.bytes_per_second = bytes_per_second
+        self._clock = clock
+        self._sleep = sleep
+        self._allowance = float(bytes_per_second)
+        self._last = clock()
+
+    def consume(self, nbytes: int):
+        if self.bytes_per_second <= 0:
+            return
+
+        now = self._clock()
+        self._allowance = min(
+            float(self.bytes_per_second),
+            self._allowance + (now - self._last) * self.bytes_per_second
+        )
+        self._last = now
+        self._allowance -= nbytes
+
+        if self._allowance < 0:
+            self._sleep(-self._allowance / self.bytes_per_second)
+
+
+class IntegrityScrubber:
+    def __init__(
+        self,
+        session_factory=None,
+        bytes_per_second: Optional[int] = None,
+        state_path: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        upload_dir: Optional[str] = None,
+        storage: Optional[BlobStorage] = None,
+    ):
+        if session_factory is None:
+            from app.database import SessionLocal
+            session_factory = SessionLocal
+
+        self.session_factory = session_factory
+        self.limiter = ByteRateLimiter(
+            settings.SCRUB_BYTES_PER_SECOND if bytes_per_second is None else bytes_per_second
+        )
+        self.state_path = state_path or os.path.join(settings.CHROMA_PERSIST_DIR, "scrub_state.json")
+        self.batch_size = batch_size or settings.SCRUB_BATCH_SIZE
+        self.upload_dir = upload_dir or settings.UPLOAD_DIR
+        self.storage = storage or get_storage()
+        self.stop_event = threading.Event()
+
+    def load_state(self) -> Dict:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"last_id": None, "passes_completed": 0, "reported_mismatches": {}}
+
+    def save_state(self, state: Dict):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _throttle(self, nbytes: int):
+        if self.stop_event.is_set():
+            raise ScrubInterrupted()
+        self.limiter.consume(nbytes)
+
+    def scrub_document(self, db, document: TrainingDocument, stored: Optional[StoredUpload], state: Dict) -> str:
+        """Re-hash one document and return its status: ok, mismatch, file_missing or skipped"""
+        if not document.checksum_sha256:
+            return "skipped"
+
+        if not stored:
+            return "file_missing"
+
+        try:
+            with stored.open() as f:
+                computed = ChecksumEngine.hash_stream(f, ("sha256",), throttle=self._throttle)["sha256"]
+        except BlobCorruptedError:
+            computed = "unreadable"
+
+        reported = state.setdefault("reported_mismatches", {})
+        if computed.lower() == document.checksum_sha256.lower():
+            document.verification_timestamp = datetime.utcnow()
+            db.commit()
+            reported.pop(document.id, None)
+            return "ok"
+
+        # Report each distinct corruption once rather than on every pass.
+        if reported.get(document.id) != computed:
+            record_security_event(
+                db,
+                user_id=document.user_id,
+                event_type="scrub_checksum_mismatch",
+                resource_id=document.id,
+                description=f"Background integrity scrub detected a checksum mismatch for {document.filename}",
+                metadata={
+                    "expected": document.checksum_sha256,
+                    "computed": computed,
+                    "verification_type": "scrub"
+                }
+            )
+            reported[document.id] = computed
+        return "mismatch"
+
+    def run_pass(self, max_documents: Optional[int] = None) -> Dict[str, int]:
+        """Scrub documents from the saved position; finishing the table resets it for the next pass"""
+        state = self.load_state()
+        report = {"ok": 0, "mismatch": 0, "file_missing": 0, "skipped": 0, "bytes": 0}
+        files = index_upload_dir(self.upload_dir)
+        processed = 0
+
+        db = self.session_factory()
+        try:
+            while not self.stop_event.is_set():
+                query = db.query(TrainingDocument).order_by(TrainingDocument.id)
+                if state.get("last_id"):
+                    query = query.filter(TrainingDocument.id > state["last_id"])
+                batch = query.limit(self.batch_size).all()
+
+                if not batch:
+                    state["last_id"] = None
+                    state["passes_completed"] = state.get("passes_completed", 0) + 1
+                    state["last_pass_finished_at"] = datetime.utcnow().isoformat()
+                    self.save_state(state)
+                    break
+
+                for document in batch:
+                    if self.stop_event.is_set() or (max_documents is not None and processed >= max_documents):
+                        return report
+
+                    stored = locate_stored_upload(
+                        document.source_name,
+                        document.checksum_sha256,
+                        storage=self.storage,
+                        legacy_index=files
+                    )
+                    try:
+                        status = self.scrub_document(db, document, stored, state)
+                    except ScrubInterrupted:
+                        return report
+                    except OSError as e:
+                        logger.warning(f"Scrub could not read {document.source_name}: {e}")
+                        status = "file_missing"
+
+                    report[status] += 1
+                    if status in ("ok", "mismatch"):
+                        report["bytes"] += document.file_size or 0
+                    processed += 1
+
+                    state["last_id"] = document.id
+                    self.save_state(state)
+        finally:
+            db.close()
+
+        logger.info(f"Integrity scrub pass finished: {report}")
+        return report
+
+    def stop(self):
+        self.stop_event.set()
+
+
+async def run_scrubber_forever(scrubber: IntegrityScrubber):
+    """Alternate full passes (in a worker thread) with SCRUB_INTERVAL_SECONDS of idle time"""
+    while not scrubber.stop_event.is_set():
+        try:
+            await asyncio.to_thread(scrubber.run_pass)
+        except Exception as e:
+            logger.error(f"Integrity scrub pass failed: {e}")
+        await asyncio.to_thread(scrubber.stop_event.wait, settings.SCRUB_INTERVAL_SECONDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-hash stored training documents and report integrity mismatches")
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+    parser.add_argument("--bytes-per-second", type=int, default=None, help="I/O budget (0 = unlimited)")
+    parser.add_argument("--max-documents", type=int, default=None)
+    args = parser.parse_args()
+
+    scrubber = IntegrityScrubber(bytes_per_second=args.bytes_per_second)
+    if args.once:
+        print(json.dumps(scrubber.run_pass(max_documents=args.max_documents), indent=2))
+    else:
+        asyncio.run(run_scrubber_forever(scrubber))
+
+
+if __name__ == "__main__":
+    main()
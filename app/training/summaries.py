@@ -0,0 +1,208 @@
+"""
+Hierarchical summaries of training documents.
+
+At ingest, a document's chunks are grouped into sections of SUMMARY_FANOUT
+chunks and each section is summarized; section summaries are then grouped and
+summarized again, level by level, until one document-level root remains. The
+tree is stored with the collection, so a "summarize X" question is answered
+from a single compact node instead of a handful of raw chunks.
+
+Summarizers are pluggable (SUMMARIZER setting): "extractive" is an offline,
+deterministic stub that keeps the highest-scoring sentences; "gemini" asks the
+model. Every node carries a hash of the text it summarizes, so re-ingesting a
+new version only re-summarizes the sections whose chunks changed.
+"""
+import hashlib
+import logging
+import re
+from abc import ABC, abstractmethod
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+from app.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+SUMMARY_QUERY_PATTERN = re.compile(r"\b(summari[sz]e|summary|gist|tl;?dr)\b", re.IGNORECASE)
+# Words that can surround a bare "summarize" without naming a topic
+SUMMARY_FILLER_WORDS = frozenset(
+    "summarize summarise summary gist tl dr tldr please can could you me my give quick short brief "
+    "document doc file upload notes".split()
+)
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+
+class Summarizer(ABC):
+    @abstractmethod
+    def summarize(self, texts: Sequence[str], max_words: int) -> str:
+        """One summary of `texts` (in order), at most about `max_words` words"""
+
+
+class ExtractiveSummarizer(Summarizer):
+    """Keeps the sentences with the most frequent content words, in their original order"""
+
+    def summarize(self, texts: Sequence[str], max_words: int) -> str:
+        sentences = [s.strip() for text in texts for s in SENTENCE_PATTERN.split(text) if s.strip()]
+        if not sentences:
+            return ""
+
+        frequencies = Counter(
+            word for sentence in sentences for word in WORD_PATTERN.findall(sentence.lower())
+            if word not in STOPWORDS
+        )
+
+        def score(sentence: str) -> float:
+            words = [w for w in WORD_PATTERN.findall(sentence.lower()) if w not in STOPWORDS]
+            return sum(frequencies[w] for w in words) / (len(words) or 1)
+
+        ranked = sorted(range(len(sentences)), key=lambda i: (-score(sentences[i]), i))
+        chosen, words_used = [], 0
+        for i in ranked:
+            length = len(sentences[i].split())
+            if chosen and words_used + length > max_words:
+                continue
+            chosen.append(i)
+            words_used += length
+            if words_used >= max_words:
+                break
+
+        summary = " ".join(sentences[i] for i in sorted(chosen))
+        words = summary.split()
+        return summary if len(words) <= max_words else " ".join(words[:max_words]) + " ..."
+
+
+class GeminiSummarizer(Summarizer):
+    def __init__(self):
+        import google.generativeai as genai
+        from app.ai_engine.gemini import configure_genai
+        configure_genai()
+        self.model = genai.GenerativeModel(settings.GEMINI_MODEL)
+
+    def summarize(self, texts: Sequence[str], max_words: int) -> str:
+        prompt = (
+            f"Summarize the following material in at most {max_words} words. "
+            "Keep technical terms, tools and steps; do not add information.\n\n" + "\n\n".join(texts)
+        )
+        try:
+            return self.model.generate_content(prompt).text.strip()
+        except Exception as e:
+            raise Exception(f"Error summarizing with Gemini: {str(e)}")
+
+
+SUMMARIZERS = {
+    "extractive": ExtractiveSummarizer,
+    "gemini": GeminiSummarizer,
+}
+
+
+def get_summarizer(name: Optional[str] = None) -> Summarizer:
+    name = (name or settings.SUMMARIZER).lower()
+    if name not in SUMMARIZERS:
+        raise ValueError(f"Unknown summarizer: {name}")
+    return SUMMARIZERS[name]()
+
+
+@dataclass
+class SummaryNode:
+    """level 0 summarizes chunks; each level above summarizes the nodes below; the single top node is the document"""
+    level: int
+    index: int
+    summary: str
+    content_hash: str
+    first_chunk: int
+    last_chunk: int
+    children: List[int] = field(default_factory=list)
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+def _hash_parts(parts: Sequence[str]) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(hashlib.sha256(part.encode("utf-8")).digest())
+    return digest.hexdigest()
+
+
+def build_summary_tree(
+    chunks: Sequence[str],
+    summarizer: Optional[Summarizer] = None,
+    fanout: Optional[int] = None,
+    max_words: Optional[int] = None,
+    previous: Optional[List[Dict]] = None,
+) -> List[Dict]:
+    """
+    Summary nodes for a document, bottom level first and the root last.
+    Nodes from `previous` whose summarized text is unchanged are reused as-is.
+    """
+    if not chunks:
+        return []
+    summarizer = summarizer or get_summarizer()
+    fanout = max(fanout or settings.SUMMARY_FANOUT, 2)
+    max_words = max_words or settings.SUMMARY_MAX_WORDS
+    reusable = {node["content_hash"]: node["summary"] for node in previous or []}
+
+    nodes: List[SummaryNode] = []
+    # (text, content hash, first chunk, last chunk) for the layer being grouped
+    layer = [(chunk, _hash_parts([chunk]), i, i) for i, chunk in enumerate(chunks)]
+    level = 0
+    while True:
+        groups = [layer[i:i + fanout] for i in range(0, len(layer), fanout)]
+        next_layer = []
+        for index, group in enumerate(groups):
+            content_hash = _hash_parts([f"{level}"] + [item[1] for item in group])
+            summary = reusable.get(content_hash)
+            if summary is None:
+                summary = summarizer.summarize([item[0] for item in group], max_words)
+            node = SummaryNode(
+                level=level,
+                index=index,
+                summary=summary,
+                content_hash=content_hash,
+                first_chunk=group[0][2],
+                last_chunk=group[-1][3],
+                children=list(range(index * fanout, index * fanout + len(group))),
+            )
+            nodes.append(node)
+            next_layer.append((summary, content_hash, node.first_chunk, node.last_chunk))
+        if len(next_layer) == 1:
+            return [node.to_dict() for node in nodes]
+        layer = next_layer
+        level += 1
+
+
+def root_summary(nodes: Optional[List[Dict]]) -> Optional[Dict]:
+    return nodes[-1] if nodes else None
+
+
+def is_summary_query(message: str) -> bool:
+    return bool(SUMMARY_QUERY_PATTERN.search(message))
+
+
+def match_document(message: str, documents: Sequence) -> Optional[object]:
+    """
+    The document a summary question is about: the longest filename (with or
+    without its extension) named in the message. A bare "summarize" or "tl;dr"
+    that names no topic at all means the only document, if there is just one.
+    """
+    text = message.lower()
+    best, best_length = None, 0
+    for document in documents:
+        filename = document.filename.lower()
+        for candidate in {filename, filename.rsplit(".", 1)[0]}:
+            if len(candidate) > best_length and candidate and re.search(rf"(?<!\w){re.escape(candidate)}(?!\w)", text):
+                best, best_length = document, len(candidate)
+    if best is None and len(documents) == 1 and is_bare_summary_request(message):
+        return documents[0]
+    return best
+
+
+def is_bare_summary_request(message: str) -> bool:
+    words = WORD_PATTERN.findall(message.lower())
+    return not [word for word in words if word not in SUMMARY_FILLER_WORDS and word not in STOPWORDS]
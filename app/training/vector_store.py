@@ -1,22 +1,100 @@
+import hashlib
+import itertools
+import json
 import os
-from typing import List, Dict, Any
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, List, Dict, Any, Optional, Tuple
 from app.config import get_settings
+from app.training.dedup import LSHIndex, MinHasher, best_match, diversify
 
 settings = get_settings()
 
+_minhasher = MinHasher(num_perm=settings.MINHASH_PERMUTATIONS)
+
+EMBEDDING_DIMENSIONS = 768
+USAGE_FIELDS = ("chunks", "text_bytes", "vector_bytes", "index_bytes", "metadata_bytes")
+
+
+def empty_usage() -> Dict[str, int]:
+    return {name: 0 for name in USAGE_FIELDS}
+
+
+def metadata_size(metadata: Dict) -> int:
+    return len(json.dumps(metadata, default=str))
+
+
+def chunk_usage(document: str, metadata: Dict) -> Dict[str, int]:
+    """
+    Approximate footprint of one chunk: its UTF-8 text, its embedding as float64s,
+    its MinHash signature plus one LSH bucket entry per band, and its metadata as JSON.
+    """
+    return {
+        "chunks": 1,
+        "text_bytes": len(document.encode("utf-8")),
+        "vector_bytes": EMBEDDING_DIMENSIONS * 8,
+        "index_bytes": (settings.MINHASH_PERMUTATIONS + settings.LSH_BANDS) * 8,
+        "metadata_bytes": metadata_size(metadata),
+    }
+
+
+def add_usage(total: Dict[str, int], delta: Dict[str, int], sign: int = 1):
+    for name in USAGE_FIELDS:
+        total[name] = total.get(name, 0) + sign * delta.get(name, 0)
+
+
+# Process-wide change counter; a collection's "version" is the value at its last change.
+_versions = itertools.count(1)
+
+
+def mark_changed(data: Dict) -> int:
+    data["version"] = next(_versions)
+    return data["version"]
+
 
 class SimpleCollection:
+    """
+    Near-duplicate chunks are collapsed at add time: a chunk whose MinHash
+    signature matches an indexed chunk above DEDUP_SIMILARITY_THRESHOLD is kept
+    (so its source can still be listed, diffed and deleted) but becomes a
+    duplicate of that canonical chunk and is never scored at query time.
+    """
     def __init__(self, data: Dict):
         self.data = data
+        self.signatures = data.setdefault("signatures", {})
+        # duplicate id -> canonical id, and canonical id -> duplicate ids
+        self.canonical_of = data.setdefault("canonical_of", {})
+        self.duplicates = data.setdefault("duplicates", {})
+        self.lsh = data.setdefault(
+            "lsh",
+            LSHIndex(bands=settings.LSH_BANDS, rows=settings.MINHASH_PERMUTATIONS // settings.LSH_BANDS)
+        )
     
     def add(self, ids: List[str], documents: List[str], metadatas: List[Dict]):
         self.data["ids"].extend(ids)
         self.data["documents"].extend(documents)
-        self.data["embeddings"].extend([[0.0] * 768 for _ in documents])
+        self.data["embeddings"].extend([[0.0] * EMBEDDING_DIMENSIONS for _ in documents])
         # Store metadatas separately
         if "metadatas" not in self.data:
             self.data["metadatas"] = []
         self.data["metadatas"].extend(metadatas)
+        usage = self.data.setdefault("usage", empty_usage())
+        for document, metadata in zip(documents, metadatas):
+            add_usage(usage, chunk_usage(document, metadata))
+        
+        for doc_id, document in zip(ids, documents):
+            signature = _minhasher.signature(document)
+            canonical = None
+            if settings.DEDUP_ENABLED:
+                canonical = best_match(signature, self.lsh, self.signatures, settings.DEDUP_SIMILARITY_THRESHOLD)
+            self.signatures[doc_id] = signature
+            if canonical:
+                self.canonical_of[doc_id] = canonical
+                self.duplicates.setdefault(canonical, []).append(doc_id)
+            else:
+                self.lsh.insert(doc_id, signature)
+        mark_changed(self.data)
     
     def query(self, query_texts: List[str], n_results: int = 5) -> Dict:
         docs = self.data.get("documents", [])
@@ -30,21 +108,38 @@ class SimpleCollection:
         
         results = []
         for i, doc in enumerate(docs):
+            doc_id = ids[i] if i < len(ids) else f"doc_{i}"
+            if doc_id in self.canonical_of:
+                continue
             similarity = self._simple_similarity(query, doc)
             results.append({
-                "id": ids[i] if i < len(ids) else f"doc_{i}",
+                "id": doc_id,
                 "document": doc,
                 "metadata": metadatas[i] if i < len(metadatas) else {},
                 "distance": 1.0 - similarity
             })
         
         results.sort(key=lambda x: x["distance"])
-        top_results = results[:n_results]
+        by_id = {r["id"]: r for r in results}
+        selected = diversify(
+            [r["id"] for r in results],
+            self.signatures,
+            n_results,
+            settings.RETRIEVAL_DIVERSITY_THRESHOLD
+        )
+        top_results = [by_id[doc_id] for doc_id in selected]
+        
+        positions = {doc_id: i for i, doc_id in enumerate(ids)}
+        duplicate_sources = [
+            sorted({metadatas[positions[d]].get("source", "unknown") for d in self.duplicates.get(r["id"], [])})
+            for r in top_results
+        ]
         
         return {
             "documents": [[r["document"] for r in top_results]],
             "metadatas": [[r["metadata"] for r in top_results]],
-            "distances": [[r["distance"] for r in top_results]]
+            "distances": [[r["distance"] for r in top_results]],
+            "duplicate_sources": [duplicate_sources]
         }
     
     def get(self, where: Dict = None) -> Dict:
@@ -77,15 +172,58 @@ class SimpleCollection:
             "metadatas": matching_metadatas
         }
     
+    def update(self, ids: List[str], metadatas: List[Dict]):
+        positions = {doc_id: i for i, doc_id in enumerate(self.data["ids"])}
+        usage = self.data.setdefault("usage", empty_usage())
+        for doc_id, metadata in zip(ids, metadatas):
+            if doc_id in positions:
+                usage["metadata_bytes"] += metadata_size(metadata) - metadata_size(self.data["metadatas"][positions[doc_id]])
+                self.data["metadatas"][positions[doc_id]] = metadata
+        mark_changed(self.data)
+    
+    def _forget(self, ids: List[str]):
+        """Drop dedup bookkeeping for deleted ids, promoting a surviving duplicate when a canonical goes"""
+        deleting = set(ids)
+        # Duplicates first, so a canonical's remaining list only holds survivors.
+        for doc_id in sorted(deleting, key=lambda d: d not in self.canonical_of):
+            signature = self.signatures.pop(doc_id, None)
+            canonical = self.canonical_of.pop(doc_id, None)
+            if canonical:
+                siblings = self.duplicates.get(canonical, [])
+                if doc_id in siblings:
+                    siblings.remove(doc_id)
+                if not siblings:
+                    self.duplicates.pop(canonical, None)
+                continue
+            
+            if signature:
+                self.lsh.remove(doc_id, signature)
+            survivors = self.duplicates.pop(doc_id, [])
+            if survivors:
+                promoted, rest = survivors[0], survivors[1:]
+                del self.canonical_of[promoted]
+                self.lsh.insert(promoted, self.signatures[promoted])
+                for duplicate in rest:
+                    self.canonical_of[duplicate] = promoted
+                if rest:
+                    self.duplicates[promoted] = rest
+    
     def delete(self, ids: List[str]):
+        self._forget(ids)
         for doc_id in ids:
             if doc_id in self.data["ids"]:
                 idx = self.data["ids"].index(doc_id)
+                add_usage(
+                    self.data.setdefault("usage", empty_usage()),
+                    chunk_usage(self.data["documents"][idx], self.data["metadatas"][idx]),
+                    sign=-1
+                )
                 self.data["ids"].pop(idx)
                 self.data["documents"].pop(idx)
                 self.data["embeddings"].pop(idx)
                 if "metadatas" in self.data and idx < len(self.data["metadatas"]):
                     self.data["metadatas"].pop(idx)
+        mark_changed(self.data)
     
     def _simple_similarity(self, text1: str, text2: str) -> float:
         words1 = set(text1.lower().split())
@@ -100,6 +238,88 @@ class SimpleCollection:
         return intersection / union if union > 0 else 0.0
 
 
+def chunk_content_hash(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class ChunkDiff:
+    """What update_source_chunks changed, kept so the update can be reverted"""
+    source_name: str
+    kept: int = 0
+    added_ids: List[str] = field(default_factory=list)
+    removed: List[Tuple[str, str, Dict]] = field(default_factory=list)
+    reindexed: List[Tuple[str, Dict]] = field(default_factory=list)
+
+    def summary(self) -> Dict[str, int]:
+        return {"kept": self.kept, "added": len(self.added_ids), "removed": len(self.removed)}
+
+
+def chunk_records(
+    user_id: str,
+    source_name: str,
+    chunks: List[str],
+    metadata: Dict[str, Any] = None
+) -> Tuple[List[str], List[Dict]]:
+    """Ids and metadatas for a source's chunks, as add_documents stores them"""
+    ids = [f"{source_name}_{i}" for i in range(len(chunks))]
+    metadatas = [
+        {
+            "source": source_name,
+            "chunk_index": i,
+            "user_id": user_id,
+            "content_hash": chunk_content_hash(chunk),
+            **(metadata or {})
+        }
+        for i, chunk in enumerate(chunks)
+    ]
+    return ids, metadatas
+
+
+def snapshot_dir() -> str:
+    return os.path.join(settings.CHROMA_PERSIST_DIR, "snapshots")
+
+
+def snapshot_path(user_id: str, directory: Optional[str] = None) -> str:
+    return os.path.join(directory or snapshot_dir(), f"user_{user_id}.json")
+
+
+def write_snapshot(path: str, snapshot: Dict):
+    """Write a collection snapshot so readers only ever see the previous or the complete new file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def prune_snapshot(snapshot: Dict, live_sources: Dict[str, Optional[str]]) -> List[str]:
+    """
+    Drop chunks and summaries of sources that were deleted, or replaced by a new
+    version, after the snapshot was written. `live_sources` maps each of the
+    user's current source names to its checksum; returns the dropped sources.
+    """
+    def current(metadata: Dict) -> bool:
+        source_name = metadata.get("source")
+        if source_name not in live_sources:
+            return False
+        checksum, expected = metadata.get("checksum"), live_sources[source_name]
+        return not checksum or not expected or checksum == expected
+
+    metadatas = snapshot["metadatas"]
+    keep = [i for i, metadata in enumerate(metadatas) if current(metadata)]
+    dropped = {metadata.get("source") for metadata in metadatas} - {metadatas[i].get("source") for i in keep}
+    for key in ("ids", "documents", "metadatas"):
+        snapshot[key] = [snapshot[key][i] for i in keep]
+    summaries = snapshot.get("summaries") or {}
+    for source_name in list(summaries):
+        if source_name not in live_sources or source_name in dropped:
+            del summaries[source_name]
+    return sorted(dropped)
+
+
 class VectorStore:
     def __init__(self):
         try:
@@ -107,23 +327,229 @@ class VectorStore:
         except OSError:
             pass
         self.collections = {}
+        # Identifies this process's change counter to replicas (see app.training.replication)
+        self.epoch = uuid.uuid4().hex
+        # user_id -> version at which their collection was deleted
+        self._deleted: Dict[str, int] = {}
+        # snapshot path -> (mtime_ns, size) of the version last loaded
+        self._snapshot_stamps: Dict[str, Tuple[int, int]] = {}
+
+    @staticmethod
+    def _empty_collection(user_id: str) -> Dict:
+        collection_name = f"user_{user_id}"
+        return {
+            "name": collection_name,
+            "metadata": {"user_id": user_id},
+            "documents": [],
+            "embeddings": [],
+            "ids": [],
+            "metadatas": [],
+            # source_name -> summary tree nodes (see app.training.summaries)
+            "summaries": {},
+            "usage": empty_usage(),
+            "version": next(_versions)
+        }
 
     def get_or_create_collection(self, user_id: str):
         """Get or create a collection for user"""
         collection_name = f"user_{user_id}"
         
         if collection_name not in self.collections:
-            self.collections[collection_name] = {
-                "name": collection_name,
-                "metadata": {"user_id": user_id},
-                "documents": [],
-                "embeddings": [],
-                "ids": [],
-                "metadatas": []
-            }
+            self.collections[collection_name] = self._empty_collection(user_id)
         
         return SimpleCollection(self.collections[collection_name])
 
+    def build_collection(
+        self,
+        user_id: str,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Dict],
+        summaries: Optional[Dict[str, List[Dict]]] = None
+    ) -> Dict:
+        """A complete collection built off to the side, ready for swap_collection"""
+        data = self._empty_collection(user_id)
+        SimpleCollection(data).add(ids=ids, documents=documents, metadatas=metadatas)
+        for source_name, nodes in (summaries or {}).items():
+            data["summaries"][source_name] = nodes
+            data["usage"]["index_bytes"] += sum(map(metadata_size, nodes))
+        return data
+
+    def swap_collection(self, user_id: str, data: Dict) -> int:
+        """
+        Replace a user's collection with one from build_collection in a single
+        assignment. Sources the live collection has but the new one lacks (uploaded
+        after the rebuild read its rows) are carried over; returns how many.
+        """
+        collection_name = f"user_{user_id}"
+        current = self.collections.get(collection_name)
+        carried = 0
+        if current:
+            rebuilt = {metadata.get("source") for metadata in data["metadatas"]}
+            keep = [
+                i for i, metadata in enumerate(current.get("metadatas", []))
+                if metadata.get("source") not in rebuilt
+            ]
+            if keep:
+                SimpleCollection(data).add(
+                    ids=[current["ids"][i] for i in keep],
+                    documents=[current["documents"][i] for i in keep],
+                    metadatas=[current["metadatas"][i] for i in keep]
+                )
+                carried_sources = {current["metadatas"][i].get("source") for i in keep}
+                for source_name in carried_sources:
+                    nodes = current.get("summaries", {}).get(source_name)
+                    if nodes:
+                        data["summaries"][source_name] = nodes
+                        data["usage"]["index_bytes"] += sum(map(metadata_size, nodes))
+                carried = len(carried_sources)
+        mark_changed(data)
+        self.collections[collection_name] = data
+        return carried
+
+    def changed_snapshots(self, directory: Optional[str] = None) -> List[Tuple[str, Tuple[int, int]]]:
+        """Snapshot files written since they were last loaded, with their stamps"""
+        directory = directory or snapshot_dir()
+        changed = []
+        if not os.path.isdir(directory):
+            return changed
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.startswith("user_") or not entry.name.endswith(".json"):
+                    continue
+                stat = entry.stat()
+                stamp = (stat.st_mtime_ns, stat.st_size)
+                if self._snapshot_stamps.get(entry.path) != stamp:
+                    changed.append((entry.path, stamp))
+        return changed
+
+    def build_from_snapshot(
+        self, path: str, live_sources: Optional[Callable[[str], Dict[str, Optional[str]]]] = None
+    ) -> Tuple[str, Dict]:
+        """
+        Build the collection in a snapshot file. With `live_sources` (user_id ->
+        {source_name: checksum} of their current documents), sources deleted or
+        re-versioned since the snapshot was written are left out.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        user_id = snapshot["user_id"]
+        if live_sources is not None:
+            prune_snapshot(snapshot, live_sources(user_id))
+        return user_id, self.build_collection(
+            user_id, snapshot["ids"], snapshot["documents"], snapshot["metadatas"], snapshot.get("summaries")
+        )
+
+    def mark_snapshot_loaded(self, path: str, stamp: Tuple[int, int]):
+        self._snapshot_stamps[path] = stamp
+
+    def load_snapshots(
+        self,
+        directory: Optional[str] = None,
+        live_sources: Optional[Callable[[str], Dict[str, Optional[str]]]] = None
+    ) -> int:
+        """Swap in every new or changed snapshot; returns how many were loaded"""
+        loaded = 0
+        for path, stamp in self.changed_snapshots(directory):
+            try:
+                user_id, data = self.build_from_snapshot(path, live_sources)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error loading snapshot {path}: {str(e)}")
+                continue
+            self.swap_collection(user_id, data)
+            self.mark_snapshot_loaded(path, stamp)
+            loaded += 1
+        return loaded
+
+    def export_state(self, since: Optional[int] = None, user_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        A consistent point-in-time copy of the collections changed after `since`
+        (all of them when None; only `user_ids`' when given), for replication. Must run without yielding to
+        other writers - on the event loop thread - and only copies references,
+        since stored chunks, metadatas and signatures are replaced, never mutated.
+        """
+        version = next(_versions)
+        collections = []
+        for data in list(self.collections.values()):
+            if since is not None and data.get("version", 0) <= since:
+                continue
+            if user_ids is not None and data["metadata"]["user_id"] not in user_ids:
+                continue
+            signatures = data.get("signatures", {})
+            collections.append({
+                "user_id": data["metadata"]["user_id"],
+                "ids": list(data["ids"]),
+                "documents": list(data["documents"]),
+                "metadatas": list(data["metadatas"]),
+                "signatures": [signatures.get(doc_id) for doc_id in data["ids"]],
+                "canonical_of": dict(data.get("canonical_of", {})),
+                "summaries": dict(data.get("summaries", {})),
+            })
+        live = {data["metadata"]["user_id"] for data in self.collections.values()}
+        deleted = [
+            user_id for user_id, deleted_at in self._deleted.items()
+            if user_id not in live and (since is None or deleted_at > since)
+            and (user_ids is None or user_id in user_ids)
+        ]
+        return {
+            "epoch": self.epoch,
+            "version": version,
+            "base_version": since,
+            "collections": collections,
+            "deleted": deleted,
+        }
+
+    def restore_collection(
+        self,
+        user_id: str,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Dict],
+        signatures: List[Optional[Tuple[int, ...]]],
+        canonical_of: Dict[str, str],
+        summaries: Optional[Dict[str, List[Dict]]] = None
+    ) -> Dict:
+        """
+        A collection rebuilt from exported state without recomputing MinHash:
+        shipped signatures go straight into the LSH index and duplicates keep
+        the canonical chunks the primary chose. Falls back to build_collection
+        when the signatures were made with a different MINHASH_PERMUTATIONS.
+        """
+        if any(signature is None or len(signature) != settings.MINHASH_PERMUTATIONS for signature in signatures):
+            return self.build_collection(user_id, ids, documents, metadatas, summaries)
+
+        data = self._empty_collection(user_id)
+        collection = SimpleCollection(data)
+        data["ids"] = list(ids)
+        data["documents"] = list(documents)
+        data["metadatas"] = list(metadatas)
+        data["embeddings"] = [[0.0] * EMBEDDING_DIMENSIONS for _ in documents]
+        for doc_id, document, metadata, signature in zip(ids, documents, metadatas, signatures):
+            add_usage(data["usage"], chunk_usage(document, metadata))
+            collection.signatures[doc_id] = tuple(signature)
+            canonical = canonical_of.get(doc_id)
+            if canonical:
+                collection.canonical_of[doc_id] = canonical
+                collection.duplicates.setdefault(canonical, []).append(doc_id)
+            else:
+                collection.lsh.insert(doc_id, collection.signatures[doc_id])
+        for source_name, nodes in (summaries or {}).items():
+            data["summaries"][source_name] = nodes
+            data["usage"]["index_bytes"] += sum(map(metadata_size, nodes))
+        return data
+
+    def install_collections(self, collections: List[Tuple[str, Dict]], deleted: List[str] = (), replace_all: bool = False):
+        """Put restored collections in place; with replace_all, every other collection is dropped"""
+        installed = {f"user_{user_id}": data for user_id, data in collections}
+        for data in installed.values():
+            mark_changed(data)
+        if replace_all:
+            self.collections = installed
+            return
+        for user_id in deleted:
+            self.collections.pop(f"user_{user_id}", None)
+        self.collections.update(installed)
+
     def add_documents(
         self,
         user_id: str,
@@ -134,33 +560,101 @@ class VectorStore:
         """Add document chunks to vector store"""
         collection = self.get_or_create_collection(user_id)
         
-        if metadata is None:
-            metadata = {}
+        ids, metadatas = chunk_records(user_id, source_name, chunks, metadata)
         
-        ids = []
-        documents = []
-        metadatas = []
+        collection.add(
+            ids=ids,
+            documents=list(chunks),
+            metadatas=metadatas
+        )
+        
+        return len(chunks)
+
+    def update_source_chunks(
+        self,
+        user_id: str,
+        source_name: str,
+        chunks: List[str],
+        metadata: Dict[str, Any] = None
+    ) -> ChunkDiff:
+        """
+        Bring a source's chunks in line with a new version of the document.
+
+        Chunks are matched by content hash, so only chunks whose text changed
+        are deleted and inserted; unchanged ones keep their ids and only get
+        their chunk_index and document-level metadata refreshed.
+        """
+        collection = self.get_or_create_collection(user_id)
+        metadata = metadata or {}
+        existing = collection.get(where={"source": source_name})
+        diff = ChunkDiff(source_name=source_name)
+        
+        available = defaultdict(list)
+        for doc_id, document, chunk_metadata in zip(existing["ids"], existing["documents"], existing["metadatas"]):
+            content_hash = chunk_metadata.get("content_hash") or chunk_content_hash(document)
+            available[content_hash].append((doc_id, document, chunk_metadata))
+        
+        taken_ids = set(existing["ids"])
+        update_ids, update_metadatas = [], []
+        add_ids, add_documents, add_metadatas = [], [], []
         
         for i, chunk in enumerate(chunks):
-            doc_id = f"{source_name}_{i}"
-            ids.append(doc_id)
-            documents.append(chunk)
-            
+            content_hash = chunk_content_hash(chunk)
             chunk_metadata = {
                 "source": source_name,
                 "chunk_index": i,
                 "user_id": user_id,
+                "content_hash": content_hash,
                 **metadata
             }
-            metadatas.append(chunk_metadata)
+            
+            if available[content_hash]:
+                doc_id, _, old_metadata = available[content_hash].pop(0)
+                diff.kept += 1
+                if old_metadata != chunk_metadata:
+                    diff.reindexed.append((doc_id, old_metadata))
+                    update_ids.append(doc_id)
+                    update_metadatas.append(chunk_metadata)
+                continue
+            
+            doc_id = f"{source_name}_{i}"
+            suffix = 0
+            while doc_id in taken_ids:
+                suffix += 1
+                doc_id = f"{source_name}_{i}_{content_hash[:8]}_{suffix}"
+            taken_ids.add(doc_id)
+            add_ids.append(doc_id)
+            add_documents.append(chunk)
+            add_metadatas.append(chunk_metadata)
         
-        collection.add(
-            ids=ids,
-            documents=documents,
-            metadatas=metadatas
-        )
+        diff.removed = [entry for entries in available.values() for entry in entries]
+        diff.added_ids = add_ids
         
-        return len(chunks)
+        if diff.removed:
+            collection.delete(ids=[doc_id for doc_id, _, _ in diff.removed])
+        if update_ids:
+            collection.update(ids=update_ids, metadatas=update_metadatas)
+        if add_ids:
+            collection.add(ids=add_ids, documents=add_documents, metadatas=add_metadatas)
+        
+        return diff
+
+    def revert_source_update(self, user_id: str, diff: ChunkDiff):
+        """Undo an update_source_chunks call"""
+        collection = self.get_or_create_collection(user_id)
+        if diff.added_ids:
+            collection.delete(ids=diff.added_ids)
+        if diff.reindexed:
+            collection.update(
+                ids=[doc_id for doc_id, _ in diff.reindexed],
+                metadatas=[metadata for _, metadata in diff.reindexed]
+            )
+        if diff.removed:
+            collection.add(
+                ids=[doc_id for doc_id, _, _ in diff.removed],
+                documents=[document for _, document, _ in diff.removed],
+                metadatas=[metadata for _, _, metadata in diff.removed]
+            )
 
     def retrieve(self, user_id: str, query: str, n_results: int = 5) -> List[Dict]:
         """Retrieve relevant documents for a query"""
@@ -178,7 +672,8 @@ class VectorStore:
                     retrieved_docs.append({
                         "content": doc,
                         "source": results["metadatas"][0][i].get("source", "unknown"),
-                        "distance": results["distances"][0][i] if "distances" in results else None
+                        "distance": results["distances"][0][i] if "distances" in results else None,
+                        "duplicate_sources": results["duplicate_sources"][0][i] if "duplicate_sources" in results else []
                     })
             
             return retrieved_docs
@@ -186,10 +681,24 @@ class VectorStore:
             print(f"Error retrieving documents: {str(e)}")
             return []
 
+    def set_source_summaries(self, user_id: str, source_name: str, nodes: List[Dict]):
+        data = self.get_or_create_collection(user_id).data
+        summaries = data.setdefault("summaries", {})
+        previous = summaries.get(source_name) or []
+        data["usage"]["index_bytes"] += sum(map(metadata_size, nodes)) - sum(map(metadata_size, previous))
+        summaries[source_name] = nodes
+        mark_changed(data)
+
+    def get_source_summaries(self, user_id: str, source_name: str) -> Optional[List[Dict]]:
+        return self.get_or_create_collection(user_id).data.get("summaries", {}).get(source_name)
+
     def delete_collection_by_source(self, user_id: str, source_name: str):
         """Delete all chunks from a specific source"""
         try:
             collection = self.get_or_create_collection(user_id)
+            nodes = collection.data.get("summaries", {}).pop(source_name, None) or []
+            collection.data["usage"]["index_bytes"] -= sum(map(metadata_size, nodes))
+            mark_changed(collection.data)
             
             results = collection.get(
                 where={"source": source_name}
@@ -200,11 +709,78 @@ class VectorStore:
         except Exception as e:
             print(f"Error deleting collection: {str(e)}")
 
+    def collection_usage(self, user_id: str) -> Dict[str, int]:
+        """Approximate memory held by a user's collection, by kind, plus total_bytes"""
+        data = self.collections.get(f"user_{user_id}")
+        usage = dict(data.get("usage", empty_usage())) if data else empty_usage()
+        usage["total_bytes"] = sum(value for name, value in usage.items() if name != "chunks")
+        return usage
+
+    def source_usage(self, user_id: str, source_name: str) -> Dict[str, int]:
+        usage = empty_usage()
+        data = self.collections.get(f"user_{user_id}")
+        if data:
+            for document, metadata in zip(data["documents"], data["metadatas"]):
+                if metadata.get("source") == source_name:
+                    add_usage(usage, chunk_usage(document, metadata))
+            nodes = data.get("summaries", {}).get(source_name) or []
+            usage["index_bytes"] += sum(map(metadata_size, nodes))
+        usage["total_bytes"] = sum(value for name, value in usage.items() if name != "chunks")
+        return usage
+
+    @staticmethod
+    def estimate_usage(chunks: List[str], metadata: Dict[str, Any] = None, source_name: str = "") -> Dict[str, int]:
+        """What adding these chunks would cost, as collection_usage counts it"""
+        usage = empty_usage()
+        for document, chunk_metadata in zip(chunks, chunk_records("", source_name, chunks, metadata)[1]):
+            add_usage(usage, chunk_usage(document, chunk_metadata))
+        usage["total_bytes"] = sum(value for name, value in usage.items() if name != "chunks")
+        return usage
+
+    def usage_report(self, top_n: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Per-user usage, largest collections first"""
+        report = [
+            {"user_id": data["metadata"]["user_id"], **self.collection_usage(data["metadata"]["user_id"])}
+            for data in list(self.collections.values())
+        ]
+        report.sort(key=lambda entry: entry["total_bytes"], reverse=True)
+        return report[:top_n] if top_n else report
+
+    def list_sources(self) -> Dict[str, Dict[str, int]]:
+        """user_id -> {source_name: chunk count} across every collection"""
+        sources = {}
+        for collection in self.collections.values():
+            counts = defaultdict(int)
+            for metadata in collection.get("metadatas", []):
+                counts[metadata.get("source")] += 1
+            sources[collection["metadata"]["user_id"]] = dict(counts)
+        return sources
+
+    def release_collection(self, user_id: str, version: int) -> bool:
+        """Drop a collection handed off to another node, unless it changed after `version` was exported"""
+        data = self.collections.get(f"user_{user_id}")
+        if data is None or data.get("version") != version:
+            return False
+        self.delete_all_user_collections(user_id)
+        return True
+
     def delete_all_user_collections(self, user_id: str):
         """Delete all collections for a user"""
         try:
             collection_name = f"user_{user_id}"
             if collection_name in self.collections:
                 del self.collections[collection_name]
+                self._deleted[user_id] = next(_versions)
         except Exception as e:
             print(f"Error deleting user collections: {str(e)}")
+
+
+_vector_store = None
+
+
+def get_vector_store() -> VectorStore:
+    """Process-wide store shared by the chat and training routes and the background jobs"""
+    global _vector_store
+    if _vector_store is None:
+        _vector_store = VectorStore()
+    return _vector_store
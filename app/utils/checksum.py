@@ -1,26 +1,203 @@
 import hashlib
-from typing import Tuple
+import io
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+DEFAULT_ALGORITHMS = ("sha256", "blake2b")
+
+
+class ChecksumCache:
+    """
+    Bounded LRU of file digests keyed by (st_dev, st_ino, st_size, st_mtime_ns).
+
+    Any write to a file changes its size or mtime, so a hit means the file is
+    untouched since it was last hashed. Tools that deliberately restore mtimes
+    can defeat this, which is why integrity scrubbing hashes with use_cache=False.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, int, int, int], Dict[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(stat_result: os.stat_result) -> Tuple[int, int, int, int]:
+        return (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+
+    def get(self, key: Tuple[int, int, int, int], algorithms: Iterable[str]) -> Optional[Dict[str, str]]:
+        with self._lock:
+            digests = self._entries.get(key)
+            if digests is None or any(name not in digests for name in algorithms):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(digests)
+
+    def put(self, key: Tuple[int, int, int, int], digests: Dict[str, str]):
+        with self._lock:
+            merged = dict(self._entries.get(key, {}))
+            merged.update(digests)
+            self._entries[key] = merged
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class ChecksumEngine:
+    """
+    Single-pass multi-digest file hashing.
+
+    Files at or above MMAP_THRESHOLD are memory-mapped and fed to every hasher
+    in SLICE_SIZE windows, so each window is hashed while it is still hot in
+    cache. Smaller files (and filesystems that refuse mmap) are read with
+    readinto() into one reusable 1 MiB buffer instead of 4 KB reads.
+    """
+
+    READ_BUFFER_SIZE = 1024 * 1024
+    SLICE_SIZE = 1024 * 1024
+    MMAP_THRESHOLD = 4 * 1024 * 1024
+
+    cache = ChecksumCache()
+
+    @staticmethod
+    def _new_hashers(algorithms: Iterable[str]) -> Dict[str, "hashlib._Hash"]:
+        return {name: hashlib.new(name) for name in algorithms}
+
+    @classmethod
+    def _hash_mmap(cls, fd: int, size: int, hashers: Dict[str, "hashlib._Hash"]) -> bool:
+        """Feed a mapped file to the hashers; returns False if the file cannot be mapped"""
+        try:
+            mapped = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+
+        with mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, size, cls.SLICE_SIZE):
+                    window = view[offset:offset + cls.SLICE_SIZE]
+                    for hasher in hashers.values():
+                        hasher.update(window)
+                    window.release()
+            finally:
+                view.release()
+        return True
+
+    @classmethod
+    def _hash_buffered(
+        cls,
+        file_obj,
+        hashers: Dict[str, "hashlib._Hash"],
+        throttle: Optional[Callable[[int], None]] = None,
+    ):
+        buffer = bytearray(cls.READ_BUFFER_SIZE)
+        view = memoryview(buffer)
+        while True:
+            read = file_obj.readinto(buffer)
+            if not read:
+                break
+            if throttle:
+                throttle(read)
+            window = view[:read]
+            for hasher in hashers.values():
+                hasher.update(window)
+
+    @classmethod
+    def hash_stream(
+        cls,
+        file_obj,
+        algorithms: Iterable[str] = DEFAULT_ALGORITHMS,
+        throttle: Optional[Callable[[int], None]] = None,
+    ) -> Dict[str, str]:
+        """Hash a binary file object; throttle(nbytes) is called before each buffer is hashed"""
+        hashers = cls._new_hashers(algorithms)
+        cls._hash_buffered(file_obj, hashers, throttle)
+        return {name: hasher.hexdigest() for name, hasher in hashers.items()}
+
+    @classmethod
+    def feed_file(cls, file_obj, sinks: Iterable, size: Optional[int] = None):
+        """
+        Read an open binary file once and pass every window to each sink's update().
+
+        Sinks are hashlib objects or anything with the same update() method
+        (see app.utils.merkle.MerkleBuilder).
+        """
+        sinks = dict(enumerate(sinks))
+        if not isinstance(file_obj, (io.BufferedReader, io.FileIO)):
+            # A decompressing or in-memory stream: fileno(), if any, is not the content.
+            cls._hash_buffered(file_obj, sinks)
+            return
+        if size is None:
+            size = os.fstat(file_obj.fileno()).st_size
+        if size >= cls.MMAP_THRESHOLD and cls._hash_mmap(file_obj.fileno(), size, sinks):
+            return
+        cls._hash_buffered(file_obj, sinks)
+
+    @classmethod
+    def hash_file(
+        cls,
+        file_path: str,
+        algorithms: Iterable[str] = DEFAULT_ALGORITHMS,
+        use_cache: bool = True,
+    ) -> Dict[str, str]:
+        """Return {algorithm: hexdigest} for every requested algorithm in one read of the file"""
+        algorithms = tuple(algorithms)
+        with open(file_path, "rb") as f:
+            before = os.fstat(f.fileno())
+            key = ChecksumCache.key_for(before)
+
+            if use_cache:
+                cached = cls.cache.get(key, algorithms)
+                if cached is not None:
+                    return {name: cached[name] for name in algorithms}
+
+            hashers = cls._new_hashers(algorithms)
+            cls.feed_file(f, hashers.values(), size=before.st_size)
+            digests = {name: hasher.hexdigest() for name, hasher in hashers.items()}
+
+            # Only remember the result if the file did not change underneath us.
+            if ChecksumCache.key_for(os.fstat(f.fileno())) == key:
+                cls.cache.put(key, digests)
+
+        return digests
+
 
 class ChecksumUtils:
     @staticmethod
     def compute_sha256(data: bytes) -> str:
         return hashlib.sha256(data).hexdigest()
-    
+
     @staticmethod
-    def compute_sha256_from_file(file_path: str) -> str:
-        sha256_hash = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(chunk)
-        return sha256_hash.hexdigest()
-    
+    def compute_sha256_from_file(file_path: str, use_cache: bool = True) -> str:
+        return ChecksumEngine.hash_file(file_path, ("sha256",), use_cache=use_cache)["sha256"]
+
+    @staticmethod
+    def compute_digests_from_file(file_path: str, algorithms: Iterable[str] = DEFAULT_ALGORITHMS) -> Dict[str, str]:
+        return ChecksumEngine.hash_file(file_path, algorithms)
+
     @staticmethod
     def verify_checksum(data: bytes, expected_checksum: str) -> bool:
         computed = ChecksumUtils.compute_sha256(data)
         return computed.lower() == expected_checksum.lower()
-    
+
     @staticmethod
     def get_file_stats(file_path: str) -> Tuple[str, int]:
         checksum = ChecksumUtils.compute_sha256_from_file(file_path)
-        file_size = __import__('os').path.getsize(file_path)
+        file_size = os.path.getsize(file_path)
         return checksum, file_size
@@ -0,0 +1,163 @@
+"""
+HTTP helpers for serving stored uploads: Range parsing, ETag matching and an
+ASGI response that streams a stored file without loading it into memory.
+
+StoredFileResponse picks the cheapest path the server offers:
+
+* `http.response.zerocopysend` (ASGI extension): the server sendfile()s the
+  byte range straight from our file descriptor
+* `http.response.pathsend`: the server sends the whole file by path
+* otherwise, bounded pread() chunks from a worker thread - or, for compressed
+  blobs, the decompressed stream from BlobStorage.iter_range()
+"""
+import logging
+import os
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.utils.storage import BlobCorruptedError
+from app.utils.uploads import StoredUpload
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single `bytes=` range into an inclusive (start, end) pair.
+
+    Returns None when the whole file should be sent: no header, another unit,
+    several ranges (allowed by RFC 9110 to be ignored) or a malformed value.
+    Raises RangeNotSatisfiable when the range lies entirely past the end.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable()
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def etag_matches(header: Optional[str], etag: Optional[str]) -> bool:
+    """If-None-Match / If-Range comparison (weak comparison, as RFC 9110 asks for If-None-Match)"""
+    if not header or not etag:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in tags)
+
+
+class StoredFileResponse(Response):
+    def __init__(
+        self,
+        stored: StoredUpload,
+        status_code: int = 200,
+        headers: Optional[Dict[str, str]] = None,
+        media_type: Optional[str] = None,
+        byte_range: Optional[Tuple[int, int]] = None,
+    ):
+        self.stored = stored
+        self.start, self.end = byte_range if byte_range else (0, stored.size - 1)
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.body = b""
+        self.init_headers(headers)
+        self.headers["content-length"] = str(self.length)
+
+    @property
+    def length(self) -> int:
+        return max(self.end - self.start + 1, 0)
+
+    def _iter_plain(self) -> Iterator[bytes]:
+        fd = os.open(self.stored.path, os.O_RDONLY)
+        try:
+            offset, remaining = self.start, self.length
+            while remaining > 0:
+                piece = os.pread(fd, min(CHUNK_SIZE, remaining), offset)
+                if not piece:
+                    break
+                offset += len(piece)
+                remaining -= len(piece)
+                yield piece
+        finally:
+            os.close(fd)
+
+    def _chunks(self) -> Iterator[bytes]:
+        if self.stored.path:
+            return self._iter_plain()
+        return self.stored.storage.iter_range(
+            self.stored.digest, self.start, self.end + 1, chunk_size=CHUNK_SIZE
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if self.stored.path and "http.response.zerocopysend" in extensions:
+            with open(self.stored.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            return
+        if self.stored.path and "http.response.pathsend" in extensions and self.length == self.stored.size:
+            await send({"type": "http.response.pathsend", "path": self.stored.path})
+            return
+
+        chunks = self._chunks()
+        try:
+            while True:
+                piece = await anyio.to_thread.run_sync(next, chunks, None)
+                if piece is None:
+                    break
+                await send({"type": "http.response.body", "body": piece, "more_body": True})
+        except BlobCorruptedError as e:
+            # The headers are already out; end without the final body message so the
+            # server drops the connection and the client sees a short transfer.
+            logger.error(f"Stopped streaming corrupt blob {self.stored.digest}: {e}")
+            return
+        finally:
+            close = getattr(chunks, "close", None)
+            if close:
+                close()
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def content_disposition(filename: str) -> str:
+    fallback = filename.encode("ascii", "ignore").decode().replace('"', "") or "download"
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
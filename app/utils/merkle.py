@@ -0,0 +1,273 @@
+"""
+Per-block Merkle trees for uploaded training documents.
+
+Client-side format (the frontend must reproduce this exactly to get the same root):
+
+1. Split the raw file bytes into fixed-size blocks of `block_size` bytes
+   (default 65536). The last block may be shorter. An empty file has exactly
+   one, empty, block.
+2. Leaf hash:      leaf_i = SHA-256(0x00 || block_i)
+3. Interior hash:  node   = SHA-256(0x01 || left || right)
+   The 0x00/0x01 prefixes keep a leaf from being passed off as an interior node.
+4. Build each level by pairing nodes left to right. When a level has an odd
+   number of nodes, the last one is promoted unchanged to the next level
+   (it is NOT hashed with itself).
+5. The root is the single node left at the top, sent as lowercase hex.
+   Leaf hashes, when sent, are a JSON list of lowercase hex strings in block order.
+
+Browser reference implementation:
+
+    async function merkleRoot(buffer, blockSize = 65536) {
+      const sha = async (prefix, ...parts) => {
+        const total = parts.reduce((n, p) => n + p.byteLength, 1);
+        const data = new Uint8Array(total);
+        data[0] = prefix;
+        let offset = 1;
+        for (const p of parts) { data.set(new Uint8Array(p), offset); offset += p.byteLength; }
+        return crypto.subtle.digest("SHA-256", data);
+      };
+      let level = [];
+      for (let i = 0; i < Math.max(buffer.byteLength, 1); i += blockSize)
+        level.push(await sha(0, buffer.slice(i, i + blockSize)));
+      while (level.length > 1) {
+        const next = [];
+        for (let i = 0; i + 1 < level.length; i += 2) next.push(await sha(1, level[i], level[i + 1]));
+        if (level.length % 2) next.push(level[level.length - 1]);
+        level = next;
+      }
+      return [...new Uint8Array(level[0])].map(b => b.toString(16).padStart(2, "0")).join("");
+    }
+
+Audit proofs list the sibling hashes from leaf to root; `position` says whether the
+sibling sits to the "left" or "right" of the running hash. Levels where the node was
+promoted contribute no sibling, so a proof has at most ceil(log2(n)) entries.
+"""
+import hashlib
+import os
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.utils.checksum import ChecksumEngine
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+LEAF_HEX_PATTERN = re.compile(r"[0-9a-fA-F]{64}")
+
+
+def check_leaf_hex(leaf_hashes: Sequence[str]) -> Sequence[str]:
+    """Client-sent leaf hashes, unchanged; ValueError unless each is exactly 64 hex characters"""
+    for leaf in leaf_hashes:
+        if not isinstance(leaf, str) or not LEAF_HEX_PATTERN.fullmatch(leaf):
+            raise ValueError("leaf hashes must be 64 hex characters")
+    return leaf_hashes
+
+
+def hash_leaf(block) -> bytes:
+    hasher = hashlib.sha256(LEAF_PREFIX)
+    hasher.update(block)
+    return hasher.digest()
+
+
+def hash_node(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+class MerkleBuilder:
+    """Streaming leaf hasher with the hashlib update() interface, so it can ride along ChecksumEngine.feed_file"""
+
+    def __init__(self, block_size: int = DEFAULT_BLOCK_SIZE):
+        self.block_size = block_size
+        self.leaves: List[bytes] = []
+        self._pending = bytearray()
+
+    def update(self, data):
+        view = memoryview(data)
+        if self._pending:
+            needed = self.block_size - len(self._pending)
+            self._pending += view[:needed]
+            view = view[needed:]
+            if len(self._pending) < self.block_size:
+                return
+            self.leaves.append(hash_leaf(self._pending))
+            self._pending = bytearray()
+
+        full = len(view) - len(view) % self.block_size
+        for offset in range(0, full, self.block_size):
+            self.leaves.append(hash_leaf(view[offset:offset + self.block_size]))
+        # Copy the tail: callers reuse or release the buffer behind `data`.
+        self._pending += view[full:]
+
+    def tree(self) -> "MerkleTree":
+        leaves = list(self.leaves)
+        if self._pending or not leaves:
+            leaves.append(hash_leaf(self._pending))
+        return MerkleTree(leaves, self.block_size)
+
+
+class MerkleTree:
+    def __init__(self, leaves: Sequence[bytes], block_size: int = DEFAULT_BLOCK_SIZE):
+        if not leaves:
+            leaves = [hash_leaf(b"")]
+        self.block_size = block_size
+        self.levels: List[List[bytes]] = [list(leaves)]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            parents = [hash_node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+            if len(level) % 2:
+                parents.append(level[-1])
+            self.levels.append(parents)
+
+    @classmethod
+    def from_file(cls, file_path: str, block_size: int = DEFAULT_BLOCK_SIZE) -> "MerkleTree":
+        builder = MerkleBuilder(block_size)
+        with open(file_path, "rb") as f:
+            ChecksumEngine.feed_file(f, [builder])
+        return builder.tree()
+
+    @classmethod
+    def from_leaf_bytes(cls, packed: bytes, block_size: int) -> "MerkleTree":
+        return cls([packed[i:i + 32] for i in range(0, len(packed), 32)], block_size)
+
+    @classmethod
+    def from_leaf_hex(cls, leaf_hashes: Sequence[str], block_size: int) -> "MerkleTree":
+        return cls([bytes.fromhex(h) for h in check_leaf_hex(leaf_hashes)], block_size)
+
+    @property
+    def leaves(self) -> List[bytes]:
+        return self.levels[0]
+
+    @property
+    def leaf_count(self) -> int:
+        return len(self.levels[0])
+
+    @property
+    def root(self) -> bytes:
+        return self.levels[-1][0]
+
+    @property
+    def root_hex(self) -> str:
+        return self.root.hex()
+
+    def packed_leaves(self) -> bytes:
+        return b"".join(self.leaves)
+
+    def proof(self, index: int) -> List[Dict[str, str]]:
+        """Sibling hashes needed to recompute the root from leaf `index`"""
+        if not 0 <= index < self.leaf_count:
+            raise IndexError(f"Block {index} out of range (0..{self.leaf_count - 1})")
+
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                proof.append({
+                    "hash": level[sibling].hex(),
+                    "position": "left" if sibling < index else "right"
+                })
+            index //= 2
+        return proof
+
+    @staticmethod
+    def verify_proof(leaf: bytes, proof: Sequence[Dict[str, str]], root: bytes) -> bool:
+        node = leaf
+        for step in proof:
+            sibling = bytes.fromhex(step["hash"])
+            node = hash_node(sibling, node) if step["position"] == "left" else hash_node(node, sibling)
+        return node == root
+
+    def block_range(self, index: int, file_size: int) -> Tuple[int, int]:
+        start = index * self.block_size
+        return start, min(start + self.block_size, file_size)
+
+    def blocks_for_range(self, start: int, end: int) -> range:
+        """Indices of the blocks covering bytes [start, end)"""
+        if end <= start:
+            return range(0)
+        return range(start // self.block_size, min((end - 1) // self.block_size + 1, self.leaf_count))
+
+    def diff(self, other: "MerkleTree") -> List[int]:
+        """
+        Indices of blocks that differ from `other`.
+
+        Trees of the same shape are compared top-down, so only subtrees whose
+        hashes disagree are descended into. Blocks past the end of the shorter
+        tree always count as different.
+        """
+        if self.block_size != other.block_size:
+            raise ValueError("Cannot diff Merkle trees with different block sizes")
+
+        if self.leaf_count != other.leaf_count:
+            common = min(self.leaf_count, other.leaf_count)
+            differing = [i for i in range(common) if self.leaves[i] != other.leaves[i]]
+            return differing + list(range(common, max(self.leaf_count, other.leaf_count)))
+
+        differing = []
+        stack = [(len(self.levels) - 1, 0)]
+        while stack:
+            depth, index = stack.pop()
+            if self.levels[depth][index] == other.levels[depth][index]:
+                continue
+            if depth == 0:
+                differing.append(index)
+                continue
+            # A promoted node has a single child at the level below.
+            for child in (index * 2 + 1, index * 2):
+                if child < len(self.levels[depth - 1]):
+                    stack.append((depth - 1, child))
+        return sorted(differing)
+
+    def byte_ranges(self, indices: Sequence[int], file_size: Optional[int] = None) -> List[Dict[str, int]]:
+        """Collapse block indices into contiguous {start, end} byte ranges (end exclusive)"""
+        ranges = []
+        for index in sorted(indices):
+            start = index * self.block_size
+            end = start + self.block_size
+            if file_size is not None:
+                end = min(end, file_size)
+            if ranges and ranges[-1]["end"] == start:
+                ranges[-1]["end"] = end
+            else:
+                ranges.append({"start": start, "end": end})
+        return ranges
+
+
+def hash_file_with_merkle(file_path: str, block_size: int = DEFAULT_BLOCK_SIZE) -> Tuple[str, int, MerkleTree]:
+    """SHA-256, size and Merkle tree of a file from a single read"""
+    sha256 = hashlib.sha256()
+    builder = MerkleBuilder(block_size)
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        ChecksumEngine.feed_file(f, [sha256, builder], size=size)
+    return sha256.hexdigest(), size, builder.tree()
+
+
+def hash_stream_with_merkle(file_obj, block_size: int = DEFAULT_BLOCK_SIZE) -> Tuple[str, int, MerkleTree]:
+    """Like hash_file_with_merkle for any readable binary stream, e.g. a stored blob"""
+    sha256 = hashlib.sha256()
+    builder = MerkleBuilder(block_size)
+    counter = _ByteCounter()
+    ChecksumEngine.feed_file(file_obj, [sha256, builder, counter])
+    return sha256.hexdigest(), counter.count, builder.tree()
+
+
+class _ByteCounter:
+    def __init__(self):
+        self.count = 0
+
+    def update(self, data):
+        self.count += len(data)
+
+
+def verify_blocks(file_obj, tree: MerkleTree, indices: Sequence[int]) -> List[int]:
+    """
+    Re-read only the given blocks and check each one against the tree root
+    through its audit proof. Returns the indices that failed.
+    """
+    failed = []
+    for index in indices:
+        file_obj.seek(index * tree.block_size)
+        block = file_obj.read(tree.block_size)
+        if not MerkleTree.verify_proof(hash_leaf(block), tree.proof(index), tree.root):
+            failed.append(index)
+    return failed
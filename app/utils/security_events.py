@@ -0,0 +1,39 @@
+import json
+from typing import Any, Dict, Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+
+def record_security_event(
+    db: Session,
+    user_id: str,
+    event_type: str,
+    resource_id: str,
+    description: str,
+    metadata: Optional[Dict[str, Any]] = None,
+    severity: str = "critical",
+    resource_type: str = "training_document",
+) -> bool:
+    """Insert a row into security_events; failures are logged and never raised"""
+    try:
+        db.execute(
+            text("""
+                INSERT INTO security_events (user_id, event_type, resource_type, resource_id, description, severity, metadata)
+                VALUES (:user_id, :event_type, :resource_type, :resource_id, :description, :severity, :metadata)
+            """),
+            {
+                "user_id": user_id,
+                "event_type": event_type,
+                "resource_type": resource_type,
+                "resource_id": resource_id,
+                "description": description,
+                "severity": severity,
+                "metadata": json.dumps(metadata or {}, default=str)
+            }
+        )
+        db.commit()
+        return True
+    except Exception as e:
+        db.rollback()
+        print(f"Failed to log security event: {str(e)}")
+        return False
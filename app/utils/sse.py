@@ -0,0 +1,24 @@
+"""
+Server-Sent Events helpers for the streaming chat endpoints.
+
+A stream is a sequence of named events whose data is one JSON object:
+
+    event: chunk
+    data: {"text": "..."}
+
+Chat streams send `start` (ids), any number of `chunk`s, then `done`; a
+failure after the stream has started is reported as an `error` event, since
+the status code has already been sent.
+"""
+import json
+from typing import Any, Dict
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Stop nginx-style proxies from buffering the stream
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
@@ -0,0 +1,300 @@
+"""
+Blob storage for uploaded training documents.
+
+LocalBlobStorage is content addressed: a blob is keyed by the SHA-256 of its
+original bytes and lives at `{root}/{digest[:2]}/{digest[2:4]}/{digest}`, with a
+`.gz` suffix when stored compressed. Next to it, `{digest}.json` records the
+original size, the on-disk size, the compression used and the set of owners
+(document ids) referencing it, so identical uploads from any number of users
+share one copy and the blob is removed when its last owner releases it.
+
+Readers always see the original bytes: open() returns a plain file or a gzip
+stream, and iter_range() streams a byte range of either. Damage to a compressed
+blob surfaces as BlobCorruptedError (an OSError) from the read that hits it.
+"""
+import fcntl
+import gzip
+import json
+import os
+import shutil
+import uuid
+import zlib
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import BinaryIO, Iterator, List, Optional
+
+from app.config import get_settings
+
+settings = get_settings()
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class BlobCorruptedError(OSError):
+    """Stored bytes can no longer be decoded back into the original content"""
+
+
+class _GzipBlobReader(gzip.GzipFile):
+    """GzipFile that reports a damaged stream as BlobCorruptedError instead of zlib/EOF errors"""
+
+    def read(self, size=-1):
+        try:
+            return super().read(size)
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            raise BlobCorruptedError(f"Compressed blob is corrupt: {e}") from e
+
+    def read1(self, size=-1):
+        try:
+            return super().read1(size)
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            raise BlobCorruptedError(f"Compressed blob is corrupt: {e}") from e
+
+
+@dataclass
+class BlobInfo:
+    digest: str
+    size: int
+    stored_size: int
+    compression: Optional[str] = None
+    refs: List[str] = field(default_factory=list)
+
+
+class BlobStorage(ABC):
+    @abstractmethod
+    def put_file(self, source_path: str, digest: str, owner: str, compress: bool = False) -> BlobInfo:
+        """Take ownership of `source_path` (moved in, or dropped if the blob exists) and reference it for `owner`"""
+
+    @abstractmethod
+    def add_ref(self, digest: str, owner: str) -> BlobInfo:
+        pass
+
+    @abstractmethod
+    def release(self, digest: str, owner: str) -> int:
+        """Drop `owner`'s reference; returns the bytes freed if that was the last one"""
+
+    @abstractmethod
+    def info(self, digest: str) -> Optional[BlobInfo]:
+        pass
+
+    @abstractmethod
+    def open(self, digest: str) -> BinaryIO:
+        """Readable binary stream of the original bytes"""
+
+    @abstractmethod
+    def iter_digests(self) -> Iterator[str]:
+        pass
+
+    def exists(self, digest: str) -> bool:
+        return self.info(digest) is not None
+
+    def local_path(self, digest: str) -> Optional[str]:
+        """Path holding the original bytes verbatim, when the backend has one"""
+        return None
+
+    def meta_mtime(self, digest: str) -> Optional[float]:
+        """When the blob's reference set last changed, if the backend tracks it"""
+        return None
+
+    def iter_range(
+        self,
+        digest: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = COPY_BUFFER_SIZE
+    ) -> Iterator[bytes]:
+        """Stream bytes [start, end) of the original content"""
+        with self.open(digest) as f:
+            f.seek(start)
+            remaining = None if end is None else max(end - start, 0)
+            while remaining is None or remaining > 0:
+                piece = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not piece:
+                    break
+                if remaining is not None:
+                    remaining -= len(piece)
+                yield piece
+
+
+class LocalBlobStorage(BlobStorage):
+    COMPRESSION = "gzip"
+
+    def __init__(self, root: Optional[str] = None, compression_level: Optional[int] = None):
+        self.root = root or settings.STORAGE_DIR or os.path.join(settings.UPLOAD_DIR, "blobs")
+        self.compression_level = compression_level or settings.STORAGE_COMPRESSION_LEVEL
+
+    def _shard(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4])
+
+    def _meta_path(self, digest: str) -> str:
+        return os.path.join(self._shard(digest), f"{digest}.json")
+
+    def _data_path(self, digest: str, compression: Optional[str]) -> str:
+        suffix = ".gz" if compression else ""
+        return os.path.join(self._shard(digest), f"{digest}{suffix}")
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _write_meta(self, info: BlobInfo):
+        path = self._meta_path(info.digest)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(info.__dict__, f)
+        os.replace(tmp_path, path)
+
+    def info(self, digest: str) -> Optional[BlobInfo]:
+        try:
+            with open(self._meta_path(digest), "r", encoding="utf-8") as f:
+                info = BlobInfo(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+        if not os.path.exists(self._data_path(digest, info.compression)):
+            return None
+        return info
+
+    def _compress(self, source_path: str, target_path: str) -> int:
+        with open(source_path, "rb") as src, open(target_path, "wb") as raw:
+            # mtime=0 keeps the compressed bytes a pure function of the content
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=self.compression_level, mtime=0) as dst:
+                shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+        return os.path.getsize(target_path)
+
+    def put_file(self, source_path: str, digest: str, owner: str, compress: bool = False) -> BlobInfo:
+        if self.info(digest):
+            try:
+                info = self.add_ref(digest, owner)
+                os.remove(source_path)
+                return info
+            except FileNotFoundError:
+                pass  # released in the meantime; store it afresh
+
+        shard = self._shard(digest)
+        os.makedirs(shard, exist_ok=True)
+        size = os.path.getsize(source_path)
+        compression = None
+        staged = source_path
+
+        # Compress outside the lock; keep the result only if it actually saves space.
+        if compress and size:
+            tmp_path = os.path.join(shard, f".{uuid.uuid4().hex}.gz.tmp")
+            if self._compress(source_path, tmp_path) < size:
+                compression = self.COMPRESSION
+                staged = tmp_path
+            else:
+                os.remove(tmp_path)
+
+        with self._locked():
+            existing = self.info(digest)
+            if existing:
+                # Lost a race with an identical upload; keep theirs.
+                for path in {source_path, staged}:
+                    if os.path.exists(path):
+                        os.remove(path)
+                existing.refs = sorted(set(existing.refs) | {owner})
+                self._write_meta(existing)
+                return existing
+
+            data_path = self._data_path(digest, compression)
+            os.replace(staged, data_path)
+            if staged != source_path:
+                os.remove(source_path)
+            info = BlobInfo(
+                digest=digest,
+                size=size,
+                stored_size=os.path.getsize(data_path),
+                compression=compression,
+                refs=[owner]
+            )
+            self._write_meta(info)
+            return info
+
+    def add_ref(self, digest: str, owner: str) -> BlobInfo:
+        with self._locked():
+            info = self.info(digest)
+            if info is None:
+                raise FileNotFoundError(f"Blob {digest} not found")
+            if owner not in info.refs:
+                info.refs = sorted(info.refs + [owner])
+            self._write_meta(info)
+            return info
+
+    def release(self, digest: str, owner: str) -> int:
+        with self._locked():
+            info = self.info(digest)
+            if info is None:
+                return 0
+            info.refs = [ref for ref in info.refs if ref != owner]
+            if info.refs:
+                self._write_meta(info)
+                return 0
+            self._remove(info)
+            return info.stored_size
+
+    def _remove(self, info: BlobInfo):
+        for path in (self._data_path(info.digest, info.compression), self._meta_path(info.digest)):
+            if os.path.exists(path):
+                os.remove(path)
+        for directory in (self._shard(info.digest), os.path.dirname(self._shard(info.digest))):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+
+    def meta_mtime(self, digest: str) -> Optional[float]:
+        try:
+            return os.path.getmtime(self._meta_path(digest))
+        except OSError:
+            return None
+
+    def open(self, digest: str) -> BinaryIO:
+        info = self.info(digest)
+        if info is None:
+            raise FileNotFoundError(f"Blob {digest} not found")
+        path = self._data_path(digest, info.compression)
+        if info.compression == self.COMPRESSION:
+            return _GzipBlobReader(path, "rb")
+        return open(path, "rb")
+
+    def local_path(self, digest: str) -> Optional[str]:
+        info = self.info(digest)
+        if info is None or info.compression:
+            return None
+        return self._data_path(digest, None)
+
+    def iter_digests(self) -> Iterator[str]:
+        if not os.path.isdir(self.root):
+            return
+        for outer in sorted(os.listdir(self.root)):
+            outer_path = os.path.join(self.root, outer)
+            if len(outer) != 2 or not os.path.isdir(outer_path):
+                continue
+            for inner in sorted(os.listdir(outer_path)):
+                inner_path = os.path.join(outer_path, inner)
+                if not os.path.isdir(inner_path):
+                    continue
+                for name in sorted(os.listdir(inner_path)):
+                    if name.endswith(".json") and not name.startswith("."):
+                        yield name[:-len(".json")]
+
+
+_storage = None
+
+
+def get_storage() -> BlobStorage:
+    global _storage
+    if _storage is None:
+        _storage = LocalBlobStorage()
+    return _storage
+
+
+def should_compress(file_type: str) -> bool:
+    compressible = {ext.strip().lower() for ext in settings.STORAGE_COMPRESS_TYPES.split(",") if ext.strip()}
+    return file_type.lower() in compressible
@@ -0,0 +1,108 @@
+import os
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Optional
+from app.config import get_settings
+from app.utils.storage import BlobStorage, get_storage
+
+settings = get_settings()
+
+# Uploads are written here while they are hashed and processed, before they move into blob storage
+STAGING_DIR_NAME = ".staging"
+
+
+def file_id_from_source_name(source_name: str) -> str:
+    return source_name.split('_')[-1]
+
+
+def staging_path(file_id: str, filename: str, upload_dir: Optional[str] = None) -> str:
+    staging_dir = os.path.join(upload_dir or settings.UPLOAD_DIR, STAGING_DIR_NAME)
+    os.makedirs(staging_dir, exist_ok=True)
+    return os.path.join(staging_dir, f"{file_id}_{filename}")
+
+
+def find_upload_path(source_name: str, upload_dir: Optional[str] = None) -> Optional[str]:
+    """Locate the stored `{file_id}_{filename}` upload for a document source name"""
+    upload_dir = upload_dir or settings.UPLOAD_DIR
+    if not os.path.isdir(upload_dir):
+        return None
+
+    file_id = file_id_from_source_name(source_name)
+    for fname in os.listdir(upload_dir):
+        if file_id in fname:
+            return os.path.join(upload_dir, fname)
+    return None
+
+
+def index_upload_dir(upload_dir: Optional[str] = None) -> Dict[str, str]:
+    """Map file_id -> path for every upload, so bulk jobs scan the directory once"""
+    upload_dir = upload_dir or settings.UPLOAD_DIR
+    index = {}
+    if not os.path.isdir(upload_dir):
+        return index
+
+    with os.scandir(upload_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith(".") or "_" not in entry.name or not entry.is_file():
+                continue
+            index[entry.name.split("_", 1)[0]] = entry.path
+    return index
+
+
+@dataclass
+class StoredUpload:
+    """Where a document's bytes live: a content-addressed blob, or a legacy `{file_id}_{filename}` file"""
+    size: int
+    path: Optional[str] = None
+    digest: Optional[str] = None
+    storage: Optional[BlobStorage] = None
+
+    @property
+    def is_blob(self) -> bool:
+        return self.digest is not None
+
+    def open(self) -> BinaryIO:
+        if self.is_blob:
+            return self.storage.open(self.digest)
+        return open(self.path, "rb")
+
+    def release(self, owner: str) -> int:
+        """Drop `owner`'s claim on the bytes; returns bytes freed"""
+        if self.is_blob:
+            return self.storage.release(self.digest, owner)
+        try:
+            os.remove(self.path)
+            return self.size
+        except OSError:
+            return 0
+
+
+def locate_stored_upload(
+    source_name: str,
+    checksum_sha256: Optional[str],
+    upload_dir: Optional[str] = None,
+    storage: Optional[BlobStorage] = None,
+    legacy_index: Optional[Dict[str, str]] = None,
+) -> Optional[StoredUpload]:
+    """
+    Resolve a document to its stored bytes. `path` is set whenever the bytes on
+    disk are the original bytes (a legacy file or an uncompressed blob), so
+    callers can keep using path-based fast paths such as the checksum cache.
+    """
+    storage = storage or get_storage()
+    if checksum_sha256:
+        info = storage.info(checksum_sha256)
+        if info:
+            return StoredUpload(
+                size=info.size,
+                path=storage.local_path(checksum_sha256),
+                digest=checksum_sha256,
+                storage=storage
+            )
+
+    if legacy_index is not None:
+        path = legacy_index.get(file_id_from_source_name(source_name))
+    else:
+        path = find_upload_path(source_name, upload_dir)
+    if not path or not os.path.exists(path):
+        return None
+    return StoredUpload(size=os.path.getsize(path), path=path)
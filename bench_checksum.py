@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark the checksum engine against the original 4 KB read loop
+"""
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+from app.utils.checksum import ChecksumEngine
+
+SIZES_MB = [1, 16, 50]
+ROUNDS = 3
+
+
+def legacy_sha256(file_path: str) -> str:
+    """The original ChecksumUtils.compute_sha256_from_file implementation"""
+    sha256_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            sha256_hash.update(chunk)
+    return sha256_hash.hexdigest()
+
+
+def best_of(func, rounds: int = ROUNDS) -> float:
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    print("=" * 78)
+    print("CHECKSUM ENGINE BENCHMARK (best of %d)" % ROUNDS)
+    print("=" * 78)
+    print(f"{'size':>6} | {'legacy 4KB':>12} | {'engine sha256':>14} | {'sha256+blake2b':>15} | {'cache hit':>10}")
+    print("-" * 78)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size_mb in SIZES_MB:
+            path = os.path.join(tmp_dir, f"bench_{size_mb}mb.bin")
+            with open(path, "wb") as f:
+                for _ in range(size_mb):
+                    f.write(os.urandom(1024 * 1024))
+
+            assert legacy_sha256(path) == ChecksumEngine.hash_file(path, ("sha256",), use_cache=False)["sha256"]
+
+            legacy = best_of(lambda: legacy_sha256(path))
+            engine = best_of(lambda: ChecksumEngine.hash_file(path, ("sha256",), use_cache=False))
+            multi = best_of(lambda: ChecksumEngine.hash_file(path, use_cache=False))
+            ChecksumEngine.hash_file(path)
+            cached = best_of(lambda: ChecksumEngine.hash_file(path))
+
+            print(
+                f"{size_mb:>4}MB | {legacy * 1000:>10.1f}ms | {engine * 1000:>12.1f}ms | "
+                f"{multi * 1000:>13.1f}ms | {cached * 1000:>8.3f}ms"
+            )
+
+    print("-" * 78)
+    print(f"Cache: {ChecksumEngine.cache.stats()}")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Test script for content-addressed blob storage
+"""
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+from app.utils.checksum import ChecksumEngine
+from app.utils.storage import LocalBlobStorage
+
+
+def stage(directory, name, data):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path, hashlib.sha256(data).hexdigest()
+
+
+def test_identical_uploads_share_one_blob():
+    """Test that identical content is stored once and removed with its last reference"""
+    print("=" * 60)
+    print("TEST 1: Deduplication And Reference Counting")
+    print("=" * 60)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        storage = LocalBlobStorage(os.path.join(work_dir, "blobs"))
+        data = os.urandom(10000)
+        first, digest = stage(work_dir, "a.pdf", data)
+        second, _ = stage(work_dir, "b.pdf", data)
+
+        storage.put_file(first, digest, owner="doc-user1")
+        info = storage.put_file(second, digest, owner="doc-user2")
+        print(f"Refs: {info.refs}, stored in {storage._shard(digest)}")
+        assert info.refs == ["doc-user1", "doc-user2"]
+        assert not os.path.exists(first) and not os.path.exists(second), "Staged files should be consumed!"
+        assert list(storage.iter_digests()) == [digest]
+
+        assert storage.release(digest, "doc-user1") == 0, "Blob must survive while referenced!"
+        freed = storage.release(digest, "doc-user2")
+        print(f"Freed {freed} bytes on last release")
+        assert freed == 10000 and not storage.exists(digest)
+        assert os.listdir(os.path.join(work_dir, "blobs")) == [".lock"], "Empty shard directories should be removed!"
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_compressed_blob_reads_back_original():
+    """Test that text is stored compressed but every read API returns the original bytes"""
+    print("=" * 60)
+    print("TEST 2: Compression And Streaming Reads")
+    print("=" * 60)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        storage = LocalBlobStorage(os.path.join(work_dir, "blobs"))
+        data = b"".join(f"line {i}: the quick brown fox jumps over the lazy dog\n".encode() for i in range(20000))
+        path, digest = stage(work_dir, "notes.txt", data)
+
+        info = storage.put_file(path, digest, owner="doc", compress=True)
+        print(f"Original {info.size} bytes, stored {info.stored_size} bytes ({info.compression})")
+        assert info.compression == "gzip" and info.stored_size < info.size // 4
+        assert storage.local_path(digest) is None
+
+        with storage.open(digest) as f:
+            assert ChecksumEngine.hash_stream(f, ("sha256",))["sha256"] == digest
+        assert b"".join(storage.iter_range(digest, 123456, 223456, chunk_size=4096)) == data[123456:223456]
+        assert b"".join(storage.iter_range(digest, len(data) - 10)) == data[-10:]
+
+        incompressible, other = stage(work_dir, "random.txt", os.urandom(50000))
+        info = storage.put_file(incompressible, other, owner="doc", compress=True)
+        print(f"Random data stored as: {info.compression}")
+        assert info.compression is None and storage.local_path(other)
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    tests = [
+        ("Deduplication", test_identical_uploads_share_one_blob),
+        ("Compression", test_compressed_blob_reads_back_original),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
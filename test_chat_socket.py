@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Test script for the WebSocket chat channel: turns, backpressure, heartbeat and disconnects
+"""
+import asyncio
+import json
+import sys
+
+from app.ai_engine.gemini import GeminiEngine, InFlightLimiter
+from app.ai_engine.prompt import PromptAssembler
+from app.api.routes import chat
+from app.api.routes.chat import ChatSocket
+from app.config import get_settings
+from app.models import User
+from test_gemini_engine import FakeAsyncModel
+
+settings = get_settings()
+
+
+class FakeWebSocket:
+    """Client frames go in through `incoming`; everything the server sends lands in `sent`"""
+
+    def __init__(self):
+        self.incoming = asyncio.Queue()
+        self.sent = []
+        self.closed_with = None
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+    def client_sends(self, **frame):
+        self.incoming.put_nowait({"type": "websocket.receive", "text": json.dumps(frame)})
+
+    def client_leaves(self):
+        self.incoming.put_nowait({"type": "websocket.disconnect", "code": 1001})
+
+    def types(self):
+        return [frame["type"] for frame in self.sent]
+
+
+def patch_turns(model, completed):
+    """Answer turns from `model` without touching the database"""
+    async def prepare(chat_request, current_user, db):
+        return "s1", None, PromptAssembler(budget=1000).assemble(chat_request.message), None
+
+    def completion(session_id, user_id):
+        async def on_complete(reply):
+            completed.append(reply)
+            return {"session_id": session_id, "message_id": f"m{len(completed)}"}
+        return on_complete
+
+    originals = (chat.prepare_chat_turn, chat.chat_turn_completion, chat.gemini_engine, chat.SessionLocal)
+    chat.prepare_chat_turn = prepare
+    chat.chat_turn_completion = completion
+    chat.gemini_engine = GeminiEngine(async_model=model, limiter=InFlightLimiter(limit=4))
+    chat.SessionLocal = lambda: type("NoSession", (), {"close": lambda self: None})()
+    return originals
+
+
+def restore_turns(originals):
+    chat.prepare_chat_turn, chat.chat_turn_completion, chat.gemini_engine, chat.SessionLocal = originals
+
+
+async def wait_for_frame(websocket, kind, count=1):
+    while websocket.types().count(kind) < count:
+        await asyncio.sleep(0.005)
+
+
+def test_many_turns_on_one_socket():
+    """Test that turns are answered in order and pings are answered while a reply streams"""
+    print("=" * 60)
+    print("TEST 1: Many Turns")
+    print("=" * 60)
+
+    completed = []
+    originals = patch_turns(FakeAsyncModel(delay=0.01), completed)
+    try:
+        websocket = FakeWebSocket()
+
+        async def run():
+            connection = ChatSocket(websocket, User(id="u1"))
+            task = asyncio.create_task(connection.run())
+            websocket.client_sends(type="message", message="firewall rules explained")
+            websocket.client_sends(type="ping")
+            websocket.client_sends(type="message", message="ids alerts explained")
+            await wait_for_frame(websocket, "done", 2)
+            websocket.client_leaves()
+            await task
+
+        asyncio.run(run())
+    finally:
+        restore_turns(originals)
+
+    print(f"Frames: {websocket.types()}")
+    assert "pong" in websocket.types()
+    assert completed == ["firewall rules explained ", "ids alerts explained "]
+    dones = [frame for frame in websocket.sent if frame["type"] == "done"]
+    assert [frame["message_id"] for frame in dones] == ["m1", "m2"]
+    assert websocket.closed_with is None, "A client that left should not be sent a close"
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_backpressure_and_disconnect():
+    """Test that excess turns are refused and a client leaving mid-reply stores nothing"""
+    print("=" * 60)
+    print("TEST 2: Backpressure and Disconnect")
+    print("=" * 60)
+
+    completed = []
+    model = FakeAsyncModel(delay=0.2)
+    originals = patch_turns(model, completed)
+    try:
+        websocket = FakeWebSocket()
+
+        async def run():
+            connection = ChatSocket(websocket, User(id="u1"))
+            task = asyncio.create_task(connection.run())
+            for i in range(settings.CHAT_WS_MAX_PENDING_TURNS + 3):
+                websocket.client_sends(type="message", message=f"question {i} about malware")
+            websocket.client_sends(type="bogus")
+            await wait_for_frame(websocket, "chunk")
+            websocket.client_leaves()
+            await task
+
+        asyncio.run(run())
+    finally:
+        restore_turns(originals)
+
+    refused = [frame for frame in websocket.sent if frame.get("status") == 429]
+    print(f"Refused {len(refused)} turns, upstream streams cancelled: {model.cancelled}")
+    # The first turn leaves the queue while the first refusal is sent, making room for one more.
+    assert len(refused) == 2
+    assert any(frame.get("status") == 400 for frame in websocket.sent)
+    assert completed == [], "An abandoned reply must not be stored or charged!"
+    assert model.cancelled == 1 and model.active == 0
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_silent_client_is_closed():
+    """Test that the server pings and closes a client that stops answering"""
+    print("=" * 60)
+    print("TEST 3: Heartbeat")
+    print("=" * 60)
+
+    original = settings.CHAT_WS_HEARTBEAT_SECONDS
+    settings.CHAT_WS_HEARTBEAT_SECONDS = 0.05
+    try:
+        websocket = FakeWebSocket()
+        asyncio.run(asyncio.wait_for(ChatSocket(websocket, User(id="u1")).run(), 2))
+    finally:
+        settings.CHAT_WS_HEARTBEAT_SECONDS = original
+
+    print(f"Frames: {websocket.types()}, closed with {websocket.closed_with}")
+    assert websocket.types().count("ping") >= 1
+    assert websocket.closed_with == 1001
+
+    print("✓ PASSED\n")
+    return True
+
+
+def main():
+    tests = [
+        ("Many Turns", test_many_turns_on_one_socket),
+        ("Backpressure and Disconnect", test_backpressure_and_disconnect),
+        ("Heartbeat", test_silent_client_is_closed),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
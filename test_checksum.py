@@ -150,6 +150,110 @@ def test_large_file():
         if os.path.exists(test_file):
             os.remove(test_file)
 
+def test_multi_digest_single_pass():
+    """Test SHA256 + BLAKE2b computed together match hashlib"""
+    print("=" * 60)
+    print("TEST 6: Multi-Digest Engine (buffered and mmap paths)")
+    print("=" * 60)
+    
+    from app.utils.checksum import ChecksumEngine
+    
+    small_file = "/tmp/test_multi_small.bin"
+    large_file = "/tmp/test_multi_large.bin"
+    small_content = b"small file content\n" * 100
+    large_content = os.urandom(ChecksumEngine.MMAP_THRESHOLD + 12345)
+    
+    with open(small_file, "wb") as f:
+        f.write(small_content)
+    with open(large_file, "wb") as f:
+        f.write(large_content)
+    
+    try:
+        for path, content in ((small_file, small_content), (large_file, large_content)):
+            digests = ChecksumEngine.hash_file(path, use_cache=False)
+            print(f"{path}: sha256={digests['sha256'][:16]}... blake2b={digests['blake2b'][:16]}...")
+            assert digests["sha256"] == hashlib.sha256(content).hexdigest(), "SHA256 mismatch!"
+            assert digests["blake2b"] == hashlib.blake2b(content).hexdigest(), "BLAKE2b mismatch!"
+        
+        print("✓ PASSED\n")
+        return True
+    finally:
+        for path in (small_file, large_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+def test_checksum_cache():
+    """Test stat-keyed cache hits on untouched files and misses after writes"""
+    print("=" * 60)
+    print("TEST 7: Stat-Keyed Checksum Cache")
+    print("=" * 60)
+    
+    from app.utils.checksum import ChecksumEngine
+    
+    test_file = "/tmp/test_checksum_cache.txt"
+    with open(test_file, "wb") as f:
+        f.write(b"original content")
+    
+    try:
+        ChecksumEngine.cache.clear()
+        first = ChecksumUtils.compute_sha256_from_file(test_file)
+        second = ChecksumUtils.compute_sha256_from_file(test_file)
+        stats = ChecksumEngine.cache.stats()
+        print(f"Cache stats after two reads: {stats}")
+        assert first == second
+        assert stats["hits"] == 1, "Second read of untouched file should hit the cache!"
+        
+        with open(test_file, "wb") as f:
+            f.write(b"tampered content!")
+        
+        changed = ChecksumUtils.compute_sha256_from_file(test_file)
+        print(f"Checksum after rewrite: {changed}")
+        assert changed == hashlib.sha256(b"tampered content!").hexdigest(), "Stale cache entry returned!"
+        
+        uncached = ChecksumUtils.compute_sha256_from_file(test_file, use_cache=False)
+        assert uncached == changed
+        
+        print("✓ PASSED\n")
+        return True
+    finally:
+        ChecksumEngine.cache.clear()
+        if os.path.exists(test_file):
+            os.remove(test_file)
+
+def test_verification_bypasses_cache():
+    """Test that document verification sees in-place corruption that keeps size and mtime"""
+    print("=" * 60)
+    print("TEST 8: Verification Ignores The Cache")
+    print("=" * 60)
+    
+    from app.api.routes.training import stored_sha256
+    from app.utils.checksum import ChecksumEngine
+    from app.utils.uploads import StoredUpload
+    
+    test_file = "/tmp/test_checksum_bitrot.txt"
+    with open(test_file, "wb") as f:
+        f.write(b"original content")
+    
+    try:
+        ChecksumEngine.cache.clear()
+        original = ChecksumUtils.compute_sha256_from_file(test_file)
+        stat = os.stat(test_file)
+        with open(test_file, "r+b") as f:
+            f.write(b"O")
+        os.utime(test_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        
+        assert ChecksumUtils.compute_sha256_from_file(test_file) == original, "Expected the cache to be fooled"
+        verified = stored_sha256(StoredUpload(size=stat.st_size, path=test_file))
+        print(f"Cached: {original[:16]}..., verified: {verified[:16]}...")
+        assert verified == hashlib.sha256(b"Original content").hexdigest(), "Verification served a cached digest!"
+        
+        print("✓ PASSED\n")
+        return True
+    finally:
+        ChecksumEngine.cache.clear()
+        if os.path.exists(test_file):
+            os.remove(test_file)
+
 def main():
     """Run all tests"""
     print("\n" + "=" * 60)
@@ -162,6 +266,9 @@ def main():
         ("File Checksum", test_file_checksum),
         ("Case-Insensitive Comparison", test_case_insensitive_comparison),
         ("Large File Handling", test_large_file),
+        ("Multi-Digest Engine", test_multi_digest_single_pass),
+        ("Checksum Cache", test_checksum_cache),
+        ("Verification Bypasses Cache", test_verification_bypasses_cache),
     ]
     
     passed = 0
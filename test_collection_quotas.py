@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test script for collection memory accounting and per-tier quotas
+"""
+import sys
+
+from app.training.quotas import MEGABYTE, QuotaExceededError, check_quota, parse_quotas
+from app.training.vector_store import VectorStore
+
+
+def test_usage_tracks_adds_updates_and_deletes():
+    """Test that usage grows with each chunk and returns to zero when everything is removed"""
+    print("=" * 60)
+    print("TEST 1: Collection Usage Accounting")
+    print("=" * 60)
+
+    store = VectorStore()
+    chunks = [f"chunk {i} about sql injection and parameterized queries" for i in range(10)]
+    estimate = store.estimate_usage(chunks, {"filename": "sqli.txt"}, source_name="sqli.txt_1")
+    store.add_documents("u1", "sqli.txt_1", chunks, {"filename": "sqli.txt"})
+    usage = store.collection_usage("u1")
+    print(f"After add: {usage}")
+    assert usage["chunks"] == 10 and usage["text_bytes"] == sum(len(c) for c in chunks)
+    assert usage["vector_bytes"] == 10 * 768 * 8
+    assert abs(usage["total_bytes"] - estimate["total_bytes"]) < 100, "Estimate should match what gets stored!"
+    assert store.source_usage("u1", "sqli.txt_1") == usage
+
+    store.update_source_chunks("u1", "sqli.txt_1", chunks[:5] + ["a brand new chunk"], {"filename": "sqli-v2.txt"})
+    assert store.collection_usage("u1")["chunks"] == 6
+    store.add_documents("u2", "tiny.txt_2", ["tiny"])
+    report = store.usage_report(top_n=1)
+    assert [entry["user_id"] for entry in report] == ["u1"]
+
+    store.delete_collection_by_source("u1", "sqli.txt_1")
+    usage = store.collection_usage("u1")
+    print(f"After delete: {usage}")
+    assert all(value == 0 for value in usage.values()), "Deleting every chunk must release all accounted bytes!"
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_quota_parsing_and_checks():
+    """Test tier quota parsing and the over-quota decision"""
+    print("=" * 60)
+    print("TEST 2: Tier Quotas")
+    print("=" * 60)
+
+    quotas = parse_quotas("free=25, Pro=200,enterprise=0,broken")
+    print(f"Parsed: {quotas}")
+    assert quotas == {"free": 25 * MEGABYTE, "pro": 200 * MEGABYTE, "enterprise": 0}
+
+    check_quota(90, 10, 100)
+    check_quota(10 ** 12, 10, None)
+    try:
+        check_quota(95, 10, 100)
+        raise AssertionError("Should have exceeded the quota!")
+    except QuotaExceededError as e:
+        print(f"Rejected: {e}")
+        assert e.quota_bytes == 100
+
+    print("✓ PASSED\n")
+    return True
+
+
+def main():
+    tests = [
+        ("Usage Accounting", test_usage_tracks_adds_updates_and_deletes),
+        ("Tier Quotas", test_quota_parsing_and_checks),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
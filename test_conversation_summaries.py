@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Test script for rolling summaries of long chat sessions
+"""
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.ai_engine.conversation import ConversationSummarizer, run_conversation_summarizer_forever
+from app.ai_engine.prompt import PromptAssembler
+from app.models import Base, ChatMessage, ChatSession, ChatSessionSummary, User
+from app.training.summaries import ExtractiveSummarizer
+
+
+class RecordingSummarizer(ExtractiveSummarizer):
+    """The offline stub, remembering what it was asked to summarize"""
+
+    def __init__(self):
+        self.calls = []
+
+    def summarize(self, texts, max_words):
+        self.calls.append(list(texts))
+        return super().summarize(texts, max_words)
+
+
+def make_session(messages):
+    work_dir = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(work_dir, 'test.db')}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    db = Session()
+    user = User(email="chat@example.com", username="chat", hashed_password="")
+    db.add(user)
+    db.commit()
+    session = ChatSession(user_id=user.id)
+    db.add(session)
+    db.commit()
+    session_id = session.id
+    db.close()
+    add_messages(Session, session_id, 0, messages)
+    return work_dir, Session, session_id
+
+
+def add_messages(Session, session_id, start, count):
+    db = Session()
+    base = datetime(2026, 1, 1)
+    for i in range(start, start + count):
+        role = "user" if i % 2 == 0 else "assistant"
+        db.add(ChatMessage(
+            session_id=session_id,
+            role=role,
+            content=f"Message {i} covers nmap scan technique number {i}.",
+            created_at=base + timedelta(seconds=i)
+        ))
+    db.commit()
+    db.close()
+
+
+def test_incremental_summaries():
+    """Test that aged-out turns are folded in every N turns and each update only reads the new ones"""
+    print("=" * 60)
+    print("TEST 1: Incremental Summaries")
+    print("=" * 60)
+
+    work_dir, Session, session_id = make_session(25)
+    try:
+        backend = RecordingSummarizer()
+        summarizer = ConversationSummarizer(Session, backend, every_turns=10, keep_recent=6, max_words=60)
+
+        report = summarizer.run_pass()
+        print(f"First pass: {report}")
+        assert report == {"checked": 1, "summarized": 1, "failed": 0}
+        db = Session()
+        record = db.query(ChatSessionSummary).filter(ChatSessionSummary.session_id == session_id).first()
+        assert record.message_count == 19, "Everything but the 6 recent messages should be covered"
+        assert record.covered_until == datetime(2026, 1, 1) + timedelta(seconds=18)
+        db.close()
+
+        add_messages(Session, session_id, 25, 5)
+        assert summarizer.run_pass() == {"checked": 0, "summarized": 0, "failed": 0}, "Only 5 new aged turns: not due yet"
+
+        add_messages(Session, session_id, 30, 5)
+        report = summarizer.run_pass()
+        db = Session()
+        record = db.query(ChatSessionSummary).filter(ChatSessionSummary.session_id == session_id).first()
+        print(f"Second pass: {report}, covers {record.message_count}: {record.summary[:80]}...")
+        assert report["summarized"] == 1 and record.message_count == 29
+        db.close()
+
+        second = backend.calls[-1]
+        assert len(second) == 11, "The update should read the old summary and the 10 new turns only"
+        assert second[1].startswith("Tutor: Message 19")
+    finally:
+        shutil.rmtree(work_dir)
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_prompt_carries_summary():
+    """Test that the summary rides in the system instruction and is dropped before the question"""
+    print("=" * 60)
+    print("TEST 2: Summary In The Prompt")
+    print("=" * 60)
+
+    history = [{"role": "user", "parts": [{"text": "recent question"}]}]
+    prompt = PromptAssembler(budget=1000).assemble(
+        "what next?", system_instruction="You are a tutor", history=history, summary="We covered nmap."
+    )
+    print(f"Instruction: {prompt.system_instruction!r}")
+    assert prompt.system_instruction.startswith("You are a tutor") and prompt.system_instruction.endswith("We covered nmap.")
+    assert prompt.report.summary_tokens > 0 and prompt.history == history
+
+    prompt = PromptAssembler(budget=20).assemble("what next?", system_instruction="tutor", summary="x" * 400)
+    assert prompt.report.summary_dropped and prompt.system_instruction == "tutor"
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_background_job_follows_turns():
+    """Test that notified sessions are summarized without waiting for the sweep"""
+    print("=" * 60)
+    print("TEST 3: Background Job")
+    print("=" * 60)
+
+    work_dir, Session, session_id = make_session(12)
+    try:
+        summarizer = ConversationSummarizer(Session, RecordingSummarizer(), every_turns=4, keep_recent=8)
+        summarizer.notify(session_id)
+        assert summarizer.take_notified() == [], "Nothing should queue while the job is not running"
+
+        async def run():
+            task = asyncio.create_task(run_conversation_summarizer_forever(summarizer))
+            while not summarizer.active:
+                await asyncio.sleep(0.01)
+            summarizer.notify(session_id)
+            for _ in range(200):
+                db = Session()
+                done = db.query(ChatSessionSummary).count()
+                db.close()
+                if done:
+                    break
+                await asyncio.sleep(0.01)
+            summarizer.stop()
+            await task
+            return done
+
+        assert asyncio.run(run()) == 1
+        assert not summarizer.active
+
+        db = Session()
+        db.delete(db.query(ChatSession).first())
+        db.commit()
+        assert db.query(ChatSessionSummary).count() == 0, "Deleting a session should delete its summary"
+        db.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+    print("✓ PASSED\n")
+    return True
+
+
+def main():
+    tests = [
+        ("Incremental Summaries", test_incremental_summaries),
+        ("Summary In The Prompt", test_prompt_carries_summary),
+        ("Background Job", test_background_job_follows_turns),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
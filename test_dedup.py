@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Test script for MinHash/LSH near-duplicate chunk suppression
+"""
+import random
+import sys
+
+from app.training.dedup import MinHasher
+from app.training.vector_store import VectorStore
+
+DISCLAIMER = " ".join(
+    "this material is provided for educational purposes only and must not be used against systems "
+    "you do not own or have explicit written permission to test all rights reserved".split() * 3
+)
+
+
+def random_text(rng, words=120):
+    return " ".join(f"term{rng.randrange(5000)}" for _ in range(words))
+
+
+def test_signature_estimates_similarity():
+    """Test that signature agreement tracks shingle-set Jaccard similarity"""
+    print("=" * 60)
+    print("TEST 1: MinHash Similarity Estimate")
+    print("=" * 60)
+
+    rng = random.Random(7)
+    hasher = MinHasher(num_perm=128)
+    base = random_text(rng, 400).split()
+    edited = list(base)
+    edited[200] = "changed"
+
+    near = MinHasher.similarity(hasher.signature(" ".join(base)), hasher.signature(" ".join(edited)))
+    far = MinHasher.similarity(hasher.signature(" ".join(base)), hasher.signature(random_text(rng, 400)))
+    exact_a, exact_b = set(hasher.shingles(" ".join(base))), set(hasher.shingles(" ".join(edited)))
+    exact = len(exact_a & exact_b) / len(exact_a | exact_b)
+    print(f"One-word edit: estimate={near:.3f} exact={exact:.3f}; unrelated: {far:.3f}")
+    assert abs(near - exact) < 0.1, "Estimate should be close to the exact Jaccard similarity!"
+    assert far < 0.1
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_duplicates_collapse_and_promote():
+    """Test that boilerplate collapses to one canonical chunk and survives deleting its source"""
+    print("=" * 60)
+    print("TEST 2: Collapse And Promote")
+    print("=" * 60)
+
+    rng = random.Random(11)
+    store = VectorStore()
+    for name in ("week1.pdf_a", "week2.pdf_b", "week3.pdf_c"):
+        store.add_documents("u1", name, [DISCLAIMER, random_text(rng)])
+
+    results = store.retrieve("u1", "educational purposes written permission", n_results=5)
+    disclaimer_hits = [r for r in results if "educational purposes" in r["content"]]
+    print(f"Disclaimer hits: {len(disclaimer_hits)}, also in: {disclaimer_hits[0]['duplicate_sources']}")
+    assert len(disclaimer_hits) == 1, "Near-identical chunks should be returned once!"
+    assert disclaimer_hits[0]["source"] == "week1.pdf_a"
+    assert disclaimer_hits[0]["duplicate_sources"] == ["week2.pdf_b", "week3.pdf_c"]
+
+    store.delete_collection_by_source("u1", "week1.pdf_a")
+    results = store.retrieve("u1", "educational purposes written permission", n_results=5)
+    disclaimer_hits = [r for r in results if "educational purposes" in r["content"]]
+    print(f"After deleting week1: {disclaimer_hits[0]['source']} also in {disclaimer_hits[0]['duplicate_sources']}")
+    assert len(disclaimer_hits) == 1 and disclaimer_hits[0]["source"] == "week2.pdf_b"
+    assert disclaimer_hits[0]["duplicate_sources"] == ["week3.pdf_c"]
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_query_results_are_diversified():
+    """Test that top-k skips results that are too similar to one already selected"""
+    print("=" * 60)
+    print("TEST 3: Diversified Top-K")
+    print("=" * 60)
+
+    rng = random.Random(3)
+    base = random_text(rng, 300).split()
+    variants = []
+    for i in range(4):
+        variant = list(base)
+        for j in range(i * 20, i * 20 + 20):
+            variant[j] = f"edit{i}_{j}"
+        variants.append(" ".join(variant))
+
+    store = VectorStore()
+    store.add_documents("u1", "slides.pdf_x", variants + [random_text(rng, 300) for _ in range(3)])
+
+    query = " ".join(base[100:140])
+    results = store.retrieve("u1", query, n_results=4)
+    near_copies = [r for r in results if r["content"] in variants]
+    print(f"Returned {len(results)} results, {len(near_copies)} from the near-identical slide variants")
+    assert len(near_copies) == 1, "Only one of the slide variants should make the top-k!"
+    assert len(results) == 4
+
+    print("✓ PASSED\n")
+    return True
+
+
+def main():
+    tests = [
+        ("MinHash Similarity", test_signature_estimates_similarity),
+        ("Collapse And Promote", test_duplicates_collapse_and_promote),
+        ("Diversified Top-K", test_query_results_are_diversified),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
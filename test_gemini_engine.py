@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Test script for the stateless Gemini engine, its model pool and the async and streaming paths
+"""
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.ai_engine.gemini import GeminiEngine, GeminiTimeout, InFlightLimiter, ModelPool, ModelPoolExhausted, make_model
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Answers with the first user turn of the history it was started with"""
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def start_chat(self, history=None):
+        class Chat:
+            def send_message(self, message):
+                with FakeModel.lock:
+                    FakeModel.active += 1
+                    FakeModel.peak = max(FakeModel.peak, FakeModel.active)
+                time.sleep(0.02)
+                with FakeModel.lock:
+                    FakeModel.active -= 1
+                first = history[0]["parts"][0]["text"] if history else "none"
+                return FakeResponse(f"{first} | {message}")
+
+        return Chat()
+
+
+class FakeAsyncModel:
+    """Async replies after `delay` seconds, echoing the history's first turn"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+        self.cancelled = 0
+
+    def start_chat(self, history=None):
+        model = self
+
+        class Chat:
+            async def send_message_async(self, message, stream=False, request_options=None):
+                if stream:
+                    return FakeStream(model, message.split())
+                model.active += 1
+                model.peak = max(model.peak, model.active)
+                try:
+                    await asyncio.sleep(model.delay)
+                except asyncio.CancelledError:
+                    model.cancelled += 1
+                    raise
+                finally:
+                    model.active -= 1
+                first = history[0]["parts"][0]["text"] if history else "none"
+                return FakeResponse(f"{first} | {message}")
+
+        return Chat()
+
+
+class FakeStream:
+    """A streamed reply: one chunk per word, `delay` seconds apart"""
+
+    def __init__(self, model, words):
+        self.model = model
+        self.words = words
+
+    async def __aiter__(self):
+        self.model.active += 1
+        try:
+            for word in self.words:
+                await asyncio.sleep(self.model.delay)
+                yield FakeResponse(word + " ")
+        except (asyncio.CancelledError, GeneratorExit):
+            self.model.cancelled += 1
+            raise
+        finally:
+            self.model.active -= 1
+
+
+def test_concurrent_conversations_stay_separate():
+    """Test that parallel calls each see only their own history"""
+    print("=" * 60)
+    print("TEST 1: Concurrent Conversations")
+    print("=" * 60)
+
+    engine = GeminiEngine(ModelPool(size=3, factory=FakeModel))
+
+    def converse(i):
+        history = [{"role": "user", "parts": [{"text": f"user-{i}"}]}]
+        return i, engine.send_message(f"question-{i}", history=history)
+
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        results = list(executor.map(converse, range(40)))
+
+    for i, reply in results:
+        assert reply == f"user-{i} | question-{i}", f"Reply crossed conversations: {reply}"
+    print(f"40 replies matched their own history; peak concurrency {FakeModel.peak}")
+    assert FakeModel.peak <= 3, "Pool should bound concurrent model calls!"
+    assert engine.send_message("q", context="ctx") == "none | Context:\nctx\n\nUser Question:\nq"
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_pool_exhaustion():
+    """Test that a caller gives up when every model stays busy"""
+    print("=" * 60)
+    print("TEST 2: Pool Exhaustion")
+    print("=" * 60)
+
+    pool = ModelPool(size=1, factory=FakeModel)
+    with pool.acquire():
+        try:
+            with pool.acquire(timeout=0.05):
+                raise AssertionError("Second acquire should have timed out!")
+        except ModelPoolExhausted as e:
+            print(f"Rejected: {e}")
+    assert pool.stats() == {"size": 1, "in_use": 0, "waits": 1}
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_models_have_their_own_clients():
+    """Test that pooled models do not share the library's default client"""
+    print("=" * 60)
+    print("TEST 3: Separate Clients")
+    print("=" * 60)
+
+    first, second = make_model(), make_model()
+    assert first._client is not None and first._client is not second._client
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_async_calls_share_the_loop():
+    """Test that hundreds of async chats wait on the model without blocking the event loop"""
+    print("=" * 60)
+    print("TEST 4: Async In-Flight Limit")
+    print("=" * 60)
+
+    model = FakeAsyncModel(delay=0.05)
+    limiter = InFlightLimiter(limit=50)
+    engine = GeminiEngine(async_model=model, limiter=limiter)
+
+    async def run():
+        ticks = 0
+        done = asyncio.Event()
+
+        async def ticker():
+            nonlocal ticks
+            while not done.is_set():
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticking = asyncio.create_task(ticker())
+        replies = await asyncio.gather(*(
+            engine.send_message_async(f"q{i}", history=[{"role": "user", "parts": [{"text": f"u{i}"}]}], timeout=5)
+            for i in range(300)
+        ))
+        done.set()
+        await ticking
+        return replies, ticks
+
+    started = time.monotonic()
+    replies, ticks = asyncio.run(run())
+    elapsed = time.monotonic() - started
+    print(f"300 replies in {elapsed:.2f}s, peak in flight {model.peak}, loop ticked {ticks} times")
+    assert replies == [f"u{i} | q{i}" for i in range(300)]
+    assert model.peak == 50, "Limiter should cap calls awaiting the model!"
+    assert ticks > 20, "The event loop should keep running while calls wait"
+    assert limiter.stats()["in_flight"] == 0 and limiter.stats()["waiting"] == 0
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_async_timeout_and_cancellation():
+    """Test that timeouts and cancelled callers cancel the upstream call and free their slot"""
+    print("=" * 60)
+    print("TEST 5: Async Timeout and Cancellation")
+    print("=" * 60)
+
+    model = FakeAsyncModel(delay=1.0)
+    limiter = InFlightLimiter(limit=1)
+    engine = GeminiEngine(async_model=model, limiter=limiter)
+
+    async def run():
+        try:
+            await engine.send_message_async("slow", timeout=0.05)
+            raise AssertionError("Should have timed out!")
+        except GeminiTimeout as e:
+            print(f"Timed out: {e}")
+
+        task = asyncio.create_task(engine.send_message_async("abandoned", timeout=5))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+        model.delay = 0.01
+        return await engine.send_message_async("next", timeout=1)
+
+    reply = asyncio.run(run())
+    print(f"Upstream calls cancelled: {model.cancelled}, stats {limiter.stats()}")
+    assert reply == "none | next", "The slot should be free again"
+    assert model.cancelled == 2
+    assert limiter.stats() == {"limit": 1, "in_flight": 0, "waiting": 0, "timeouts": 1}
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_streamed_reply():
+    """Test chunked replies, a stream deadline, and a client leaving mid-stream"""
+    print("=" * 60)
+    print("TEST 6: Streamed Replies")
+    print("=" * 60)
+
+    model = FakeAsyncModel(delay=0.01)
+    limiter = InFlightLimiter(limit=1)
+    engine = GeminiEngine(async_model=model, limiter=limiter)
+
+    async def run():
+        chunks = [text async for text in engine.stream_message_async("one two three", timeout=1)]
+        assert chunks == ["one ", "two ", "three "], chunks
+
+        model.delay = 0.1
+        try:
+            async for _ in engine.stream_message_async("a b c d e f", timeout=0.25):
+                pass
+            raise AssertionError("Stream should have timed out!")
+        except GeminiTimeout as e:
+            print(f"Timed out: {e}")
+
+        stream = engine.stream_message_async("left early", timeout=5)
+        assert await stream.__anext__() == "left "
+        await stream.aclose()
+        assert limiter.stats()["in_flight"] == 0, "Closing the stream should free its slot"
+
+    asyncio.run(run())
+    print(f"Upstream streams cancelled: {model.cancelled}, stats {limiter.stats()}")
+    assert model.cancelled == 2 and model.active == 0
+    assert limiter.stats() == {"limit": 1, "in_flight": 0, "waiting": 0, "timeouts": 1}
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_sse_reply_completion():
+    """Test that the disclaimer leads the stream and the reply is kept only once it has finished"""
+    print("=" * 60)
+    print("TEST 7: SSE Reply Completion")
+    print("=" * 60)
+
+    from app.api.routes.chat import stream_reply
+
+    completed = []
+
+    async def on_complete(reply):
+        completed.append(reply)
+        return {"message_id": "m1"}
+
+    async def words(*items):
+        for item in items:
+            yield item
+
+    async def failing():
+        yield "partial "
+        raise GeminiTimeout("Gemini did not finish within 1s")
+
+    async def run():
+        events = [event async for event in stream_reply(words("alpha ", "beta"), "NOTE ", on_complete, {"session_id": "s1"})]
+        assert [event.split("\n")[0] for event in events] == [
+            "event: start", "event: chunk", "event: chunk", "event: chunk", "event: done"
+        ]
+        assert '"NOTE "' in events[1] and '"m1"' in events[-1]
+
+        events = [event async for event in stream_reply(failing(), "", on_complete, {})]
+        assert events[-1].startswith("event: error") and '"status": 504' in events[-1]
+
+        body = stream_reply(words("never ", "finished"), "", on_complete, {})
+        await body.__anext__()
+        await body.__anext__()
+        await body.aclose()
+
+    asyncio.run(run())
+    print(f"Completed replies: {completed}")
+    assert completed == ["NOTE alpha beta"], "Failed or abandoned streams must not be stored or charged!"
+
+    print("✓ PASSED\n")
+    return True
+
+
+def main():
+    tests = [
+        ("Concurrent Conversations", test_concurrent_conversations_stay_separate),
+        ("Pool Exhaustion", test_pool_exhaustion),
+        ("Separate Clients", test_models_have_their_own_clients),
+        ("Async In-Flight Limit", test_async_calls_share_the_loop),
+        ("Async Timeout and Cancellation", test_async_timeout_and_cancellation),
+        ("Streamed Replies", test_streamed_reply),
+        ("SSE Reply Completion", test_sse_reply_completion),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Test script for the in-process chat history cache
+"""
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.ai_engine.history import SessionHistoryCache
+from app.models import Base, ChatMessage, ChatSession, User
+
+
+def make_environment(sessions=1, messages=30):
+    work_dir = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(work_dir, 'test.db')}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+
+    db = Session()
+    user = User(email="history@example.com", username="history", hashed_password="")
+    db.add(user)
+    db.commit()
+    session_ids = []
+    for _ in range(sessions):
+        session = ChatSession(user_id=user.id)
+        db.add(session)
+        db.commit()
+        session_ids.append(session.id)
+        for i in range(messages):
+            db.add(message(session.id, i))
+        db.commit()
+    db.close()
+    return work_dir, Session, session_ids, statements
+
+
+def message(session_id, i):
+    return ChatMessage(
+        session_id=session_id,
+        role="user" if i % 2 == 0 else "assistant",
+        content=f"message {i}",
+        created_at=datetime(2026, 1, 1) + timedelta(seconds=i)
+    )
+
+
+def message_reads(statements):
+    return [s for s in statements if s.lstrip().upper().startswith("SELECT") and "chat_messages" in s]
+
+
+def test_warm_sessions_skip_the_database():
+    """Test that a cold miss reads only the last N messages and later turns read none"""
+    print("=" * 60)
+    print("TEST 1: Warm And Cold Sessions")
+    print("=" * 60)
+
+    work_dir, Session, (session_id,), statements = make_environment(messages=30)
+    try:
+        cache = SessionHistoryCache(max_sessions=10, max_turns=8)
+        db = Session()
+
+        history = cache.history(db, session_id)
+        reads = message_reads(statements)
+        print(f"Cold miss: {len(reads)} read, {len(history)} turns")
+        assert len(reads) == 1 and "LIMIT" in reads[0].upper()
+        assert [turn["parts"][0]["text"] for turn in history] == [f"message {i}" for i in range(22, 30)]
+        assert history[0]["role"] == "user" and history[1]["role"] == "model"
+
+        for i in range(30, 34):
+            stored = message(session_id, i)
+            db.add(stored)
+            db.commit()
+            cache.append(session_id, stored)
+            statements.clear()
+            history = cache.history(db, session_id)
+            assert not message_reads(statements), "A warm session should not read messages"
+        assert history[-1]["parts"][0]["text"] == "message 33" and len(history) == 8
+
+        after = datetime(2026, 1, 1) + timedelta(seconds=31)
+        assert [turn["parts"][0]["text"] for turn in cache.history(db, session_id, after=after)] == ["message 32", "message 33"]
+        print(f"Stats: {cache.stats()}")
+        assert cache.stats() == {"sessions": 1, "hits": 5, "misses": 1}
+        db.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_eviction_and_invalidation():
+    """Test that the least recently used session is evicted and a deleted one is forgotten"""
+    print("=" * 60)
+    print("TEST 2: Eviction And Invalidation")
+    print("=" * 60)
+
+    work_dir, Session, session_ids, statements = make_environment(sessions=3, messages=4)
+    try:
+        cache = SessionHistoryCache(max_sessions=2, max_turns=10)
+        db = Session()
+        first, second, third = session_ids
+        cache.history(db, first)
+        cache.history(db, second)
+        cache.history(db, first)
+        cache.history(db, third)
+        assert cache.stats()["sessions"] == 2
+
+        statements.clear()
+        cache.history(db, first)
+        assert not message_reads(statements), "The recently used session should have been kept"
+        cache.history(db, second)
+        assert len(message_reads(statements)) == 1, "The least recently used session should have been evicted"
+
+        cache.invalidate(first)
+        cache.start("new-session")
+        statements.clear()
+        assert cache.history(db, "new-session") == []
+        assert not message_reads(statements)
+        assert "new-session" in cache._sessions and first not in cache._sessions
+        db.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+    print("✓ PASSED\n")
+    return True
+
+
+def main():
+    tests = [
+        ("Warm And Cold Sessions", test_warm_sessions_skip_the_database),
+        ("Eviction And Invalidation", test_eviction_and_invalidation),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Test script for per-block Merkle tree checksums
+"""
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import security
+from app.api.routes import training
+from app.database import get_db
+from app.models import Base, TrainingDocument, User
+from app.utils.merkle import MerkleTree, hash_file_with_merkle, hash_leaf, hash_node, verify_blocks
+
+BLOCK = 1024
+
+
+def reference_root(data: bytes, block_size: int) -> bytes:
+    """Straight transcription of the documented client-side algorithm"""
+    level = [hash_leaf(data[i:i + block_size]) for i in range(0, max(len(data), 1), block_size)]
+    while len(level) > 1:
+        nxt = [hash_node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            nxt.append(level[-1])
+        level = nxt
+    return level[0]
+
+
+def test_root_matches_reference():
+    """Test streaming build matches the documented format for awkward sizes"""
+    print("=" * 60)
+    print("TEST 1: Merkle Root Matches Client Format")
+    print("=" * 60)
+
+    test_file = "/tmp/test_merkle_root.bin"
+    try:
+        for size in (0, 1, BLOCK - 1, BLOCK, BLOCK + 1, 7 * BLOCK + 3):
+            data = os.urandom(size)
+            with open(test_file, "wb") as f:
+                f.write(data)
+            sha256, file_size, tree = hash_file_with_merkle(test_file, BLOCK)
+            print(f"size={size:>5} leaves={tree.leaf_count} root={tree.root_hex[:16]}...")
+            assert tree.root == reference_root(data, BLOCK), f"Root mismatch for size {size}!"
+            assert sha256 == hashlib.sha256(data).hexdigest() and file_size == size
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        if os.path.exists(test_file):
+            os.remove(test_file)
+
+
+def test_proofs_are_logarithmic():
+    """Test every block proof verifies and has at most ceil(log2(n)) steps"""
+    print("=" * 60)
+    print("TEST 2: Audit Proofs")
+    print("=" * 60)
+
+    leaves = [hash_leaf(bytes([i])) for i in range(13)]
+    tree = MerkleTree(leaves, BLOCK)
+    for index in range(tree.leaf_count):
+        proof = tree.proof(index)
+        assert len(proof) <= 4, "Proof longer than ceil(log2(13))!"
+        assert MerkleTree.verify_proof(leaves[index], proof, tree.root), f"Proof for block {index} failed!"
+        assert not MerkleTree.verify_proof(hash_leaf(b"forged"), proof, tree.root)
+
+    print(f"Verified {tree.leaf_count} proofs against root {tree.root_hex[:16]}...")
+    print("✓ PASSED\n")
+    return True
+
+
+def test_diff_pinpoints_regions():
+    """Test tree diff and range verification locate modified blocks"""
+    print("=" * 60)
+    print("TEST 3: Pinpoint Differing Regions")
+    print("=" * 60)
+
+    test_file = "/tmp/test_merkle_diff.bin"
+    original = os.urandom(10 * BLOCK + 17)
+    with open(test_file, "wb") as f:
+        f.write(original)
+
+    try:
+        tree = MerkleTree.from_file(test_file, BLOCK)
+
+        tampered = bytearray(original)
+        tampered[3 * BLOCK + 5] ^= 0xFF
+        tampered[4 * BLOCK] ^= 0xFF
+        tampered[-1] ^= 0xFF
+        with open(test_file, "wb") as f:
+            f.write(tampered)
+
+        differing = tree.diff(MerkleTree.from_file(test_file, BLOCK))
+        ranges = tree.byte_ranges(differing, len(original))
+        print(f"Differing blocks: {differing}")
+        print(f"Ranges: {ranges}")
+        assert differing == [3, 4, 10]
+        assert ranges == [{"start": 3 * BLOCK, "end": 5 * BLOCK}, {"start": 10 * BLOCK, "end": len(original)}]
+
+        with open(test_file, "rb") as f:
+            assert verify_blocks(f, tree, tree.blocks_for_range(0, 3 * BLOCK)) == []
+            assert verify_blocks(f, tree, tree.blocks_for_range(3 * BLOCK + 1, 3 * BLOCK + 2)) == [3]
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        if os.path.exists(test_file):
+            os.remove(test_file)
+
+
+def test_bad_client_leaves_are_rejected():
+    """Test that two-way verification refuses leaf hashes that are not 64 hex characters"""
+    print("=" * 60)
+    print("TEST 4: Malformed Client Leaves")
+    print("=" * 60)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        engine = create_engine(f"sqlite:///{os.path.join(work_dir, 'test.db')}")
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        db = Session()
+        user = User(email="leaves@example.com", username="leaves", hashed_password="")
+        db.add(user)
+        db.commit()
+        tree = MerkleTree([hash_leaf(bytes([i]) * BLOCK) for i in range(4)], BLOCK)
+        db.add(TrainingDocument(
+            user_id=user.id, filename="notes.txt", source_name="notes.txt_1", file_type="txt",
+            file_size=4 * BLOCK, merkle_tree=training.build_merkle_record(tree)
+        ))
+        db.commit()
+        db.refresh(user)
+        db.expunge(user)
+        db.close()
+
+        def session():
+            db = Session()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app = FastAPI()
+        app.include_router(training.router)
+        app.dependency_overrides[get_db] = session
+        app.dependency_overrides[security.get_current_user] = lambda: user
+        client = TestClient(app)
+
+        good = [leaf.hex() for leaf in tree.leaves]
+        for name, leaves in [
+            ("non-hex", ["zz" * 32] + good[1:]),
+            ("short", ["ab" * 16] + good[1:]),
+            ("long", [good[0] + "00"] + good[1:]),
+        ]:
+            response = client.post(
+                "/training/documents/notes.txt_1/verify-two-way",
+                json={"merkle_root": "00" * 32, "block_size": BLOCK, "leaf_hashes": leaves}
+            )
+            print(f"{name}: {response.status_code} {response.json()}")
+            assert response.status_code == 400, f"{name} leaves must be refused!"
+
+        response = client.post(
+            "/training/documents/notes.txt_1/verify-two-way",
+            json={"merkle_root": tree.root_hex, "block_size": BLOCK, "leaf_hashes": good}
+        )
+        assert response.status_code == 200 and response.json()["match"]
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    tests = [
+        ("Root Matches Reference", test_root_matches_reference),
+        ("Audit Proofs", test_proofs_are_logarithmic),
+        ("Pinpoint Regions", test_diff_pinpoints_regions),
+        ("Malformed Client Leaves", test_bad_client_leaves_are_rejected),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Test script for the shared, memory-mapped module corpus
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+from app.training.module_corpus import ModuleCorpus, build_module_corpus
+
+MODULES = [
+    {"id": "reconnaissance", "title": "Reconnaissance", "description": "Information gathering", "topics": ["Port Scanning"]},
+    {"id": "defense", "title": "Defense Strategies", "description": "Defensive security", "topics": ["Threat Detection"]},
+]
+
+
+def make_corpus(work_dir):
+    content_dir = os.path.join(work_dir, "content")
+    for module_id, text in (
+        ("reconnaissance", "nmap port scanning discovers open services on a target host"),
+        ("defense", "detect port scanning with an ids and block the scanning host"),
+    ):
+        os.makedirs(os.path.join(content_dir, module_id))
+        with open(os.path.join(content_dir, module_id, "notes.md"), "w") as f:
+            f.write(text)
+    path = os.path.join(work_dir, "corpus.bin")
+    return path, build_module_corpus(path, content_dir, MODULES)
+
+
+def test_query_matches_word_set_similarity():
+    """Test that postings-based scoring equals the Jaccard similarity user collections use"""
+    print("=" * 60)
+    print("TEST 1: Corpus Build And Query")
+    print("=" * 60)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        path, chunk_count = make_corpus(work_dir)
+        corpus = ModuleCorpus(path)
+        print(f"{chunk_count} chunks, {len(corpus.terms)} terms, {os.path.getsize(path)} bytes")
+        assert chunk_count == len(corpus) == 4
+
+        query = "how does nmap port scanning work"
+        results = corpus.query(query, n_results=2)
+        top = results[0]
+        expected = set(query.split()) & set(top["content"].split())
+        jaccard = len(expected) / len(set(query.split()) | set(top["content"].split()))
+        print(f"Top: {top['source']} distance={top['distance']:.3f}")
+        assert top["module_id"] == "reconnaissance" and abs(top["distance"] - (1 - jaccard)) < 1e-9
+        assert corpus.query("zzz unknown words") == []
+        corpus.close()
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_module_boost_reorders_results():
+    """Test that passing module_id lifts that module's chunks"""
+    print("=" * 60)
+    print("TEST 2: Module Boost")
+    print("=" * 60)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        path, _ = make_corpus(work_dir)
+        corpus = ModuleCorpus(path)
+        query = "port scanning host"
+        plain = [r["module_id"] for r in corpus.query(query, n_results=2)]
+        boosted = [r["module_id"] for r in corpus.query(query, n_results=2, module_id="defense")]
+        print(f"Unboosted: {plain}, boosted for defense: {boosted}")
+        assert plain[0] == "reconnaissance" and boosted[0] == "defense"
+        corpus.close()
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    tests = [
+        ("Corpus Query", test_query_matches_word_set_similarity),
+        ("Module Boost", test_module_boost_reorders_results),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Test script for the token-budgeted prompt assembler
+"""
+import asyncio
+import sys
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import schemas
+from app.ai_engine import prompt as prompt_module
+from app.ai_engine.gemini import GeminiEngine, InFlightLimiter
+from app.ai_engine.prompt import PromptAssembler, estimate_tokens
+from app.api.routes.training import prepare_training_chat
+from app.models import Base, TrainingDocument, User
+from app.training import vector_store as vector_store_module
+from app.training.vector_store import VectorStore
+from test_gemini_engine import FakeResponse
+
+
+def turn(role, text):
+    return {"role": role, "parts": [{"text": text}]}
+
+
+def test_priority_order():
+    """Test that the question comes first, then ranked context, then the latest history"""
+    print("=" * 60)
+    print("TEST 1: Priority Order")
+    print("=" * 60)
+
+    history = [turn("user" if i % 2 == 0 else "model", f"turn {i} " + "x" * 200) for i in range(10)]
+    context = ["a" * 400, "b" * 2000, "c" * 400]
+    prompt = PromptAssembler(budget=500).assemble(
+        "how do firewalls filter traffic?",
+        system_instruction="s" * 200,
+        context_items=context,
+        history=history,
+        context_header="Retrieved:\n"
+    )
+    report = prompt.report
+    print(f"Report: {report.to_dict()}")
+    assert prompt.message == "how do firewalls filter traffic?"
+    assert report.context_used == [0, 2], "A long item should not keep shorter, lower-ranked ones out"
+    assert prompt.context == "Retrieved:\n" + "a" * 400 + "\n" + "c" * 400
+    assert prompt.history == history[-report.history_used:], "History should be the latest turns"
+    assert prompt.history[0]["role"] == "user"
+    assert report.history_dropped == 10 - report.history_used > 0
+    assert report.system_tokens == 50 and report.tokens <= 500
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_small_and_oversized_requests():
+    """Test that everything fits under a roomy budget and a huge question is cut to the budget"""
+    print("=" * 60)
+    print("TEST 2: Roomy and Oversized")
+    print("=" * 60)
+
+    history = [turn("user", "hello"), turn("model", "hi")]
+    prompt = PromptAssembler(budget=8000).assemble("what is xss?", "system", ["ctx"], history)
+    assert prompt.history == history and prompt.report.context_used == [0]
+    assert prompt.report.context_dropped == prompt.report.history_dropped == 0
+
+    prompt = PromptAssembler(budget=100).assemble("q" * 2000, "s" * 40, ["ctx"], history)
+    print(f"Report: {prompt.report.to_dict()}")
+    assert prompt.report.question_truncated and estimate_tokens(prompt.message) == 90
+    assert prompt.report.context_dropped == 1 and prompt.history == []
+
+    print("✓ PASSED\n")
+    return True
+
+
+class RecordingModel:
+    """Records the system instruction each chat was started under"""
+
+    def __init__(self):
+        self._system_instruction = None
+        self.seen = []
+
+    def start_chat(self, history=None):
+        model = self
+
+        class Chat:
+            async def send_message_async(self, message, request_options=None):
+                instruction = model._system_instruction
+                model.seen.append(instruction.parts[0].text if instruction else None)
+                return FakeResponse(message)
+
+        return Chat()
+
+
+def test_system_instruction_is_sent_once():
+    """Test that the system prompt goes as the model's instruction, not in the message"""
+    print("=" * 60)
+    print("TEST 3: System Instruction")
+    print("=" * 60)
+
+    model = RecordingModel()
+    engine = GeminiEngine(async_model=model, limiter=InFlightLimiter(limit=2))
+    prompt = PromptAssembler(budget=1000).assemble("what is csrf?", system_instruction="You are a tutor")
+
+    async def run():
+        first = await engine.send_message_async(prompt.message, prompt.context, prompt.history, system_instruction=prompt.system_instruction)
+        second = await engine.send_message_async("plain")
+        return first, second
+
+    replies = asyncio.run(run())
+    print(f"Replies {replies}, instructions {model.seen}")
+    assert replies == ("what is csrf?", "plain")
+    assert model.seen == ["You are a tutor", None]
+    assert model._system_instruction is None, "The shared model must not be changed"
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_training_chat_cites_documents_in_prompt():
+    """Test that training chat labels context by filename and cites exactly the documents that fit"""
+    print("=" * 60)
+    print("TEST 4: Training Chat Sources")
+    print("=" * 60)
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    user = User(email="sources@example.com", username="sources", hashed_password="")
+    db.add(user)
+    db.commit()
+
+    store = VectorStore()
+    chunks = {
+        "sqli.txt": "sql injection exploits unsanitized input in a vulnerable query",
+        "huge.txt": "sql injection vulnerability exploit walkthrough " * 300,
+        "params.txt": "parameterized queries stop sql injection exploits",
+    }
+    for filename, chunk in chunks.items():
+        source_name = f"{filename}_1"
+        store.add_documents(user.id, source_name, [chunk], metadata={"filename": filename})
+        db.add(TrainingDocument(user_id=user.id, filename=filename, source_name=source_name, file_type="txt"))
+    db.commit()
+
+    original_store, original_assembler = vector_store_module._vector_store, prompt_module._assembler
+    vector_store_module._vector_store = store
+    prompt_module._assembler = PromptAssembler(budget=400)
+    try:
+        request = schemas.TrainingChatRequest(message="explain the sql injection vulnerability and exploit")
+        prompt, fixed_answer, sources = prepare_training_chat(request, user, db)
+    finally:
+        vector_store_module._vector_store, prompt_module._assembler = original_store, original_assembler
+        db.close()
+
+    print(f"Report: {prompt.report.to_dict()}")
+    print(f"Sources: {sources}")
+    assert fixed_answer is None
+    assert 0 < len(prompt.report.context_used) and prompt.report.context_dropped == 1
+    assert {source["filename"] for source in sources} == {"sqli.txt", "params.txt"}
+    assert all(source["source_name"] == f"{source['filename']}_1" for source in sources)
+    assert "From 'sqli.txt'" in prompt.context and "Unknown" not in prompt.context
+
+    print("✓ PASSED\n")
+    return True
+
+
+def main():
+    tests = [
+        ("Priority Order", test_priority_order),
+        ("Roomy and Oversized", test_small_and_oversized_requests),
+        ("System Instruction", test_system_instruction_is_sent_once),
+        ("Training Chat Sources", test_training_chat_cites_documents_in_prompt),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Test script for the bulk re-index and snapshot swap
+"""
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models import Base, User, TrainingDocument
+from app.training.reindex import Reindexer, SnapshotLoader
+from app.training.vector_store import VectorStore
+from app.utils.storage import LocalBlobStorage
+
+
+def make_environment():
+    work_dir = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(work_dir, 'test.db')}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    storage = LocalBlobStorage(os.path.join(work_dir, "uploads", "blobs"))
+    return work_dir, Session, storage
+
+
+def add_user(Session, name):
+    db = Session()
+    user = User(email=f"{name}@example.com", username=name, hashed_password="")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    return user_id
+
+
+def add_document(work_dir, Session, storage, user_id, name, text, stored=True):
+    data = text.encode()
+    digest = hashlib.sha256(data).hexdigest()
+    source_name = f"{name}_{uuid.uuid4()}"
+    if stored:
+        staged = os.path.join(work_dir, f"staged_{uuid.uuid4().hex}")
+        with open(staged, "wb") as f:
+            f.write(data)
+        document_id = str(uuid.uuid4())
+        storage.put_file(staged, digest, owner=document_id, compress=True)
+    else:
+        document_id = None
+    db = Session()
+    db.add(TrainingDocument(
+        id=document_id or str(uuid.uuid4()), user_id=user_id, filename=name, source_name=source_name,
+        file_type="txt", checksum_sha256=digest, file_size=len(data), chunk_count=0
+    ))
+    db.commit()
+    db.close()
+    return source_name
+
+
+def make_reindexer(work_dir, Session, storage):
+    return Reindexer(
+        session_factory=Session, workers=2, bytes_per_second=0,
+        snapshot_directory=os.path.join(work_dir, "snapshots"),
+        upload_dir=os.path.join(work_dir, "uploads"), storage=storage
+    )
+
+
+def test_rebuild_writes_and_swaps_collections():
+    """Test that every user's documents are re-chunked into a snapshot the server swaps in"""
+    print("=" * 60)
+    print("TEST 1: Rebuild And Swap")
+    print("=" * 60)
+
+    work_dir, Session, storage = make_environment()
+    try:
+        alice, bob = add_user(Session, "alice"), add_user(Session, "bob")
+        notes = add_document(work_dir, Session, storage, alice, "notes.txt", "buffer overflow exploitation basics " * 200)
+        add_document(work_dir, Session, storage, alice, "web.txt", "cross site scripting payloads " * 50)
+        add_document(work_dir, Session, storage, bob, "crypto.txt", "block cipher modes of operation " * 80)
+
+        reindexer = make_reindexer(work_dir, Session, storage)
+        estimate = reindexer.estimate()
+        print(f"Dry run estimate: {estimate}")
+        assert estimate["users"] == 2 and estimate["documents"] == 3 and estimate["missing_files"] == 0
+        assert not os.path.exists(os.path.join(work_dir, "snapshots", f"user_{alice}.json")), "Dry run must not write!"
+
+        report = reindexer.run()
+        print(f"Run: {report}")
+        assert report["users_written"] == 2 and report["documents"] == 3
+
+        store = VectorStore()
+        store.add_documents(alice, "uploaded-during-rebuild.txt_x", ["kept across the swap"])
+        store.add_documents(alice, notes, ["stale chunk from the old chunker"])
+        assert store.load_snapshots(os.path.join(work_dir, "snapshots")) == 2
+        sources = store.list_sources()
+        print(f"Sources after swap: {sources[alice]}")
+        assert sources[alice]["uploaded-during-rebuild.txt_x"] == 1, "Newer sources must be carried over!"
+        assert all("stale chunk" not in r["content"] for r in store.retrieve(alice, "stale chunk old chunker"))
+        assert store.retrieve(bob, "cipher modes")[0]["source"].startswith("crypto.txt")
+        assert store.load_snapshots(os.path.join(work_dir, "snapshots")) == 0, "Unchanged snapshots are not reloaded!"
+
+        db = Session()
+        assert all(d.chunk_count > 0 for d in db.query(TrainingDocument).all())
+        db.close()
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_failed_user_is_not_swapped_and_resume_skips_done():
+    """Test that a user with an unreadable document keeps their collection, and --resume skips finished users"""
+    print("=" * 60)
+    print("TEST 2: Partial Failure And Resume")
+    print("=" * 60)
+
+    work_dir, Session, storage = make_environment()
+    try:
+        alice, bob = add_user(Session, "alice"), add_user(Session, "bob")
+        add_document(work_dir, Session, storage, alice, "notes.txt", "packet capture analysis " * 100)
+        missing = add_document(work_dir, Session, storage, bob, "lost.txt", "gone", stored=False)
+
+        report = make_reindexer(work_dir, Session, storage).run()
+        print(f"First run: {report}")
+        assert report["users_written"] == 1 and report["users_failed"] == 1
+        assert report["failed_documents"] == [missing]
+        assert not os.path.exists(os.path.join(work_dir, "snapshots", f"user_{bob}.json"))
+
+        resumed = make_reindexer(work_dir, Session, storage).run(resume=True)
+        print(f"Resumed: {resumed}")
+        assert resumed["build_id"] == report["build_id"]
+        assert resumed["users_skipped"] == 1 and resumed["users_failed"] == 1
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_snapshots_skip_deleted_and_replaced_sources():
+    """Test that a restart does not bring back deleted documents or the old chunks of a new version"""
+    print("=" * 60)
+    print("TEST 3: Deleted And Re-Versioned Sources")
+    print("=" * 60)
+
+    work_dir, Session, storage = make_environment()
+    try:
+        alice = add_user(Session, "alice")
+        notes = add_document(work_dir, Session, storage, alice, "notes.txt", "buffer overflow exploitation basics " * 200)
+        web = add_document(work_dir, Session, storage, alice, "web.txt", "cross site scripting payloads " * 50)
+        keep = add_document(work_dir, Session, storage, alice, "crypto.txt", "block cipher modes of operation " * 80)
+        assert make_reindexer(work_dir, Session, storage).run()["users_written"] == 1
+
+        # After the re-index: web.txt is deleted and notes.txt gets a new version.
+        db = Session()
+        db.delete(db.query(TrainingDocument).filter(TrainingDocument.source_name == web).one())
+        db.query(TrainingDocument).filter(TrainingDocument.source_name == notes).one().checksum_sha256 = "0" * 64
+        db.commit()
+        db.close()
+
+        store = VectorStore()
+        loader = SnapshotLoader(store=store, session_factory=Session)
+        assert loader.load_all(os.path.join(work_dir, "snapshots")) == 1
+        sources = store.list_sources()[alice]
+        print(f"Sources after restart: {sources}")
+        assert web not in sources, "A deleted document must stay gone after a reload!"
+        assert notes not in sources, "Chunks of a replaced version must not come back!"
+        assert sources[keep] > 0
+        assert web not in store.collections[f"user_{alice}"]["summaries"]
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    tests = [
+        ("Rebuild And Swap", test_rebuild_writes_and_swaps_collections),
+        ("Partial Failure And Resume", test_failed_user_is_not_swapped_and_resume_skips_done),
+        ("Deleted And Re-Versioned Sources", test_snapshots_skip_deleted_and_replaced_sources),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Test script for index snapshot export, shipping and restore
+"""
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+from fastapi import HTTPException
+
+from app.api.dependencies.admin_auth import verify_admin_token, verify_replication_token
+from app.config import get_settings
+from app.training.replication import IndexSnapshot, SnapshotError, apply_snapshot, export_snapshot
+from app.training.vector_store import VectorStore
+
+PRIMARY_SCRIPT = textwrap.dedent("""
+    import json, sys
+    from app.training.replication import export_snapshot
+    from app.training.vector_store import VectorStore
+
+    directory = sys.argv[1]
+    store = VectorStore()
+    text = "cross site scripting happens when untrusted input is rendered without output encoding"
+    store.add_documents("alice", "xss.txt_1", [text, text, "csrf tokens protect state changing requests"])
+    store.add_documents("bob", "sqli.txt_2", ["use parameterized queries to stop sql injection attacks"])
+    store.add_documents("carol", "nmap.txt_3", ["nmap scans ports to find exposed services"])
+    store.set_source_summaries("alice", "xss.txt_1", [{"level": 0, "summary": "XSS and CSRF basics"}])
+    full = export_snapshot(store, directory + "/full.vssnap")
+
+    store.add_documents("bob", "hashing.txt_4", ["store passwords with a slow salted hash such as argon2"])
+    store.delete_all_user_collections("carol")
+    delta = export_snapshot(store, directory + "/delta.vssnap", since=full["version"])
+    print(json.dumps({"full": full["version"], "delta": delta["version"], "epoch": store.epoch}))
+""")
+
+
+def run_primary(directory):
+    result = subprocess.run(
+        [sys.executable, "-c", PRIMARY_SCRIPT, directory],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return result.stdout.strip().splitlines()[-1]
+
+
+def test_full_and_delta_across_processes():
+    """Test that a second process serves queries from a primary's full snapshot plus delta"""
+    print("=" * 60)
+    print("TEST 1: Full Snapshot and Delta Between Processes")
+    print("=" * 60)
+
+    directory = tempfile.mkdtemp()
+    try:
+        print(f"Primary: {run_primary(directory)}")
+        standby = VectorStore()
+
+        full = IndexSnapshot(os.path.join(directory, "full.vssnap"))
+        assert full.kind == "full" and len(full.header["collections"]) == 3
+        assert apply_snapshot(standby, full) == 3
+        full.close()
+        results = standby.retrieve("carol", "which ports does nmap find", n_results=1)
+        assert results and results[0]["source"] == "nmap.txt_3"
+        assert standby.get_source_summaries("alice", "xss.txt_1")[0]["summary"] == "XSS and CSRF basics"
+
+        alice = standby.collections["user_alice"]
+        assert alice["canonical_of"] == {"xss.txt_1_1": "xss.txt_1_0"}, "Duplicates should survive the trip!"
+        assert alice["usage"]["chunks"] == 3
+
+        delta = IndexSnapshot(os.path.join(directory, "delta.vssnap"))
+        print(f"Delta header: kind={delta.kind} collections={[c['user_id'] for c in delta.header['collections']]} deleted={delta.header['deleted']}")
+        assert delta.kind == "delta"
+        assert [c["user_id"] for c in delta.header["collections"]] == ["bob"]
+        assert delta.header["deleted"] == ["carol"]
+        apply_snapshot(standby, delta)
+        delta.close()
+
+        assert "user_carol" not in standby.collections
+        assert "user_alice" in standby.collections, "A delta should leave unchanged collections alone!"
+        results = standby.retrieve("bob", "how to store passwords with a salted hash", n_results=1)
+        assert results[0]["source"] == "hashing.txt_4"
+    finally:
+        shutil.rmtree(directory)
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_corruption_is_detected():
+    """Test that a flipped byte in a section or in the header is refused"""
+    print("=" * 60)
+    print("TEST 2: Checksums")
+    print("=" * 60)
+
+    directory = tempfile.mkdtemp()
+    try:
+        store = VectorStore()
+        store.add_documents("dave", "tls.txt_1", ["tls certificates are validated against trusted roots"] * 2)
+        path = os.path.join(directory, "full.vssnap")
+        export_snapshot(store, path)
+        with open(path, "rb") as f:
+            original = f.read()
+
+        for position, label in ((len(original) - 5, "section"), (60, "header")):
+            damaged = bytearray(original)
+            damaged[position] ^= 0xFF
+            with open(path, "wb") as f:
+                f.write(damaged)
+            try:
+                snapshot = IndexSnapshot(path)
+                try:
+                    apply_snapshot(VectorStore(), snapshot)
+                finally:
+                    snapshot.close()
+                raise AssertionError(f"Damaged {label} should have been rejected!")
+            except SnapshotError as e:
+                print(f"Rejected damaged {label}: {e}")
+    finally:
+        shutil.rmtree(directory)
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_unchanged_store_gives_empty_delta():
+    """Test that only collections changed after `since` are exported"""
+    print("=" * 60)
+    print("TEST 3: Change Versions")
+    print("=" * 60)
+
+    store = VectorStore()
+    store.add_documents("erin", "a.txt_1", ["firewall rules filter inbound traffic"])
+    store.add_documents("frank", "b.txt_2", ["phishing emails imitate trusted senders"])
+    version = store.export_state()["version"]
+    assert store.export_state(since=version)["collections"] == []
+
+    store.get_or_create_collection("erin").update(["a.txt_1_0"], [{"source": "a.txt_1", "chunk_index": 0, "user_id": "erin"}])
+    changed = [c["user_id"] for c in store.export_state(since=version)["collections"]]
+    print(f"Changed after metadata update: {changed}")
+    assert changed == ["erin"]
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_replication_token_is_accepted():
+    """Test that nodes authenticate to the index and cluster endpoints with REPLICATION_TOKEN"""
+    print("=" * 60)
+    print("TEST 4: Replication Token")
+    print("=" * 60)
+
+    settings = get_settings()
+    original = settings.REPLICATION_TOKEN
+    settings.REPLICATION_TOKEN = "node-secret"
+
+    def accepted(check, token):
+        try:
+            asyncio.run(check(f"Bearer {token}"))
+            return True
+        except HTTPException:
+            return False
+
+    try:
+        assert accepted(verify_replication_token, "node-secret")
+        assert accepted(verify_replication_token, settings.ADMIN_PASSWORD)
+        assert not accepted(verify_replication_token, "guess")
+        assert not accepted(verify_admin_token, "node-secret"), "The node token must not open every admin endpoint!"
+        settings.REPLICATION_TOKEN = ""
+        assert not accepted(verify_replication_token, ""), "An unset token must not match an empty bearer!"
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        settings.REPLICATION_TOKEN = original
+
+
+def main():
+    tests = [
+        ("Full Snapshot and Delta", test_full_and_delta_across_processes),
+        ("Checksums", test_corruption_is_detected),
+        ("Change Versions", test_unchanged_store_gives_empty_delta),
+        ("Replication Token", test_replication_token_is_accepted),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
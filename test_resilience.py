@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Test script for Gemini retries, the retry budget, the circuit breaker and hedged requests
+"""
+import asyncio
+import sys
+
+from google.api_core import exceptions as google_exceptions
+
+from app.ai_engine.gemini import GeminiEngine, GeminiUnavailable, InFlightLimiter
+from app.ai_engine.resilience import CircuitBreaker, LatencyTracker, ResilientCaller, RetryBudget
+from app.ai_engine.single_flight import SingleFlight
+from app.api.routes.chat import stream_reply
+from test_gemini_engine import FakeAsyncModel, FakeResponse
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FlakyModel(FakeAsyncModel):
+    """FakeAsyncModel whose first `failures` requests fail with `error`"""
+
+    def __init__(self, failures, error=google_exceptions.ServiceUnavailable("overloaded")):
+        super().__init__(delay=0.01)
+        self.failures = failures
+        self.error = error
+        self.requests = 0
+
+    def start_chat(self, history=None):
+        model = self
+        chat = super().start_chat(history)
+        send = chat.send_message_async
+
+        class Chat:
+            async def send_message_async(self, message, stream=False, request_options=None):
+                model.requests += 1
+                if model.failures:
+                    model.failures -= 1
+                    raise model.error
+                return await send(message, stream=stream, request_options=request_options)
+
+        return Chat()
+
+
+class MidStreamFailureModel(FakeAsyncModel):
+    """Streams one chunk, then loses the connection"""
+
+    def start_chat(self, history=None):
+        class Chat:
+            async def send_message_async(self, message, stream=False, request_options=None):
+                return BrokenStream()
+
+        return Chat()
+
+
+class BrokenStream:
+    async def __aiter__(self):
+        yield FakeResponse("partial ")
+        raise google_exceptions.ServiceUnavailable("connection reset")
+
+
+def make_caller(**overrides):
+    options = {
+        "attempts": 3,
+        "base_delay": 0.001,
+        "budget": RetryBudget(ratio=0.0, minimum=10, window_seconds=60),
+        "breaker": CircuitBreaker(failure_rate=0.5, min_calls=4, window_seconds=60, open_seconds=30),
+        "hedge": False,
+    }
+    options.update(overrides)
+    return ResilientCaller(**options)
+
+
+def make_engine(model, caller):
+    return GeminiEngine(async_model=model, limiter=InFlightLimiter(limit=8), flights=SingleFlight(), resilience=caller)
+
+
+def test_transient_errors_are_retried():
+    """Test that transient errors are retried within the attempt limit and budget, and bad requests are not"""
+    print("=" * 60)
+    print("TEST 1: Retries And Retry Budget")
+    print("=" * 60)
+
+    async def run():
+        model = FlakyModel(failures=2)
+        caller = make_caller()
+        assert await make_engine(model, caller).send_message_async("what is nmap", timeout=5) == "none | what is nmap"
+        assert model.requests == 3 and caller.retries == 2
+
+        model = FlakyModel(failures=1, error=google_exceptions.InvalidArgument("bad prompt"))
+        caller = make_caller()
+        try:
+            await make_engine(model, caller).send_message_async("what is nmap", timeout=5)
+            raise AssertionError("A bad request should not be retried!")
+        except Exception as e:
+            assert "bad prompt" in str(e) and model.requests == 1 and caller.retries == 0
+
+        model = FlakyModel(failures=10)
+        caller = make_caller(attempts=5, budget=RetryBudget(ratio=0.0, minimum=1, window_seconds=60))
+        engine = make_engine(model, caller)
+        for question in ("scan one", "scan two"):
+            try:
+                await engine.send_message_async(question, timeout=5)
+                raise AssertionError("Should have failed!")
+            except Exception as e:
+                assert "overloaded" in str(e)
+        stats = caller.stats()
+        print(f"Stats: {stats}")
+        assert model.requests == 3, "One retry in the budget: 2 + 1 requests"
+        assert stats["retries"] == 1 and stats["gave_up"] == 2 and stats["retry_budget"]["exhausted"] == 2
+
+    asyncio.run(run())
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_circuit_breaker():
+    """Test that the breaker opens on a failure spike, fails fast, and closes after a successful probe"""
+    print("=" * 60)
+    print("TEST 2: Circuit Breaker")
+    print("=" * 60)
+
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_rate=0.5, min_calls=4, window_seconds=60, open_seconds=30, clock=clock)
+    model = FlakyModel(failures=4)
+    engine = make_engine(model, make_caller(attempts=1, breaker=breaker))
+
+    async def run():
+        for i in range(4):
+            try:
+                await engine.send_message_async(f"question {i}", timeout=5)
+            except Exception as e:
+                assert "overloaded" in str(e)
+        assert breaker.state == CircuitBreaker.OPEN
+
+        try:
+            await engine.send_message_async("question 5", timeout=5)
+            raise AssertionError("An open breaker should fail fast!")
+        except GeminiUnavailable as e:
+            print(f"Rejected: {e}")
+            assert e.retry_after == 30
+        assert model.requests == 4, "A rejected call should not reach the model"
+
+        events = [event async for event in stream_reply(
+            engine.stream_message_async("question 6", timeout=5), "", None, {}, encode=lambda event, data: (event, data)
+        )]
+        assert events[-1][0] == "error" and events[-1][1]["status"] == 503
+
+        clock.now = 31
+        assert await engine.send_message_async("question 7", timeout=5) == "none | question 7"
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(run())
+    print(f"Stats: {breaker.stats()}")
+    assert breaker.stats()["opened"] == 1 and breaker.stats()["rejected"] == 2
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_streams_retry_only_before_text():
+    """Test that a stream is retried while nothing has been sent, and not once text has gone out"""
+    print("=" * 60)
+    print("TEST 3: Stream Retries")
+    print("=" * 60)
+
+    async def run():
+        model = FlakyModel(failures=1)
+        caller = make_caller()
+        chunks = [text async for text in make_engine(model, caller).stream_message_async("one two", timeout=5)]
+        assert chunks == ["one ", "two "] and caller.retries == 1
+
+        caller = make_caller()
+        received = []
+        try:
+            async for text in make_engine(MidStreamFailureModel(), caller).stream_message_async("one two", timeout=5):
+                received.append(text)
+            raise AssertionError("Should have failed mid-stream!")
+        except Exception as e:
+            assert "connection reset" in str(e)
+        assert received == ["partial "] and caller.retries == 0
+
+    asyncio.run(run())
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_hedged_requests():
+    """Test that a request slower than the recent p95 is hedged and the faster reply wins"""
+    print("=" * 60)
+    print("TEST 4: Hedged Requests")
+    print("=" * 60)
+
+    latencies = LatencyTracker(min_samples=10)
+    for _ in range(20):
+        latencies.record(0.02)
+    caller = make_caller(hedge=True, latencies=latencies)
+    delays = [0.5, 0.01]
+
+    async def attempt():
+        await asyncio.sleep(delays.pop(0))
+        return "reply"
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        assert await caller.call(attempt, loop.time() + 5) == "reply"
+        return loop.time() - started
+
+    elapsed = asyncio.run(run())
+    stats = caller.stats()
+    print(f"Answered in {elapsed:.3f}s, stats {stats}")
+    assert elapsed < 0.2, "The hedge should have answered long before the slow request"
+    assert stats["hedges"] == 1 and stats["hedges_won"] == 1 and stats["hedge_after_ms"] == 20
+
+    print("✓ PASSED\n")
+    return True
+
+
+def main():
+    tests = [
+        ("Retries And Retry Budget", test_transient_errors_are_retried),
+        ("Circuit Breaker", test_circuit_breaker),
+        ("Stream Retries", test_streams_retry_only_before_text),
+        ("Hedged Requests", test_hedged_requests),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
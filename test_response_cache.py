@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Test script for the cache of replies to history-independent prompts
+"""
+import asyncio
+import sys
+import time
+
+from app.ai_engine.gemini import GeminiEngine, InFlightLimiter
+from app.ai_engine.prompt import PromptAssembler
+from app.ai_engine.response_cache import GLOBAL_SCOPE, HashingEmbedder, ResponseCache, normalize_question, user_scope
+from app.api.routes import chat
+from test_gemini_engine import FakeAsyncModel
+
+
+class CountingModel(FakeAsyncModel):
+    """FakeAsyncModel recording each chat it starts; copies share the record"""
+
+    def __init__(self):
+        super().__init__(delay=0.01)
+        self.chats = []
+
+    def start_chat(self, history=None):
+        self.chats.append(history)
+        return super().start_chat(history)
+
+
+def prompt_for(question, context_items=None, system_instruction="You are a tutor"):
+    return PromptAssembler(budget=1000).assemble(
+        question, system_instruction=system_instruction, context_items=context_items or []
+    )
+
+
+def test_exact_matches():
+    """Test that normalized questions hit and a different instruction or context misses"""
+    print("=" * 60)
+    print("TEST 1: Exact Matches")
+    print("=" * 60)
+
+    assert normalize_question("  What is  XSS?! ") == "what is xss"
+    cache = ResponseCache(max_entries=10, max_chars=10_000, ttl_seconds=60)
+    cache.put(GLOBAL_SCOPE, prompt_for("What is XSS?", ["- xss notes"]), "Cross-site scripting is...")
+
+    assert cache.get(GLOBAL_SCOPE, prompt_for("what is xss", ["- xss notes"])) == "Cross-site scripting is..."
+    assert cache.get(GLOBAL_SCOPE, prompt_for("What is XSS?", ["- updated xss notes"])) is None
+    assert cache.get(GLOBAL_SCOPE, prompt_for("What is XSS?", ["- xss notes"], "You are terse")) is None
+    assert cache.get(GLOBAL_SCOPE, prompt_for("What is an XSS payload?", ["- xss notes"])) is None, "No embedder: exact only"
+
+    stats = cache.stats()
+    print(f"Stats: {stats}")
+    assert stats["exact_hits"] == 1 and stats["misses"] == 3 and stats["hit_rate"] == 0.25
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_semantic_matches_and_scopes():
+    """Test that near-duplicate questions hit within a scope and never across users"""
+    print("=" * 60)
+    print("TEST 2: Semantic Matches And Scopes")
+    print("=" * 60)
+
+    cache = ResponseCache(max_entries=10, max_chars=10_000, ttl_seconds=60, embedder=HashingEmbedder(), similarity=0.75)
+    alice, bob = user_scope("alice"), user_scope("bob")
+    cache.put(alice, prompt_for("how does a sql injection attack work", ["- from my notes"]), "Alice's answer")
+
+    assert cache.get(alice, prompt_for("how does an sql injection attack work", ["- from my notes"])) == "Alice's answer"
+    assert cache.get(alice, prompt_for("how do i configure a firewall", ["- from my notes"])) is None
+    assert cache.get(bob, prompt_for("how does a sql injection attack work", ["- from my notes"])) is None
+    assert cache.get(GLOBAL_SCOPE, prompt_for("how does a sql injection attack work", ["- from my notes"])) is None
+
+    stats = cache.stats()
+    print(f"Stats: {stats}")
+    assert stats["semantic_hits"] == 1 and stats["exact_hits"] == 0 and stats["misses"] == 3
+
+    cache.clear(alice)
+    assert cache.stats()["entries"] == 0
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_expiry_and_limits():
+    """Test that entries expire and the least recently used go first when over size"""
+    print("=" * 60)
+    print("TEST 3: Expiry And Limits")
+    print("=" * 60)
+
+    cache = ResponseCache(max_entries=10, max_chars=10_000, ttl_seconds=1)
+    cache.put(GLOBAL_SCOPE, prompt_for("what is nmap"), "A scanner")
+    cache._entries[next(iter(cache._entries))].expires_at = time.time() - 1
+    assert cache.get(GLOBAL_SCOPE, prompt_for("what is nmap")) is None
+    assert cache.stats()["expirations"] == 1 and cache.stats()["entries"] == 0
+
+    cache = ResponseCache(max_entries=2, max_chars=25, ttl_seconds=60)
+    cache.put(GLOBAL_SCOPE, prompt_for("one"), "a" * 10)
+    cache.put(GLOBAL_SCOPE, prompt_for("two"), "b" * 10)
+    cache.get(GLOBAL_SCOPE, prompt_for("one"))
+    cache.put(GLOBAL_SCOPE, prompt_for("three"), "c" * 10)
+    assert cache.get(GLOBAL_SCOPE, prompt_for("two")) is None, "The least recently used entry should be evicted"
+    assert cache.get(GLOBAL_SCOPE, prompt_for("one")) == "a" * 10
+
+    cache.put(GLOBAL_SCOPE, prompt_for("four"), "d" * 20)
+    stats = cache.stats()
+    print(f"Stats: {stats}")
+    assert stats["entries"] == 1 and stats["chars"] == 20 and stats["evictions"] == 3
+    cache.put(GLOBAL_SCOPE, prompt_for("five"), "e" * 30)
+    assert cache.stats()["stores"] == 4, "A reply larger than the whole cache is not stored"
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_routes_answer_from_cache():
+    """Test that a repeated first question skips the model, streamed or not, and an abandoned stream is not cached"""
+    print("=" * 60)
+    print("TEST 4: Answering From The Cache")
+    print("=" * 60)
+
+    model = CountingModel()
+    originals = (chat.gemini_engine, chat.response_cache)
+    chat.gemini_engine = GeminiEngine(async_model=model, limiter=InFlightLimiter(limit=4))
+    chat.response_cache = ResponseCache(max_entries=10, max_chars=10_000, ttl_seconds=60)
+    try:
+        async def run():
+            prompt = prompt_for("explain port scanning")
+            first = await chat.answer_prompt(prompt, GLOBAL_SCOPE)
+            calls = len(model.chats)
+            assert await chat.answer_prompt(prompt, GLOBAL_SCOPE) == first
+            assert "".join([chunk async for chunk in chat.stream_prompt(prompt, GLOBAL_SCOPE)]) == first
+            assert len(model.chats) == calls, "Cached replies should not reach the model"
+
+            await chat.answer_prompt(prompt_for("explain port scanning"), None)
+            assert len(model.chats) == calls + 1, "Prompts without a scope always reach the model"
+
+            other = prompt_for("explain packet sniffing")
+            stream = chat.stream_prompt(other, GLOBAL_SCOPE)
+            await stream.__anext__()
+            await stream.aclose()
+            assert chat.response_cache.get(GLOBAL_SCOPE, other) is None, "Only a completed stream is cached"
+            streamed = "".join([chunk async for chunk in chat.stream_prompt(other, GLOBAL_SCOPE)])
+            assert chat.response_cache.get(GLOBAL_SCOPE, other) == streamed
+
+        asyncio.run(run())
+        print(f"Stats: {chat.response_cache.stats()}")
+    finally:
+        chat.gemini_engine, chat.response_cache = originals
+
+    print("✓ PASSED\n")
+    return True
+
+
+def main():
+    tests = [
+        ("Exact Matches", test_exact_matches),
+        ("Semantic Matches And Scopes", test_semantic_matches_and_scopes),
+        ("Expiry And Limits", test_expiry_and_limits),
+        ("Answering From The Cache", test_routes_answer_from_cache),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Test script for consistent-hash user sharding and collection handoff
+"""
+import asyncio
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.core import sharding
+from app.core.sharding import HashRing, ShardRouter, cluster_token, parse_nodes, sign_forward, verify_forward
+from app.middleware.sharding import FORWARDED_HEADER, ShardRoutingMiddleware
+from app.training import rebalance
+from app.training.rebalance import Rebalancer, import_collections
+from app.training.vector_store import VectorStore
+
+USERS = [f"user-{i}" for i in range(3000)]
+
+
+def test_ring_balance():
+    """Test that virtual nodes spread users evenly"""
+    print("=" * 60)
+    print("TEST 1: Ring Balance")
+    print("=" * 60)
+
+    ring = HashRing(["a", "b", "c"], vnodes=128)
+    counts = Counter(ring.owner(user_id) for user_id in USERS)
+    print(f"Users per node: {dict(counts)}")
+    assert set(counts) == {"a", "b", "c"}
+    assert all(0.25 < count / len(USERS) < 0.42 for count in counts.values()), "Ring is badly unbalanced!"
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_join_and_leave_move_few_users():
+    """Test that a join only moves users to the new node and a leave only moves the leaver's users"""
+    print("=" * 60)
+    print("TEST 2: Minimal Movement")
+    print("=" * 60)
+
+    ring = HashRing(["a", "b", "c"], vnodes=128)
+    before = {user_id: ring.owner(user_id) for user_id in USERS}
+
+    ring.add("d")
+    after_join = {user_id: ring.owner(user_id) for user_id in USERS}
+    moved = [user_id for user_id in USERS if before[user_id] != after_join[user_id]]
+    print(f"Join moved {len(moved)} of {len(USERS)} users")
+    assert all(after_join[user_id] == "d" for user_id in moved)
+    assert 0.15 < len(moved) / len(USERS) < 0.35
+
+    ring.remove("b")
+    after_leave = {user_id: ring.owner(user_id) for user_id in USERS}
+    moved = [user_id for user_id in USERS if after_join[user_id] != after_leave[user_id]]
+    print(f"Leave moved {len(moved)} users")
+    assert all(after_join[user_id] == "b" for user_id in moved)
+    assert "b" not in after_leave.values()
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_membership_generations():
+    """Test that stale member lists are ignored and a removed node routes everything away"""
+    print("=" * 60)
+    print("TEST 3: Membership Generations")
+    print("=" * 60)
+
+    nodes = parse_nodes("a=http://127.0.0.1:8001/, b=http://127.0.0.1:8002")
+    assert nodes == {"a": "http://127.0.0.1:8001", "b": "http://127.0.0.1:8002"}
+    router = ShardRouter("a", nodes, vnodes=64)
+    assert router.enabled
+
+    assert router.set_members({**nodes, "c": "http://127.0.0.1:8003"}, 2)
+    assert not router.set_members(nodes, 1), "An older generation should be ignored!"
+    assert len(router.nodes) == 3
+
+    router.leave("a")
+    print(f"After leaving: {router.describe()}")
+    assert router.enabled, "A removed node must keep routing so it can hand off"
+    assert not any(router.is_local(user_id) for user_id in USERS[:200])
+
+    assert not ShardRouter("a", {"a": "http://127.0.0.1:8001"}).enabled
+    assert ShardRouter("", {}).is_local("anyone")
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_handoff_to_new_owner():
+    """Test that misplaced collections move to their owner and are dropped locally"""
+    print("=" * 60)
+    print("TEST 4: Collection Handoff")
+    print("=" * 60)
+
+    nodes = {"a": "http://node-a", "b": "http://node-b"}
+    router = ShardRouter("a", nodes, vnodes=64)
+    store_a, store_b = VectorStore(), VectorStore()
+    for user_id in USERS[:20]:
+        store_a.add_documents(user_id, "notes.txt_1", [f"{user_id} studies firewall rules and ids alerts"])
+    late_user = next(user_id for user_id in USERS[:20] if router.owner(user_id)[0] == "b")
+    store_b.add_documents(late_user, "late.txt_2", ["an upload that reached the new owner first"])
+
+    received = []
+
+    def deliver(url, path, token):
+        received.append(url)
+        return {"imported": asyncio.run(import_collections(store_b, path))}
+
+    original = rebalance._post_file
+    rebalance._post_file = deliver
+    try:
+        rebalancer = Rebalancer(router, store_a)
+        expected = len(rebalancer.misplaced().get("b", []))
+        report = asyncio.run(rebalancer.handoff())
+    finally:
+        rebalance._post_file = original
+
+    print(f"Handoff: {report}, {expected} expected")
+    assert received == ["http://node-b/api/v1/admin/index/collections"]
+    assert report["moved"] == expected > 0
+    assert not rebalancer.misplaced()
+    assert len(store_a.collections) + len(store_b.collections) == 20
+
+    sources = {m["source"] for m in store_b.collections[f"user_{late_user}"]["metadatas"]}
+    assert sources == {"notes.txt_1", "late.txt_2"}, "The owner's own uploads should be kept!"
+
+    print("✓ PASSED\n")
+    return True
+
+
+def make_node_app():
+    """A sharded route behind the routing middleware; the test names the user in X-Test-User"""
+    async def upload(request):
+        body = await request.body()
+        return JSONResponse({"bytes": len(body), "served_here": True})
+
+    async def set_user(request, call_next):
+        request.state.user_id = request.headers.get("x-test-user")
+        return await call_next(request)
+
+    app = Starlette(routes=[Route("/api/v1/training/upload", upload, methods=["POST"])])
+    app.add_middleware(ShardRoutingMiddleware)
+    app.add_middleware(BaseHTTPMiddleware, dispatch=set_user)
+    return app
+
+
+def test_forwarding_is_signed_and_streamed():
+    """Test that only signed forwards skip routing and that a forwarded body reaches the owner intact"""
+    print("=" * 60)
+    print("TEST 5: Signed, Streamed Forwarding")
+    print("=" * 60)
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    nodes = {"a": "http://node-a.invalid", "b": f"http://127.0.0.1:{port}"}
+    router = ShardRouter("a", nodes, vnodes=64)
+    remote_user = next(user_id for user_id in USERS if router.owner(user_id)[0] == "b")
+
+    token = cluster_token()
+    target = "/api/v1/training/upload"
+    assert verify_forward(sign_forward("b", "POST", target, token), "POST", target, token, nodes) == "b"
+    assert verify_forward(sign_forward("b", "POST", target, "wrong"), "POST", target, token, nodes) is None
+    assert verify_forward(sign_forward("x", "POST", target, token), "POST", target, token, nodes) is None
+    assert verify_forward(sign_forward("b", "GET", target, token), "POST", target, token, nodes) is None
+    stale = sign_forward("b", "POST", target, token, timestamp=int(time.time()) - 3600)
+    assert verify_forward(stale, "POST", target, token, nodes) is None
+
+    # Both "nodes" share this process's router; the owner serves what node a forwarded because a signed it.
+    server = uvicorn.Server(uvicorn.Config(make_node_app(), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    original_router, original_routing = sharding._router, sharding.settings.CLUSTER_ROUTING
+    sharding._router = router
+    try:
+        thread.start()
+        for _ in range(100):
+            if server.started:
+                break
+            time.sleep(0.05)
+        client = TestClient(make_node_app())
+
+        payload = b"pcap " * 200000
+        response = client.post(target, content=payload, headers={"X-Test-User": remote_user})
+        print(f"Forwarded: {response.status_code} {response.json()} owner={response.headers.get('x-shard-owner')}")
+        assert response.status_code == 200 and response.json()["bytes"] == len(payload)
+        assert response.headers["x-shard-owner"] == "b"
+
+        sharding.settings.CLUSTER_ROUTING = "hint"
+        forged = client.post(target, content=b"x", headers={"X-Test-User": remote_user, FORWARDED_HEADER: "b"})
+        print(f"Forged header: {forged.status_code}")
+        assert forged.status_code == 421, "An unsigned forwarding header must not bypass owner routing!"
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        sharding._router, sharding.settings.CLUSTER_ROUTING = original_router, original_routing
+        server.should_exit = True
+        thread.join(timeout=5)
+
+
+def main():
+    tests = [
+        ("Ring Balance", test_ring_balance),
+        ("Minimal Movement", test_join_and_leave_move_few_users),
+        ("Membership Generations", test_membership_generations),
+        ("Collection Handoff", test_handoff_to_new_owner),
+        ("Signed Forwarding", test_forwarding_is_signed_and_streamed),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Test script for coalescing identical concurrent Gemini calls
+"""
+import asyncio
+import sys
+
+from app.ai_engine.gemini import GeminiEngine, GeminiTimeout, InFlightLimiter
+from app.ai_engine.single_flight import SingleFlight
+from test_gemini_engine import FakeAsyncModel
+
+
+def make_engine(delay):
+    model = FakeAsyncModel(delay=delay)
+    flights = SingleFlight()
+    return model, flights, GeminiEngine(async_model=model, limiter=InFlightLimiter(limit=64), flights=flights)
+
+
+def test_identical_calls_share_one_upstream_call():
+    """Test that a burst of identical prompts makes one model call and different prompts are not merged"""
+    print("=" * 60)
+    print("TEST 1: Identical Calls Coalesce")
+    print("=" * 60)
+
+    model, flights, engine = make_engine(delay=0.05)
+    history = [{"role": "user", "parts": [{"text": "earlier"}]}]
+
+    async def run():
+        replies = await asyncio.gather(*(engine.send_message_async("what is nmap", timeout=5) for _ in range(30)))
+        assert set(replies) == {"none | what is nmap"}
+        assert model.peak == 1, "Thirty identical prompts should make one upstream call"
+
+        replies = await asyncio.gather(
+            engine.send_message_async("what is nmap", timeout=5),
+            engine.send_message_async("what is nmap", history=history, timeout=5),
+            engine.send_message_async("what is nmap", context="module notes", timeout=5),
+        )
+        assert len(set(replies)) == 3 and model.peak == 3, "Different history or context must not be shared"
+
+        await engine.send_message_async("what is nmap", timeout=5)
+
+    asyncio.run(run())
+    print(f"Stats: {flights.stats()}")
+    assert flights.stats() == {"in_flight": 0, "leaders": 5, "followers": 29, "abandoned": 0}
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_callers_leave_on_their_own_deadline():
+    """Test that a caller timing out or cancelled leaves the others waiting, and the last one cancels upstream"""
+    print("=" * 60)
+    print("TEST 2: Per-Caller Deadlines")
+    print("=" * 60)
+
+    model, flights, engine = make_engine(delay=0.3)
+
+    async def run():
+        leader = asyncio.create_task(engine.send_message_async("explain xss", timeout=5))
+        patient = asyncio.create_task(engine.send_message_async("explain xss", timeout=5))
+        await asyncio.sleep(0.01)
+        try:
+            await engine.send_message_async("explain xss", timeout=0.05)
+            raise AssertionError("Should have timed out!")
+        except GeminiTimeout as e:
+            print(f"Follower timed out: {e}")
+        leader.cancel()
+        assert await patient == "none | explain xss", "The call should survive its starter leaving"
+        assert model.cancelled == 0
+
+        abandoned = [asyncio.create_task(engine.send_message_async("explain csrf", timeout=5)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        for task in abandoned:
+            task.cancel()
+        await asyncio.gather(*abandoned, return_exceptions=True)
+        assert model.cancelled == 1 and model.active == 0, "The upstream call should end with its last caller"
+
+    asyncio.run(run())
+    print(f"Stats: {flights.stats()}")
+    assert flights.stats()["abandoned"] == 1 and flights.stats()["in_flight"] == 0
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_streams_fan_out():
+    """Test that a late subscriber replays the chunks it missed and a stream outlives any one reader"""
+    print("=" * 60)
+    print("TEST 3: Streams Fan Out")
+    print("=" * 60)
+
+    model, flights, engine = make_engine(delay=0.02)
+
+    async def read(delay=0.0):
+        await asyncio.sleep(delay)
+        return [text async for text in engine.stream_message_async("scan the target network now", timeout=5)]
+
+    async def run():
+        first, late = await asyncio.gather(read(), read(delay=0.05))
+        assert first == late == ["scan ", "the ", "target ", "network ", "now "], late
+        assert flights.stats()["leaders"] == 1, "The late reader should have joined the running stream"
+
+        leaver = engine.stream_message_async("scan the target network now", timeout=5)
+        stayer = asyncio.create_task(read(delay=0.01))
+        assert await leaver.__anext__() == "scan "
+        await leaver.aclose()
+        assert len(await stayer) == 5 and model.cancelled == 0
+
+        try:
+            async for _ in engine.stream_message_async("scan the target network now", timeout=0.03):
+                pass
+            raise AssertionError("Stream should have timed out!")
+        except GeminiTimeout as e:
+            print(f"Subscriber timed out: {e}")
+        assert model.cancelled == 1 and model.active == 0, "A stream nobody reads should be cancelled"
+
+    asyncio.run(run())
+    print(f"Stats: {flights.stats()}")
+    assert flights.stats() == {"in_flight": 0, "leaders": 3, "followers": 2, "abandoned": 1}
+
+    print("✓ PASSED\n")
+    return True
+
+
+def main():
+    tests = [
+        ("Identical Calls Coalesce", test_identical_calls_share_one_upstream_call),
+        ("Per-Caller Deadlines", test_callers_leave_on_their_own_deadline),
+        ("Streams Fan Out", test_streams_fan_out),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
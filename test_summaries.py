@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Test script for hierarchical document summaries
+"""
+import sys
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import schemas
+from app.api.routes.training import prepare_training_chat
+from app.models import Base, TrainingDocument, User
+from app.training import vector_store as vector_store_module
+from app.training.summaries import (
+    ExtractiveSummarizer, Summarizer, build_summary_tree, is_summary_query, match_document, root_summary
+)
+from app.training.vector_store import VectorStore
+
+
+class CountingSummarizer(Summarizer):
+    def __init__(self):
+        self.calls = 0
+
+    def summarize(self, texts, max_words):
+        self.calls += 1
+        return " | ".join(text.split()[0] for text in texts)
+
+
+def section(i):
+    return f"section{i} " + "detail " * 40
+
+
+def test_tree_shape_and_reuse():
+    """Test that chunks fold into one root and unchanged sections are not re-summarized"""
+    print("=" * 60)
+    print("TEST 1: Tree Shape And Incremental Rebuild")
+    print("=" * 60)
+
+    chunks = [section(i) for i in range(20)]
+    summarizer = CountingSummarizer()
+    nodes = build_summary_tree(chunks, summarizer, fanout=4, max_words=50)
+    levels = [node["level"] for node in nodes]
+    print(f"{len(chunks)} chunks -> levels {levels}, {summarizer.calls} summarizer calls")
+    assert levels == [0] * 5 + [1] * 2 + [2]
+    root = root_summary(nodes)
+    assert (root["first_chunk"], root["last_chunk"]) == (0, 19)
+    assert nodes[5]["children"] == [0, 1, 2, 3]
+
+    chunks[13] = "rewritten " + "detail " * 40
+    rebuilt = CountingSummarizer()
+    build_summary_tree(chunks, rebuilt, fanout=4, max_words=50, previous=nodes)
+    print(f"After editing one chunk: {rebuilt.calls} summarizer calls")
+    assert rebuilt.calls == 3, "Only the edited section and its ancestors should be re-summarized!"
+
+    text = ExtractiveSummarizer().summarize(
+        ["Nmap scans ports. Nmap finds open ports and services. The weather was nice."], max_words=12
+    )
+    print(f"Extractive: {text}")
+    assert "Nmap finds open ports" in text and "weather" not in text
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_summary_queries_resolve_to_a_document():
+    """Test summary-query detection, document matching and storage alongside the collection"""
+    print("=" * 60)
+    print("TEST 2: Summary Queries")
+    print("=" * 60)
+
+    documents = [SimpleNamespace(filename="web-basics.pdf"), SimpleNamespace(filename="web-basics-advanced.pdf")]
+    assert is_summary_query("Can you summarize web-basics-advanced?")
+    assert is_summary_query("tl;dr please")
+    assert not is_summary_query("How does a buffer overflow work?")
+    for question in ("what are the key points of XSS prevention", "give an overview of CSRF", "what is in a JWT"):
+        assert not is_summary_query(question), f"{question!r} is an ordinary question"
+    assert match_document("summarize web-basics-advanced", documents) is documents[1]
+    assert match_document("give me an overview of WEB-BASICS.pdf", documents) is documents[0]
+    assert match_document("summarize everything", documents) is None
+    assert match_document("summarize it", documents[:1]) is documents[0]
+    assert match_document("can you give me a quick summary of my document?", documents[:1]) is documents[0]
+    assert match_document("summarize xss prevention", documents[:1]) is None, "A named topic is not the only document"
+    assert match_document("summarize web", documents) is None, "Part of a filename does not name it"
+
+    store = VectorStore()
+    store.add_documents("u1", "notes.txt_1", ["alpha beta"])
+    store.set_source_summaries("u1", "notes.txt_1", build_summary_tree(["alpha beta"], CountingSummarizer()))
+    assert root_summary(store.get_source_summaries("u1", "notes.txt_1"))["summary"] == "alpha"
+    store.delete_collection_by_source("u1", "notes.txt_1")
+    assert store.get_source_summaries("u1", "notes.txt_1") is None
+
+    print("✓ PASSED\n")
+    return True
+
+
+def test_topic_questions_still_retrieve():
+    """Test that a user with one document gets chunk retrieval for "key points of <topic>" questions"""
+    print("=" * 60)
+    print("TEST 3: Topic Questions With One Document")
+    print("=" * 60)
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    user = User(email="topics@example.com", username="topics", hashed_password="")
+    db.add(user)
+    db.commit()
+    db.add(TrainingDocument(user_id=user.id, filename="notes.txt", source_name="notes.txt_1", file_type="txt"))
+    db.commit()
+
+    store = VectorStore()
+    store.add_documents(user.id, "notes.txt_1", ["xss prevention relies on output encoding and a strict csp"])
+    store.set_source_summaries(user.id, "notes.txt_1", build_summary_tree(["document overview"], CountingSummarizer()))
+
+    original = vector_store_module._vector_store
+    vector_store_module._vector_store = store
+    try:
+        results = {}
+        for message in ("what are the key points of xss prevention", "summarize my notes on security vulnerabilities"):
+            prompt, _, _ = prepare_training_chat(schemas.TrainingChatRequest(message=message), user, db)
+            results[message] = prompt.context
+    finally:
+        vector_store_module._vector_store = original
+        db.close()
+
+    print(f"Contexts: {results}")
+    assert "output encoding" in results["what are the key points of xss prevention"], "Topic questions must retrieve chunks!"
+    assert "document" in results["summarize my notes on security vulnerabilities"] and "output encoding" not in results["summarize my notes on security vulnerabilities"]
+
+    print("✓ PASSED\n")
+    return True
+
+
+def main():
+    tests = [
+        ("Tree Shape", test_tree_shape_and_reuse),
+        ("Summary Queries", test_summary_queries_resolve_to_a_document),
+        ("Topic Questions", test_topic_questions_still_retrieve),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Test script for the upload/index garbage collector
+"""
+import os
+import shutil
+import asyncio
+import sys
+import tempfile
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models import Base, User, TrainingDocument
+from app.training import gc as gc_module
+from app.training.gc import GarbageCollector, run_gc_forever
+from app.training import resumable_upload
+from app.training.resumable_upload import UploadSessionError, UploadSessionManager
+from app.training.vector_store import VectorStore
+from app.utils.storage import LocalBlobStorage
+
+
+def make_environment():
+    work_dir = tempfile.mkdtemp()
+    upload_dir = os.path.join(work_dir, "uploads")
+    os.makedirs(upload_dir)
+
+    engine = create_engine(f"sqlite:///{os.path.join(work_dir, 'test.db')}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    db = Session()
+    user = User(email="gc@example.com", username="gc", hashed_password="")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+
+    return work_dir, upload_dir, Session, user_id
+
+
+def add_upload(upload_dir, Session, user_id, store, name, with_row=True, with_file=True):
+    file_id = str(uuid.uuid4())
+    source_name = f"{name}_{file_id}"
+    path = os.path.join(upload_dir, f"{file_id}_{name}")
+    if with_file:
+        with open(path, "wb") as f:
+            f.write(b"x" * 1000)
+    store.add_documents(user_id, source_name, [f"{name} chunk one", f"{name} chunk two"])
+    if with_row:
+        db = Session()
+        db.add(TrainingDocument(user_id=user_id, filename=name, source_name=source_name, file_type="txt"))
+        db.commit()
+        db.close()
+    return source_name, path
+
+
+def test_gc_removes_orphans():
+    """Test that files and index sources without a row are reclaimed and live ones kept"""
+    print("=" * 60)
+    print("TEST 1: Orphan Files And Sources")
+    print("=" * 60)
+
+    work_dir, upload_dir, Session, user_id = make_environment()
+    try:
+        store = VectorStore()
+        live_source, live_path = add_upload(upload_dir, Session, user_id, store, "live.txt")
+        orphan_source, orphan_path = add_upload(upload_dir, Session, user_id, store, "orphan.txt", with_row=False)
+
+        collector = GarbageCollector(
+            session_factory=Session, upload_dir=upload_dir, vector_store=store, grace_seconds=0,
+            storage=LocalBlobStorage(os.path.join(upload_dir, "blobs"))
+        )
+        dry = collector.run_pass(dry_run=True)
+        print(f"Dry run: {dry}")
+        assert dry["orphan_files"] == 1 and dry["reclaimed_bytes"] == 1000
+        assert os.path.exists(orphan_path), "Dry run must not delete anything!"
+
+        first = collector.run_pass()
+        print(f"First pass: {first}")
+        assert first["orphan_files"] == 1 and not os.path.exists(orphan_path)
+        assert first["orphan_sources"] == 0, "Index sources are only removed once seen orphaned twice!"
+
+        second = collector.run_pass()
+        print(f"Second pass: {second}")
+        assert second["orphan_sources"] == 1 and second["orphan_chunks"] == 2
+        assert set(store.list_sources()[user_id]) == {live_source}
+        assert os.path.exists(live_path)
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_gc_grace_period_and_rows():
+    """Test that fresh files are spared and rows without files are only pruned on request"""
+    print("=" * 60)
+    print("TEST 2: Grace Period And Missing Files")
+    print("=" * 60)
+
+    work_dir, upload_dir, Session, user_id = make_environment()
+    try:
+        store = VectorStore()
+        _, fresh_path = add_upload(upload_dir, Session, user_id, store, "fresh.txt", with_row=False)
+        add_upload(upload_dir, Session, user_id, store, "gone.txt", with_file=False)
+
+        collector = GarbageCollector(
+            session_factory=Session, upload_dir=upload_dir, vector_store=store, grace_seconds=3600,
+            storage=LocalBlobStorage(os.path.join(upload_dir, "blobs"))
+        )
+        report = collector.run_pass()
+        print(f"Report: {report}")
+        assert report["orphan_files"] == 0 and os.path.exists(fresh_path)
+        assert report["rows_missing_file"] == 1 and report["rows_pruned"] == 0
+
+        report = collector.run_pass(prune_rows=True)
+        db = Session()
+        remaining = db.query(TrainingDocument).count()
+        db.close()
+        print(f"Prune report: {report}")
+        assert report["rows_pruned"] == 1 and remaining == 0
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_gc_purges_expired_sessions():
+    """Test that expired resumable upload sessions are removed with their partial data"""
+    print("=" * 60)
+    print("TEST 3: Expired Upload Sessions")
+    print("=" * 60)
+
+    work_dir, upload_dir, Session, user_id = make_environment()
+    try:
+        manager = UploadSessionManager(upload_dir)
+        expired = manager.create_session(user_id, "old.txt", "txt", total_size=1000)
+        active = manager.create_session(user_id, "new.txt", "txt", total_size=1000)
+        expired["expires_at"] = (datetime.utcnow() - timedelta(hours=1)).isoformat()
+        manager._write_state(expired)
+
+        collector = GarbageCollector(
+            session_factory=Session, upload_dir=upload_dir, vector_store=VectorStore(),
+            storage=LocalBlobStorage(os.path.join(upload_dir, "blobs"))
+        )
+        report = collector.run_pass()
+        print(f"Report: {report}")
+        assert report["expired_sessions"] == 1 and report["reclaimed_bytes"] >= 1000
+        assert not os.path.exists(manager.data_path(expired["session_id"]))
+        assert os.path.exists(manager.data_path(active["session_id"]))
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def test_open_session_limits():
+    """Test that a user cannot hold more open sessions, or preallocated bytes, than configured"""
+    print("=" * 60)
+    print("TEST 5: Open Session Limits")
+    print("=" * 60)
+
+    work_dir = tempfile.mkdtemp()
+    settings = resumable_upload.settings
+    limits = settings.RESUMABLE_UPLOAD_MAX_SESSIONS, settings.RESUMABLE_UPLOAD_MAX_PENDING_BYTES
+    settings.RESUMABLE_UPLOAD_MAX_SESSIONS, settings.RESUMABLE_UPLOAD_MAX_PENDING_BYTES = 2, 5000
+    try:
+        manager = UploadSessionManager(os.path.join(work_dir, "uploads"))
+
+        def refused(user_id, total_size):
+            try:
+                manager.create_session(user_id, "f.txt", "txt", total_size=total_size)
+                return None
+            except UploadSessionError as e:
+                return e.status_code
+
+        first = manager.create_session("alice", "a.txt", "txt", total_size=3000)
+        assert refused("alice", 3000) == 413, "Preallocated bytes must count against the limit!"
+        assert refused("alice", 1000) is None
+        assert refused("alice", 1000) == 429, "Open sessions must be capped!"
+        assert refused("bob", 4000) is None, "Limits are per user!"
+
+        manager.abort(first["session_id"], "alice")
+        assert refused("alice", 1000) is None, "Aborting a session frees its slot"
+        counts = {user_id: len(manager.open_sessions(user_id)) for user_id in ("alice", "bob")}
+        print(f"Open sessions: {counts}")
+        assert counts == {"alice": 2, "bob": 1}
+
+        expired = manager.open_sessions("alice")[0]
+        expired["expires_at"] = (datetime.utcnow() - timedelta(hours=1)).isoformat()
+        manager._write_state(expired)
+        assert refused("alice", 1000) is None, "Expired sessions no longer count"
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        settings.RESUMABLE_UPLOAD_MAX_SESSIONS, settings.RESUMABLE_UPLOAD_MAX_PENDING_BYTES = limits
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+class ThreadRecordingStore(VectorStore):
+    """Records which thread touches the index"""
+
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def list_sources(self):
+        self.threads.add(threading.get_ident())
+        return super().list_sources()
+
+    def delete_collection_by_source(self, user_id, source_name):
+        self.threads.add(threading.get_ident())
+        return super().delete_collection_by_source(user_id, source_name)
+
+
+def test_gc_job_keeps_index_on_loop():
+    """Test that the scheduled job only touches the vector store from the event loop thread"""
+    print("=" * 60)
+    print("TEST 4: Index Work On The Event Loop")
+    print("=" * 60)
+
+    work_dir, upload_dir, Session, user_id = make_environment()
+    interval = gc_module.settings.GC_INTERVAL_SECONDS
+    try:
+        store = ThreadRecordingStore()
+        add_upload(upload_dir, Session, user_id, store, "live.txt")
+        add_upload(upload_dir, Session, user_id, store, "orphan.txt", with_row=False)
+        collector = GarbageCollector(
+            session_factory=Session, upload_dir=upload_dir, vector_store=store, grace_seconds=0,
+            storage=LocalBlobStorage(os.path.join(upload_dir, "blobs"))
+        )
+        # Mark the orphan as seen on an earlier pass so the job removes it.
+        collector._suspect_sources = {(user_id, source) for source in store.list_sources()[user_id]}
+        store.threads.clear()
+        gc_module.settings.GC_INTERVAL_SECONDS = 0.05
+
+        async def run():
+            job = asyncio.create_task(run_gc_forever(collector))
+            for _ in range(100):
+                if store.threads:
+                    break
+                await asyncio.sleep(0.05)
+            await asyncio.sleep(0.1)
+            collector.stop()
+            await job
+            return threading.get_ident()
+
+        loop_thread = asyncio.run(run())
+        print(f"Index touched from {len(store.threads)} thread(s); remaining sources: {store.list_sources()}")
+        assert store.threads == {loop_thread}, "The index must only be touched on the event loop!"
+        assert len(store.list_sources()[user_id]) == 1
+
+        print("✓ PASSED\n")
+        return True
+    finally:
+        gc_module.settings.GC_INTERVAL_SECONDS = interval
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    tests = [
+        ("Orphan Files And Sources", test_gc_removes_orphans),
+        ("Grace Period And Rows", test_gc_grace_period_and_rows),
+        ("Expired Sessions", test_gc_purges_expired_sessions),
+        ("Index On Loop", test_gc_job_keeps_index_on_loop),
+        ("Session Limits", test_open_session_limits),
+    ]
+
+    passed = 0
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED: {name}: {str(e)}\n")
+
+    print(f"Passed: {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)